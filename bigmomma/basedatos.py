@@ -0,0 +1,113 @@
+# bigmomma/basedatos.py
+# ============================================================
+#  CONFIGURACIÓN DE LA BASE DE DATOS (POOL / SQLITE)
+# ============================================================
+# Se arma desde DATABASE_URL y variables de entorno:
+#
+#   PostgreSQL
+#     DB_POOL=1            pool de psycopg 3 (Django ≥ 5.1) por proceso.
+#                          Cada worker de gunicorn tiene el suyo: el total
+#                          es workers × DB_POOL_MAX y debe quedar bajo el
+#                          max_connections del servidor.
+#     DB_POOL_MIN / DB_POOL_MAX / DB_POOL_TIMEOUT (s que espera un request
+#     por una conexión libre) / DB_POOL_MAX_IDLE (s antes de cerrar una
+#     conexión ociosa sobre el mínimo).
+#     Sin pool: conexiones persistentes (DB_CONN_MAX_AGE) con health check
+#     al reusarlas, así una conexión cortada por el servidor después de un
+#     rato sin tráfico se reabre en vez de dar error.
+#
+#   Réplica de lectura (opcional)
+#     DATABASE_REPLICA_URL  alias 'replica' para reportes (ver
+#                          inventario/replicas.py). Para desarrollo puede
+#                          apuntar a la misma base (otra conexión, de solo
+#                          lectura) y así probar el ruteo sin una réplica real.
+#
+#   Shards de tenants (opcional)
+#     DATABASE_SHARDS      'shard1=url;shard2=url': bases extra para las
+#                          empresas grandes (ver inventario/shards.py). Se
+#                          migran con 'migrate --database shard1'. Para
+#                          probar alcanza con varios archivos SQLite.
+#
+#   SQLite (instalaciones locales)
+#     SQLITE_WAL=1         journal WAL: lecturas no bloquean a la escritura.
+#                          Apagado por defecto: el PRAGMA reescribe el
+#                          encabezado del archivo, y el db.sqlite3 de
+#                          desarrollo está versionado. Activarlo en cada
+#                          instalación.
+#     SQLITE_BUSY_TIMEOUT  s que espera un lock antes de "database is locked".
+#     Las transacciones arrancan IMMEDIATE: toman el lock de escritura al
+#     empezar y no fallan a mitad de camino al querer escribir.
+import os
+
+import dj_database_url
+
+
+def _entero(nombre, defecto):
+    return int(os.environ.get(nombre, defecto))
+
+
+def configurar(url_defecto, variable="DATABASE_URL", replica=False):
+    """
+    Configuración de un alias desde la URL en 'variable'. Con replica=True
+    la conexión queda de solo lectura (una escritura mal ruteada falla en
+    vez de divergir) y los tests la usan como espejo de 'default'.
+    Devuelve None si no hay URL.
+    """
+    if url_defecto is None and not os.environ.get(variable):
+        return None
+    db = dj_database_url.config(
+        env=variable,
+        default=url_defecto,
+        conn_max_age=_entero("DB_CONN_MAX_AGE", 600),
+        conn_health_checks=True,
+    )
+    return _ajustar(db, replica) if db else None
+
+
+def configurar_shards(variable="DATABASE_SHARDS"):
+    """
+    {alias: configuración} de las bases de tenants extra, desde
+    'alias=url;alias=url' (mismos ajustes de pool/SQLite que 'default').
+    """
+    shards = {}
+    for par in filter(None, (p.strip() for p in os.environ.get(variable, "").split(";"))):
+        alias, _, url = par.partition("=")
+        shards[alias.strip()] = _ajustar(dj_database_url.parse(
+            url.strip(), conn_max_age=_entero("DB_CONN_MAX_AGE", 600), conn_health_checks=True,
+        ))
+    return shards
+
+
+def _ajustar(db, replica=False):
+    motor = db["ENGINE"]
+    opciones = db.setdefault("OPTIONS", {})
+
+    if "postgresql" in motor and os.environ.get("DB_POOL", "0") == "1":
+        from psycopg_pool import ConnectionPool
+
+        opciones["pool"] = {
+            "min_size": _entero("DB_POOL_MIN", 2),
+            "max_size": _entero("DB_POOL_MAX", 10),
+            "timeout": _entero("DB_POOL_TIMEOUT", 10),
+            "max_idle": _entero("DB_POOL_MAX_IDLE", 300),
+            # Verifica la conexión al sacarla del pool (descarta las muertas).
+            "check": ConnectionPool.check_connection,
+        }
+        # El pool reemplaza a las conexiones persistentes (Django lo exige).
+        db["CONN_MAX_AGE"] = 0
+
+    elif "sqlite3" in motor:
+        opciones.setdefault("timeout", _entero("SQLITE_BUSY_TIMEOUT", 20))
+        opciones.setdefault("transaction_mode", "IMMEDIATE")
+        if os.environ.get("SQLITE_WAL", "0") == "1":
+            opciones.setdefault("init_command", "PRAGMA journal_mode=WAL; PRAGMA synchronous=NORMAL;")
+
+    if replica:
+        if "postgresql" in motor:
+            opciones["options"] = "-c default_transaction_read_only=on"
+        elif "sqlite3" in motor:
+            # query_only en lugar de WAL/synchronous: no es quien escribe.
+            opciones["init_command"] = "PRAGMA query_only=ON;"
+            opciones.pop("transaction_mode", None)
+        db["TEST"] = {"MIRROR": "default"}
+    return db
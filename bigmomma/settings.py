@@ -1,6 +1,6 @@
 from pathlib import Path
 import os
-import dj_database_url # <--
+from .basedatos import configurar as configurar_base, configurar_shards
 from pathlib import Path
 from django.urls import reverse_lazy  #
 BASE_DIR = Path(__file__).resolve().parent.parent
@@ -30,6 +30,8 @@ INSTALLED_APPS = [
     'allauth.account',
     'allauth.socialaccount',
     'allauth.socialaccount.providers.google', #
+    'rest_framework',
+    'rest_framework.authtoken',  # Tokens para POS / escáneres
 ]
 
 # 2. Añade los 'AUTHENTICATION_BACKENDS'
@@ -54,9 +56,13 @@ MIDDLEWARE = [
     "django.middleware.common.CommonMiddleware",
     "django.middleware.csrf.CsrfViewMiddleware",
     "django.contrib.auth.middleware.AuthenticationMiddleware",
+    'inventario.shards.ShardMiddleware',  # base del tenant del usuario (DATABASE_SHARDS)
+    'inventario.replicas.ReplicaMiddleware',  # lee-lo-que-escribiste con la réplica de reportes
     "django.contrib.messages.middleware.MessageMiddleware",
     "django.middleware.clickjacking.XFrameOptionsMiddleware",
     'inventario.middleware.SetupWizardMiddleware',
+    'inventario.idempotencia.IdempotenciaMiddleware',  # Idempotency-Key en /api/
+    'inventario.instrumentacion.InstrumentacionMiddleware',  # opcional: INSTRUMENTACION_ACTIVA=1
 ]
 
 ROOT_URLCONF = "bigmomma.urls"
@@ -73,6 +79,8 @@ TEMPLATES = [
                 "django.template.context_processors.request",
                 "django.contrib.auth.context_processors.auth",
                 "django.contrib.messages.context_processors.messages",
+                "inventario.idempotencia.context_processor",  # {{ idempotency_key }}
+                "inventario.cache_empresa.context_processor",  # {{ datos_version }} {{ cache_segundos }}
             ],
         },
     },
@@ -84,15 +92,25 @@ CSRF_TRUSTED_ORIGINS = [
 WSGI_APPLICATION = "bigmomma.wsgi.application"
 
 # === Base de datos ===
+# Render nos dará una variable "DATABASE_URL"; si no la encuentra
+# (porque estamos en tu PC), usará tu archivo db.sqlite3 como respaldo.
+# Pool de conexiones, health checks y perfil de SQLite: ver bigmomma/basedatos.py.
 DATABASES = {
-    'default': dj_database_url.config(
-        # Render nos dará una variable "DATABASE_URL"
-        # Si no la encuentra (porque estamos en tu PC), 
-        # usará tu archivo db.sqlite3 como respaldo.
-        default=f"sqlite:///{BASE_DIR / 'db.sqlite3'}",
-        conn_max_age=600
-    )
+    'default': configurar_base(f"sqlite:///{BASE_DIR / 'db.sqlite3'}"),
 }
+# Réplica de lectura para reportes (vistas con @usar_replica, ver inventario/replicas.py).
+_replica = configurar_base(None, variable="DATABASE_REPLICA_URL", replica=True)
+if _replica:
+    DATABASES["replica"] = _replica
+# Shards: bases extra para tenants (SuscripcionCliente.base_datos, ver inventario/shards.py).
+# Cada shard genera sus ids a partir de su bloque (posición × SHARD_BLOQUE_IDS).
+_shards = configurar_shards()
+DATABASES.update(_shards)
+SHARDS = list(_shards)
+SHARD_BLOQUE_IDS = int(os.environ.get("SHARD_BLOQUE_IDS", str(10**12)))
+# Primero el de shards (tenants en otra base); lo que queda en 'default' lo decide el de la réplica.
+DATABASE_ROUTERS = ["inventario.shards.RouterShards", "inventario.replicas.RouterReplica"]
+REPLICA_FIJAR_SEGUNDOS = int(os.environ.get("REPLICA_FIJAR_SEGUNDOS", "10"))  # tras escribir, la sesión lee de la primaria
 
 # === Validación de contraseñas ===
 AUTH_PASSWORD_VALIDATORS = [
@@ -129,6 +147,71 @@ LOGOUT_REDIRECT_URL = 'inventario:index'
 
 DEFAULT_AUTO_FIELD = "django.db.models.BigAutoField"
 
+# === Idempotencia (reintentos de POS / celulares) ===
+IDEMPOTENCIA_TTL_HORAS = 24          # cuánto se guarda la respuesta de cada llave
+IDEMPOTENCIA_RUTAS = ["/api/"]       # prefijos cubiertos por el middleware
+
+# === Actualización de StockPorUbicacion al guardar un MovimientoMP ===
+# 'bloqueo': SELECT ... FOR UPDATE de la fila y suma en Python (serializa
+#            todas las OPs que usan la misma MP hasta el commit).
+# 'atomico': UPDATE stock = stock + delta con guarda de no-negativo;
+#            un faltante levanta StockInsuficiente en vez de dejar stock < 0.
+STOCK_MODO_ACTUALIZACION = os.environ.get("STOCK_MODO_ACTUALIZACION", "bloqueo")
+
+# === Reservas de stock de borradores (OP / Venta) ===
+RESERVAS_TTL_MINUTOS = int(os.environ.get("RESERVAS_TTL_MINUTOS", "60"))  # después de esto dejan de apartar stock
+
+# === Puntos de reorden (stock_minimo) desde el consumo (ver inventario/reabastecimiento.py) ===
+REPOSICION_VENTANA_DIAS = 56         # historial de CONSUMO usado (8 semanas)
+REPOSICION_LEAD_TIME_DIAS = int(os.environ.get("REPOSICION_LEAD_TIME_DIAS", "2"))  # días entre pedir y recibir
+REPOSICION_LEAD_TIME_SUCURSAL = {}   # {sucursal_id: días} para las que difieren del general
+REPOSICION_NIVEL_SERVICIO = 0.95     # probabilidad de no quedarse sin stock durante la reposición
+REPOSICION_MIN_DIAS_CONSUMO = 4      # con menos días con consumo el mínimo no se recalcula
+
+# === Archivado del kardex (ver inventario/archivo.py) ===
+ARCHIVO_HORIZONTE_DIAS = int(os.environ.get("ARCHIVO_HORIZONTE_DIAS", "365"))  # lo más viejo que esto pasa al archivo
+
+# === Caché (versión de datos por empresa y fragmentos del panel, ver inventario/cache_empresa.py) ===
+# Con REDIS_URL (paquete 'redis') el caché es compartido por todos los
+# workers. Sin él es por proceso: una escritura solo subiría la versión
+# en el worker que la hizo y los demás mostrarían fragmentos viejos, así
+# que los fragmentos quedan apagados salvo que se pida lo contrario.
+# REDIS_URL también lleva los eventos en vivo del panel entre procesos (inventario/eventos.py).
+REDIS_URL = os.environ.get("REDIS_URL")
+CACHES = {
+    "default": ({"BACKEND": "django.core.cache.backends.redis.RedisCache", "LOCATION": REDIS_URL}
+                if REDIS_URL else {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}),
+}
+CACHE_FRAGMENTOS_SEGUNDOS = int(os.environ.get("CACHE_FRAGMENTOS_SEGUNDOS", "600" if REDIS_URL else "0"))
+
+# === Instrumentación por request (SQL, templates, N+1) ===
+INSTRUMENTACION_ACTIVA = os.environ.get("INSTRUMENTACION_ACTIVA", "0") == "1"
+INSTRUMENTACION_MUESTREO = float(os.environ.get("INSTRUMENTACION_MUESTREO", "0.1"))  # fracción de requests medidos
+INSTRUMENTACION_UMBRAL_N1 = 5        # mismo SQL repetido N veces en un request → N+1
+INSTRUMENTACION_LENTO_MS = 1000      # sobre esto se loguea como WARNING
+INSTRUMENTACION_BUFFER = 200         # requests guardados en memoria (por proceso)
+
+LOGGING = {
+    "version": 1,
+    "disable_existing_loggers": False,
+    "handlers": {"console": {"class": "logging.StreamHandler"}},
+    "loggers": {
+        "inventario.instrumentacion": {"handlers": ["console"], "level": "INFO", "propagate": False},
+    },
+}
+
+# === API REST (POS / escáneres) ===
+REST_FRAMEWORK = {
+    "DEFAULT_AUTHENTICATION_CLASSES": [
+        "rest_framework.authentication.TokenAuthentication",  # Header: Authorization: Token <key>
+        "rest_framework.authentication.SessionAuthentication",
+    ],
+    "DEFAULT_PERMISSION_CLASSES": [
+        "rest_framework.permissions.IsAuthenticated",
+    ],
+    # La paginación por cursor se define en inventario/api.py (TenantViewSetMixin).
+}
+
 
 AZURE_DOCINT_ENDPOINT = "https://recetafactura.cognitiveservices.azure.com/"
 
@@ -1,12 +1,15 @@
-from django.contrib import admin
+from django.contrib import admin, messages
+from django.core.exceptions import ValidationError
 from .models import (
     UnidadMedida, MateriaPrima, MovimientoMP,
     Producto, Receta, RecetaLinea, OrdenProduccion,
-    LoteProducto, Venta, VentaLinea, VentaConsumo,
+    LoteProducto, Venta, VentaLinea, VentaConsumo, TrazaEnlace, StockReserva,
+    Traslado, TrasladoLinea, ConteoFisico, ConteoLinea, CorteArchivo,
     
     # <--- Registramos los nuevos modelos
-    Sucursal, Ubicacion, StockPorUbicacion
+    Sucursal, Ubicacion, StockPorUbicacion, SaldoDiarioMP
 )
+from .saldos import reparar_pares
 
 # ============================================================
 #  NUEVOS MODELOS WMS
@@ -30,14 +33,31 @@ class StockPorUbicacionAdmin(admin.ModelAdmin):
     list_display = ("mp", "get_sucursal", "ubicacion", "stock", "stock_minimo")
     list_filter = ("ubicacion__sucursal", "mp")
     search_fields = ("mp__nombre", "ubicacion__nombre", "ubicacion__sucursal__nombre")
-    list_editable = ("stock", "stock_minimo")
+    # 'stock' lo mantiene el kardex (MovimientoMP); editarlo a mano lo descuadra.
+    # Para corregirlo: acción "Recalcular desde el kardex" o manage.py conciliar_stock.
+    list_editable = ("stock_minimo",)
+    readonly_fields = ("stock",)
     autocomplete_fields = ("mp", "ubicacion") 
     ordering = ("mp__nombre", "ubicacion__sucursal__nombre", "ubicacion__nombre")
+    actions = ["recalcular_desde_kardex"]
+
+    @admin.action(description="Recalcular stock desde el kardex")
+    def recalcular_desde_kardex(self, request, queryset):
+        n = reparar_pares(set(queryset.values_list("mp_id", "ubicacion_id")))
+        self.message_user(request, f"{n} saldos corregidos.")
 
     @admin.display(description="Sucursal", ordering="ubicacion__sucursal")
     def get_sucursal(self, obj):
         return obj.ubicacion.sucursal
 
+@admin.register(SaldoDiarioMP)
+class SaldoDiarioMPAdmin(admin.ModelAdmin):
+    list_display = ("fecha", "mp", "ubicacion", "stock")
+    list_filter = ("ubicacion__sucursal",)
+    search_fields = ("mp__nombre", "ubicacion__nombre")
+    date_hierarchy = "fecha"
+    list_select_related = ("mp", "ubicacion", "ubicacion__sucursal")
+
 # ============================================================
 #  MODELOS EXISTENTES (Actualizados)
 # ============================================================
@@ -62,11 +82,12 @@ class MPAdmin(admin.ModelAdmin):
 class MovAdmin(admin.ModelAdmin):
     # <--- ¡¡AQUÍ ESTÁ LA CORRECCIÓN!! ---
     # 'tipo' ahora existe y puede ser usado
-    list_display = ("id", "fecha", "mp", "ubicacion", "tipo", "cantidad", "created_by")
+    list_display = ("id", "fecha", "mp", "ubicacion", "tipo", "cantidad", "op", "created_by")
     list_filter = ("tipo", "mp", "ubicacion__sucursal")
     search_fields = ("mp__nombre", "nota", "ubicacion__nombre")
     date_hierarchy = "fecha"
     autocomplete_fields = ("mp", "ubicacion")
+    raw_id_fields = ("op", "traslado", "conteo")
 
 # -------- Productos / Recetas --------
 class RecetaLineaInline(admin.TabularInline):
@@ -124,4 +145,79 @@ class VentaConsumoAdmin(admin.ModelAdmin): # <--- ¡¡AQUÍ ESTÁ LA CORRECCIÓN
     list_filter = ("lote__producto",)
     date_hierarchy = "created_at"
     ordering = ("created_at",)
-    search_fields = ("venta__id", "lote__codigo", "linea__producto__nombre")
\ No newline at end of file
+    search_fields = ("venta__id", "lote__codigo", "linea__producto__nombre")
+
+# -------- Traslados --------
+class TrasladoLineaInline(admin.TabularInline):
+    model = TrasladoLinea
+    extra = 1
+    raw_id_fields = ("mp", "lote")
+
+@admin.register(Traslado)
+class TrasladoAdmin(admin.ModelAdmin):
+    list_display = ("id", "fecha", "origen", "destino", "estado", "created_by")
+    list_filter = ("estado", "origen__sucursal", "destino__sucursal")
+    inlines = [TrasladoLineaInline]
+    date_hierarchy = "fecha"
+    raw_id_fields = ("origen", "destino")
+    actions = ["confirmar_traslados"]
+
+    @admin.action(description="Confirmar traslados seleccionados")
+    def confirmar_traslados(self, request, queryset):
+        ok = 0
+        for t in queryset.filter(estado=Traslado.BORRADOR).select_related("origen", "destino"):
+            try:
+                t.confirmar(user=request.user); ok += 1
+            except ValidationError as e:
+                self.message_user(request, f"{t}: {'; '.join(e.messages)}", level=messages.ERROR)
+        self.message_user(request, f"{ok} traslados confirmados.")
+
+# -------- Conteos físicos --------
+class ConteoLineaInline(admin.TabularInline):
+    model = ConteoLinea
+    extra = 0
+    raw_id_fields = ("ubicacion", "mp")
+    readonly_fields = ("sistema",)
+
+@admin.register(ConteoFisico)
+class ConteoFisicoAdmin(admin.ModelAdmin):
+    list_display = ("id", "created_at", "sucursal", "estado", "created_by", "contabilizado_en")
+    list_filter = ("estado", "sucursal")
+    inlines = [ConteoLineaInline]
+    date_hierarchy = "created_at"
+    readonly_fields = ("estado", "contabilizado_en")
+    actions = ["contabilizar_conteos"]
+
+    @admin.action(description="Contabilizar conteos seleccionados")
+    def contabilizar_conteos(self, request, queryset):
+        ok = 0
+        for c in queryset.filter(estado=ConteoFisico.ABIERTO):
+            try:
+                c.contabilizar(user=request.user); ok += 1
+            except ValidationError as e:
+                self.message_user(request, f"Conteo #{c.pk}: {'; '.join(e.messages)}", level=messages.ERROR)
+        self.message_user(request, f"{ok} conteos contabilizados.")
+
+# -------- Archivo del kardex --------
+@admin.register(CorteArchivo)
+class CorteArchivoAdmin(admin.ModelAdmin):
+    list_display = ("suscripcion", "hasta", "movimientos", "aperturas", "consumos", "created_at")
+    list_filter = ("suscripcion",)
+    readonly_fields = ("suscripcion", "hasta", "movimientos", "aperturas", "consumos", "created_at")
+
+@admin.register(TrazaEnlace)
+class TrazaEnlaceAdmin(admin.ModelAdmin):
+    list_display = ("fecha", "tipo", "mp", "lote", "venta", "cantidad")
+    list_filter = ("tipo",)
+    search_fields = ("lote__codigo", "mp__nombre", "venta__id")
+    date_hierarchy = "fecha"
+    raw_id_fields = ("movimiento", "lote", "venta")
+    list_select_related = ("mp", "lote", "venta", "venta__sucursal")
+
+@admin.register(StockReserva)
+class StockReservaAdmin(admin.ModelAdmin):
+    list_display = ("creado", "op", "venta", "mp", "lote", "ubicacion", "cantidad", "expira")
+    list_filter = ("suscripcion",)
+    search_fields = ("mp__nombre", "lote__codigo", "op__id", "venta__id")
+    raw_id_fields = ("op", "venta", "linea", "lote", "mp", "ubicacion")
+    list_select_related = ("op", "venta", "mp", "lote", "ubicacion")
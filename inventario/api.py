@@ -0,0 +1,454 @@
+# inventario/api.py
+# ============================================================
+#  API REST PARA POS Y ESCÁNERES
+# ============================================================
+# Endpoints JSON para los clientes de alto volumen (terminales POS,
+# pistolas de escaneo). Evitan el render de templates y el ida y vuelta
+# de CSRF de las vistas HTML (VentaCreateView, MPIngresoView).
+#
+#   /api/movimientos/          GET, POST      (+ /batch/, /traza/?mp=&desde=&hasta=)
+#   /api/ventas/               GET, POST      (+ /batch/, /<id>/reservar/, /<id>/confirmar/, /<id>/traza/)
+#   /api/ordenes-produccion/   GET, POST      (+ /batch/, /<id>/reservar/, /<id>/ejecutar/)
+#   /api/lotes/                GET            (+ /<id>/traza/?direccion=adelante|atras)
+#   /api/stock/                GET
+#   /api/traslados/            GET, POST      (+ /batch/, /<id>/confirmar/)
+#   /api/conteos/              GET, POST      (+ /<id>/lineas/, /<id>/diferencias/, /<id>/contabilizar/)
+#
+# - Paginación por cursor (estable aunque entren filas nuevas).
+# - Todos los POST aceptan el header 'Idempotency-Key' para reintentos seguros
+#   (lo resuelve IdempotenciaMiddleware, ver inventario/idempotencia.py).
+# - Los endpoints /batch/ reciben un arreglo y reportan el resultado por ítem.
+import datetime
+
+from django.core.exceptions import ValidationError as DjangoValidationError
+from django.db.models import Count, Q
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime, parse_date
+from rest_framework import mixins, serializers, status, viewsets
+from rest_framework.decorators import action
+from rest_framework.exceptions import APIException
+from rest_framework.pagination import CursorPagination
+from rest_framework.permissions import IsAuthenticated, DjangoModelPermissions, SAFE_METHODS
+from rest_framework.response import Response
+from rest_framework.routers import DefaultRouter
+
+from .models import (
+    MateriaPrima, MovimientoMP, StockPorUbicacion, OrdenProduccion,
+    LoteProducto, Venta, Traslado, ConteoFisico,
+)
+from . import conteos, trazabilidad
+from . import shards
+from .shards import atomico
+from .serializers import (
+    MovimientoMPSerializer, StockPorUbicacionSerializer,
+    OrdenProduccionSerializer, LoteProductoSerializer, VentaSerializer,
+    TrasladoSerializer, ConteoFisicoSerializer, ConteoLecturaSerializer,
+)
+
+# ============================================================
+#  UTILIDADES
+# ============================================================
+class CursorPaginacion(CursorPagination):
+    page_size = 100
+    max_page_size = 500
+    page_size_query_param = "page_size"
+    ordering = "-id"
+
+
+class PermisosModelo(DjangoModelPermissions):
+    # Igual que DjangoModelPermissions, pero también exige 'view_' en GET.
+    perms_map = {
+        **DjangoModelPermissions.perms_map,
+        "GET": ["%(app_label)s.view_%(model_name)s"],
+    }
+
+
+def _errores(exc):
+    """Normaliza un ValidationError de Django (modelo) al formato de DRF."""
+    if hasattr(exc, "message_dict"):
+        return exc.message_dict
+    return {"non_field_errors": exc.messages}
+
+
+def _momento(valor, fin=False):
+    """'2025-03-01' o '2025-03-01T10:00'. Una fecha sola abarca el día completo."""
+    if not valor:
+        return None
+    dt = parse_datetime(valor)
+    if dt is None:
+        d = parse_date(valor)
+        if d is None:
+            raise serializers.ValidationError({"fecha": f"Fecha inválida: {valor}"})
+        dt = datetime.datetime.combine(d, datetime.time.max if fin else datetime.time.min)
+    return timezone.make_aware(dt) if timezone.is_naive(dt) else dt
+
+
+def _reservar_borrador(obj):
+    """Un borrador sin stock suficiente se crea igual, solo que sin reserva."""
+    try:
+        with atomico():
+            obj.reservar()
+    except DjangoValidationError:
+        pass
+
+
+def _reservar_accion(obj, estado_final):
+    if obj.estado == estado_final:
+        return Response({"detail": "Ya no es un borrador."}, status=status.HTTP_409_CONFLICT)
+    try:
+        reservas = obj.reservar()
+    except DjangoValidationError as e:
+        return Response(_errores(e), status=status.HTTP_409_CONFLICT)
+    return Response({"reservas": [
+        {"mp": r.mp_id, "lote": r.lote_id, "ubicacion": r.ubicacion_id, "cantidad": r.cantidad, "expira": r.expira}
+        for r in reservas
+    ]})
+
+
+class EnMudanza(APIException):
+    status_code = status.HTTP_503_SERVICE_UNAVAILABLE
+    default_detail = "La empresa se está moviendo de base de datos; reintente en unos minutos."
+
+
+class TenantViewSetMixin:
+    permission_classes = [IsAuthenticated, PermisosModelo]
+    pagination_class = CursorPaginacion
+
+    @property
+    def suscripcion(self):
+        return self.request.user.suscripcion
+
+    def initial(self, request, *args, **kwargs):
+        super().initial(request, *args, **kwargs)
+        # Con token el usuario recién se conoce acá (ShardMiddleware no lo vio):
+        # se fija la base de su empresa hasta finalize_response().
+        suscripcion = self.suscripcion
+        if suscripcion is not None:
+            if suscripcion.en_mudanza and request.method not in SAFE_METHODS:
+                raise EnMudanza()
+            self._shard = shards.fijar(suscripcion)
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        if getattr(self, "_shard", None) is not None:
+            shards.soltar(self._shard)
+            self._shard = None
+        return super().finalize_response(request, response, *args, **kwargs)
+
+    def _recargar(self, obj):
+        # Re-lee el objeto con el queryset optimizado de la vista.
+        return self.get_serializer(self.get_queryset().get(pk=obj.pk)).data
+
+
+class CrearTenantMixin(TenantViewSetMixin):
+    """POST individual y POST /batch/ (arreglo)."""
+
+    def _crear_uno(self, data):
+        """Valida y crea un objeto. Debe correr dentro de atomico()."""
+        serializer = self.get_serializer(data=data)
+        serializer.is_valid(raise_exception=True)
+        self.perform_create(serializer)
+        return serializer
+
+    def create(self, request, *args, **kwargs):
+        try:
+            with atomico():
+                serializer = self._crear_uno(request.data)
+        except DjangoValidationError as e:
+            return Response(_errores(e), status=status.HTTP_400_BAD_REQUEST)
+        return Response(self._recargar(serializer.instance), status=status.HTTP_201_CREATED)
+
+    @action(detail=False, methods=["post"])
+    def batch(self, request, *args, **kwargs):
+        if not isinstance(request.data, list):
+            return Response({"detail": "Se esperaba un arreglo de objetos."}, status=status.HTTP_400_BAD_REQUEST)
+
+        # Cada ítem va en su propio savepoint: un error no deshace los demás.
+        resultados, creados = [], []
+        for i, item in enumerate(request.data):
+            try:
+                with atomico():
+                    serializer = self._crear_uno(item)
+                creados.append(serializer.instance.pk)
+                resultados.append({"indice": i, "ok": True, "id": serializer.instance.pk})
+            except serializers.ValidationError as e:
+                resultados.append({"indice": i, "ok": False, "errores": e.detail})
+            except DjangoValidationError as e:
+                resultados.append({"indice": i, "ok": False, "errores": _errores(e)})
+
+        # Una sola consulta (con sus prefetch) para devolver lo creado.
+        objetos = {o.pk: o for o in self.get_queryset().filter(pk__in=creados)}
+        for r in resultados:
+            if r["ok"]:
+                r["data"] = self.get_serializer(objetos[r["id"]]).data
+
+        errores = sum(1 for r in resultados if not r["ok"])
+        return Response(
+            {"creados": len(creados), "errores": errores, "resultados": resultados},
+            status=status.HTTP_207_MULTI_STATUS if errores else status.HTTP_201_CREATED,
+        )
+
+
+# ============================================================
+#  KARDEX / STOCK
+# ============================================================
+class MovimientoMPViewSet(CrearTenantMixin,
+                          mixins.ListModelMixin, mixins.RetrieveModelMixin,
+                          viewsets.GenericViewSet):
+    serializer_class = MovimientoMPSerializer
+    queryset = MovimientoMP.objects.all()
+
+    def get_queryset(self):
+        qs = (MovimientoMP.objects
+              .filter(mp__suscripcion=self.suscripcion)
+              .select_related("mp", "mp__unidad", "ubicacion"))
+        p = self.request.query_params
+        if p.get("mp"): qs = qs.filter(mp_id=p["mp"])
+        if p.get("ubicacion"): qs = qs.filter(ubicacion_id=p["ubicacion"])
+        if p.get("tipo"): qs = qs.filter(tipo=p["tipo"])
+        return qs
+
+    def perform_create(self, serializer):
+        serializer.save(created_by=self.request.user)
+
+    @action(detail=False, methods=["get"])
+    def traza(self, request):
+        """Recall de una MP: lotes hechos con ella (en el rango) y ventas que los recibieron."""
+        p = request.query_params
+        mp = MateriaPrima.objects.filter(suscripcion=self.suscripcion, pk=p.get("mp") or None).first()
+        if mp is None:
+            return Response({"mp": "Indique una materia prima válida."}, status=status.HTTP_400_BAD_REQUEST)
+        return Response(trazabilidad.adelante(
+            self.suscripcion, mp=mp, desde=_momento(p.get("desde")), hasta=_momento(p.get("hasta"), fin=True),
+        ))
+
+
+class StockViewSet(TenantViewSetMixin, viewsets.ReadOnlyModelViewSet):
+    serializer_class = StockPorUbicacionSerializer
+    queryset = StockPorUbicacion.objects.all()
+
+    def get_queryset(self):
+        qs = (StockPorUbicacion.objects
+              .filter(ubicacion__sucursal__suscripcion=self.suscripcion)
+              .select_related("mp", "mp__unidad", "ubicacion", "ubicacion__sucursal"))
+        p = self.request.query_params
+        if p.get("mp"): qs = qs.filter(mp_id=p["mp"])
+        if p.get("ubicacion"): qs = qs.filter(ubicacion_id=p["ubicacion"])
+        if p.get("sucursal"): qs = qs.filter(ubicacion__sucursal_id=p["sucursal"])
+        return qs
+
+
+class LoteProductoViewSet(TenantViewSetMixin, viewsets.ReadOnlyModelViewSet):
+    serializer_class = LoteProductoSerializer
+    queryset = LoteProducto.objects.all()
+
+    def get_queryset(self):
+        qs = (LoteProducto.objects
+              .filter(producto__suscripcion=self.suscripcion)
+              .select_related("producto", "producto__unidad", "ubicacion"))
+        p = self.request.query_params
+        if p.get("producto"): qs = qs.filter(producto_id=p["producto"])
+        if p.get("sucursal"): qs = qs.filter(ubicacion__sucursal_id=p["sucursal"])
+        if p.get("estado"): qs = qs.filter(estado=p["estado"])
+        if p.get("disponibles"): qs = qs.filter(cantidad_disponible__gt=0)
+        if p.get("codigo"): qs = qs.filter(codigo=p["codigo"])
+        return qs
+
+    @action(detail=True, methods=["get"])
+    def traza(self, request, pk=None):
+        lote = self.get_object()
+        if request.query_params.get("direccion") == "atras":
+            return Response(trazabilidad.atras(self.suscripcion, lote=lote))
+        return Response(trazabilidad.adelante(self.suscripcion, lote=lote))
+
+
+# ============================================================
+#  PRODUCCIÓN
+# ============================================================
+class OrdenProduccionViewSet(CrearTenantMixin,
+                             mixins.ListModelMixin, mixins.RetrieveModelMixin,
+                             viewsets.GenericViewSet):
+    serializer_class = OrdenProduccionSerializer
+    queryset = OrdenProduccion.objects.all()
+
+    def get_queryset(self):
+        qs = (OrdenProduccion.objects
+              .filter(producto__suscripcion=self.suscripcion)
+              .select_related("producto", "receta")
+              .prefetch_related("lotes_creados"))
+        p = self.request.query_params
+        if p.get("estado"): qs = qs.filter(estado=p["estado"])
+        if p.get("sucursal"): qs = qs.filter(sucursal_id=p["sucursal"])
+        return qs
+
+    def perform_create(self, serializer):
+        ejecutar = serializer.validated_data.get("ejecutar")
+        op = serializer.save(created_by=self.request.user)
+        if ejecutar:
+            op.ejecutar(user=self.request.user)
+        else:
+            _reservar_borrador(op)
+
+    @action(detail=True, methods=["post"])
+    def reservar(self, request, pk=None):
+        """Renueva (o rehace) la reserva de MP de un borrador."""
+        return _reservar_accion(self.get_object(), OrdenProduccion.CONSUMIDA)
+
+    @action(detail=True, methods=["post"])
+    def ejecutar(self, request, pk=None):
+        op = self.get_object()
+        try:
+            with atomico():
+                op.ejecutar(user=request.user)
+        except DjangoValidationError as e:
+            return Response(_errores(e), status=status.HTTP_409_CONFLICT)
+        return Response(self._recargar(op))
+
+
+# ============================================================
+#  VENTAS
+# ============================================================
+class VentaViewSet(CrearTenantMixin,
+                   mixins.ListModelMixin, mixins.RetrieveModelMixin,
+                   viewsets.GenericViewSet):
+    serializer_class = VentaSerializer
+    queryset = Venta.objects.all()
+
+    def get_queryset(self):
+        qs = (Venta.objects
+              .filter(suscripcion=self.suscripcion)
+              .prefetch_related("lineas__producto__unidad", "consumos__lote", "consumos__linea"))
+        p = self.request.query_params
+        if p.get("estado"): qs = qs.filter(estado=p["estado"])
+        if p.get("sucursal"): qs = qs.filter(sucursal_id=p["sucursal"])
+        return qs
+
+    def perform_create(self, serializer):
+        confirmar = serializer.validated_data.get("confirmar")
+        venta = serializer.save(created_by=self.request.user)
+        if confirmar:
+            venta.consumir_fifo(user=self.request.user)
+        else:
+            _reservar_borrador(venta)
+
+    @action(detail=True, methods=["post"])
+    def reservar(self, request, pk=None):
+        """Renueva (o rehace) la reserva de lotes de un borrador."""
+        return _reservar_accion(self.get_object(), Venta.CONFIRMADA)
+
+    @action(detail=True, methods=["post"])
+    def confirmar(self, request, pk=None):
+        venta = self.get_object()
+        try:
+            venta.consumir_fifo(user=request.user)
+        except DjangoValidationError as e:
+            return Response(_errores(e), status=status.HTTP_409_CONFLICT)
+        return Response(self._recargar(venta))
+
+    @action(detail=True, methods=["get"])
+    def traza(self, request, pk=None):
+        return Response(trazabilidad.atras(self.suscripcion, venta=self.get_object()))
+
+
+# ============================================================
+#  TRASLADOS
+# ============================================================
+class TrasladoViewSet(CrearTenantMixin,
+                      mixins.ListModelMixin, mixins.RetrieveModelMixin,
+                      viewsets.GenericViewSet):
+    serializer_class = TrasladoSerializer
+    queryset = Traslado.objects.all()
+
+    def get_queryset(self):
+        qs = (Traslado.objects
+              .filter(suscripcion=self.suscripcion)
+              .prefetch_related("lineas__mp", "lineas__lote"))
+        p = self.request.query_params
+        if p.get("estado"): qs = qs.filter(estado=p["estado"])
+        if p.get("sucursal"): qs = qs.filter(Q(origen__sucursal_id=p["sucursal"]) | Q(destino__sucursal_id=p["sucursal"]))
+        return qs
+
+    def perform_create(self, serializer):
+        confirmar = serializer.validated_data.get("confirmar")
+        traslado = serializer.save(created_by=self.request.user)
+        if confirmar:
+            traslado.confirmar(user=self.request.user)
+
+    @action(detail=True, methods=["post"])
+    def confirmar(self, request, pk=None):
+        traslado = self.get_object()
+        try:
+            traslado.confirmar(user=request.user)
+        except DjangoValidationError as e:
+            return Response(_errores(e), status=status.HTTP_409_CONFLICT)
+        return Response(self._recargar(traslado))
+
+
+# ============================================================
+#  CONTEOS FÍSICOS
+# ============================================================
+class ConteoViewSet(CrearTenantMixin,
+                    mixins.ListModelMixin, mixins.RetrieveModelMixin,
+                    viewsets.GenericViewSet):
+    """
+    Los escáneres crean el conteo (con o sin líneas) y después mandan
+    lecturas a /lineas/, que se suman a lo ya contado.
+    """
+    serializer_class = ConteoFisicoSerializer
+    queryset = ConteoFisico.objects.all()
+
+    def get_queryset(self):
+        qs = (ConteoFisico.objects
+              .filter(suscripcion=self.suscripcion)
+              .annotate(n_lineas=Count("lineas")))
+        p = self.request.query_params
+        if p.get("estado"): qs = qs.filter(estado=p["estado"])
+        if p.get("sucursal"): qs = qs.filter(sucursal_id=p["sucursal"])
+        return qs
+
+    def perform_create(self, serializer):
+        serializer.save(created_by=self.request.user)
+
+    @action(detail=True, methods=["post"])
+    def lineas(self, request, pk=None):
+        conteo = self.get_object()
+        lecturas = ConteoLecturaSerializer(data=request.data, many=True)
+        lecturas.is_valid(raise_exception=True)
+        try:
+            n, errores = conteos.cargar(
+                conteo, [(ln["ubicacion"], ln["mp"], ln["contado"]) for ln in lecturas.validated_data], sumar=True)
+        except DjangoValidationError as e:
+            return Response(_errores(e), status=status.HTTP_409_CONFLICT)
+        return Response({"cargadas": n, "errores": errores},
+                        status=status.HTTP_207_MULTI_STATUS if errores else status.HTTP_200_OK)
+
+    @action(detail=True, methods=["get"])
+    def diferencias(self, request, pk=None):
+        conteo = self.get_object()
+        qs = conteos.diferencias(conteo)
+        if request.query_params.get("todas") != "1":
+            qs = qs.exclude(diferencia=0)
+        pagina = self.paginate_queryset(qs.order_by("-id"))
+        return self.get_paginated_response([
+            {"ubicacion": ln.ubicacion_id, "ubicacion_nombre": ln.ubicacion.nombre,
+             "mp": ln.mp_id, "mp_nombre": ln.mp.nombre,
+             "contado": ln.contado, "stock": ln.stock, "diferencia": ln.diferencia}
+            for ln in pagina
+        ])
+
+    @action(detail=True, methods=["post"])
+    def contabilizar(self, request, pk=None):
+        conteo = self.get_object()
+        try:
+            movimientos = conteo.contabilizar(user=request.user)
+        except DjangoValidationError as e:
+            return Response(_errores(e), status=status.HTTP_409_CONFLICT)
+        return Response({**self._recargar(conteo), "ajustes": len(movimientos), "resumen": conteos.resumen(conteo)})
+
+router = DefaultRouter()
+router.register("movimientos", MovimientoMPViewSet, basename="api-movimiento")
+router.register("stock", StockViewSet, basename="api-stock")
+router.register("lotes", LoteProductoViewSet, basename="api-lote")
+router.register("ordenes-produccion", OrdenProduccionViewSet, basename="api-op")
+router.register("ventas", VentaViewSet, basename="api-venta")
+router.register("traslados", TrasladoViewSet, basename="api-traslado")
+router.register("conteos", ConteoViewSet, basename="api-conteo")
@@ -0,0 +1,196 @@
+# inventario/archivo.py
+# ============================================================
+#  ARCHIVADO DEL KARDEX (MovimientoMP / VentaConsumo)
+# ============================================================
+# MovimientoMP y VentaConsumo crecen sin límite y cada consulta de la
+# empresa (kardex, mermas del panel, chequeos del wizard) carga con toda
+# la historia. archivar() pasa lo anterior a un horizonte (por defecto
+# ARCHIVO_HORIZONTE_DIAS) a MovimientoMPArchivo / VentaConsumoArchivo:
+#
+#   - Por tandas de MPs, cada una en su transacción: INSERT ... SELECT al
+#     archivo (las filas no pasan por Python), DELETE de las originales y,
+#     por cada (mp, ubicación), un movimiento APERTURA con el saldo de lo
+#     archivado, fechado en el último movimiento archivado. Así la suma
+#     del kardex vivo sigue siendo StockPorUbicacion (conciliar) y el
+#     saldo corrido / stock a una fecha no cambian.
+#   - Antes de archivar se completan las fotos diarias (SaldoDiarioMP)
+#     hasta el horizonte: stock_at() de fechas viejas sale de ellas.
+#   - Los VentaConsumo se archivan por venta (fecha de la venta).
+#   - Cada corrida deja un CorteArchivo con el horizonte y los totales.
+#
+# Los reportes leen el archivo solo cuando se les pide (historico=True,
+# o un rango que empieza antes del horizonte): movimientos(), sumar() y
+# consumos_de_venta() devuelven filas con los mismos atributos venga de
+# donde venga cada una.
+import datetime
+import heapq
+
+from django.conf import settings
+from django.db import connections, router
+from django.db.models import Count, Max, Q, Sum
+from django.utils import timezone
+
+from .models import (
+    CorteArchivo, MovimientoMP, MovimientoMPArchivo, StockPorUbicacion, VentaConsumo, VentaConsumoArchivo,
+)
+from .saldos import CERO, _q, generar_snapshots, inicio_dia
+from .shards import atomico
+
+RELACIONADOS_MOV = ("mp", "ubicacion", "ubicacion__sucursal", "created_by")
+
+
+def horizonte_por_defecto(hoy=None):
+    """Inicio del día de hace ARCHIVO_HORIZONTE_DIAS días."""
+    hoy = hoy or timezone.localdate()
+    return inicio_dia(hoy - datetime.timedelta(days=getattr(settings, "ARCHIVO_HORIZONTE_DIAS", 365)))
+
+
+def _tandas(ids, tamano):
+    for i in range(0, len(ids), tamano):
+        yield ids[i:i + tamano]
+
+
+def _copiar(qs, destino):
+    """INSERT INTO <destino> (...) SELECT ... de 'qs' (mismas columnas). Devuelve las filas copiadas."""
+    campos = [f for f in destino._meta.concrete_fields if f.name != "archivado_en"]
+    sql, params = qs.order_by().values_list(*[f.attname for f in campos]).query.sql_with_params()
+    conn = connections[router.db_for_write(destino)]
+    q = conn.ops.quote_name
+    columnas = ", ".join(q(f.column) for f in campos)
+    with conn.cursor() as cur:
+        cur.execute(f"INSERT INTO {q(destino._meta.db_table)} ({columnas}) {sql}", params)
+        return cur.rowcount
+
+
+# ============================================================
+#  ARCHIVAR
+# ============================================================
+@atomico
+def _archivar_mps(mp_ids, hasta):
+    """Archiva los movimientos < 'hasta' de estas MPs. Devuelve (archivados, aperturas)."""
+    # Lock de las filas de stock (mismo orden que registrar_bulk): un
+    # movimiento de estas MPs que entre ahora espera y no queda afuera
+    # del saldo de apertura ni se borra sin haberse copiado.
+    list(StockPorUbicacion.objects.select_for_update().filter(mp_id__in=mp_ids)
+         .order_by("ubicacion_id", "mp_id").values_list("pk", flat=True))
+
+    viejos = MovimientoMP.objects.filter(mp_id__in=mp_ids, fecha__lt=hasta)
+    reales = viejos.exclude(tipo=MovimientoMP.APERTURA)
+    # El saldo incluye la APERTURA de un archivado anterior: la reemplaza.
+    # Los pares sin movimientos nuevos que archivar conservan la suya.
+    saldos = [s for s in viejos.order_by().values("mp_id", "ubicacion_id").annotate(
+                  saldo=Sum(MovimientoMP.expr_cantidad_signed()), ultimo=Max("fecha"),
+                  reales=Count("pk", filter=~Q(tipo=MovimientoMP.APERTURA)))
+              if s["reales"]]
+    tocados = {(s["mp_id"], s["ubicacion_id"]) for s in saldos}
+    previas = [pk for pk, mp_id, ubicacion_id in viejos.filter(tipo=MovimientoMP.APERTURA)
+               .values_list("pk", "mp_id", "ubicacion_id") if (mp_id, ubicacion_id) in tocados]
+
+    archivados = _copiar(reales, MovimientoMPArchivo)
+    # Sin collector: las trazas conservan el id (ver TrazaEnlace.movimiento).
+    reales._raw_delete(reales.db)
+    MovimientoMP.objects.filter(pk__in=previas)._raw_delete(viejos.db)
+
+    aperturas = [
+        MovimientoMP(mp_id=s["mp_id"], ubicacion_id=s["ubicacion_id"], tipo=MovimientoMP.APERTURA,
+                     cantidad=_q(s["saldo"]), fecha=s["ultimo"],
+                     nota=f"Saldo al {timezone.localtime(s['ultimo']):%d-%m-%Y %H:%M} (kardex archivado)")
+        for s in saldos if _q(s["saldo"]) != CERO
+    ]
+    MovimientoMP.objects.bulk_create(aperturas, batch_size=2000)
+    return archivados, len(aperturas)
+
+
+@atomico
+def _archivar_consumos(venta_ids):
+    qs = VentaConsumo.objects.filter(venta_id__in=venta_ids)
+    copiados = _copiar(qs, VentaConsumoArchivo)
+    qs._raw_delete(qs.db)
+    return copiados
+
+
+def pendientes(suscripcion, hasta):
+    """(MPs con movimientos para archivar, ventas con consumos para archivar): ids ordenados."""
+    mp_ids = list(MovimientoMP.objects
+                  .filter(mp__suscripcion=suscripcion, fecha__lt=hasta)
+                  .exclude(tipo=MovimientoMP.APERTURA)
+                  .order_by("mp_id").values_list("mp_id", flat=True).distinct())
+    venta_ids = list(VentaConsumo.objects
+                     .filter(venta__suscripcion=suscripcion, venta__fecha__lt=hasta)
+                     .order_by("venta_id").values_list("venta_id", flat=True).distinct())
+    return mp_ids, venta_ids
+
+
+def archivar(suscripcion, hasta=None, tanda_mps=200, tanda_ventas=2000):
+    """
+    Archiva el kardex de la suscripción anterior a 'hasta' (datetime;
+    por defecto horizonte_por_defecto()). Cada tanda es una transacción:
+    si se corta a mitad de camino lo hecho queda consistente y la próxima
+    corrida sigue desde ahí. Devuelve el CorteArchivo guardado.
+    """
+    hasta = hasta or horizonte_por_defecto()
+    generar_snapshots(hasta=timezone.localtime(hasta).date() - datetime.timedelta(days=1), suscripcion=suscripcion)
+
+    corte = CorteArchivo(suscripcion=suscripcion, hasta=hasta)
+    mp_ids, venta_ids = pendientes(suscripcion, hasta)
+    for tanda in _tandas(mp_ids, tanda_mps):
+        archivados, aperturas = _archivar_mps(tanda, hasta)
+        corte.movimientos += archivados
+        corte.aperturas += aperturas
+    for tanda in _tandas(venta_ids, tanda_ventas):
+        corte.consumos += _archivar_consumos(tanda)
+    corte.save()
+    return corte
+
+
+# ============================================================
+#  LECTURA (VIVO + ARCHIVO)
+# ============================================================
+def incluye_archivo(suscripcion, desde):
+    """¿Un reporte que empieza en 'desde' necesita leer el archivo?"""
+    horizonte = CorteArchivo.horizonte(suscripcion)
+    return horizonte is not None and desde < horizonte
+
+
+def movimientos(suscripcion, limite=300, historico=False, **filtros):
+    """
+    Los últimos 'limite' movimientos (más nuevos primero). Con
+    historico=True mezcla el kardex vivo, sin los saldos de apertura
+    (repetirían lo archivado), con el archivo: dos consultas acotadas
+    por 'limite', no una por tabla completa.
+    """
+    vivos = (MovimientoMP.objects.filter(mp__suscripcion=suscripcion, **filtros)
+             .select_related(*RELACIONADOS_MOV).order_by("-fecha", "-id"))
+    if not historico:
+        return list(vivos[:limite])
+    archivados = (MovimientoMPArchivo.objects.filter(mp__suscripcion=suscripcion, **filtros)
+                  .select_related(*RELACIONADOS_MOV).order_by("-fecha", "-id"))
+    mezcla = heapq.merge(vivos.exclude(tipo=MovimientoMP.APERTURA)[:limite], archivados[:limite],
+                         key=lambda m: (m.fecha, m.id), reverse=True)
+    return [m for m, _ in zip(mezcla, range(limite))]
+
+
+def sumar(suscripcion, campos, historico=False, **filtros):
+    """
+    {(valores de 'campos'): suma de 'cantidad'} de los movimientos que
+    cumplen 'filtros'; con historico=True suma también los archivados.
+    Los saldos de apertura no cuentan (no son movimientos reales).
+    """
+    totales = {}
+    for modelo in (MovimientoMP, MovimientoMPArchivo) if historico else (MovimientoMP,):
+        filas = (modelo.objects.filter(mp__suscripcion=suscripcion, **filtros)
+                 .exclude(tipo=MovimientoMP.APERTURA)
+                 .order_by().values_list(*campos).annotate(total=Sum("cantidad")))
+        for *clave, total in filas:
+            totales[tuple(clave)] = totales.get(tuple(clave), CERO) + (total or CERO)
+    return totales
+
+
+def consumos_de_venta(venta):
+    """VentaConsumo de la venta (usa el prefetch si lo hay); si ya se archivaron, los del archivo."""
+    consumos = list(venta.consumos.all())
+    if consumos or venta.estado != venta.CONFIRMADA:
+        # Un borrador no tiene consumos: no hace falta mirar el archivo.
+        return consumos
+    return list(VentaConsumoArchivo.objects.filter(venta=venta)
+                .select_related("linea", "lote__producto", "lote__ubicacion"))
@@ -0,0 +1,202 @@
+# inventario/bom.py
+# ============================================================
+#  EXPLOSIÓN DE RECETAS (BOM MULTINIVEL)
+# ============================================================
+# Una línea de receta es una MP o un producto intermedio (masa, relleno)
+# que a su vez tiene receta: RecetaLinea.mp o RecetaLinea.producto.
+# Para producir hay que llevar todo a MP:
+#
+#   Pan (por lote): 2 kg Masa + 0,1 kg Sal
+#   Masa (rinde 5 kg por lote): 4 kg Harina + 2,5 l Agua
+#   → Pan por lote: 1,6 kg Harina + 1 l Agua + 0,1 kg Sal
+#
+# La cantidad de un intermedio está en la unidad del producto; se divide
+# por el rendimiento de SU receta activa (la activa de mayor versión).
+#
+#   - Carga por niveles: una consulta de líneas por nivel de anidamiento
+#     y una de recetas activas por nivel que tenga intermedios. Una
+#     receta solo de MPs es una consulta; nunca más de
+#     2 × PROFUNDIDAD_MAX.
+#   - Cada sub-receta se expande una sola vez por Explosion aunque
+#     aparezca en varias ramas (memo por (receta, versión)). El memo vive
+#     lo que vive la Explosion: las líneas se editan sin subir la
+#     versión, así que no se guarda entre requests.
+#   - Ciclos (Masa → Relleno → Masa) levantan ValidationError al
+#     expandir; el formulario de recetas los rechaza antes de guardar.
+from collections import defaultdict
+from decimal import Decimal, ROUND_HALF_UP
+
+from django.core.exceptions import ValidationError
+
+from .models import MateriaPrima, Producto, Receta, RecetaLinea
+
+CERO = Decimal("0")
+TRES_DEC = Decimal("0.001")
+NUEVE_DEC = Decimal("1e-9")
+PROFUNDIDAD_MAX = 10
+
+
+def recetas_activas(producto_ids, *campos):
+    """{producto_id: Receta} con la receta activa (mayor versión) de cada producto (1 consulta)."""
+    activas = {}
+    if not producto_ids:
+        return activas
+    qs = (Receta.objects.filter(producto_id__in=set(producto_ids), activo=True)
+          .order_by("producto_id", "-version", "-pk"))
+    if campos:
+        qs = qs.only("pk", "producto_id", *campos)
+    for r in qs:
+        activas.setdefault(r.producto_id, r)
+    return activas
+
+
+class Explosion:
+    """Expande recetas a MP. Reutilizable para varias recetas: comparte la carga y el memo."""
+
+    def __init__(self):
+        self._lineas = {}     # receta_id → [(mp_id, producto_id, cantidad)]
+        self._version = {}    # receta_id → versión (de las sub-recetas cargadas)
+        self._activa = {}     # producto_id → Receta activa (o None)
+        self._memo = {}       # (receta_id, versión) → {mp_id: cantidad por lote}
+
+    # ---------------- carga ----------------
+    def _cargar(self, receta_ids):
+        pendientes = set(receta_ids) - self._lineas.keys()
+        nivel = 0
+        while pendientes:
+            nivel += 1
+            if nivel > PROFUNDIDAD_MAX:
+                raise ValidationError(f"La receta anida más de {PROFUNDIDAD_MAX} niveles de sub-recetas.")
+            for receta_id in pendientes:
+                self._lineas[receta_id] = []
+            for receta_id, mp_id, producto_id, cantidad in (
+                    RecetaLinea.objects.filter(receta_id__in=pendientes).order_by()
+                    .values_list("receta_id", "mp_id", "producto_id", "cantidad")):
+                self._lineas[receta_id].append((mp_id, producto_id, Decimal(cantidad)))
+
+            productos = {p for r in pendientes for _, p, _ in self._lineas[r] if p} - self._activa.keys()
+            activas = recetas_activas(productos, "version", "rendimiento_por_lote")
+            for producto_id in productos:
+                r = activas.get(producto_id)
+                self._activa[producto_id] = r
+                if r is not None:
+                    self._version[r.pk] = r.version
+            pendientes = {r.pk for r in activas.values()} - self._lineas.keys()
+
+    # ---------------- expansión ----------------
+    def por_lote(self, receta_id):
+        """{mp_id: cantidad} de MP por lote de la receta, con las sub-recetas expandidas."""
+        self._cargar([receta_id])
+        return self._expandir(receta_id, ())
+
+    def _expandir(self, receta_id, camino):
+        clave = (receta_id, self._version.get(receta_id))
+        if clave in self._memo:
+            return self._memo[clave]
+        if receta_id in camino:
+            raise ValidationError(_mensaje_ciclo(camino[camino.index(receta_id):] + (receta_id,)))
+        camino += (receta_id,)
+
+        total = defaultdict(lambda: CERO)
+        for mp_id, producto_id, cantidad in self._lineas[receta_id]:
+            if mp_id:
+                total[mp_id] += cantidad
+                continue
+            sub = self._activa.get(producto_id)
+            if sub is None:
+                nombre = Producto.objects.filter(pk=producto_id).values_list("nombre", flat=True).first()
+                raise ValidationError(f"El intermedio '{nombre}' no tiene una receta activa.")
+            if not sub.rendimiento_por_lote:
+                raise ValidationError(f"La receta '{sub}' tiene rendimiento 0.")
+            factor = cantidad / Decimal(sub.rendimiento_por_lote)
+            for mp_id, q in self._expandir(sub.pk, camino).items():
+                total[mp_id] += q * factor
+        self._memo[clave] = dict(total)
+        return self._memo[clave]
+
+    def requerimientos(self, receta_id, lotes):
+        """{mp_id: cantidad total} para 'lotes' lotes, redondeada a 3 decimales como el kardex."""
+        return {mp_id: total(q, lotes) for mp_id, q in self.por_lote(receta_id).items()}
+
+    def productos(self, receta_id):
+        """Intermedios usados en cualquier nivel de la receta (sin expandir cantidades)."""
+        self._cargar([receta_id])
+        vistos, pendientes = set(), [receta_id]
+        recetas = set()
+        while pendientes:
+            r = pendientes.pop()
+            if r in recetas:
+                continue
+            recetas.add(r)
+            for _, producto_id, _ in self._lineas.get(r, ()):
+                if producto_id and producto_id not in vistos:
+                    vistos.add(producto_id)
+                    sub = self._activa.get(producto_id)
+                    if sub is not None:
+                        pendientes.append(sub.pk)
+        return vistos
+
+
+def total(por_lote, lotes):
+    """Cantidad de MP para 'lotes' lotes, redondeada a 3 decimales como el kardex."""
+    return (Decimal(por_lote) * Decimal(lotes or 0)).quantize(TRES_DEC, rounding=ROUND_HALF_UP)
+
+
+def _mensaje_ciclo(receta_ids):
+    nombres = {r.pk: r.producto.nombre for r in Receta.objects.filter(pk__in=receta_ids).select_related("producto")}
+    return "Receta circular: " + " → ".join(nombres.get(r, str(r)) for r in receta_ids) + "."
+
+
+# ============================================================
+#  ATAJOS
+# ============================================================
+def requerimientos(receta, lotes):
+    """{mp_id: cantidad total} de MP para producir 'lotes' lotes de la receta."""
+    return Explosion().requerimientos(receta.pk, lotes)
+
+
+def snapshot(receta):
+    """
+    Receta explotada en formato compacto, para OrdenProduccion.receta_snapshot:
+
+        {"receta": id, "nombre": "Pan - Tradicional v2", "rendimiento": "10.000",
+         "mp": [[mp_id, nombre, unidad_id, "cantidad por lote"], ...]}
+
+    Nombre y unidad de la MP van copiados para mostrar la OP sin JOINs.
+    """
+    por_lote = Explosion().por_lote(receta.pk)
+    mps = (MateriaPrima.objects.filter(pk__in=por_lote).order_by("nombre")
+           .values_list("pk", "nombre", "unidad_id"))
+    return {
+        "receta": receta.pk,
+        "nombre": str(receta),
+        "rendimiento": str(receta.rendimiento_por_lote),
+        "mp": [[pk, nombre, unidad_id, format(por_lote[pk].quantize(NUEVE_DEC).normalize(), "f")]
+               for pk, nombre, unidad_id in mps],
+    }
+
+
+def detalle(receta, lotes):
+    """Filas {mp, por_lote, total_fmt} de la receta explotada a MP, ordenadas por nombre de MP."""
+    lotes = Decimal(lotes or 0)
+    por_lote = Explosion().por_lote(receta.pk)
+    mps = MateriaPrima.objects.in_bulk(por_lote)
+    return [
+        {"mp": mps[mp_id], "por_lote": mps[mp_id].format_qty(q), "total_fmt": mps[mp_id].format_qty(q * lotes)}
+        for mp_id, q in sorted(por_lote.items(), key=lambda par: mps[par[0]].nombre)
+    ]
+
+
+def validar_intermedios(producto_id, intermedio_ids):
+    """ValidationError si usar estos intermedios en una receta de 'producto_id' arma un ciclo."""
+    activas = recetas_activas(intermedio_ids)
+    explosion = Explosion()
+    for intermedio_id in intermedio_ids:
+        if intermedio_id == producto_id:
+            raise ValidationError("Un producto no puede ser ingrediente de su propia receta.")
+        sub = activas.get(intermedio_id)
+        if sub is None:
+            nombre = Producto.objects.filter(pk=intermedio_id).values_list("nombre", flat=True).first()
+            raise ValidationError(f"El intermedio '{nombre}' no tiene una receta activa.")
+        if producto_id in explosion.productos(sub.pk):
+            raise ValidationError(f"Receta circular: '{sub.producto}' ya usa este producto como ingrediente.")
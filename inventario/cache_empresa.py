@@ -0,0 +1,112 @@
+# inventario/cache_empresa.py
+# ============================================================
+#  CACHÉ DE FRAGMENTOS POR EMPRESA
+# ============================================================
+# Los widgets caros del panel (alertas de stock, lotes por vencer, KPIs,
+# gráficos) y el reporte de stock global se guardan con {% cache %} bajo
+# una llave que incluye la "versión de datos" de la empresa:
+#
+#   {% load cache %}
+#   {% cache cache_segundos "panel_alertas" datos_version %} ... {% endcache %}
+#
+# Toda escritura que cambia esos números (kardex, lotes, ventas, OPs,
+# mínimos de stock) sube la versión de su empresa: las llaves viejas
+# dejan de pedirse (vencen solas) y la próxima vista recalcula. No hace
+# falta saber qué fragmentos borrar, y una empresa no invalida a otra.
+#
+#   - Las señales de signals.py cubren los save()/delete(); los caminos
+#     en bloque (registrar_bulk, mínimos, reparaciones) llaman a
+#     invalidar_mps() a mano.
+#   - Dentro de una transacción la subida espera al commit: un rollback
+#     no invalida nada y nadie guarda un fragmento "nuevo" con datos de
+#     antes del commit.
+#   - La versión vive en el caché 'default' (CACHES en settings). Si se
+#     pierde (reinicio, desalojo) arranca desde la hora actual en ms, así
+#     no vuelve a un número con fragmentos viejos todavía guardados.
+#   - Leyendo de la réplica el fragmento dura a lo sumo
+#     REPLICA_FIJAR_SEGUNDOS: pudo armarse con datos atrasados después
+#     de la subida.
+#
+# La vista tiene que dejar perezoso lo que va dentro del fragmento
+# (querysets, SimpleLazyObject): si está en caché no se consulta nada.
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.exceptions import ObjectDoesNotExist
+from django.db import transaction
+from django.utils.functional import SimpleLazyObject
+
+from . import replicas
+from .shards import base_actual
+
+
+def _llave(suscripcion_id):
+    return f"datos_version:{suscripcion_id}"
+
+
+def _inicial():
+    return int(time.time() * 1000)
+
+
+def version(suscripcion_id):
+    """Versión de datos actual de la empresa (la crea si no está en el caché)."""
+    llave = _llave(suscripcion_id)
+    v = cache.get(llave)
+    if v is None:
+        cache.add(llave, _inicial(), timeout=None)
+        v = cache.get(llave, 0)
+    return v
+
+
+def _subir(suscripcion_id):
+    try:
+        cache.incr(_llave(suscripcion_id))
+    except ValueError:
+        # No estaba: cualquier valor nuevo sirve (nadie guardó fragmentos con él).
+        cache.add(_llave(suscripcion_id), _inicial(), timeout=None)
+
+
+def invalidar(suscripcion_id, using=None):
+    """Sube la versión de la empresa al confirmar la transacción en curso (o ya, si no hay)."""
+    if suscripcion_id is None:
+        return
+    transaction.on_commit(lambda: _subir(suscripcion_id), using=using or base_actual())
+
+
+def invalidar_mps(mp_ids, using=None):
+    """invalidar() de las empresas dueñas de estas MPs (escrituras en bloque sin señales)."""
+    from .models import MateriaPrima
+    using = using or base_actual()
+    for sid in (MateriaPrima.objects.using(using).filter(pk__in=set(mp_ids))
+                .order_by().values_list("suscripcion_id", flat=True).distinct()):
+        invalidar(sid, using)
+
+
+def empresa_de(instancia, campo):
+    """suscripcion_id de la fila a través de la FK 'campo' (queda cargada para los demás receptores)."""
+    try:
+        relacionado = getattr(instancia, campo)
+    except ObjectDoesNotExist:
+        return None
+    return relacionado.suscripcion_id if relacionado is not None else None
+
+
+def segundos():
+    """Vida de los fragmentos en este request (acotada si se lee de la réplica)."""
+    s = getattr(settings, "CACHE_FRAGMENTOS_SEGUNDOS", 0)
+    if replicas.leyendo_replica():
+        s = min(s, getattr(settings, "REPLICA_FIJAR_SEGUNDOS", 10))
+    return s
+
+
+def context_processor(request):
+    """{{ datos_version }} (perezoso: solo consulta el caché si la página lo usa) y {{ cache_segundos }}."""
+    user = getattr(request, "user", None)
+    sid = getattr(user, "suscripcion_id", None) if user is not None and user.is_authenticated else None
+    if sid is None:
+        return {"datos_version": "", "cache_segundos": 0}
+    return {
+        "datos_version": SimpleLazyObject(lambda: f"{sid}.{version(sid)}"),
+        "cache_segundos": segundos(),
+    }
@@ -0,0 +1,314 @@
+# inventario/cierre_pos.py
+# ============================================================
+#  IMPORTACIÓN DEL CIERRE DEL DÍA DE UN POS EXTERNO
+# ============================================================
+# Las tiendas con POS propio mandan las ventas del día en un archivo
+# (ticket, fecha, producto, cantidad). Cargarlas una por una por
+# VentaCreateView + consumir_fifo() es una transacción, una reserva y un
+# lock de lotes por venta. importar() hace el día completo de una vez:
+#
+#   1. Lee y valida las filas; productos por nombre o id (una consulta):
+#      la columna producto_id trae ids y producto/sku nombres, nunca se
+#      mezclan (un producto llamado "7" no es el producto 7).
+#      Los tickets ya importados en la sucursal se saltan (ticket_pos).
+#   2. Toma lock de los lotes vendibles de todos los productos del día,
+#      en orden FEFO (reservas.filas_lotes: descuenta lo que tienen
+#      apartado otros borradores), y asigna en UNA pasada: las ventas en
+#      orden de fecha, cada línea desde el primer lote con saldo de su
+#      producto.
+#   3. Un ticket al que no le alcanza alguna línea no consume nada: queda
+#      BORRADOR (se confirma después, cuando haya stock) y sus líneas
+#      cortas van al reporte. Lo que había tomado vuelve a los lotes para
+#      los tickets siguientes.
+#   4. Escribe todo en bloque: Venta, VentaLinea, VentaConsumo y
+#      TrazaEnlace con bulk_create, y los saldos de los lotes con un
+#      UPDATE por lote (actualizar_columna).
+#
+# Es una sola transacción: o entra el archivo entero (con sus faltantes
+# como borradores) o nada. Con aplicar=False solo arma el reporte.
+import datetime
+import os
+from collections import defaultdict
+from dataclasses import dataclass, field
+from decimal import Decimal, InvalidOperation
+
+import pandas as pd
+from django.core.exceptions import ValidationError
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+
+from .models import LoteProducto, Producto, TrazaEnlace, Venta, VentaConsumo, VentaLinea, actualizar_columna
+from .reservas import filas_lotes
+from .shards import atomico
+from . import cache_empresa, eventos
+
+CERO = Decimal("0")
+BATCH = 2000
+MAX_ERRORES = 50
+
+# Nombres de columna aceptados (en minúsculas, sin espacios de más). 'fecha' es opcional.
+COLUMNAS = {
+    "ticket": ("ticket", "boleta", "venta", "numero", "número"),
+    "fecha": ("fecha", "fecha_hora", "hora"),
+    "producto": ("producto", "producto_id", "sku"),
+    "cantidad": ("cantidad", "unidades"),
+}
+FORMATOS_FECHA = ("%d-%m-%Y %H:%M:%S", "%d-%m-%Y %H:%M", "%d/%m/%Y %H:%M:%S", "%d/%m/%Y %H:%M", "%d-%m-%Y", "%d/%m/%Y")
+
+
+@dataclass
+class Faltante:
+    ticket: str
+    producto: str
+    requerido: Decimal
+    asignado: Decimal
+
+    @property
+    def falta(self): return self.requerido - self.asignado
+
+
+@dataclass
+class Resultado:
+    confirmadas: int = 0
+    borradores: int = 0
+    lineas: int = 0
+    unidades: Decimal = CERO
+    costo: Decimal = CERO
+    lotes: int = 0
+    faltantes: list = field(default_factory=list)
+    duplicados: list = field(default_factory=list)
+    errores: list = field(default_factory=list)
+
+
+# ============================================================
+#  LECTURA
+# ============================================================
+def leer_archivo(archivo):
+    """[(ticket, fecha, producto, cantidad), ...] de un CSV o Excel ('fecha' puede faltar: '')."""
+    ext = os.path.splitext(getattr(archivo, "name", ""))[1].lower()
+    try:
+        df = pd.read_csv(archivo, dtype=str) if ext == ".csv" else pd.read_excel(archivo, dtype=str)
+    except Exception as e:
+        raise ValidationError(f"No se pudo leer el archivo: {e}")
+    df.columns = [str(c).strip().lower() for c in df.columns]
+    elegidas = {}
+    for clave, alias in COLUMNAS.items():
+        col = next((c for c in alias if c in df.columns), None)
+        if col is None and clave != "fecha":
+            raise ValidationError(f"Falta la columna '{clave}' (se aceptan: {', '.join(alias)}).")
+        elegidas[clave] = col
+    if elegidas["fecha"] is None:
+        df["__fecha"] = ""
+        elegidas["fecha"] = "__fecha"
+    df = df[[elegidas[c] for c in ("ticket", "fecha", "producto", "cantidad")]].fillna("")
+    filas = list(df.itertuples(index=False, name=None))
+    if elegidas["producto"].endswith("_id"):
+        filas = [(t, f, _a_id(p), c) for t, f, p, c in filas]
+    return filas
+
+
+class _NoId(str):
+    """Texto de la columna producto_id que no es un número: no resuelve a nada."""
+
+
+def _a_id(texto):
+    """Valor de la columna producto_id: int si es un id; si no, el texto (no se busca como nombre)."""
+    texto = str(texto).strip()
+    return int(texto) if texto.isdigit() else _NoId(texto)
+
+
+def _fecha(texto, defecto):
+    texto = str(texto).strip()
+    if not texto:
+        return defecto
+    valor = parse_datetime(texto.replace(" ", "T", 1)) or parse_date(texto[:10])
+    if valor is None:
+        for fmt in FORMATOS_FECHA:
+            try:
+                valor = datetime.datetime.strptime(texto, fmt)
+                break
+            except ValueError:
+                pass
+    if valor is None:
+        return None
+    if not isinstance(valor, datetime.datetime):
+        valor = datetime.datetime.combine(valor, datetime.time.min)
+    return timezone.make_aware(valor) if timezone.is_naive(valor) else valor
+
+
+def _tickets(suscripcion, filas, errores, ahora):
+    """
+    {ticket: {"fecha", "lineas": {producto_id: cantidad}}} y {producto_id: Producto}.
+    El producto de una fila es un id si viene como int y un nombre si viene como texto.
+    """
+    productos = {p.pk: p for p in Producto.objects.filter(suscripcion=suscripcion).select_related("unidad")}
+    nombres = {p.nombre.strip().lower(): p for p in productos.values()}
+
+    tickets = {}
+    for i, (ticket, fecha, producto, cantidad) in enumerate(filas, start=1):
+        ticket = str(ticket).strip()
+        if isinstance(producto, int) and not isinstance(producto, bool):
+            p = productos.get(producto)
+        else:
+            p = None if isinstance(producto, _NoId) else nombres.get(str(producto).strip().lower())
+        f = _fecha(fecha, ahora)
+        try:
+            c = Decimal(str(cantidad).strip().replace(",", "."))
+        except InvalidOperation:
+            c = None
+        if not ticket or len(ticket) > 40 or p is None or f is None or c is None or c <= 0:
+            if len(errores) < MAX_ERRORES:
+                motivo = ("ticket inválido" if not ticket or len(ticket) > 40 else "producto desconocido" if p is None
+                          else "fecha inválida" if f is None else "cantidad inválida")
+                errores.append(f"Fila {i}: {motivo} ({ticket} / {producto} / {cantidad})")
+            continue
+        t = tickets.setdefault(ticket, {"fecha": f, "lineas": defaultdict(lambda: CERO)})
+        t["fecha"] = min(t["fecha"], f)
+        # El mismo producto repetido en un ticket se suma en una línea.
+        t["lineas"][p.pk] += c
+    return tickets, productos
+
+
+# ============================================================
+#  ASIGNACIÓN FEFO (UNA PASADA)
+# ============================================================
+class _Lotes:
+    """Lotes de un producto en orden FEFO con lo que les queda libre; 'i' = primero con saldo."""
+
+    def __init__(self):
+        self.lotes = []
+        self.i = 0
+
+    def tomar(self, cantidad):
+        """[(índice, lote, cantidad)] tomado desde el primero con saldo; puede quedar corto."""
+        tomado, pendiente, j = [], cantidad, self.i
+        while pendiente > 0 and j < len(self.lotes):
+            lote = self.lotes[j]
+            t = min(pendiente, lote.libre)
+            if t > 0:
+                lote.libre -= t; pendiente -= t
+                tomado.append((j, lote, t))
+            if lote.libre <= 0:
+                j += 1
+        self.i = j
+        return tomado
+
+    def devolver(self, tomado):
+        for j, lote, t in tomado:
+            lote.libre += t
+            self.i = min(self.i, j)
+
+
+def asignar(tickets, lotes_por_producto):
+    """
+    Recorre los tickets por fecha y asigna cada línea. Devuelve
+    {ticket: [(producto_id, cantidad, [(lote, cantidad)])]} de los que
+    alcanzan y [(ticket, producto_id, requerido, asignado)] de las
+    líneas cortas (sus tickets no toman nada).
+    """
+    asignados, faltantes = {}, []
+    for ticket, t in sorted(tickets.items(), key=lambda kv: (kv[1]["fecha"], kv[0])):
+        tomado_ticket, cortas = [], []
+        for producto_id, cantidad in t["lineas"].items():
+            lotes = lotes_por_producto[producto_id]
+            tomado = lotes.tomar(cantidad)
+            tomado_ticket.append((producto_id, cantidad, tomado))
+            asignado = sum((x[2] for x in tomado), CERO)
+            if asignado < cantidad:
+                cortas.append((producto_id, cantidad, asignado))
+        if cortas:
+            for producto_id, _, tomado in tomado_ticket:
+                lotes_por_producto[producto_id].devolver(tomado)
+            faltantes.extend((ticket, producto_id, req, asig) for producto_id, req, asig in cortas)
+        else:
+            asignados[ticket] = [(pid, cant, [(lote, x) for _, lote, x in tomado]) for pid, cant, tomado in tomado_ticket]
+    return asignados, faltantes
+
+
+# ============================================================
+#  ESCRITURA
+# ============================================================
+def _con_pks(objetos, qs, clave):
+    """bulk_create sin RETURNING (MySQL) deja pk=None: se leen de vuelta por 'clave'."""
+    if objetos and objetos[0].pk is None:
+        pks = {tuple(fila[:-1]): fila[-1] for fila in qs.values_list(*clave, "pk")}
+        for o in objetos:
+            o.pk = pks[tuple(getattr(o, c) for c in clave)]
+
+
+@atomico
+def importar(suscripcion, sucursal, filas, user=None, aplicar=True):
+    """
+    Importa las ventas de 'filas' (ver leer_archivo) en la sucursal.
+    Devuelve un Resultado; con aplicar=False no escribe nada.
+    """
+    res = Resultado()
+    ahora = timezone.now()
+    tickets, productos = _tickets(suscripcion, filas, res.errores, ahora)
+    if not tickets:
+        if not res.errores:
+            raise ValidationError("El archivo no tiene ventas.")
+        return res
+
+    existentes = set(Venta.objects.filter(sucursal=sucursal, ticket_pos__in=list(tickets))
+                     .values_list("ticket_pos", flat=True))
+    res.duplicados = sorted(existentes)
+    for ticket in existentes:
+        del tickets[ticket]
+
+    lotes_por_producto = defaultdict(_Lotes)
+    ids = {pid for t in tickets.values() for pid in t["lineas"]}
+    for lote in filas_lotes(sucursal, ids, bloquear=True) if ids else ():
+        lote.libre = lote.cantidad_disponible - lote.reservado
+        lotes_por_producto[lote.producto_id].lotes.append(lote)
+
+    asignados, faltantes = asignar(tickets, lotes_por_producto)
+    res.faltantes = [Faltante(ticket, productos[pid].nombre, req, asig) for ticket, pid, req, asig in faltantes]
+    res.confirmadas = len(asignados)
+    res.borradores = len(tickets) - len(asignados)
+    res.lineas = sum(len(t["lineas"]) for t in tickets.values())
+    res.unidades = sum((c for t in tickets.values() for c in t["lineas"].values()), CERO)
+    consumido = defaultdict(lambda: CERO)
+    for lineas in asignados.values():
+        for _, _, tomado in lineas:
+            for lote, cantidad in tomado:
+                consumido[lote.pk] += cantidad
+                res.costo += cantidad * (lote.costo_unitario or CERO)
+    res.lotes = len(consumido)
+    if not aplicar or not tickets:
+        return res
+
+    ventas = Venta.objects.bulk_create([
+        Venta(suscripcion=suscripcion, sucursal=sucursal, fecha=t["fecha"], ticket_pos=ticket, created_by=user,
+              estado=Venta.CONFIRMADA if ticket in asignados else Venta.BORRADOR, nota=f"POS ticket {ticket}")
+        for ticket, t in tickets.items()
+    ], batch_size=BATCH)
+    _con_pks(ventas, Venta.objects.filter(sucursal=sucursal, ticket_pos__in=list(tickets)), ("ticket_pos",))
+    por_ticket = {v.ticket_pos: v for v in ventas}
+
+    lineas = VentaLinea.objects.bulk_create([
+        VentaLinea(venta=por_ticket[ticket], producto=productos[pid], cantidad=cantidad)
+        for ticket, t in tickets.items() for pid, cantidad in t["lineas"].items()
+    ], batch_size=BATCH)
+    # Un ticket tiene una línea por producto: (venta, producto) identifica la línea.
+    _con_pks(lineas, VentaLinea.objects.filter(venta__in=ventas), ("venta_id", "producto_id"))
+    linea_de = {(ln.venta_id, ln.producto_id): ln for ln in lineas}
+
+    consumos, trazas = [], []
+    for ticket, lineas_ticket in asignados.items():
+        venta = por_ticket[ticket]
+        de_venta = [VentaConsumo(venta=venta, linea=linea_de[venta.pk, pid], lote=lote, cantidad=cantidad,
+                                 created_by=user)
+                    for pid, _, tomado in lineas_ticket for lote, cantidad in tomado]
+        consumos.extend(de_venta)
+        trazas.extend(TrazaEnlace.desde_ventas(de_venta, venta))
+    VentaConsumo.objects.bulk_create(consumos, batch_size=BATCH)
+    TrazaEnlace.objects.bulk_create(trazas, batch_size=BATCH)
+    lotes = {l.pk: l for ls in lotes_por_producto.values() for l in ls.lotes}
+    actualizar_columna(LoteProducto, "cantidad_disponible",
+                       {pk: lotes[pk].cantidad_disponible - c for pk, c in consumido.items()})
+
+    # Sin señales (todo fue en bloque): caché del panel y paneles abiertos, a mano.
+    cache_empresa.invalidar(suscripcion.pk)
+    eventos.publicar(suscripcion.pk, "recargar", {})
+    return res
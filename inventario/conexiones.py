@@ -0,0 +1,71 @@
+# inventario/conexiones.py
+# ============================================================
+#  MÉTRICAS DE CONEXIONES A LA BASE DE DATOS
+# ============================================================
+# Cuántas conexiones abrió este proceso (signal connection_created, ver
+# signals.py) y, si la base usa el pool de psycopg (DB_POOL=1), el estado
+# del pool: tamaño, libres, requests esperando, errores y conexiones
+# perdidas. Sirve para ver si los workers reusan conexiones o abren una
+# por request, y si el pool se queda corto en los picos.
+#
+# Los números son por proceso: con varios workers de gunicorn cada uno
+# responde con los suyos.
+import os
+import threading
+from collections import Counter
+
+from django.contrib.auth.decorators import user_passes_test
+from django.db import connections
+from django.http import JsonResponse
+
+_aperturas = Counter()
+_lock = threading.Lock()
+
+
+def registrar_apertura(connection):
+    with _lock:
+        _aperturas[connection.alias] += 1
+
+
+def aperturas(alias="default"):
+    return _aperturas[alias]
+
+
+def _pool(conn):
+    # Solo el backend de PostgreSQL tiene pool; acceder a la propiedad lo
+    # crea si está configurado y todavía no se usó.
+    if "pool" not in conn.settings_dict.get("OPTIONS", {}):
+        return None
+    return getattr(conn, "pool", None)
+
+
+def metricas():
+    """Por alias: motor, política de conexiones, aperturas y estadísticas del pool."""
+    datos = {"pid": os.getpid(), "bases": {}}
+    for alias in connections:
+        conn = connections[alias]
+        cfg = conn.settings_dict
+        entrada = {
+            "motor": conn.vendor,
+            "conn_max_age": cfg.get("CONN_MAX_AGE"),
+            "health_checks": cfg.get("CONN_HEALTH_CHECKS"),
+            "aperturas": aperturas(alias),
+            "pool": None,
+        }
+        pool = _pool(conn)
+        if pool is not None:
+            # get_stats() de psycopg_pool: pool_min, pool_max, pool_size,
+            # pool_available, requests_waiting, connections_num,
+            # connections_errors, connections_lost, ...
+            entrada["pool"] = pool.get_stats()
+        if conn.vendor == "sqlite":
+            entrada["sqlite"] = {k: v for k, v in cfg.get("OPTIONS", {}).items()
+                                 if k in ("timeout", "transaction_mode", "init_command")}
+        datos["bases"][alias] = entrada
+    return datos
+
+
+@user_passes_test(lambda u: u.is_active and u.is_superuser)
+def diagnostico_conexiones(request):
+    """JSON con las métricas de conexiones de este proceso."""
+    return JsonResponse(metricas(), json_dumps_params={"ensure_ascii": False})
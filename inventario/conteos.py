@@ -0,0 +1,224 @@
+# inventario/conteos.py
+# ============================================================
+#  CONTEOS FÍSICOS: CARGA, DIFERENCIAS Y AJUSTES EN BLOQUE
+# ============================================================
+# Flujo de un conteo (ConteoFisico):
+#
+#   1. cargar(): filas (ubicación, MP, cantidad) desde un CSV/Excel o
+#      desde los escáneres (API). Ubicaciones y MPs se resuelven con dos
+#      consultas: un int es un id y un texto es un nombre, nunca las dos
+#      cosas (una MP llamada "12" no es la MP 12). En el archivo las
+#      columnas *_id traen ids y las demás nombres. Las líneas entran con
+#      un solo bulk_create (upsert sobre (conteo, ubicacion, mp)).
+#   2. diferencias(): contado − stock, calculado en UNA consulta con una
+#      subconsulta por línea contra StockPorUbicacion (índice único
+#      (ubicacion, mp)). resumen() agrega esa misma consulta.
+#   3. contabilizar(): toma lock de las filas de stock contadas, fija el
+#      stock del sistema en cada línea y registra todos los AJUSTE_POS /
+#      AJUSTE_NEG con MovimientoMP.registrar_bulk (una escritura del
+#      kardex, todo o nada).
+#
+# Lo que no se contó no se toca: un conteo cíclico cubre solo una parte
+# del inventario.
+import os
+from decimal import Decimal, InvalidOperation
+
+import pandas as pd
+from django.core.exceptions import ValidationError
+from django.db.models import Count, DecimalField, F, OuterRef, Q, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from .models import (
+    ConteoFisico, ConteoLinea, MateriaPrima, MovimientoMP, StockPorUbicacion, Ubicacion, actualizar_columna,
+)
+from .shards import atomico
+
+CERO = Decimal("0")
+BATCH = 2000
+MAX_ERRORES = 50
+
+# Nombres de columna aceptados (en minúsculas, sin espacios de más).
+COLUMNAS = {
+    "ubicacion": ("ubicacion", "ubicación", "ubicacion_id"),
+    "mp": ("mp", "materia_prima", "materia prima", "mp_id"),
+    "cantidad": ("cantidad", "contado", "conteo"),
+}
+
+
+# ============================================================
+#  CARGA
+# ============================================================
+def leer_archivo(archivo):
+    """[(ubicacion, mp, cantidad), ...] de un CSV o Excel con esas tres columnas."""
+    ext = os.path.splitext(getattr(archivo, "name", ""))[1].lower()
+    try:
+        df = pd.read_csv(archivo, dtype=str) if ext == ".csv" else pd.read_excel(archivo, dtype=str)
+    except Exception as e:
+        raise ValidationError(f"No se pudo leer el archivo: {e}")
+    df.columns = [str(c).strip().lower() for c in df.columns]
+    elegidas = {}
+    for clave, alias in COLUMNAS.items():
+        col = next((c for c in alias if c in df.columns), None)
+        if col is None:
+            raise ValidationError(f"Falta la columna '{clave}' (se aceptan: {', '.join(alias)}).")
+        elegidas[clave] = col
+    df = df[[elegidas["ubicacion"], elegidas["mp"], elegidas["cantidad"]]].fillna("")
+    u_id, mp_id = elegidas["ubicacion"].endswith("_id"), elegidas["mp"].endswith("_id")
+    return [(_a_id(u) if u_id else u, _a_id(m) if mp_id else m, c)
+            for u, m, c in df.itertuples(index=False, name=None)]
+
+
+class _NoId(str):
+    """Texto de una columna *_id que no es un número: no resuelve a nada."""
+
+
+def _a_id(texto):
+    """Valor de una columna *_id: int si es un id; si no, el texto (no se busca como nombre)."""
+    texto = str(texto).strip()
+    return int(texto) if texto.isdigit() else _NoId(texto)
+
+
+def _resolver(pares):
+    """({id: pk}, {'nombre en minúsculas': pk}) a partir de (pk, nombre)."""
+    ids, nombres = {}, {}
+    for pk, nombre in pares:
+        ids[pk] = pk
+        nombres[nombre.strip().lower()] = pk
+    return ids, nombres
+
+
+def _buscar(valor, mapas):
+    """pk de un valor de fila: un int se busca como id, un texto como nombre."""
+    ids, nombres = mapas
+    if isinstance(valor, int) and not isinstance(valor, bool):
+        return ids.get(valor)
+    if isinstance(valor, _NoId):
+        return None
+    return nombres.get(str(valor).strip().lower())
+
+
+@atomico
+def cargar(conteo, filas, sumar=False):
+    """
+    Agrega o reemplaza líneas del conteo. 'filas' son (ubicación, MP,
+    cantidad); ubicación y MP van como id (int) o nombre (texto), nunca
+    los dos: "12" es el nombre "12". Con sumar=True la cantidad se suma a lo
+    ya contado (lecturas sucesivas de un escáner); si no, la reemplaza.
+    Devuelve (líneas cargadas, [errores por fila]).
+    """
+    if conteo.estado != ConteoFisico.ABIERTO:
+        raise ValidationError("El conteo ya fue contabilizado.")
+    ubicaciones = _resolver(Ubicacion.objects.filter(sucursal_id=conteo.sucursal_id).values_list("pk", "nombre"))
+    mps = _resolver(MateriaPrima.objects.filter(suscripcion_id=conteo.suscripcion_id).values_list("pk", "nombre"))
+
+    contado, errores = {}, []
+    for i, (ubicacion, mp, cantidad) in enumerate(filas, start=1):
+        u = _buscar(ubicacion, ubicaciones)
+        m = _buscar(mp, mps)
+        try:
+            c = Decimal(str(cantidad).strip().replace(",", "."))
+        except InvalidOperation:
+            c = None
+        if u is None or m is None or c is None or c < 0:
+            if len(errores) < MAX_ERRORES:
+                motivo = ("ubicación desconocida" if u is None else "MP desconocida" if m is None
+                          else "cantidad inválida")
+                errores.append(f"Fila {i}: {motivo} ({ubicacion} / {mp} / {cantidad})")
+            continue
+        # La misma (ubicación, MP) repetida en el archivo se suma.
+        contado[u, m] = contado.get((u, m), CERO) + c
+
+    if sumar and contado:
+        previas = ConteoLinea.objects.filter(conteo=conteo, mp_id__in={m for _, m in contado}).values_list(
+            "ubicacion_id", "mp_id", "contado")
+        for u, m, c in previas:
+            if (u, m) in contado:
+                contado[u, m] += c
+
+    ConteoLinea.objects.bulk_create(
+        [ConteoLinea(conteo=conteo, ubicacion_id=u, mp_id=m, contado=c) for (u, m), c in contado.items()],
+        batch_size=BATCH, update_conflicts=True,
+        unique_fields=["conteo", "ubicacion", "mp"], update_fields=["contado"],
+    )
+    return len(contado), errores
+
+
+# ============================================================
+#  DIFERENCIAS
+# ============================================================
+def _stock_actual():
+    return Coalesce(
+        Subquery(StockPorUbicacion.objects.filter(ubicacion_id=OuterRef("ubicacion_id"), mp_id=OuterRef("mp_id"))
+                 .values("stock")[:1]),
+        Value(CERO),
+        output_field=DecimalField(max_digits=12, decimal_places=3),
+    )
+
+
+def diferencias(conteo):
+    """
+    Líneas con '.stock' (el actual, o el fijado al contabilizar) y
+    '.diferencia' = contado − stock, en una consulta.
+    """
+    qs = ConteoLinea.objects.filter(conteo=conteo)
+    stock = F("sistema") if conteo.estado == ConteoFisico.CONTABILIZADO else _stock_actual()
+    return (qs.annotate(stock=stock)
+              .annotate(diferencia=F("contado") - F("stock"))
+              .select_related("mp", "ubicacion"))
+
+
+def resumen(conteo):
+    """Totales de la revisión (una consulta)."""
+    qs = diferencias(conteo).select_related(None)
+    return qs.aggregate(
+        lineas=Count("pk"),
+        con_diferencia=Count("pk", filter=~Q(diferencia=0)),
+        sobrantes=Count("pk", filter=Q(diferencia__gt=0)),
+        faltantes=Count("pk", filter=Q(diferencia__lt=0)),
+        total_sobrante=Coalesce(Sum("diferencia", filter=Q(diferencia__gt=0)), Value(CERO)),
+        total_faltante=Coalesce(Sum("diferencia", filter=Q(diferencia__lt=0)), Value(CERO)),
+    )
+
+
+# ============================================================
+#  CONTABILIZAR
+# ============================================================
+@atomico
+def contabilizar(conteo, user=None):
+    """
+    Ajusta el stock a lo contado. El stock del sistema se lee con lock de
+    las filas (mismo orden que registrar_bulk), así lo que entre o salga
+    durante el conteo no se pisa. Devuelve los movimientos creados.
+    """
+    estado = ConteoFisico.objects.select_for_update().values_list("estado", flat=True).get(pk=conteo.pk)
+    if estado != ConteoFisico.ABIERTO:
+        raise ValidationError("El conteo ya fue contabilizado.")
+    lineas = list(ConteoLinea.objects.filter(conteo=conteo).only("pk", "ubicacion_id", "mp_id", "contado"))
+    if not lineas:
+        raise ValidationError("El conteo no tiene líneas.")
+
+    contadas = ConteoLinea.objects.filter(conteo=conteo)
+    stock = {
+        (u, m): s for u, m, s in StockPorUbicacion.objects.select_for_update().filter(
+            ubicacion_id__in=contadas.values("ubicacion_id"), mp_id__in=contadas.values("mp_id"),
+        ).order_by("ubicacion_id", "mp_id").values_list("ubicacion_id", "mp_id", "stock")
+    }
+
+    ahora = timezone.now(); nota = f"Conteo #{conteo.pk}"
+    movimientos = []
+    for ln in lineas:
+        ln.sistema = stock.get((ln.ubicacion_id, ln.mp_id), CERO)
+        dif = ln.contado - ln.sistema
+        if dif:
+            movimientos.append(MovimientoMP(
+                mp_id=ln.mp_id, ubicacion_id=ln.ubicacion_id, cantidad=abs(dif),
+                tipo=MovimientoMP.AJUSTE_POS if dif > 0 else MovimientoMP.AJUSTE_NEG,
+                fecha=ahora, nota=nota, conteo=conteo, created_by=user,
+            ))
+    creados = MovimientoMP.registrar_bulk(movimientos)
+    actualizar_columna(ConteoLinea, "sistema", {ln.pk: ln.sistema for ln in lineas})
+
+    conteo.estado = ConteoFisico.CONTABILIZADO; conteo.contabilizado_en = ahora
+    conteo.save(update_fields=["estado", "contabilizado_en"])
+    return creados
@@ -0,0 +1,208 @@
+# inventario/costos.py
+# ============================================================
+#  COSTOS: RECETAS, LOTES Y COSTO DE LO VENDIDO
+# ============================================================
+# Cadena de costos:
+#
+#   MovimientoMP.costo_unitario (INGRESO)
+#     → MateriaPrima.costo_promedio      (promedio ponderado, en MovimientoMP.save)
+#     → Receta.costo_unitario            (caché: Σ cantidad × costo / rendimiento;
+#                                         un intermedio cuesta el costo_unitario
+#                                         de su receta activa, ver bom.py)
+#     → LoteProducto.costo_unitario      (costo real de la OP, en OrdenProduccion.ejecutar)
+#     → costo de lo vendido por Venta    (Σ VentaConsumo.cantidad × costo del lote)
+#
+# La caché de recetas se mantiene sola (ver signals.py): cuando cambia el
+# promedio de una MP se recalculan SOLO las recetas que la usan, y hacia
+# arriba las que usan esas recetas como intermedio. Para recalcular todo
+# el catálogo (p.ej. después de una carga masiva) está recalcular_todo(),
+# vectorizado con pandas.
+from decimal import Decimal, ROUND_HALF_UP
+
+import pandas as pd
+from django.db import connections, router
+from django.db.models import Sum, F, DecimalField, ExpressionWrapper
+from django.utils import timezone
+
+from .bom import PROFUNDIDAD_MAX, recetas_activas
+from .models import Receta, RecetaLinea, VentaConsumo, VentaConsumoArchivo
+from .shards import atomico
+
+CERO = Decimal("0")
+CUATRO_DEC = Decimal("0.0001")
+
+
+def _costo(total, rendimiento):
+    if not rendimiento:
+        return CERO
+    return (Decimal(total) / Decimal(rendimiento)).quantize(CUATRO_DEC, rounding=ROUND_HALF_UP)
+
+
+def _guardar(recetas, batch_size=1000):
+    """
+    Escribe el costo de las recetas. Con muchas filas, executemany de un
+    UPDATE por pk es varias veces más rápido que bulk_update (que arma un
+    CASE WHEN gigante por tanda).
+    """
+    ahora = timezone.now()
+    if len(recetas) < 50:
+        for r in recetas:
+            r.costo_actualizado_en = ahora
+        Receta.objects.bulk_update(recetas, ["costo_unitario", "costo_actualizado_en"])
+        return len(recetas)
+
+    connection = connections[router.db_for_write(Receta)]
+    tabla = connection.ops.quote_name(Receta._meta.db_table)
+    campo_ahora = Receta._meta.get_field("costo_actualizado_en")
+    ahora_db = campo_ahora.get_db_prep_value(ahora, connection)
+    sql = f"UPDATE {tabla} SET costo_unitario = %s, costo_actualizado_en = %s WHERE id = %s"
+    with atomico(), connection.cursor() as cursor:
+        for i in range(0, len(recetas), batch_size):
+            cursor.executemany(sql, [
+                (connection.ops.adapt_decimalfield_value(r.costo_unitario, 14, 4), ahora_db, r.pk)
+                for r in recetas[i:i + batch_size]
+            ])
+    return len(recetas)
+
+
+# ============================================================
+#  INCREMENTAL
+# ============================================================
+def _costos_intermedios(lineas):
+    """Σ cantidad × costo unitario de la receta activa del intermedio, por receta."""
+    activas = recetas_activas({p for _, p, _ in lineas}, "costo_unitario")
+    totales = {}
+    for receta_id, producto_id, cantidad in lineas:
+        sub = activas.get(producto_id)
+        if sub is not None:
+            totales[receta_id] = totales.get(receta_id, CERO) + Decimal(cantidad) * sub.costo_unitario
+    return totales
+
+
+def _recalcular(receta_ids, mp_ids, producto_ids):
+    recetas = Receta.objects.none()
+    if receta_ids:
+        recetas |= Receta.objects.filter(pk__in=receta_ids)
+    if mp_ids:
+        recetas |= Receta.objects.filter(lineas__mp_id__in=mp_ids)
+    if producto_ids:
+        recetas |= Receta.objects.filter(lineas__producto_id__in=producto_ids)
+    recetas = {r.pk: r for r in recetas.distinct().only("pk", "producto_id", "rendimiento_por_lote", "costo_unitario")}
+    if not recetas:
+        return []
+
+    importe = ExpressionWrapper(F("cantidad") * F("mp__costo_promedio"),
+                                output_field=DecimalField(max_digits=20, decimal_places=7))
+    totales = dict(RecetaLinea.objects
+                   .filter(receta_id__in=recetas, mp__isnull=False)
+                   .values("receta_id").annotate(total=Sum(importe))
+                   .order_by().values_list("receta_id", "total"))
+    intermedios = _costos_intermedios(list(RecetaLinea.objects
+                                           .filter(receta_id__in=recetas, producto__isnull=False)
+                                           .values_list("receta_id", "producto_id", "cantidad")))
+
+    cambiadas = []
+    for pk, receta in recetas.items():
+        nuevo = _costo((totales.get(pk) or CERO) + intermedios.get(pk, CERO), receta.rendimiento_por_lote)
+        if nuevo != receta.costo_unitario:
+            receta.costo_unitario = nuevo
+            cambiadas.append(receta)
+    return cambiadas
+
+
+def recalcular_recetas(receta_ids=None, mp_ids=None, producto_ids=None):
+    """
+    Recalcula la caché de las recetas indicadas, de las que usan alguna de
+    las MPs indicadas y de las que usan alguno de los productos indicados
+    como intermedio. Tres consultas (recetas + Σ de MPs + intermedios) más
+    la escritura de las que cambiaron; si cambió el costo de una receta, se
+    repite hacia arriba con las recetas que usan su producto (a lo sumo
+    bom.PROFUNDIDAD_MAX niveles). Devuelve cuántas recetas se escribieron.
+    """
+    escritas = 0
+    for _ in range(PROFUNDIDAD_MAX + 1):
+        cambiadas = _recalcular(receta_ids, mp_ids, producto_ids)
+        if not cambiadas:
+            break
+        escritas += _guardar(cambiadas)
+        receta_ids, mp_ids, producto_ids = None, None, {r.producto_id for r in cambiadas}
+    return escritas
+
+
+# ============================================================
+#  COMPLETO (VECTORIZADO)
+# ============================================================
+def recalcular_todo(suscripcion=None, batch_size=1000):
+    """
+    Recalcula el costo de TODAS las recetas (de una empresa o de todas)
+    con cuatro lecturas planas y un groupby de pandas, sin iterar receta
+    por receta. Los intermedios se resuelven por rondas (una por nivel de
+    sub-recetas). Solo escribe las que cambiaron.
+    """
+    recetas_qs = Receta.objects.all()
+    lineas_qs = RecetaLinea.objects.all()
+    if suscripcion is not None:
+        recetas_qs = recetas_qs.filter(producto__suscripcion=suscripcion)
+        lineas_qs = lineas_qs.filter(receta__producto__suscripcion=suscripcion)
+
+    recetas = pd.DataFrame.from_records(
+        recetas_qs.values_list("pk", "producto_id", "activo", "version", "rendimiento_por_lote", "costo_unitario"),
+        columns=["receta_id", "producto_id", "activo", "version", "rendimiento", "costo_actual"],
+    )
+    if recetas.empty:
+        return 0
+    lineas = pd.DataFrame.from_records(
+        lineas_qs.filter(mp__isnull=False).values_list("receta_id", "cantidad", "mp__costo_promedio"),
+        columns=["receta_id", "cantidad", "costo_mp"],
+    )
+    sub = pd.DataFrame.from_records(
+        lineas_qs.filter(producto__isnull=False).values_list("receta_id", "producto_id", "cantidad"),
+        columns=["receta_id", "producto_id", "cantidad"],
+    )
+
+    lineas["importe"] = lineas["cantidad"].astype(float) * lineas["costo_mp"].astype(float)
+    total_mp = recetas["receta_id"].map(lineas.groupby("receta_id")["importe"].sum()).fillna(0.0)
+    rendimiento = recetas["rendimiento"].astype(float).where(lambda r: r != 0)
+    recetas["nuevo"] = (total_mp / rendimiento).fillna(0.0).round(4)
+
+    if not sub.empty:
+        # Receta activa de cada producto (mayor versión) → costo del intermedio.
+        activas = (recetas[recetas["activo"]].sort_values(["version", "receta_id"], ascending=False)
+                   .drop_duplicates("producto_id").set_index("producto_id")["receta_id"])
+        sub["sub_receta"] = sub["producto_id"].map(activas)
+        sub["cantidad"] = sub["cantidad"].astype(float)
+        for _ in range(PROFUNDIDAD_MAX + 1):
+            costo = recetas.set_index("receta_id")["nuevo"]
+            sub["importe"] = sub["cantidad"] * sub["sub_receta"].map(costo).fillna(0.0)
+            total = total_mp + recetas["receta_id"].map(sub.groupby("receta_id")["importe"].sum()).fillna(0.0)
+            nuevo = (total / rendimiento).fillna(0.0).round(4)
+            if nuevo.equals(recetas["nuevo"]):
+                break
+            recetas["nuevo"] = nuevo
+
+    cambiadas = recetas[recetas["nuevo"] != recetas["costo_actual"].astype(float)]
+
+    return _guardar(
+        [Receta(pk=int(pk), costo_unitario=Decimal(f"{nuevo:.4f}"))
+         for pk, nuevo in zip(cambiadas["receta_id"], cambiadas["nuevo"])],
+        batch_size=batch_size,
+    )
+
+
+# ============================================================
+#  COSTO DE LO VENDIDO
+# ============================================================
+def costo_ventas(ventas):
+    """
+    {venta_id: costo de lo vendido} para un queryset de ventas (2 consultas:
+    consumos vivos y archivados, ver inventario/archivo.py).
+    """
+    importe = ExpressionWrapper(F("cantidad") * F("lote__costo_unitario"),
+                                output_field=DecimalField(max_digits=20, decimal_places=7))
+    costos = {}
+    for modelo in (VentaConsumo, VentaConsumoArchivo):
+        for venta_id, total in (modelo.objects.filter(venta__in=ventas)
+                                .values("venta_id").annotate(total=Sum(importe))
+                                .order_by().values_list("venta_id", "total")):
+            costos[venta_id] = costos.get(venta_id, CERO) + (total or CERO)
+    return {venta_id: total.quantize(CUATRO_DEC) for venta_id, total in costos.items()}
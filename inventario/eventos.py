@@ -0,0 +1,155 @@
+# inventario/eventos.py
+# ============================================================
+#  EVENTOS EN VIVO DEL PANEL (Server-Sent Events)
+# ============================================================
+# El panel queda abierto todo el día. En vez de recargarlo (y recalcular
+# todos los agregados) se suscribe a /panel/eventos/ y recibe solo lo que
+# cambió en su empresa:
+#
+#   venta   venta confirmada: fecha y líneas (producto, cantidad)
+#   op      OP ejecutada: fecha, producto, unidades
+#   merma   MERMA de MP: fecha, MP, cantidad
+#   lote    lote guardado: estado, disponible, vencimiento
+#   recargar  cambios en bloque (cierre de POS importado) o eventos
+#             descartados: el panel se recarga entero
+#
+# Las señales de signals.py arman el evento y lo publican al confirmar la
+# transacción (un rollback no avisa nada). Cada evento lleva la fecha: el
+# panel lo suma solo si cae en su rango.
+#
+# Broker:
+#   - Con REDIS_URL (paquete 'redis'): pub/sub de Redis, así una venta
+#     hecha en un worker WSGI llega a los paneles conectados a otro
+#     proceso (el ASGI que sirve los streams).
+#   - Sin él (o si no se puede publicar en Redis): un broker local en
+#     memoria; solo ven el evento los paneles conectados a este proceso.
+#
+# El stream necesita el servidor ASGI (bigmomma/asgi.py, p. ej.
+# 'gunicorn -k uvicorn.workers.UvicornWorker bigmomma.asgi:application'):
+# bajo WSGI cada panel abierto ocuparía un worker para siempre, así que
+# ahí la vista contesta 204 y el navegador deja de reintentar.
+import asyncio
+import json
+import logging
+import threading
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import transaction
+
+from .shards import base_actual
+
+logger = logging.getLogger(__name__)
+
+PING_SEGUNDOS = 15     # comentario SSE para que proxies no corten la conexión
+COLA_MAX = 200         # eventos pendientes por panel; si se llena, el panel recarga
+
+
+class BrokerLocal:
+    """Pub/sub en memoria del proceso: {suscripcion_id: {(loop, cola)}}."""
+
+    def __init__(self):
+        self._subs = {}
+        self._lock = threading.Lock()
+
+    def publicar(self, suscripcion_id, evento):
+        with self._lock:
+            destinos = list(self._subs.get(suscripcion_id, ()))
+        for loop, cola in destinos:
+            # Se publica desde el thread de la vista (sync); la cola es del loop del stream.
+            loop.call_soon_threadsafe(_poner, cola, evento)
+
+    async def suscribir(self, suscripcion_id):
+        """Generador: cada evento, o None cada PING_SEGUNDOS sin eventos."""
+        cola = asyncio.Queue(maxsize=COLA_MAX)
+        par = (asyncio.get_running_loop(), cola)
+        with self._lock:
+            self._subs.setdefault(suscripcion_id, set()).add(par)
+        try:
+            while True:
+                try:
+                    yield await asyncio.wait_for(cola.get(), PING_SEGUNDOS)
+                except asyncio.TimeoutError:
+                    yield None
+        finally:
+            with self._lock:
+                subs = self._subs.get(suscripcion_id, set())
+                subs.discard(par)
+                if not subs:
+                    self._subs.pop(suscripcion_id, None)
+
+
+def _poner(cola, evento):
+    try:
+        cola.put_nowait(evento)
+    except asyncio.QueueFull:
+        # Panel que no lee: se descarta lo pendiente y se le pide recargar.
+        while not cola.empty():
+            cola.get_nowait()
+        cola.put_nowait({"tipo": "recargar"})
+
+
+class BrokerRedis:
+    """Pub/sub de Redis, canal 'eventos:<suscripcion_id>'. Si no puede publicar, usa el local."""
+
+    def __init__(self, url, local):
+        import redis
+        self.url = url
+        self.local = local
+        self._cliente = redis.Redis.from_url(url)
+
+    @staticmethod
+    def _canal(suscripcion_id):
+        return f"eventos:{suscripcion_id}"
+
+    def publicar(self, suscripcion_id, evento):
+        try:
+            self._cliente.publish(self._canal(suscripcion_id), json.dumps(evento, cls=DjangoJSONEncoder))
+        except Exception:
+            logger.warning("No se pudo publicar en Redis; evento solo local", exc_info=True)
+            self.local.publicar(suscripcion_id, evento)
+
+    async def suscribir(self, suscripcion_id):
+        import redis.asyncio as aredis
+        cliente = aredis.Redis.from_url(self.url)
+        pubsub = cliente.pubsub()
+        await pubsub.subscribe(self._canal(suscripcion_id))
+        try:
+            while True:
+                msg = await pubsub.get_message(ignore_subscribe_messages=True, timeout=PING_SEGUNDOS)
+                yield json.loads(msg["data"]) if msg else None
+        finally:
+            await pubsub.unsubscribe()
+            await pubsub.aclose()
+            await cliente.aclose()
+
+
+_local = BrokerLocal()
+_broker = None
+
+
+def broker():
+    global _broker
+    if _broker is None:
+        url = getattr(settings, "REDIS_URL", None)
+        try:
+            _broker = BrokerRedis(url, _local) if url else _local
+        except ImportError:
+            logger.warning("REDIS_URL definido pero falta el paquete 'redis': eventos solo locales")
+            _broker = _local
+    return _broker
+
+
+def publicar(suscripcion_id, tipo, datos, using=None):
+    """Publica {'tipo': tipo, **datos} a los paneles de la empresa al confirmar la transacción."""
+    if suscripcion_id is None:
+        return
+    evento = {"tipo": tipo, **datos}
+    transaction.on_commit(lambda: broker().publicar(suscripcion_id, evento), using=using or base_actual())
+
+
+def formatear(evento):
+    """Un evento (o None → ping) en formato text/event-stream."""
+    if evento is None:
+        return ": ping\n\n"
+    return f"event: {evento['tipo']}\ndata: {json.dumps(evento, cls=DjangoJSONEncoder)}\n\n"
@@ -22,6 +22,8 @@ from .models import (
     # <--- AQUI: Importamos los nuevos modelos WMS
     Sucursal, Ubicacion, StockPorUbicacion
 )
+from .reservas import disponible_mp
+from . import bom, unidades
 
 # ============================================================
 #  FORMULARIOS DE USUARIO (Sin cambios)
@@ -77,6 +79,10 @@ class MateriaPrimaForm(forms.ModelForm):
 
 class MovimientoIngresoForm(forms.ModelForm):
     cantidad = SmartDecimalField(min_value=Decimal("0.1")) 
+    costo_unitario = forms.DecimalField(
+        required=False, min_value=Decimal("0"), max_digits=14, decimal_places=4,
+        label="Costo por unidad (opcional)", widget=forms.NumberInput(attrs={"step": "0.01", "inputmode": "decimal"}),
+    )
     def __init__(self, *args, **kwargs):
         user = kwargs.pop('user', None) 
         super().__init__(*args, **kwargs)
@@ -93,7 +99,7 @@ class MovimientoIngresoForm(forms.ModelForm):
             
     class Meta:
         model = MovimientoMP
-        fields = ["mp", "ubicacion", "cantidad", "nota"] 
+        fields = ["mp", "ubicacion", "cantidad", "costo_unitario", "nota"] 
     def save(self, user=None, commit=True):
         obj = super().save(commit=False); obj.tipo = MovimientoMP.INGRESO
         if user: obj.created_by = user
@@ -185,18 +191,23 @@ class RecetaLineaForm(forms.ModelForm):
         super().__init__(*args, **kwargs)
         if user and user.suscripcion:
             self.fields['mp'].queryset = MateriaPrima.objects.filter(suscripcion=user.suscripcion, activo=True)
+            # Intermedios: productos con alguna receta activa (ver inventario/bom.py).
+            self.fields['producto'].queryset = (Producto.objects
+                .filter(suscripcion=user.suscripcion, activo=True, recetas__activo=True).distinct())
+        self.fields['producto'].label = "Sub-receta"
+        # El JS de receta_form.html cambia las opciones según la MP (kg/g, l/ml
+        # o la unidad base): el servidor tiene que aceptar cualquiera de ellas.
+        self.fields["cantidad_unidad"].choices = [("auto", "—")] + unidades.opciones()
     class Meta:
         model = RecetaLinea
-        fields = ["mp"] 
+        fields = ["mp", "producto"] 
     def clean(self):
-        c = super().clean(); mp = c.get("mp"); val = c.get("cantidad_valor"); uin = c.get("cantidad_unidad") 
-        if not mp or not val: return c
-        unidad_base = (mp.unidad.nombre or "").lower(); cantidad_base = Decimal(val) 
-        if unidad_base == "kg":
-            if uin and uin.lower() == "g": cantidad_base = Decimal(val) / Decimal("1000")
-        elif unidad_base in ("l", "lt", "litro", "litros"):
-            if uin and uin.lower() == "ml": cantidad_base = Decimal(val) / Decimal("1000")
-        self.cleaned_data["cantidad_base"] = cantidad_base
+        c = super().clean(); mp = c.get("mp"); prod = c.get("producto"); val = c.get("cantidad_valor"); uin = c.get("cantidad_unidad") 
+        if mp and prod:
+            raise forms.ValidationError("Elige una MP o una sub-receta, no ambas.")
+        ingrediente = mp or prod
+        if not ingrediente or not val: return c
+        self.cleaned_data["cantidad_base"] = unidades.a_base(val, uin, unidades.nombre(ingrediente.unidad_id))
         return c
     def save(self, commit=True):
         inst = super().save(commit=False); inst.cantidad = self.cleaned_data.get("cantidad_base") or Decimal("0")
@@ -205,17 +216,26 @@ class RecetaLineaForm(forms.ModelForm):
 
 class RecetaLineaBaseFormSet(BaseInlineFormSet):
     def clean(self):
-        super().clean(); mps = set(); at_least_one = False
+        super().clean(); mps = set(); productos = set(); at_least_one = False
         for form in self.forms: 
             if not getattr(form, "cleaned_data", None): continue
             if form.cleaned_data.get("DELETE"): continue
-            mp = form.cleaned_data.get("mp")
+            mp = form.cleaned_data.get("mp"); prod = form.cleaned_data.get("producto")
             if mp:
                 at_least_one = True
                 if mp in mps: form.add_error("mp", "La materia prima está duplicada.")
                 mps.add(mp)
+            elif prod:
+                at_least_one = True
+                if prod in productos: form.add_error("producto", "La sub-receta está duplicada.")
+                productos.add(prod)
+            elif form.has_changed():
+                form.add_error("mp", "Elige una MP o una sub-receta.")
         if not at_least_one:
             raise forms.ValidationError("La receta debe tener al menos un ingrediente.")
+        # Sin ciclos: el producto de esta receta no puede estar bajo ninguna sub-receta.
+        if productos and self.instance.producto_id:
+            bom.validar_intermedios(self.instance.producto_id, {p.pk for p in productos})
 
 RecetaLineaFormSet = inlineformset_factory(Receta, RecetaLinea, form=RecetaLineaForm, formset=RecetaLineaBaseFormSet, extra=1, can_delete=True)
 
@@ -258,7 +278,7 @@ class OrdenProduccionForm(forms.ModelForm):
             
             if prod:
                 self.fields["receta"].queryset = Receta.objects.filter(producto=prod, activo=True)
-                self.fields["lotes"].label = f"Cantidad a producir ({prod.unidad.nombre})"
+                self.fields["lotes"].label = f"Cantidad a producir ({unidades.nombre(prod.unidad_id)})"
             else:
                 self.fields["receta"].queryset = Receta.objects.none()
     
@@ -272,24 +292,24 @@ class OrdenProduccionForm(forms.ModelForm):
         
         if lotes and lotes <= 0: self.add_error("lotes", "La cantidad a producir debe ser > 0.")
         
+        if rec and lotes:
+            # Foto de la receta explotada a MP (ver bom.snapshot): la OP la
+            # guarda tal cual y el chequeo de stock la usa.
+            self.instance.receta_snapshot = foto = bom.snapshot(rec)
+
         if c.get("confirmar_y_ejecutar") and rec and lotes and sucursal:
             faltantes = []
-            for ln in rec.lineas.select_related("mp", "mp__unidad"):
-                req = (ln.cantidad or Decimal("0")) * lotes
-                
-                stock_en_sucursal = StockPorUbicacion.objects.filter(
-                    mp=ln.mp,
-                    ubicacion__sucursal=sucursal
-                ).aggregate(
-                    total=Coalesce(Sum('stock'), Decimal('0.0'))
-                )['total']
-                
-                disp = stock_en_sucursal
+            requerido = {mp_id: bom.total(q, lotes) for mp_id, _, _, q in foto["mp"]}
+            # Stock menos lo que ya reservaron otros borradores (1 consulta).
+            disponible = disponible_mp(sucursal, requerido)
+            for mp_id, nombre, unidad_id, _ in foto["mp"]:
+                req = requerido[mp_id]
+                disp = disponible[mp_id]
                 
                 if disp < req:
-                    req_fmt = ln.mp.format_qty(req)
-                    disp_fmt = ln.mp.format_qty(disp)
-                    faltantes.append(f"{ln.mp.nombre}: req {req_fmt} / stock {disp_fmt}")
+                    req_fmt = unidades.formatear(req, unidad_id)
+                    disp_fmt = unidades.formatear(disp, unidad_id)
+                    faltantes.append(f"{nombre}: req {req_fmt} / stock {disp_fmt}")
             
             if faltantes: 
                 raise forms.ValidationError(
@@ -467,5 +487,33 @@ class UbicacionForm(forms.ModelForm):
 class UploadFileForm(forms.Form):
     file = forms.FileField(label="Archivo CSV/Excel", help_text="Sube un archivo con columnas 'fecha' y 'valor'")
 
+class ConteoFisicoForm(forms.Form):
+    """Nuevo conteo físico: sucursal + archivo con columnas ubicacion, mp, cantidad."""
+    sucursal = forms.ModelChoiceField(queryset=Sucursal.objects.none())
+    archivo = forms.FileField(label="Archivo CSV/Excel",
+                              help_text="Columnas 'ubicacion', 'mp' y 'cantidad' (nombres o ids)")
+    nota = forms.CharField(max_length=200, required=False)
+
+    def __init__(self, *args, **kwargs):
+        user = kwargs.pop('user', None)
+        super().__init__(*args, **kwargs)
+        if user and user.suscripcion:
+            self.fields['sucursal'].queryset = Sucursal.objects.filter(suscripcion=user.suscripcion, activa=True)
+            self.fields['sucursal'].initial = self.fields['sucursal'].queryset.first()
+
+class CierrePOSForm(forms.Form):
+    """Cierre del día de un POS externo: sucursal + archivo (ver inventario/cierre_pos.py)."""
+    sucursal = forms.ModelChoiceField(queryset=Sucursal.objects.none())
+    archivo = forms.FileField(label="Archivo CSV/Excel",
+                              help_text="Columnas 'ticket', 'producto', 'cantidad' y opcional 'fecha'")
+    simular = forms.BooleanField(required=False, label="Solo revisar (no guarda)")
+
+    def __init__(self, *args, **kwargs):
+        user = kwargs.pop('user', None)
+        super().__init__(*args, **kwargs)
+        if user and user.suscripcion:
+            self.fields['sucursal'].queryset = Sucursal.objects.filter(suscripcion=user.suscripcion, activa=True)
+            self.fields['sucursal'].initial = self.fields['sucursal'].queryset.first()
+
 class UploadInvoiceForm(forms.Form):
     invoice_file = forms.FileField(label="Subir factura (imagen o PDF)", widget=forms.ClearableFileInput(attrs={'class': '...'}))
\ No newline at end of file
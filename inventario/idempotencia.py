@@ -0,0 +1,205 @@
+# inventario/idempotencia.py
+# ============================================================
+#  IDEMPOTENCIA DE POSTS QUE MUEVEN STOCK
+# ============================================================
+# Cuando un cliente (celular, POS, escáner) reintenta un POST que se le
+# cortó por timeout, el segundo intento NO debe crear otra venta u otro
+# movimiento (MovimientoMP.save() sumaría el stock dos veces).
+#
+# El cliente manda una llave única por operación:
+#   - header  'Idempotency-Key: <uuid>'       (API / clientes JSON)
+#   - campo   'idempotency_key' en el form     (vistas HTML)
+#
+# La primera petición "reclama" la llave insertando una fila en
+# RespuestaIdempotente (índice único → O(1) y a prueba de carreras:
+# dos reintentos simultáneos no pueden insertar la misma llave). Al
+# terminar se guarda la respuesta; los reintentos la reciben tal cual.
+#
+# Se usa como middleware (IdempotenciaMiddleware, para /api/) o como
+# decorador de vistas (@idempotente).
+import functools
+import hashlib
+import uuid
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.http import HttpResponse, JsonResponse
+from django.utils import timezone
+from django.utils.functional import SimpleLazyObject
+
+from .models import RespuestaIdempotente
+
+HEADER = "Idempotency-Key"
+CAMPO_FORM = "idempotency_key"
+METODOS = ("POST", "PUT", "PATCH", "DELETE")
+
+# Si la primera petición murió sin terminar (worker reiniciado, etc.)
+# la llave se libera pasado este tiempo.
+EN_PROCESO_TIMEOUT = timedelta(seconds=60)
+
+
+def _ttl():
+    return timedelta(hours=getattr(settings, "IDEMPOTENCIA_TTL_HORAS", 24))
+
+
+def _sha(*partes) -> str:
+    return hashlib.sha256("\x1f".join(str(p) for p in partes).encode()).hexdigest()
+
+
+def _llave_cliente(request):
+    return (request.headers.get(HEADER)
+            or (request.POST.get(CAMPO_FORM) if request.method == "POST" else None))
+
+
+def _alcance(request):
+    """Quién hace la petición: la llave de un usuario no sirve para otro."""
+    user = getattr(request, "user", None)
+    if user is not None and user.is_authenticated:
+        return f"u{user.pk}"
+    # Token de la API: el middleware corre antes de que DRF autentique.
+    auth = request.headers.get("Authorization")
+    return "a" + _sha(auth) if auth else "anon"
+
+
+def _replay(fila):
+    resp = HttpResponse(bytes(fila.contenido), status=fila.status_code, content_type=fila.content_type or None)
+    if fila.location:
+        resp["Location"] = fila.location
+    resp["Idempotent-Replay"] = "true"
+    return resp
+
+
+def _reclamar(llave, body_hash):
+    """
+    Inserta la fila "en proceso". Devuelve (fila, None) si la llave es
+    nuestra, o (None, respuesta) si hay que contestar sin ejecutar la vista.
+    """
+    ahora = timezone.now()
+    for _ in range(2):
+        try:
+            with transaction.atomic():
+                return RespuestaIdempotente.objects.create(
+                    llave=llave, body_hash=body_hash, expira=ahora + _ttl()
+                ), None
+        except IntegrityError:
+            pass
+
+        fila = RespuestaIdempotente.objects.filter(llave=llave).first()
+        if fila is None:
+            continue  # se borró entre medio: reintentamos el insert
+        abandonada = fila.status_code is None and fila.creado < ahora - EN_PROCESO_TIMEOUT
+        if fila.expira <= ahora or abandonada:
+            RespuestaIdempotente.objects.filter(pk=fila.pk, creado=fila.creado).delete()
+            continue
+        if fila.body_hash != body_hash:
+            return None, JsonResponse(
+                {"detail": f"La llave {HEADER} ya se usó con otro contenido."}, status=422
+            )
+        if fila.status_code is None:
+            resp = JsonResponse({"detail": "La solicitud original aún se está procesando."}, status=409)
+            resp["Retry-After"] = "1"
+            return None, resp
+        return None, _replay(fila)
+    return None, JsonResponse({"detail": "No se pudo reservar la llave de idempotencia."}, status=409)
+
+
+def _guardar(fila, response):
+    RespuestaIdempotente.objects.filter(pk=fila.pk).update(
+        status_code=response.status_code,
+        content_type=response.get("Content-Type", ""),
+        location=response.get("Location", "")[:500],
+        contenido=response.content,
+    )
+
+
+def procesar(request, ejecutar, guardar_si=None):
+    """
+    Ejecuta 'ejecutar()' una sola vez por llave. 'guardar_si(response)'
+    decide qué respuestas se guardan; las demás liberan la llave para que
+    el cliente pueda corregir y reintentar.
+    """
+    if request.method not in METODOS:
+        return ejecutar()
+    # Leer el cuerpo ANTES de request.POST: así queda cacheado y la vista
+    # (o DRF) lo puede volver a parsear.
+    body_hash = _sha(request.body)
+    llave_cliente = _llave_cliente(request)
+    if not llave_cliente:
+        return ejecutar()
+
+    guardar_si = guardar_si or (lambda r: r.status_code < 500)
+    llave = _sha(_alcance(request), request.method, request.path, llave_cliente)
+
+    fila, respuesta = _reclamar(llave, body_hash)
+    if respuesta is not None:
+        return respuesta
+
+    try:
+        response = ejecutar()
+        if hasattr(response, "render") and not getattr(response, "is_rendered", True):
+            response.render()
+    except BaseException:
+        fila.delete()
+        raise
+
+    if guardar_si(response) and not getattr(response, "streaming", False):
+        _guardar(fila, response)
+    else:
+        fila.delete()
+    return response
+
+
+# ============================================================
+#  MIDDLEWARE Y DECORADOR
+# ============================================================
+class IdempotenciaMiddleware:
+    """
+    Aplica la idempotencia a todas las rutas que empiecen con alguno de
+    los prefijos de settings.IDEMPOTENCIA_RUTAS (por defecto, la API).
+    """
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.rutas = tuple(getattr(settings, "IDEMPOTENCIA_RUTAS", ["/api/"]))
+
+    def __call__(self, request):
+        if not request.path.startswith(self.rutas):
+            return self.get_response(request)
+        return procesar(request, lambda: self.get_response(request))
+
+
+def _es_redirect(response):
+    return response.status_code in (301, 302, 303)
+
+
+def idempotente(view=None, *, guardar_si=_es_redirect):
+    """
+    Decorador para vistas HTML. Por defecto solo guarda las redirecciones
+    (el POST se aplicó); si el form vuelve con errores la llave se libera.
+
+        @method_decorator(idempotente, name="post")
+        class VentaCreateView(...)
+    """
+    def decorador(func):
+        @functools.wraps(func)
+        def wrapper(request, *args, **kwargs):
+            return procesar(request, lambda: func(request, *args, **kwargs), guardar_si=guardar_si)
+        return wrapper
+    return decorador(view) if view is not None else decorador
+
+
+def purgar_expiradas(batch=5000):
+    """Borra las respuestas vencidas en tandas (usa el índice de 'expira')."""
+    total = 0
+    while True:
+        ids = list(RespuestaIdempotente.objects
+                   .filter(expira__lte=timezone.now())
+                   .values_list("pk", flat=True)[:batch])
+        if not ids:
+            return total
+        total += RespuestaIdempotente.objects.filter(pk__in=ids).delete()[0]
+
+
+def context_processor(request):
+    """Expone {{ idempotency_key }} para los forms que mueven stock."""
+    return {"idempotency_key": SimpleLazyObject(lambda: uuid.uuid4().hex)}
@@ -0,0 +1,249 @@
+# inventario/instrumentacion.py
+# ============================================================
+#  INSTRUMENTACIÓN POR REQUEST (SQL, TEMPLATES, N+1)
+# ============================================================
+# Middleware opcional para saber en producción qué vistas son lentas y
+# por qué. Por cada request muestreado registra:
+#
+#   - tiempo total de la vista,
+#   - cantidad y tiempo de consultas SQL (connection.execute_wrapper),
+#   - consultas duplicadas (mismo SQL y mismos parámetros),
+#   - patrones N+1 (mismo SQL repetido con distintos parámetros) con la
+#     línea de NUESTRO código que lo dispara,
+#   - tiempo de render de templates.
+#
+# El resultado va a un ring buffer en memoria (por proceso), visible en
+# /diagnostico/requests/ para superusuarios, y al logger
+# "inventario.instrumentacion" como una línea JSON por request.
+#
+# Se activa con INSTRUMENTACION_ACTIVA=1 (variable de entorno). Si está
+# apagado el middleware se desactiva solo (MiddlewareNotUsed) y no
+# cuesta nada; encendido, solo los requests sorteados según
+# INSTRUMENTACION_MUESTREO pagan el costo de medir.
+import contextvars
+import json
+import logging
+import os
+import random
+import threading
+import time
+import traceback
+from collections import Counter, deque
+from contextlib import ExitStack
+
+from django.conf import settings
+from django.contrib.auth.decorators import user_passes_test
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+from django.http import JsonResponse
+from django.template import base as template_base
+from django.utils import timezone
+
+logger = logging.getLogger("inventario.instrumentacion")
+
+PREFIJOS_IGNORADOS = ("/static/", "/media/", "/diagnostico/")
+
+_actual = contextvars.ContextVar("instrumentacion_registro", default=None)
+_buffer = deque(maxlen=200)
+_buffer_lock = threading.Lock()
+
+
+def _config(nombre, defecto):
+    return getattr(settings, f"INSTRUMENTACION_{nombre}", defecto)
+
+
+# ============================================================
+#  REGISTRO DE UN REQUEST
+# ============================================================
+def _origen():
+    """Primer frame del stack que es código del proyecto (no Django ni librerías)."""
+    base = str(settings.BASE_DIR)
+    for frame in reversed(traceback.extract_stack()[:-2]):
+        archivo = frame.filename
+        if (archivo.startswith(base) and "site-packages" not in archivo
+                and not archivo.endswith("instrumentacion.py")):
+            return f"{os.path.relpath(archivo, base)}:{frame.lineno} en {frame.name}"
+    return None
+
+
+class Registro:
+    def __init__(self):
+        self.consultas = 0
+        self.sql_ms = 0.0
+        self.template_ms = 0.0
+        self._profundidad = 0
+        self.por_sql = Counter()         # SQL (con %s) → veces
+        self.por_params = Counter()      # (SQL, params) → veces
+        self.origenes = {}               # SQL → call site de la 2ª ejecución
+
+    def __call__(self, execute, sql, params, many, context):
+        t0 = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.sql_ms += (time.perf_counter() - t0) * 1000
+            self.consultas += 1
+            self.por_sql[sql] += 1
+            if not many:
+                try:
+                    self.por_params[sql, tuple(params or ())] += 1
+                except TypeError:   # parámetros no hasheables (listas, dicts)
+                    pass
+            # El stack solo se recorre la 2ª vez que aparece un SQL: la
+            # primera ejecución no es sospechosa y las siguientes ya
+            # tienen origen.
+            if self.por_sql[sql] == 2:
+                self.origenes[sql] = _origen()
+
+    def resumen(self, umbral_n1):
+        duplicadas = sum(n - 1 for n in self.por_params.values() if n > 1)
+        n1 = [
+            {"sql": sql[:300], "veces": n, "origen": self.origenes.get(sql)}
+            for sql, n in self.por_sql.most_common() if n >= umbral_n1
+        ]
+        return {
+            "consultas": self.consultas,
+            "sql_ms": round(self.sql_ms, 2),
+            "template_ms": round(self.template_ms, 2),
+            "duplicadas": duplicadas,
+            "n_mas_1": n1,
+        }
+
+
+# ============================================================
+#  RENDER DE TEMPLATES
+# ============================================================
+# Django no expone un hook de tiempo de render: se envuelve
+# Template.render una sola vez. Solo se mide el template más externo
+# (los {% include %} y {% extends %} quedan dentro de ese tiempo).
+_render_original = template_base.Template.render
+
+
+def _render_medido(self, context):
+    registro = _actual.get()
+    if registro is None:
+        return _render_original(self, context)
+    registro._profundidad += 1
+    t0 = time.perf_counter()
+    try:
+        return _render_original(self, context)
+    finally:
+        registro._profundidad -= 1
+        if registro._profundidad == 0:
+            registro.template_ms += (time.perf_counter() - t0) * 1000
+
+
+# ============================================================
+#  MIDDLEWARE
+# ============================================================
+class InstrumentacionMiddleware:
+    def __init__(self, get_response):
+        if not _config("ACTIVA", False):
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self.muestreo = float(_config("MUESTREO", 0.1))
+        self.umbral_n1 = int(_config("UMBRAL_N1", 5))
+        self.lento_ms = float(_config("LENTO_MS", 1000))
+        global _buffer
+        _buffer = deque(_buffer, maxlen=int(_config("BUFFER", 200)))
+        template_base.Template.render = _render_medido
+
+    def __call__(self, request):
+        if request.path.startswith(PREFIJOS_IGNORADOS) or random.random() >= self.muestreo:
+            return self.get_response(request)
+
+        registro = Registro()
+        token = _actual.set(registro)
+        t0 = time.perf_counter()
+        try:
+            with ExitStack() as stack:
+                for conn in connections.all():
+                    stack.enter_context(conn.execute_wrapper(registro))
+                response = self.get_response(request)
+                # TemplateResponse se renderiza después del middleware:
+                # se fuerza acá para que su tiempo y sus consultas cuenten.
+                if hasattr(response, "render") and not getattr(response, "is_rendered", True):
+                    response.render()
+        finally:
+            _actual.reset(token)
+        total_ms = (time.perf_counter() - t0) * 1000
+
+        entrada = self._entrada(request, response, total_ms, registro)
+        with _buffer_lock:
+            _buffer.append(entrada)
+        self._log(entrada)
+        response["Server-Timing"] = (
+            f"total;dur={entrada['total_ms']}, db;dur={entrada['sql_ms']}, tpl;dur={entrada['template_ms']}"
+        )
+        return response
+
+    def _entrada(self, request, response, total_ms, registro):
+        match = getattr(request, "resolver_match", None)
+        user = getattr(request, "user", None)
+        return {
+            "fecha": timezone.now().isoformat(),
+            "metodo": request.method,
+            "ruta": request.path,
+            "vista": match.view_name if match else None,
+            "status": response.status_code,
+            "usuario": user.pk if user is not None and user.is_authenticated else None,
+            "total_ms": round(total_ms, 2),
+            **registro.resumen(self.umbral_n1),
+        }
+
+    def _log(self, entrada):
+        linea = json.dumps(entrada, ensure_ascii=False, default=str)
+        if entrada["n_mas_1"] or entrada["total_ms"] >= self.lento_ms:
+            logger.warning(linea)
+        else:
+            logger.info(linea)
+
+
+# ============================================================
+#  ENDPOINT
+# ============================================================
+def _agrupar(entradas):
+    """Por vista: requests, mediana y máximo de ms, consultas promedio."""
+    por_vista = {}
+    for e in entradas:
+        por_vista.setdefault(e["vista"] or e["ruta"], []).append(e)
+    filas = []
+    for vista, es in por_vista.items():
+        tiempos = sorted(e["total_ms"] for e in es)
+        filas.append({
+            "vista": vista,
+            "requests": len(es),
+            "mediana_ms": tiempos[len(tiempos) // 2],
+            "max_ms": tiempos[-1],
+            "consultas_promedio": round(sum(e["consultas"] for e in es) / len(es), 1),
+            "con_n_mas_1": sum(1 for e in es if e["n_mas_1"]),
+        })
+    return sorted(filas, key=lambda f: f["max_ms"], reverse=True)
+
+
+# Superusuarios y no is_staff: los usuarios de las empresas son staff
+# (para tener permisos) y el buffer mezcla requests de todas.
+@user_passes_test(lambda u: u.is_active and u.is_superuser)
+def diagnostico_requests(request):
+    """
+    JSON con los últimos requests medidos y un resumen por vista.
+    Filtros: ?vista=<view_name>, ?n1=1 (solo con N+1), ?lentos=<ms>.
+    """
+    with _buffer_lock:
+        entradas = list(_buffer)
+    if request.GET.get("vista"):
+        entradas = [e for e in entradas if e["vista"] == request.GET["vista"]]
+    if request.GET.get("n1"):
+        entradas = [e for e in entradas if e["n_mas_1"]]
+    if request.GET.get("lentos"):
+        try:
+            minimo = float(request.GET["lentos"])
+        except ValueError:
+            return JsonResponse({"detail": "'lentos' debe ser un número (ms)."}, status=400)
+        entradas = [e for e in entradas if e["total_ms"] >= minimo]
+    return JsonResponse({
+        "activa": bool(_config("ACTIVA", False)),
+        "muestreo": float(_config("MUESTREO", 0.1)),
+        "por_vista": _agrupar(entradas),
+        "requests": list(reversed(entradas)),
+    }, json_dumps_params={"ensure_ascii": False})
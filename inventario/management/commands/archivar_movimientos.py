@@ -0,0 +1,55 @@
+# inventario/management/commands/archivar_movimientos.py
+# Pasa el kardex viejo (MovimientoMP / VentaConsumo) a las tablas de
+# archivo y deja saldos de apertura. Ver inventario/archivo.py.
+#
+#   python manage.py archivar_movimientos                  # ARCHIVO_HORIZONTE_DIAS
+#   python manage.py archivar_movimientos --dias 180 --suscripcion 3
+#   python manage.py archivar_movimientos --simular
+import datetime
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from inventario import archivo, shards
+from inventario.models import SuscripcionCliente
+from inventario.saldos import conciliar
+
+
+class Command(BaseCommand):
+    help = "Archiva los movimientos y consumos de venta más viejos que el horizonte (correr por cron, p.ej. semanal)"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--dias", type=int, help="Horizonte en días (por defecto ARCHIVO_HORIZONTE_DIAS)")
+        parser.add_argument("--suscripcion", type=int, help="Solo esta suscripción (por defecto, todas)")
+        parser.add_argument("--tanda", type=int, default=200, help="MPs por transacción")
+        parser.add_argument("--simular", action="store_true", help="Solo informa cuánto se archivaría")
+        parser.add_argument("--verificar", action="store_true",
+                            help="Concilia StockPorUbicacion contra el kardex después de archivar")
+
+    def handle(self, *args, **o):
+        if o["dias"] is not None and o["dias"] < 1:
+            raise CommandError("--dias debe ser al menos 1.")
+        hasta = (archivo.inicio_dia(timezone.localdate() - datetime.timedelta(days=o["dias"]))
+                 if o["dias"] else archivo.horizonte_por_defecto())
+        suscripciones = SuscripcionCliente.objects.all()
+        if o["suscripcion"]:
+            suscripciones = suscripciones.filter(pk=o["suscripcion"])
+
+        self.stdout.write(f"Horizonte: {timezone.localtime(hasta):%d-%m-%Y}")
+        for s in suscripciones:
+            with shards.usar(s):
+                self._archivar(s, hasta, o)
+        self.stdout.write(self.style.SUCCESS("Archivado terminado."))
+
+    def _archivar(self, s, hasta, o):
+        if o["simular"]:
+            mp_ids, venta_ids = archivo.pendientes(s, hasta)
+            self.stdout.write(f"  {s}: {len(mp_ids)} MPs y {len(venta_ids)} ventas con filas para archivar")
+            return
+        corte = archivo.archivar(s, hasta, tanda_mps=o["tanda"])
+        self.stdout.write(f"  {s}: {corte.movimientos} movimientos, {corte.consumos} consumos de venta "
+                          f"archivados; {corte.aperturas} saldos de apertura")
+        if o["verificar"]:
+            difs = conciliar(s)
+            estilo = self.style.ERROR if difs else self.style.SUCCESS
+            self.stdout.write(estilo(f"    conciliación: {len(difs)} diferencias"))
@@ -0,0 +1,273 @@
+# inventario/management/commands/benchmark.py
+# ============================================================
+#  BENCHMARK DE LOS CAMINOS CALIENTES
+# ============================================================
+# Mide tiempo, cantidad de consultas SQL y pico de memoria de las
+# operaciones más usadas sobre una empresa grande (ver sembrar_datos)
+# y deja el resultado en JSON para comparar entre commits:
+#
+#   python manage.py sembrar_datos --empresa Bench
+#   python manage.py benchmark --suscripcion 7 --salida bench/$(git rev-parse --short HEAD).json
+#
+# Cada repetición corre dentro de una transacción que se deshace al
+# final: las operaciones que escriben (ventas, OPs, ingresos) no
+# alteran los datos entre corridas.
+import datetime
+import json
+import os
+import platform
+import random
+import statistics
+import subprocess
+import time
+import tracemalloc
+import uuid
+from decimal import Decimal
+from io import BytesIO
+
+import pandas as pd
+from django.conf import settings
+from django.core.files.storage import FileSystemStorage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management.base import BaseCommand, CommandError
+from django.core.signals import request_started, request_finished
+from django.db import close_old_connections, connection, transaction
+from django.db.models import Count
+from django.test import Client
+from django.utils import timezone
+
+from inventario import unidades
+from inventario.models import (
+    SuscripcionCliente, User, MateriaPrima, MovimientoMP, Ubicacion,
+    Producto, Receta, OrdenProduccion, LoteProducto, Venta, VentaLinea, fmt1,
+)
+
+
+class _Deshacer(Exception):
+    pass
+
+
+class _Contador:
+    """
+    Cuenta consultas con execute_wrapper. CaptureQueriesContext no sirve
+    para los escenarios con Client: request_started vacía queries_log.
+    """
+    def __init__(self):
+        self.n = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        self.n += 1
+        return execute(sql, params, many, context)
+
+
+# ============================================================
+#  ESCENARIOS
+# ============================================================
+# Cada escenario recibe el contexto y devuelve una función sin
+# argumentos: lo que se prepara antes de devolverla NO se mide.
+def esc_movimiento_save(ctx):
+    mp = ctx["mp"]; ubic = ctx["ubicacion"]
+    return lambda: MovimientoMP.objects.create(
+        mp=mp, ubicacion=ubic, tipo=MovimientoMP.INGRESO, cantidad=Decimal("5"), costo_unitario=Decimal("10"),
+    )
+
+
+def esc_consumir_fifo(ctx):
+    # Productos con lotes frescos en la sucursal, 3 líneas por venta.
+    lotes = (LoteProducto.objects
+             .filter(producto__suscripcion=ctx["suscripcion"], ubicacion__sucursal=ctx["sucursal"],
+                     estado__in=[LoteProducto.OK, LoteProducto.POR_RALLAR], cantidad_disponible__gt=5)
+             .values("producto_id").annotate(n=Count("id")).order_by("-n")[:3])
+    venta = Venta.objects.create(suscripcion=ctx["suscripcion"], sucursal=ctx["sucursal"])
+    VentaLinea.objects.bulk_create([VentaLinea(venta=venta, producto_id=l["producto_id"], cantidad=Decimal("5"))
+                                    for l in lotes])
+    return lambda: venta.consumir_fifo(user=ctx["user"])
+
+
+def esc_op_ejecutar(ctx):
+    receta = ctx["receta"]
+    for ln in receta.lineas.select_related("mp"):
+        MovimientoMP.objects.create(mp=ln.mp, ubicacion=ctx["ubicacion"], tipo=MovimientoMP.INGRESO,
+                                    cantidad=ln.cantidad * 2)
+    op = OrdenProduccion.objects.create(producto=receta.producto, receta=receta, lotes=Decimal("2"),
+                                        sucursal=ctx["sucursal"])
+    return lambda: op.ejecutar(user=ctx["user"])
+
+
+def _get(url):
+    def preparar(ctx):
+        return lambda: _ok(ctx["client"].get(url))
+    return preparar
+
+
+def esc_importar_excel(ctx):
+    productos = list(Producto.objects.filter(suscripcion=ctx["suscripcion"]).values_list("nombre", flat=True)[:50])
+    hoy = timezone.localdate()
+    df = pd.DataFrame({
+        "producto": [productos[i % len(productos)] for i in range(ctx["filas_excel"])],
+        "fecha": [hoy - datetime.timedelta(days=i % 90) for i in range(ctx["filas_excel"])],
+        "cantidad": [(i % 40) + 1 for i in range(ctx["filas_excel"])],
+    })
+    buf = BytesIO(); df.to_excel(buf, index=False)
+    nombre = f"bench_{uuid.uuid4().hex}.xlsx"
+
+    def correr():
+        archivo = SimpleUploadedFile(nombre, buf.getvalue())
+        try:
+            _ok(ctx["client"].post("/ia/cargar-excel/", {"file": archivo}))
+        finally:
+            FileSystemStorage().delete(nombre)
+    return correr
+
+
+def esc_formato_100k(ctx):
+    # Micro-benchmark: 100k cantidades con format_qty de MPs de distintas
+    # unidades + fmt1. Como en las pantallas reales los valores se repiten
+    # (~2.000 distintos, 0 a 2 con 3 decimales). Las cachés LRU se vacían
+    # antes de cada corrida: se mide con caché fría.
+    rnd = random.Random(1)
+    mps = list(MateriaPrima.objects.filter(suscripcion=ctx["suscripcion"]).order_by("pk")[:50])
+    valores = [Decimal(rnd.randint(0, 2000)) / 1000 for _ in range(100_000)]
+    unidades.decimal_corto.cache_clear(); unidades._formatear.cache_clear()
+
+    def correr():
+        for i, v in enumerate(valores):
+            mps[i % len(mps)].format_qty(v); fmt1(v)
+    return correr
+
+
+def _ok(resp):
+    if resp.status_code >= 400:
+        raise CommandError(f"{resp.request['PATH_INFO']} respondió {resp.status_code}")
+    return resp
+
+
+ESCENARIOS = {
+    "movimiento_save": esc_movimiento_save,
+    "consumir_fifo": esc_consumir_fifo,
+    "op_ejecutar": esc_op_ejecutar,
+    "panel": _get("/panel/"),
+    "kardex": _get("/kardex/"),
+    "reporte_stock_global": _get("/reporte/stock-global/"),
+    "importar_excel": esc_importar_excel,
+    "formato_100k": esc_formato_100k,
+}
+
+
+# ============================================================
+#  COMANDO
+# ============================================================
+class Command(BaseCommand):
+    help = "Mide tiempo, consultas SQL y memoria de las operaciones críticas y guarda el resultado en JSON."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--suscripcion", type=int, help="Empresa a medir (por defecto, la última creada)")
+        parser.add_argument("--repeticiones", type=int, default=5)
+        parser.add_argument("--solo", nargs="*", choices=list(ESCENARIOS), help="Escenarios a correr")
+        parser.add_argument("--filas-excel", type=int, default=500, dest="filas_excel")
+        parser.add_argument("--salida", help="Archivo JSON (por defecto, bench_<commit>_<fecha>.json)")
+
+    def handle(self, *args, **o):
+        s = (SuscripcionCliente.objects.filter(pk=o["suscripcion"]) if o["suscripcion"]
+             else SuscripcionCliente.objects.order_by("-pk")).first()
+        if s is None:
+            raise CommandError("No hay empresa para medir (use sembrar_datos).")
+        user = User.objects.filter(suscripcion=s).order_by("pk").first()
+        ubicacion = Ubicacion.objects.filter(sucursal__suscripcion=s).select_related("sucursal").order_by("pk").first()
+        if user is None or ubicacion is None:
+            raise CommandError(f"La empresa {s.pk} no tiene usuario o ubicaciones.")
+
+        if "testserver" not in settings.ALLOWED_HOSTS and "*" not in settings.ALLOWED_HOSTS:
+            settings.ALLOWED_HOSTS = [*settings.ALLOWED_HOSTS, "testserver"]
+        # Igual que los tests de Django: el cliente no debe cerrar la conexión
+        # al terminar cada request (perdería la transacción que se deshace).
+        request_started.disconnect(close_old_connections)
+        request_finished.disconnect(close_old_connections)
+        client = Client(); client.force_login(user)
+        ctx = {
+            "suscripcion": s, "user": user, "client": client,
+            "ubicacion": ubicacion, "sucursal": ubicacion.sucursal,
+            "mp": MateriaPrima.objects.filter(suscripcion=s).order_by("pk").first(),
+            "receta": Receta.objects.filter(producto__suscripcion=s).order_by("pk").first(),
+            "filas_excel": o["filas_excel"],
+        }
+
+        resultados = {}
+        for nombre in o["solo"] or ESCENARIOS:
+            resultados[nombre] = self._medir(ESCENARIOS[nombre], ctx, o["repeticiones"])
+            r = resultados[nombre]
+            self.stdout.write(
+                f"{nombre:<22} {r['mediana_ms']:>9.1f} ms  {r['consultas']:>6} consultas  "
+                f"{r['memoria_pico_kb']:>9.0f} KB"
+            )
+
+        commit = _commit()
+        salida = o["salida"] or f"bench_{commit or 'sin-git'}_{timezone.now():%Y%m%d_%H%M%S}.json"
+        os.makedirs(os.path.dirname(os.path.abspath(salida)), exist_ok=True)
+        with open(salida, "w", encoding="utf-8") as f:
+            json.dump({
+                "commit": commit,
+                "fecha": timezone.now().isoformat(),
+                "python": platform.python_version(),
+                "base_de_datos": connection.vendor,
+                "suscripcion": s.pk,
+                "datos": _tamano(s),
+                "repeticiones": o["repeticiones"],
+                "resultados": resultados,
+            }, f, indent=2, ensure_ascii=False)
+        self.stdout.write(self.style.SUCCESS(f"Resultados en {salida}"))
+
+    def _medir(self, escenario, ctx, repeticiones):
+        # tracemalloc hace todo varias veces más lento: la memoria se mide
+        # en una corrida aparte para no inflar los tiempos.
+        corridas = [self._una(escenario, ctx) for _ in range(repeticiones)]
+        tiempos = [t for t, _, _ in corridas]
+        _, _, pico = self._una(escenario, ctx, memoria=True)
+        return {
+            "tiempos_ms": [round(t, 2) for t in tiempos],
+            "mediana_ms": round(statistics.median(tiempos), 2),
+            "min_ms": round(min(tiempos), 2),
+            "consultas": max(n for _, n, _ in corridas),
+            "memoria_pico_kb": round(pico, 1),
+        }
+
+    def _una(self, escenario, ctx, memoria=False):
+        """(ms, consultas, pico de memoria en KB) de una corrida, deshaciendo lo que escriba."""
+        ms = pico = 0
+        q = _Contador()
+        try:
+            with transaction.atomic():
+                correr = escenario(ctx)
+                if memoria:
+                    tracemalloc.start()
+                with connection.execute_wrapper(q):
+                    t0 = time.perf_counter()
+                    correr()
+                    ms = (time.perf_counter() - t0) * 1000
+                if memoria:
+                    pico = tracemalloc.get_traced_memory()[1] / 1024
+                raise _Deshacer
+        except _Deshacer:
+            pass
+        finally:
+            if tracemalloc.is_tracing():
+                tracemalloc.stop()
+        return ms, q.n, pico
+
+
+def _commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=settings.BASE_DIR, timeout=5).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def _tamano(s):
+    return {
+        "materias_primas": MateriaPrima.objects.filter(suscripcion=s).count(),
+        "productos": Producto.objects.filter(suscripcion=s).count(),
+        "movimientos": MovimientoMP.objects.filter(mp__suscripcion=s).count(),
+        "lotes": LoteProducto.objects.filter(producto__suscripcion=s).count(),
+        "ventas": Venta.objects.filter(suscripcion=s).count(),
+    }
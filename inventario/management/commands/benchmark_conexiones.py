@@ -0,0 +1,121 @@
+# inventario/management/commands/benchmark_conexiones.py
+# ============================================================
+#  BENCHMARK DE CONCURRENCIA: REUSO DE CONEXIONES
+# ============================================================
+# Simula N workers (hilos) atendiendo requests en paralelo, con el mismo
+# ciclo que un request real: close_old_connections() al empezar y al
+# terminar (request_started / request_finished) y unas consultas en el
+# medio. Compara la configuración actual (conexiones persistentes o pool,
+# ver bigmomma/basedatos.py) contra abrir una conexión por request:
+#
+#   python manage.py benchmark_conexiones --hilos 16 --requests 200
+#   DB_POOL=1 DB_POOL_MAX=8 python manage.py benchmark_conexiones --hilos 16
+#
+# "aperturas" son las conexiones nuevas que abrió el proceso (signal
+# connection_created); con reuso deberían ser ~1 por hilo (o el tamaño
+# del pool), no 1 por request.
+import copy
+import statistics
+import threading
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections, connections
+
+from inventario import conexiones
+
+
+class Command(BaseCommand):
+    help = "Mide requests/s, latencia y conexiones abiertas con varios hilos en paralelo."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--hilos", type=int, default=8)
+        parser.add_argument("--requests", type=int, default=100, help="Requests por hilo")
+        parser.add_argument("--consultas", type=int, default=3, help="Consultas por request")
+        parser.add_argument("--database", default="default")
+        parser.add_argument("--sin-comparar", action="store_true", dest="sin_comparar",
+                            help="No correr la línea base de una conexión por request")
+
+    def handle(self, *args, **o):
+        alias = o["database"]
+        original = copy.deepcopy(connections.settings[alias])
+        modos = [("configuracion_actual", None)]
+        if not o["sin_comparar"]:
+            modos.insert(0, ("sin_reuso", self._sin_reuso))
+
+        for nombre, preparar in modos:
+            try:
+                if preparar:
+                    preparar(connections.settings[alias])
+                r = self._correr(alias, o["hilos"], o["requests"], o["consultas"])
+            finally:
+                connections.settings[alias].clear()
+                connections.settings[alias].update(copy.deepcopy(original))
+            self.stdout.write(
+                f"{nombre:<22} {r['requests_s']:>8.0f} req/s  p50 {r['p50_ms']:>6.2f} ms  "
+                f"p95 {r['p95_ms']:>6.2f} ms  aperturas {r['aperturas']:>5} / {r['requests']} requests "
+                f"({r['reuso_pct']:.1f}% reuso)"
+            )
+            if r["errores"]:
+                self.stdout.write(self.style.WARNING(f"  {r['errores']} requests con error (ej.: {r['error']})"))
+
+        pool = conexiones.metricas()["bases"].get(alias, {}).get("pool")
+        if pool:
+            self.stdout.write(f"pool: {pool}")
+        self.stdout.write(self.style.SUCCESS("Benchmark de conexiones terminado."))
+
+    @staticmethod
+    def _sin_reuso(cfg):
+        cfg["CONN_MAX_AGE"] = 0
+        cfg.get("OPTIONS", {}).pop("pool", None)
+
+    def _correr(self, alias, hilos, por_hilo, consultas):
+        latencias, errores = [], []
+        lock = threading.Lock()
+        inicio = threading.Barrier(hilos)
+
+        def worker():
+            propias = []
+            inicio.wait()
+            try:
+                for _ in range(por_hilo):
+                    t0 = time.perf_counter()
+                    close_old_connections()                       # request_started
+                    try:
+                        with connections[alias].cursor() as cur:
+                            for _ in range(consultas):
+                                cur.execute("SELECT 1")
+                                cur.fetchone()
+                    except Exception as e:                         # se informa, no corta el hilo
+                        with lock:
+                            errores.append(repr(e))
+                    finally:
+                        close_old_connections()                   # request_finished
+                    propias.append((time.perf_counter() - t0) * 1000)
+            finally:
+                connections.close_all()
+                with lock:
+                    latencias.extend(propias)
+
+        antes = conexiones.aperturas(alias)
+        t0 = time.perf_counter()
+        ts = [threading.Thread(target=worker) for _ in range(hilos)]
+        for t in ts:
+            t.start()
+        for t in ts:
+            t.join()
+        total_s = time.perf_counter() - t0
+        abiertas = conexiones.aperturas(alias) - antes
+
+        latencias.sort()
+        n = len(latencias)
+        return {
+            "requests": n,
+            "requests_s": n / total_s if total_s else 0,
+            "p50_ms": statistics.median(latencias) if latencias else 0,
+            "p95_ms": latencias[int(n * 0.95) - 1] if n else 0,
+            "aperturas": abiertas,
+            "reuso_pct": 100 * (1 - abiertas / n) if n else 0,
+            "errores": len(errores),
+            "error": errores[0] if errores else None,
+        }
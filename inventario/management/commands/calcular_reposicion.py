@@ -0,0 +1,44 @@
+# inventario/management/commands/calcular_reposicion.py
+# Recalcula StockPorUbicacion.stock_minimo desde el consumo (correr de
+# noche por cron). Ver inventario/reabastecimiento.py.
+import time
+
+import pandas as pd
+from django.core.management.base import BaseCommand
+
+from inventario import shards
+from inventario.models import SuscripcionCliente
+from inventario.reabastecimiento import actualizar_minimos
+
+
+class Command(BaseCommand):
+    help = "Calcula puntos de reorden por (MP, sucursal) desde el consumo y actualiza stock_minimo"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--suscripcion", type=int, help="Solo esta suscripción (por defecto, todas)")
+        parser.add_argument("--ventana", type=int, help="Días de historial (REPOSICION_VENTANA_DIAS)")
+        parser.add_argument("--nivel-servicio", type=float, dest="nivel_servicio",
+                            help="Entre 0 y 1 (REPOSICION_NIVEL_SERVICIO)")
+        parser.add_argument("--simular", action="store_true", help="Calcula y muestra, sin escribir")
+        parser.add_argument("--mostrar", type=int, default=0, help="Muestra los N pares de mayor demanda")
+
+    def handle(self, *args, **o):
+        suscripcion = SuscripcionCliente.objects.get(pk=o["suscripcion"]) if o["suscripcion"] else None
+        t0 = time.perf_counter()
+        # Una vuelta por base (o solo la de la suscripción pedida).
+        resultados = [actualizar_minimos(
+            suscripcion, dias=o["ventana"], nivel_servicio=o["nivel_servicio"], aplicar=not o["simular"],
+        ) for _ in shards.en_bases(suscripcion)]
+        # Las bases sin consumo devuelven un DataFrame vacío (sin tipos): no entran al concat.
+        calculados = [p for p, _ in resultados if not p.empty]
+        puntos = pd.concat(calculados, ignore_index=True) if calculados else resultados[0][0]
+        cambios = sum(c for _, c in resultados)
+        segundos = time.perf_counter() - t0
+
+        if o["mostrar"] and not puntos.empty:
+            tabla = puntos.nlargest(o["mostrar"], "demanda_diaria")
+            self.stdout.write(tabla.to_string(index=False, float_format=lambda v: f"{v:.3f}"))
+        verbo = "cambiarían" if o["simular"] else "actualizadas"
+        self.stdout.write(self.style.SUCCESS(
+            f"{len(puntos)} puntos de reorden calculados; {cambios} filas de stock {verbo} ({segundos:.2f} s)."
+        ))
@@ -0,0 +1,65 @@
+# inventario/management/commands/conciliar_stock.py
+import datetime
+
+from django.core.management.base import BaseCommand, CommandError
+
+from inventario import shards
+from inventario.models import SuscripcionCliente, MateriaPrima, Ubicacion
+from inventario.saldos import conciliar, generar_snapshots
+
+
+def _fecha(valor):
+    try:
+        return datetime.date.fromisoformat(valor)
+    except ValueError:
+        raise CommandError(f"Fecha inválida '{valor}' (use AAAA-MM-DD).")
+
+
+class Command(BaseCommand):
+    help = (
+        "Compara StockPorUbicacion contra el kardex (MovimientoMP) y opcionalmente "
+        "repara las diferencias. Con --snapshots escribe los saldos diarios (SaldoDiarioMP)."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--suscripcion", type=int, help="ID de la empresa (por defecto, todas)")
+        parser.add_argument("--reparar", action="store_true", help="Deja StockPorUbicacion igual al kardex")
+        parser.add_argument("--snapshots", action="store_true", help="Escribe los saldos diarios pendientes")
+        parser.add_argument("--hasta", type=_fecha, help="Último día a fotografiar (por defecto, ayer)")
+        parser.add_argument("--rehacer-desde", type=_fecha, dest="desde",
+                            help="Borra y recalcula los saldos diarios desde esta fecha")
+
+    def handle(self, *args, **opts):
+        suscripcion = None
+        if opts["suscripcion"]:
+            suscripcion = SuscripcionCliente.objects.filter(pk=opts["suscripcion"]).first()
+            if suscripcion is None:
+                raise CommandError(f"No existe la suscripción {opts['suscripcion']}.")
+
+        for alias in shards.en_bases(suscripcion):
+            if len(shards.bases()) > 1:
+                self.stdout.write(f"Base '{alias}':")
+            self._conciliar(suscripcion, opts)
+
+    def _conciliar(self, suscripcion, opts):
+        difs = conciliar(suscripcion=suscripcion, reparar=opts["reparar"])
+        if not difs:
+            self.stdout.write(self.style.SUCCESS("Stock cuadrado con el kardex."))
+        else:
+            mps = dict(MateriaPrima.objects.filter(pk__in={d.mp_id for d in difs}).values_list("pk", "nombre"))
+            ubics = {u.pk: str(u) for u in Ubicacion.objects.filter(
+                pk__in={d.ubicacion_id for d in difs}).select_related("sucursal")}
+            for d in difs:
+                self.stdout.write(
+                    f"{ubics.get(d.ubicacion_id, d.ubicacion_id)} | {mps.get(d.mp_id, d.mp_id)}: "
+                    f"registrado {d.stock_registrado} / kardex {d.stock_kardex} "
+                    f"(dif {d.stock_registrado - d.stock_kardex})"
+                )
+            if opts["reparar"]:
+                self.stdout.write(self.style.SUCCESS(f"{len(difs)} saldos reparados."))
+            else:
+                self.stdout.write(self.style.WARNING(f"{len(difs)} saldos descuadrados (use --reparar)."))
+
+        if opts["snapshots"] or opts["desde"]:
+            n = generar_snapshots(hasta=opts["hasta"], suscripcion=suscripcion, desde=opts["desde"])
+            self.stdout.write(self.style.SUCCESS(f"{n} saldos diarios escritos."))
@@ -0,0 +1,51 @@
+# inventario/management/commands/importar_cierre_pos.py
+# Importa el cierre del día de un POS externo (ver inventario/cierre_pos.py).
+#
+#   python manage.py importar_cierre_pos --suscripcion 3 --sucursal 4 --archivo cierre_2026-10-19.csv
+#   python manage.py importar_cierre_pos --suscripcion 3 --sucursal 4 --archivo cierre.xlsx --simular
+from django.core.exceptions import ValidationError
+from django.core.management.base import BaseCommand, CommandError
+
+from inventario import cierre_pos, shards
+from inventario.models import Sucursal, SuscripcionCliente
+
+
+class Command(BaseCommand):
+    help = "Crea y confirma en bloque las ventas del cierre de un POS externo (ticket, fecha, producto, cantidad)"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--suscripcion", type=int, required=True)
+        parser.add_argument("--sucursal", type=int, required=True)
+        parser.add_argument("--archivo", required=True, help="CSV o Excel")
+        parser.add_argument("--simular", action="store_true", help="Solo muestra el reporte, no guarda")
+
+    def handle(self, *args, **o):
+        s = SuscripcionCliente.objects.filter(pk=o["suscripcion"]).first()
+        if s is None:
+            raise CommandError(f"No existe la suscripción {o['suscripcion']}.")
+        try:
+            with open(o["archivo"], "rb") as f:
+                filas = cierre_pos.leer_archivo(f)
+        except OSError as e:
+            raise CommandError(str(e))
+        except ValidationError as e:
+            raise CommandError("; ".join(e.messages))
+
+        with shards.usar(s):
+            sucursal = Sucursal.objects.filter(pk=o["sucursal"], suscripcion=s).first()
+            if sucursal is None:
+                raise CommandError(f"La sucursal {o['sucursal']} no es de '{s}'.")
+            try:
+                res = cierre_pos.importar(s, sucursal, filas, aplicar=not o["simular"])
+            except ValidationError as e:
+                raise CommandError("; ".join(e.messages))
+
+        for f in res.faltantes:
+            self.stdout.write(f"  ticket {f.ticket:<12} {f.producto:<30} vendido {f.requerido:>10} disp {f.asignado:>10}")
+        for e in res.errores:
+            self.stdout.write(self.style.WARNING(f"  {e}"))
+        if res.duplicados:
+            self.stdout.write(self.style.WARNING(f"  {len(res.duplicados)} tickets ya importados (se saltaron)."))
+        resumen = (f"{res.confirmadas} ventas confirmadas, {res.borradores} en borrador por falta de stock; "
+                   f"{res.unidades} unidades de {res.lotes} lotes, costo {res.costo:.0f}.")
+        self.stdout.write(self.style.SUCCESS(("[simulación] " if o["simular"] else "") + resumen))
@@ -0,0 +1,71 @@
+# inventario/management/commands/mover_tenant.py
+# Mueve todas las filas de una empresa a otra base (shard) conservando
+# los ids. Ver inventario/shards.py.
+#
+#   DATABASE_SHARDS="shard1=sqlite:////tmp/shard1.sqlite3" python manage.py migrate --database shard1
+#   python manage.py mover_tenant --suscripcion 3 --a shard1
+#   python manage.py mover_tenant --suscripcion 3 --a default          # de vuelta
+#   python manage.py mover_tenant --suscripcion 3 --simular
+#   python manage.py mover_tenant --suscripcion 3 --borrar-de shard1   # restos de una mudanza cortada
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from inventario import shards
+from inventario.models import SuscripcionCliente
+
+
+class Command(BaseCommand):
+    help = "Mueve una empresa (todas sus filas de inventario) a otra base de datos"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--suscripcion", type=int, required=True)
+        parser.add_argument("--a", dest="destino", help="Alias de la base destino (ver DATABASE_SHARDS)")
+        parser.add_argument("--tanda", type=int, default=2000, help="Filas leídas por consulta")
+        parser.add_argument("--espera", type=float, default=2,
+                            help="Segundos entre marcar la mudanza y copiar (requests en curso)")
+        parser.add_argument("--conservar-origen", action="store_true", dest="conservar",
+                            help="No borra las filas del origen después de copiar")
+        parser.add_argument("--simular", action="store_true", help="Solo cuenta las filas a mover")
+        parser.add_argument("--borrar-de", dest="borrar_de",
+                            help="Borra las filas de la empresa de una base que ya no es la suya")
+
+    def handle(self, *args, **o):
+        s = SuscripcionCliente.objects.filter(pk=o["suscripcion"]).first()
+        if s is None:
+            raise CommandError(f"No existe la suscripción {o['suscripcion']}.")
+        origen = shards.base_de(s)
+
+        if o["borrar_de"]:
+            try:
+                n = shards.borrar_tenant(s, o["borrar_de"])
+            except shards.MudanzaError as e:
+                raise CommandError(str(e))
+            self.stdout.write(self.style.SUCCESS(f"{n} filas de '{s}' borradas de '{o['borrar_de']}'."))
+            return
+
+        if o["simular"]:
+            filas = shards.contar(s, origen)
+            for modelo, n in filas.items():
+                if n:
+                    self.stdout.write(f"  {modelo._meta.label:<32} {n:>10}")
+            self.stdout.write(self.style.SUCCESS(f"{sum(filas.values())} filas de '{s}' en '{origen}'."))
+            return
+
+        if not o["destino"]:
+            raise CommandError("Indique la base destino con --a.")
+        self.stdout.write(f"Moviendo '{s}' de '{origen}' a '{o['destino']}'...")
+        SuscripcionCliente.objects.filter(pk=s.pk).update(en_mudanza=True)
+        time.sleep(max(o["espera"], 0))
+        t0 = time.perf_counter()
+        try:
+            copiados = shards.mover(s, o["destino"], tanda=o["tanda"], borrar_origen=not o["conservar"])
+        except shards.MudanzaError as e:
+            SuscripcionCliente.objects.filter(pk=s.pk).update(en_mudanza=False)
+            raise CommandError(str(e))
+        for modelo, n in copiados.items():
+            if n:
+                self.stdout.write(f"  {modelo._meta.label:<32} {n:>10}")
+        self.stdout.write(self.style.SUCCESS(
+            f"{sum(copiados.values())} filas movidas a '{o['destino']}' en {time.perf_counter() - t0:.1f} s."
+        ))
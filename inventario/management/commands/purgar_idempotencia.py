@@ -0,0 +1,15 @@
+# inventario/management/commands/purgar_idempotencia.py
+from django.core.management.base import BaseCommand
+
+from inventario.idempotencia import purgar_expiradas
+
+
+class Command(BaseCommand):
+    help = "Borra las respuestas idempotentes vencidas (correr por cron, p.ej. cada hora)"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch", type=int, default=5000, help="Filas a borrar por tanda")
+
+    def handle(self, *args, **options):
+        total = purgar_expiradas(batch=options["batch"])
+        self.stdout.write(self.style.SUCCESS(f"{total} respuestas idempotentes vencidas eliminadas."))
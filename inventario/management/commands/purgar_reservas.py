@@ -0,0 +1,16 @@
+# inventario/management/commands/purgar_reservas.py
+from django.core.management.base import BaseCommand
+
+from inventario import shards
+from inventario.reservas import purgar_vencidas
+
+
+class Command(BaseCommand):
+    help = "Borra las reservas de stock vencidas (ya no apartan stock; correr por cron, p.ej. cada hora)"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch", type=int, default=5000, help="Filas a borrar por tanda")
+
+    def handle(self, *args, **options):
+        total = sum(purgar_vencidas(batch=options["batch"]) for _ in shards.en_bases())
+        self.stdout.write(self.style.SUCCESS(f"{total} reservas vencidas eliminadas."))
@@ -0,0 +1,27 @@
+# inventario/management/commands/recalcular_costos.py
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from inventario import shards
+from inventario.models import SuscripcionCliente
+from inventario.costos import recalcular_todo
+
+
+class Command(BaseCommand):
+    help = "Recalcula el costo unitario de todas las recetas (modo completo, vectorizado)."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--suscripcion", type=int, help="ID de la empresa (por defecto, todas)")
+
+    def handle(self, *args, **opts):
+        suscripcion = None
+        if opts["suscripcion"]:
+            suscripcion = SuscripcionCliente.objects.filter(pk=opts["suscripcion"]).first()
+            if suscripcion is None:
+                raise CommandError(f"No existe la suscripción {opts['suscripcion']}.")
+        t0 = time.perf_counter()
+        n = sum(recalcular_todo(suscripcion=suscripcion) for _ in shards.en_bases(suscripcion))
+        self.stdout.write(self.style.SUCCESS(
+            f"{n} recetas actualizadas en {time.perf_counter() - t0:.2f} s."
+        ))
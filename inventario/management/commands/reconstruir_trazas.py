@@ -0,0 +1,23 @@
+# inventario/management/commands/reconstruir_trazas.py
+from django.core.management.base import BaseCommand
+
+from inventario import shards
+from inventario.trazabilidad import reconstruir
+
+
+class Command(BaseCommand):
+    help = (
+        "Completa la trazabilidad (MovimientoMP.op y TrazaEnlace) de las OPs y ventas "
+        "registradas antes de que existiera. Se puede volver a correr sin duplicar."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch", type=int, default=2000, help="Filas por tanda")
+
+    def handle(self, *args, **options):
+        totales = [reconstruir(batch=options["batch"]) for _ in shards.en_bases()]
+        enlazados, aristas_mp, aristas_venta = (sum(t) for t in zip(*totales))
+        self.stdout.write(self.style.SUCCESS(
+            f"{enlazados} consumos enlazados a su OP, {aristas_mp} enlaces MP→lote "
+            f"y {aristas_venta} enlaces lote→venta creados."
+        ))
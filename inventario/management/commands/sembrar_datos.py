@@ -0,0 +1,237 @@
+# inventario/management/commands/sembrar_datos.py
+# ============================================================
+#  DATOS DE PRUEBA MASIVOS (PARA BENCHMARKS)
+# ============================================================
+# Crea una empresa "grande" con inserciones en bloque (bulk_create),
+# sin pasar por save(): por eso el stock por ubicación, el estado de
+# los lotes, el costo y las aristas de trazabilidad se calculan aquí
+# mismo, en memoria, para que el resultado quede consistente:
+#
+#   - StockPorUbicacion.stock  == Σ kardex de cada (mp, ubicación)
+#   - LoteProducto.cantidad_disponible == inicial − Σ VentaConsumo
+#
+#   python manage.py sembrar_datos --empresa "Bench" --movimientos 2000000
+import datetime
+import random
+import time
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+
+from inventario.models import (
+    SuscripcionCliente, User, UnidadMedida, Sucursal, Ubicacion,
+    MateriaPrima, StockPorUbicacion, MovimientoMP,
+    Producto, Receta, RecetaLinea, LoteProducto,
+    Venta, VentaLinea, VentaConsumo, TrazaEnlace,
+)
+from inventario.costos import recalcular_todo
+from inventario.saldos import generar_snapshots
+
+M = MovimientoMP
+
+
+class Command(BaseCommand):
+    help = "Genera una empresa con volumen realista (MPs, recetas, kardex, lotes y ventas) para benchmarks."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--empresa", default="Panadería Benchmark")
+        parser.add_argument("--sucursales", type=int, default=5)
+        parser.add_argument("--ubicaciones", type=int, default=4, help="Ubicaciones por sucursal")
+        parser.add_argument("--mps", type=int, default=10000)
+        parser.add_argument("--productos", type=int, default=2000)
+        parser.add_argument("--lineas-receta", type=int, default=8, dest="lineas")
+        parser.add_argument("--movimientos", type=int, default=1000000)
+        parser.add_argument("--lotes", type=int, default=50000)
+        parser.add_argument("--ventas", type=int, default=100000)
+        parser.add_argument("--dias", type=int, default=365, help="Historia a generar (días hacia atrás)")
+        parser.add_argument("--batch", type=int, default=5000)
+        parser.add_argument("--semilla", type=int, default=42)
+        parser.add_argument("--snapshots", action="store_true", help="Genera también los saldos diarios")
+
+    # ------------------------------------------------------------
+    def handle(self, *args, **o):
+        self.rnd = random.Random(o["semilla"])
+        self.batch = o["batch"]
+        self.ahora = timezone.now()
+        self.dias = o["dias"]
+        t0 = time.perf_counter()
+
+        with transaction.atomic():
+            s, user = self._empresa(o["empresa"])
+            ubicaciones = self._bodegas(s, o["sucursales"], o["ubicaciones"])
+            kg, un = (UnidadMedida.objects.get_or_create(nombre=n)[0] for n in ("kg", "un"))
+            mps = self._mps(s, o["mps"], kg)
+            productos = self._recetas(s, o["productos"], o["lineas"], mps, un)
+        self._paso("catálogo", t0)
+
+        recalcular_todo(suscripcion=s)
+        self._kardex(mps, ubicaciones, o["movimientos"])
+        lotes = self._lotes(productos, ubicaciones, o["lotes"])
+        self._ventas(s, lotes, o["ventas"])
+        if o["snapshots"]:
+            generar_snapshots(suscripcion=s)
+            self._paso("saldos diarios", t0)
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Empresa '{s.nombre_empresa}' (id {s.pk}) lista en {time.perf_counter() - t0:.1f} s. "
+            f"Usuario: {user.username}"
+        ))
+
+    def _paso(self, nombre, t0):
+        self.stdout.write(f"  {nombre}: {time.perf_counter() - t0:.1f} s")
+
+    def _fecha(self, dias=None):
+        segundos = self.rnd.randint(0, (dias or self.dias) * 86400)
+        return self.ahora - datetime.timedelta(seconds=segundos)
+
+    # ------------------------------------------------------------
+    def _empresa(self, nombre):
+        s = SuscripcionCliente.objects.create(
+            nombre_empresa=nombre, plan_actual=SuscripcionCliente.PLAN_MULTI_SUCURSAL,
+            subscription_status="active", ha_completado_onboarding=True,
+        )
+        # Superusuario: 'can_run_predictions' (importación Excel) no está declarado
+        # en ningún modelo, así que no se puede asignar como permiso normal.
+        user = User.objects.create_user(username=f"bench_{s.pk}", password="bench", suscripcion=s,
+                                        is_staff=True, is_superuser=True)
+        return s, user
+
+    def _bodegas(self, s, n_suc, n_ubic):
+        sucursales = Sucursal.objects.bulk_create([
+            Sucursal(suscripcion=s, nombre=f"Sucursal {i + 1}", es_principal=(i == 0)) for i in range(n_suc)
+        ])
+        return Ubicacion.objects.bulk_create([
+            Ubicacion(sucursal=suc, nombre=f"Estante {j + 1}") for suc in sucursales for j in range(n_ubic)
+        ])
+
+    def _mps(self, s, n, unidad):
+        return MateriaPrima.objects.bulk_create([
+            MateriaPrima(suscripcion=s, nombre=f"MP {i:05d}", unidad=unidad,
+                         costo_promedio=Decimal(self.rnd.randint(100, 50000)) / 100)
+            for i in range(n)
+        ], batch_size=self.batch)
+
+    def _recetas(self, s, n, n_lineas, mps, unidad):
+        productos = Producto.objects.bulk_create([
+            Producto(suscripcion=s, nombre=f"Producto {i:05d}", unidad=unidad, vida_util_dias=self.rnd.randint(2, 30))
+            for i in range(n)
+        ], batch_size=self.batch)
+        recetas = Receta.objects.bulk_create([
+            Receta(producto=p, rendimiento_por_lote=Decimal(self.rnd.randint(10, 100))) for p in productos
+        ], batch_size=self.batch)
+        n_lineas = min(n_lineas, len(mps))
+        RecetaLinea.objects.bulk_create([
+            RecetaLinea(receta=r, mp=mp, cantidad=Decimal(self.rnd.randint(1, 5000)) / 1000)
+            for r in recetas for mp in self.rnd.sample(mps, n_lineas)
+        ], batch_size=self.batch)
+        return productos
+
+    # ------------------------------------------------------------
+    def _kardex(self, mps, ubicaciones, total):
+        """Movimientos en orden cronológico; nunca deja un saldo negativo."""
+        t0 = time.perf_counter()
+        saldos = {}
+        fechas = sorted(self._fecha() for _ in range(total))
+        salidas = [M.CONSUMO] * 6 + [M.MERMA, M.AJUSTE_NEG]
+        pendientes = []
+        for fecha in fechas:
+            mp = self.rnd.choice(mps); ubic = self.rnd.choice(ubicaciones)
+            par = (mp.pk, ubic.pk); saldo = saldos.get(par, Decimal("0"))
+            cantidad = Decimal(self.rnd.randint(100, 50000)) / 1000
+            tipo = self.rnd.choice(salidas) if self.rnd.random() < 0.6 else M.INGRESO
+            if tipo != M.INGRESO:
+                if saldo <= 0: tipo = M.INGRESO
+                else: cantidad = min(cantidad, saldo)
+            saldos[par] = saldo + (cantidad if tipo == M.INGRESO else -cantidad)
+            pendientes.append(M(
+                mp_id=mp.pk, ubicacion_id=ubic.pk, tipo=tipo, cantidad=cantidad, fecha=fecha,
+                costo_unitario=mp.costo_promedio if tipo == M.INGRESO else None,
+            ))
+            if len(pendientes) >= self.batch:
+                M.objects.bulk_create(pendientes); pendientes = []
+        M.objects.bulk_create(pendientes)
+
+        StockPorUbicacion.objects.bulk_create([
+            StockPorUbicacion(mp_id=mp_id, ubicacion_id=ubic_id, stock=saldo,
+                              stock_minimo=Decimal(self.rnd.randint(0, 20)))
+            for (mp_id, ubic_id), saldo in saldos.items()
+        ], batch_size=self.batch)
+        self._paso(f"kardex ({total} movimientos)", t0)
+
+    def _lotes(self, productos, ubicaciones, total):
+        """El 80% son lotes viejos (los consumen las ventas); el 20% son de hoy, intactos."""
+        t0 = time.perf_counter()
+        recetas = dict(Receta.objects.filter(producto__in=productos).values_list("producto_id", "costo_unitario"))
+        lotes, correlativos = [], {}
+        for i in range(total):
+            p = self.rnd.choice(productos); ubic = self.rnd.choice(ubicaciones)
+            fresco = i >= total * 0.8
+            prod = self._fecha(1) if fresco else self._fecha()
+            base = f"{p.pk}-{prod.strftime('%Y%m%d')}"  # mismo formato que LoteProducto.generar_codigo
+            n = correlativos[base] = correlativos.get(base, 0) + 1
+            cant = Decimal(self.rnd.randint(20, 200))
+            lote = LoteProducto(
+                producto=p, ubicacion=ubic, codigo=f"{base}-{n:03d}",
+                fecha_produccion=prod, fecha_vencimiento=(prod + datetime.timedelta(days=p.vida_util_dias)).date(),
+                cantidad_inicial=cant, cantidad_disponible=cant, costo_unitario=recetas.get(p.pk),
+            )
+            lote.estado = lote._calcular_estado()
+            lotes.append(lote)
+        LoteProducto.objects.bulk_create(lotes, batch_size=self.batch)
+        self._paso(f"lotes ({total})", t0)
+        return lotes
+
+    def _ventas(self, s, lotes, total):
+        """Consume FEFO en memoria y escribe ventas, líneas, consumos y trazas en bloque."""
+        t0 = time.perf_counter()
+        viejos = [l for l in lotes if l.fecha_produccion < self.ahora - datetime.timedelta(days=1)]
+        por_clave = {}
+        for l in sorted(viejos, key=lambda l: (l.fecha_vencimiento, l.pk)):
+            por_clave.setdefault((l.producto_id, l.ubicacion.sucursal_id), []).append(l)
+        claves = list(por_clave)
+        if not claves:
+            return
+
+        ventas, lineas_por_venta = [], []
+        for _ in range(total):
+            producto_id, sucursal_id = self.rnd.choice(claves)
+            ventas.append(Venta(suscripcion=s, sucursal_id=sucursal_id, fecha=self._fecha(),
+                                estado=Venta.CONFIRMADA))
+            lineas_por_venta.append([(producto_id, Decimal(self.rnd.randint(1, 12)))])
+        Venta.objects.bulk_create(ventas, batch_size=self.batch)
+
+        lineas = [VentaLinea(venta=v, producto_id=pid, cantidad=c)
+                  for v, lns in zip(ventas, lineas_por_venta) for pid, c in lns]
+        VentaLinea.objects.bulk_create(lineas, batch_size=self.batch)
+
+        consumos, trazas = [], []
+        for ln in lineas:
+            venta = ln.venta; pendiente = ln.cantidad
+            for lote in por_clave[(ln.producto_id, venta.sucursal_id)]:
+                if pendiente <= 0: break
+                tomar = min(pendiente, lote.cantidad_disponible)
+                if tomar <= 0: continue
+                lote.cantidad_disponible -= tomar; pendiente -= tomar
+                consumos.append(VentaConsumo(venta=venta, linea=ln, lote=lote, cantidad=tomar))
+                trazas.append(TrazaEnlace(suscripcion=s, tipo=TrazaEnlace.LOTE_VENTA, lote=lote,
+                                          venta=venta, cantidad=tomar, fecha=venta.fecha))
+            if pendiente > 0:
+                venta.estado = Venta.BORRADOR  # sin stock: queda como borrador, igual que en el POS
+
+        # Las que quedaron en borrador no descuentan nada.
+        borradores = {v.pk for v in ventas if v.estado == Venta.BORRADOR}
+        if borradores:
+            for c in consumos:
+                if c.venta.pk in borradores:
+                    c.lote.cantidad_disponible += c.cantidad
+            consumos = [c for c in consumos if c.venta.pk not in borradores]
+            trazas = [t for t in trazas if t.venta.pk not in borradores]
+            for i in range(0, len(borradores), self.batch):
+                Venta.objects.filter(pk__in=list(borradores)[i:i + self.batch]).update(estado=Venta.BORRADOR)
+
+        VentaConsumo.objects.bulk_create(consumos, batch_size=self.batch)
+        TrazaEnlace.objects.bulk_create(trazas, batch_size=self.batch)
+        LoteProducto.objects.bulk_update(viejos, ["cantidad_disponible"], batch_size=1000)
+        self._paso(f"ventas ({total}, {len(borradores)} en borrador)", t0)
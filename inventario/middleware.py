@@ -53,7 +53,8 @@ class SetupWizardMiddleware:
             request.headers.get('x-requested-with') == 'XMLHttpRequest' or
             request.path.startswith('/media/') or 
             request.path.startswith('/static/') or
-            request.path.startswith('/admin/')):
+            request.path.startswith('/admin/') or
+            request.path.startswith('/api/')):
             
             return self.get_response(request)
 
@@ -103,7 +104,9 @@ class SetupWizardMiddleware:
                 paso_destino_nombre = 'inventario:wizard_materias_primas' # Paso 4
                 
             # 5. ¿Ha registrado su stock inicial?
-            elif MovimientoMP.objects.filter(mp__suscripcion=suscripcion, tipo=MovimientoMP.INGRESO).count() == 0:
+            # (con el kardex archivado los ingresos viejos quedan como APERTURA)
+            elif not MovimientoMP.objects.filter(mp__suscripcion=suscripcion,
+                                                 tipo__in=[MovimientoMP.INGRESO, MovimientoMP.APERTURA]).exists():
                 paso_destino_nombre = 'inventario:wizard_stock_inicial' # Paso 5
             
             # 6. Si pasó todo, solo le falta finalizar
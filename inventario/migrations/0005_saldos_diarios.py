@@ -0,0 +1,43 @@
+# Generated by Django 5.1 on 2026-10-19 12:51
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('inventario', '0004_respuesta_idempotente'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SaldoDiarioMP',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('fecha', models.DateField()),
+                ('stock', models.DecimalField(decimal_places=3, max_digits=14)),
+            ],
+            options={
+                'ordering': ['-fecha'],
+            },
+        ),
+        migrations.AddIndex(
+            model_name='movimientomp',
+            index=models.Index(fields=['mp', 'ubicacion', 'fecha'], name='movmp_mp_ubic_fecha_idx'),
+        ),
+        migrations.AddField(
+            model_name='saldodiariomp',
+            name='mp',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='saldos_diarios', to='inventario.materiaprima'),
+        ),
+        migrations.AddField(
+            model_name='saldodiariomp',
+            name='ubicacion',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='saldos_diarios', to='inventario.ubicacion'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='saldodiariomp',
+            unique_together={('mp', 'ubicacion', 'fecha')},
+        ),
+    ]
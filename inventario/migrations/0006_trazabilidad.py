@@ -0,0 +1,36 @@
+# Generated by Django 5.1 on 2026-10-19 12:55
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('inventario', '0005_saldos_diarios'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='movimientomp',
+            name='op',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='consumos_mp', to='inventario.ordenproduccion'),
+        ),
+        migrations.CreateModel(
+            name='TrazaEnlace',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('tipo', models.CharField(choices=[('MP_LOTE', 'MP → Lote'), ('LOTE_VENTA', 'Lote → Venta')], max_length=10)),
+                ('cantidad', models.DecimalField(decimal_places=3, max_digits=12)),
+                ('fecha', models.DateTimeField()),
+                ('lote', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='trazas', to='inventario.loteproducto')),
+                ('movimiento', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='trazas', to='inventario.movimientomp')),
+                ('mp', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.PROTECT, related_name='trazas', to='inventario.materiaprima')),
+                ('suscripcion', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='trazas', to='inventario.suscripcioncliente')),
+                ('venta', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='trazas', to='inventario.venta')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['mp', 'fecha'], name='traza_mp_fecha_idx'), models.Index(fields=['lote', 'tipo'], name='traza_lote_tipo_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,38 @@
+# Generated by Django 5.1 on 2026-10-19 12:57
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('inventario', '0006_trazabilidad'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='loteproducto',
+            name='costo_unitario',
+            field=models.DecimalField(blank=True, decimal_places=4, max_digits=14, null=True),
+        ),
+        migrations.AddField(
+            model_name='materiaprima',
+            name='costo_promedio',
+            field=models.DecimalField(decimal_places=4, default=0, max_digits=14),
+        ),
+        migrations.AddField(
+            model_name='movimientomp',
+            name='costo_unitario',
+            field=models.DecimalField(blank=True, decimal_places=4, max_digits=14, null=True),
+        ),
+        migrations.AddField(
+            model_name='receta',
+            name='costo_actualizado_en',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='receta',
+            name='costo_unitario',
+            field=models.DecimalField(decimal_places=4, default=0, max_digits=14),
+        ),
+    ]
@@ -0,0 +1,34 @@
+# Generated by Django 5.1 on 2026-10-19 13:13
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('inventario', '0007_costos'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StockReserva',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('cantidad', models.DecimalField(decimal_places=3, max_digits=12)),
+                ('expira', models.DateTimeField()),
+                ('creado', models.DateTimeField(auto_now_add=True)),
+                ('linea', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='reservas', to='inventario.ventalinea')),
+                ('lote', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='reservas', to='inventario.loteproducto')),
+                ('mp', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='reservas', to='inventario.materiaprima')),
+                ('op', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='reservas', to='inventario.ordenproduccion')),
+                ('suscripcion', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='reservas', to='inventario.suscripcioncliente')),
+                ('ubicacion', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='reservas', to='inventario.ubicacion')),
+                ('venta', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='reservas', to='inventario.venta')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['mp', 'ubicacion', 'expira'], name='reserva_mp_ubic_exp_idx'), models.Index(fields=['lote', 'expira'], name='reserva_lote_exp_idx'), models.Index(fields=['expira'], name='reserva_expira_idx')],
+                'constraints': [models.CheckConstraint(condition=models.Q(models.Q(('lote__isnull', True), ('mp__isnull', False), ('op__isnull', False), ('venta__isnull', True)), models.Q(('lote__isnull', False), ('mp__isnull', True), ('op__isnull', True), ('venta__isnull', False)), _connector='OR'), name='reserva_mp_op_o_lote_venta')],
+            },
+        ),
+    ]
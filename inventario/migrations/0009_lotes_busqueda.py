@@ -0,0 +1,56 @@
+# Generated by Django 5.1 on 2026-10-19 13:20
+
+from django.db import migrations, models
+
+# Índices por expresión para la búsqueda de LoteListView. Dependen del
+# motor, así que no forman parte del estado del modelo:
+#
+#   - código: prefijo sin distinguir mayúsculas (codigo__istartswith).
+#     PostgreSQL compara UPPER(codigo::text) LIKE 'X%' → índice sobre esa
+#     expresión con text_pattern_ops. SQLite usa LIKE (ya insensible a
+#     mayúsculas) → índice con COLLATE NOCASE.
+#   - nombre de producto: en PostgreSQL, índice trigram (pg_trgm) sobre
+#     UPPER(nombre::text), que resuelve nombre__icontains sin recorrer la
+#     tabla. En SQLite no hay equivalente: se filtra sobre los productos
+#     de la empresa, que son pocos.
+INDICES = {
+    "postgresql": [
+        ("CREATE EXTENSION IF NOT EXISTS pg_trgm", None),
+        ('CREATE INDEX IF NOT EXISTS lote_codigo_upper_idx ON inventario_loteproducto '
+         '(UPPER(codigo::text) text_pattern_ops)',
+         "DROP INDEX IF EXISTS lote_codigo_upper_idx"),
+        ('CREATE INDEX IF NOT EXISTS producto_nombre_trgm_idx ON inventario_producto '
+         'USING gin (UPPER(nombre::text) gin_trgm_ops)',
+         "DROP INDEX IF EXISTS producto_nombre_trgm_idx"),
+    ],
+    "sqlite": [
+        ("CREATE INDEX IF NOT EXISTS lote_codigo_nocase_idx ON inventario_loteproducto (codigo COLLATE NOCASE)",
+         "DROP INDEX IF EXISTS lote_codigo_nocase_idx"),
+    ],
+}
+
+
+def crear_indices(apps, schema_editor):
+    for crear, _ in INDICES.get(schema_editor.connection.vendor, []):
+        schema_editor.execute(crear)
+
+
+def borrar_indices(apps, schema_editor):
+    for _, borrar in reversed(INDICES.get(schema_editor.connection.vendor, [])):
+        if borrar:
+            schema_editor.execute(borrar)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('inventario', '0008_reservas'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='loteproducto',
+            index=models.Index(fields=['fecha_vencimiento', 'created_at', 'id'], name='lote_venc_orden_idx'),
+        ),
+        migrations.RunPython(crear_indices, borrar_indices),
+    ]
@@ -0,0 +1,56 @@
+# Generated by Django 5.1 on 2026-10-19 13:25
+
+import django.db.models.deletion
+import django.utils.timezone
+from decimal import Decimal
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('inventario', '0009_lotes_busqueda'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='movimientomp',
+            name='tipo',
+            field=models.CharField(choices=[('INGRESO', 'Ingreso'), ('CONSUMO', 'Consumo'), ('AJUSTE_POS', 'Ajuste (+)'), ('AJUSTE_NEG', 'Ajuste (-)'), ('MERMA', 'Merma'), ('TRASLADO_SAL', 'Traslado (salida)'), ('TRASLADO_ENT', 'Traslado (entrada)')], max_length=12),
+        ),
+        migrations.CreateModel(
+            name='Traslado',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('estado', models.CharField(choices=[('BORRADOR', 'Borrador'), ('CONFIRMADO', 'Confirmado')], default='BORRADOR', max_length=12)),
+                ('fecha', models.DateTimeField(default=django.utils.timezone.now)),
+                ('nota', models.CharField(blank=True, max_length=200)),
+                ('created_by', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to=settings.AUTH_USER_MODEL)),
+                ('destino', models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, related_name='traslados_entrada', to='inventario.ubicacion')),
+                ('origen', models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, related_name='traslados_salida', to='inventario.ubicacion')),
+                ('suscripcion', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='traslados', to='inventario.suscripcioncliente')),
+            ],
+            options={
+                'ordering': ['-fecha'],
+            },
+        ),
+        migrations.AddField(
+            model_name='movimientomp',
+            name='traslado',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.PROTECT, related_name='movimientos', to='inventario.traslado'),
+        ),
+        migrations.CreateModel(
+            name='TrasladoLinea',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('cantidad', models.DecimalField(decimal_places=3, default=Decimal('0'), max_digits=12)),
+                ('lote', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.PROTECT, related_name='lineas_traslado', to='inventario.loteproducto')),
+                ('mp', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.PROTECT, related_name='lineas_traslado', to='inventario.materiaprima')),
+                ('traslado', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='lineas', to='inventario.traslado')),
+            ],
+            options={
+                'constraints': [models.CheckConstraint(condition=models.Q(models.Q(('lote__isnull', True), ('mp__isnull', False)), models.Q(('lote__isnull', False), ('mp__isnull', True)), _connector='OR'), name='traslado_linea_mp_o_lote')],
+            },
+        ),
+    ]
@@ -0,0 +1,82 @@
+# Generated by Django 5.1 on 2026-10-19 13:27
+
+import django.db.models.deletion
+from django.conf import settings
+from django.contrib.auth.management import create_permissions
+from django.db import migrations, models
+
+# Permisos de los documentos nuevos (traslados y conteos) para los grupos
+# por defecto de 0002. Los permisos de Django se crean en post_migrate,
+# después de las migraciones: acá se crean antes de asignarlos.
+PERMISOS = {
+    "Gerente": [
+        "view_traslado", "add_traslado", "change_traslado", "delete_traslado",
+        "view_conteofisico", "add_conteofisico", "change_conteofisico", "delete_conteofisico",
+    ],
+    "Bodeguero": [
+        "view_traslado", "add_traslado", "change_traslado",
+        "view_conteofisico", "add_conteofisico", "change_conteofisico",
+    ],
+}
+
+
+def asignar_permisos(apps, schema_editor):
+    app_config = apps.get_app_config("inventario")
+    app_config.models_module = True
+    create_permissions(app_config, apps=apps, verbosity=0)
+    app_config.models_module = None
+    Group = apps.get_model("auth", "Group")
+    Permission = apps.get_model("auth", "Permission")
+    for nombre, codenames in PERMISOS.items():
+        grupo = Group.objects.filter(name=nombre).first()
+        if grupo:
+            grupo.permissions.add(*Permission.objects.filter(
+                content_type__app_label="inventario", codename__in=codenames))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('inventario', '0010_traslados'),
+        ('auth', '0012_alter_user_first_name_max_length'),
+        ('contenttypes', '0002_remove_content_type_name'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ConteoFisico',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('estado', models.CharField(choices=[('ABIERTO', 'Abierto'), ('CONTABILIZADO', 'Contabilizado')], default='ABIERTO', max_length=14)),
+                ('nota', models.CharField(blank=True, max_length=200)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('contabilizado_en', models.DateTimeField(blank=True, null=True)),
+                ('created_by', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to=settings.AUTH_USER_MODEL)),
+                ('sucursal', models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, related_name='conteos', to='inventario.sucursal')),
+                ('suscripcion', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='conteos', to='inventario.suscripcioncliente')),
+            ],
+            options={
+                'ordering': ['-created_at'],
+            },
+        ),
+        migrations.AddField(
+            model_name='movimientomp',
+            name='conteo',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.PROTECT, related_name='movimientos', to='inventario.conteofisico'),
+        ),
+        migrations.CreateModel(
+            name='ConteoLinea',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('contado', models.DecimalField(decimal_places=3, max_digits=12)),
+                ('sistema', models.DecimalField(blank=True, decimal_places=3, max_digits=12, null=True)),
+                ('conteo', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='lineas', to='inventario.conteofisico')),
+                ('mp', models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, related_name='+', to='inventario.materiaprima')),
+                ('ubicacion', models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, related_name='+', to='inventario.ubicacion')),
+            ],
+            options={
+                'unique_together': {('conteo', 'ubicacion', 'mp')},
+            },
+        ),
+        migrations.RunPython(asignar_permisos, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,80 @@
+# Generated by Django 5.1 on 2026-10-19 13:38
+
+import django.db.models.deletion
+import django.db.models.functions.datetime
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('inventario', '0011_conteos'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='movimientomp',
+            name='tipo',
+            field=models.CharField(choices=[('INGRESO', 'Ingreso'), ('CONSUMO', 'Consumo'), ('AJUSTE_POS', 'Ajuste (+)'), ('AJUSTE_NEG', 'Ajuste (-)'), ('MERMA', 'Merma'), ('TRASLADO_SAL', 'Traslado (salida)'), ('TRASLADO_ENT', 'Traslado (entrada)'), ('APERTURA', 'Saldo de apertura')], max_length=12),
+        ),
+        migrations.AlterField(
+            model_name='trazaenlace',
+            name='movimiento',
+            field=models.ForeignKey(blank=True, db_constraint=False, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='trazas', to='inventario.movimientomp'),
+        ),
+        migrations.CreateModel(
+            name='CorteArchivo',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('hasta', models.DateTimeField()),
+                ('movimientos', models.PositiveIntegerField(default=0)),
+                ('aperturas', models.PositiveIntegerField(default=0)),
+                ('consumos', models.PositiveIntegerField(default=0)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('suscripcion', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='cortes_archivo', to='inventario.suscripcioncliente')),
+            ],
+            options={
+                'ordering': ['-hasta'],
+            },
+        ),
+        migrations.CreateModel(
+            name='MovimientoMPArchivo',
+            fields=[
+                ('id', models.BigIntegerField(primary_key=True, serialize=False)),
+                ('tipo', models.CharField(choices=[('INGRESO', 'Ingreso'), ('CONSUMO', 'Consumo'), ('AJUSTE_POS', 'Ajuste (+)'), ('AJUSTE_NEG', 'Ajuste (-)'), ('MERMA', 'Merma'), ('TRASLADO_SAL', 'Traslado (salida)'), ('TRASLADO_ENT', 'Traslado (entrada)'), ('APERTURA', 'Saldo de apertura')], max_length=12)),
+                ('cantidad', models.DecimalField(decimal_places=3, max_digits=12)),
+                ('fecha', models.DateTimeField()),
+                ('nota', models.CharField(blank=True, max_length=250)),
+                ('costo_unitario', models.DecimalField(blank=True, decimal_places=4, max_digits=14, null=True)),
+                ('archivado_en', models.DateTimeField(db_default=django.db.models.functions.datetime.Now())),
+                ('conteo', models.ForeignKey(blank=True, db_constraint=False, null=True, on_delete=django.db.models.deletion.DO_NOTHING, related_name='+', to='inventario.conteofisico')),
+                ('created_by', models.ForeignKey(blank=True, db_constraint=False, null=True, on_delete=django.db.models.deletion.DO_NOTHING, related_name='+', to=settings.AUTH_USER_MODEL)),
+                ('mp', models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.DO_NOTHING, related_name='+', to='inventario.materiaprima')),
+                ('op', models.ForeignKey(blank=True, db_constraint=False, null=True, on_delete=django.db.models.deletion.DO_NOTHING, related_name='+', to='inventario.ordenproduccion')),
+                ('traslado', models.ForeignKey(blank=True, db_constraint=False, null=True, on_delete=django.db.models.deletion.DO_NOTHING, related_name='+', to='inventario.traslado')),
+                ('ubicacion', models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.DO_NOTHING, related_name='+', to='inventario.ubicacion')),
+            ],
+            options={
+                'ordering': ['-fecha'],
+                'indexes': [models.Index(fields=['mp', 'ubicacion', 'fecha'], name='movarch_mp_ubic_fecha_idx')],
+            },
+        ),
+        migrations.CreateModel(
+            name='VentaConsumoArchivo',
+            fields=[
+                ('id', models.BigIntegerField(primary_key=True, serialize=False)),
+                ('cantidad', models.DecimalField(decimal_places=3, max_digits=12)),
+                ('created_at', models.DateTimeField(blank=True, null=True)),
+                ('archivado_en', models.DateTimeField(db_default=django.db.models.functions.datetime.Now())),
+                ('created_by', models.ForeignKey(blank=True, db_constraint=False, null=True, on_delete=django.db.models.deletion.DO_NOTHING, related_name='+', to=settings.AUTH_USER_MODEL)),
+                ('linea', models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.DO_NOTHING, related_name='+', to='inventario.ventalinea')),
+                ('lote', models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.DO_NOTHING, related_name='+', to='inventario.loteproducto')),
+                ('venta', models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.DO_NOTHING, related_name='+', to='inventario.venta')),
+            ],
+            options={
+                'ordering': ['created_at'],
+                'indexes': [models.Index(fields=['venta'], name='ventacons_arch_venta_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.1 on 2026-10-19 13:47
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('inventario', '0012_archivo_kardex'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='suscripcioncliente',
+            name='base_datos',
+            field=models.CharField(default='default', max_length=50),
+        ),
+        migrations.AddField(
+            model_name='suscripcioncliente',
+            name='en_mudanza',
+            field=models.BooleanField(default=False),
+        ),
+    ]
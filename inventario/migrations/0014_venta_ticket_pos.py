@@ -0,0 +1,22 @@
+# Generated by Django 5.1 on 2026-10-19 14:02
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('inventario', '0013_shards'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='venta',
+            name='ticket_pos',
+            field=models.CharField(blank=True, max_length=40, null=True),
+        ),
+        migrations.AddConstraint(
+            model_name='venta',
+            constraint=models.UniqueConstraint(fields=('sucursal', 'ticket_pos'), name='venta_ticket_pos_uniq'),
+        ),
+    ]
@@ -0,0 +1,36 @@
+# Generated by Django 5.1 on 2026-10-19 14:08
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('inventario', '0014_venta_ticket_pos'),
+    ]
+
+    operations = [
+        migrations.AlterModelOptions(
+            name='recetalinea',
+            options={'ordering': ['mp__nombre', 'producto__nombre']},
+        ),
+        migrations.AddField(
+            model_name='recetalinea',
+            name='producto',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.PROTECT, related_name='usos_en_recetas', to='inventario.producto'),
+        ),
+        migrations.AlterField(
+            model_name='recetalinea',
+            name='mp',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.PROTECT, to='inventario.materiaprima'),
+        ),
+        migrations.AddConstraint(
+            model_name='recetalinea',
+            constraint=models.UniqueConstraint(fields=('receta', 'producto'), name='recetalinea_receta_producto_uniq'),
+        ),
+        migrations.AddConstraint(
+            model_name='recetalinea',
+            constraint=models.CheckConstraint(condition=models.Q(models.Q(('mp__isnull', False), ('producto__isnull', True)), models.Q(('mp__isnull', True), ('producto__isnull', False)), _connector='OR'), name='recetalinea_mp_o_producto'),
+        ),
+    ]
@@ -0,0 +1,122 @@
+# Generated by Django 5.1 on 2026-10-19 14:11
+
+from decimal import Decimal
+
+from django.db import migrations, models
+
+# Foto de la receta para las OPs que ya existían. Se arma con la receta
+# como está hoy (lo que hubo al crearlas no quedó guardado), en tandas de
+# BATCH OPs: una lectura de OPs, las recetas/MPs que falten y un
+# bulk_update por tanda. Misma forma que inventario.bom.snapshot, pero con
+# los modelos históricos. Una OP cuya receta no se puede explotar (ciclo,
+# intermedio sin receta activa) queda sin foto: la OP la arma en vivo.
+BATCH = 500
+NUEVE_DEC = Decimal("1e-9")
+
+
+class _Fotos:
+    def __init__(self, apps, db):
+        self.Receta = apps.get_model("inventario", "Receta")
+        self.RecetaLinea = apps.get_model("inventario", "RecetaLinea")
+        self.MateriaPrima = apps.get_model("inventario", "MateriaPrima")
+        self.db = db
+        self.lineas = {}     # receta_id → [(mp_id, producto_id, cantidad)]
+        self.activa = {}     # producto_id → (receta_id, rendimiento) o None
+        self.memo = {}       # receta_id → {mp_id: por lote} o None (no se puede explotar)
+        self.fotos = {}      # receta_id → foto
+
+    def _cargar(self, receta_ids):
+        pendientes = set(receta_ids) - self.lineas.keys()
+        while pendientes:
+            for r in pendientes:
+                self.lineas[r] = []
+            for r, mp_id, producto_id, cantidad in (
+                    self.RecetaLinea.objects.using(self.db).filter(receta_id__in=pendientes)
+                    .values_list("receta_id", "mp_id", "producto_id", "cantidad")):
+                self.lineas[r].append((mp_id, producto_id, Decimal(cantidad)))
+            productos = {p for r in pendientes for _, p, _ in self.lineas[r] if p} - self.activa.keys()
+            for producto_id in productos:
+                self.activa[producto_id] = None
+            for pk, producto_id, rendimiento in (
+                    self.Receta.objects.using(self.db).filter(producto_id__in=productos, activo=True)
+                    .order_by("producto_id", "-version", "-pk").values_list("pk", "producto_id", "rendimiento_por_lote")):
+                if self.activa[producto_id] is None:
+                    self.activa[producto_id] = (pk, Decimal(rendimiento))
+            pendientes = {a[0] for a in self.activa.values() if a} - self.lineas.keys()
+
+    def _por_lote(self, receta_id, camino=()):
+        if receta_id in self.memo:
+            return self.memo[receta_id]
+        if receta_id in camino:
+            return None
+        total = {}
+        for mp_id, producto_id, cantidad in self.lineas[receta_id]:
+            if mp_id:
+                total[mp_id] = total.get(mp_id, Decimal("0")) + cantidad
+                continue
+            sub = self.activa.get(producto_id)
+            hijo = self._por_lote(sub[0], camino + (receta_id,)) if sub and sub[1] else None
+            if hijo is None:
+                self.memo[receta_id] = None
+                return None
+            for mp_id, q in hijo.items():
+                total[mp_id] = total.get(mp_id, Decimal("0")) + q * cantidad / sub[1]
+        self.memo[receta_id] = total
+        return total
+
+    def preparar(self, receta_ids):
+        nuevas = set(receta_ids) - self.fotos.keys()
+        if not nuevas:
+            return
+        self._cargar(nuevas)
+        por_lote = {r: self._por_lote(r) for r in nuevas}
+        mp_ids = {m for pl in por_lote.values() if pl for m in pl}
+        mps = {pk: (nombre, unidad_id) for pk, nombre, unidad_id in
+               self.MateriaPrima.objects.using(self.db).filter(pk__in=mp_ids).values_list("pk", "nombre", "unidad_id")}
+        for pk, nombre, version, rendimiento, producto in (
+                self.Receta.objects.using(self.db).filter(pk__in=nuevas)
+                .values_list("pk", "nombre", "version", "rendimiento_por_lote", "producto__nombre")):
+            pl = por_lote[pk]
+            self.fotos[pk] = pl and {
+                "receta": pk,
+                "nombre": f"{producto} - {nombre} v{version}",
+                "rendimiento": str(rendimiento),
+                "mp": sorted(([m, mps[m][0], mps[m][1], format(q.quantize(NUEVE_DEC).normalize(), "f")]
+                              for m, q in pl.items()), key=lambda fila: fila[1]),
+            }
+
+
+def completar_fotos(apps, schema_editor):
+    OrdenProduccion = apps.get_model("inventario", "OrdenProduccion")
+    db = schema_editor.connection.alias
+    fotos = _Fotos(apps, db)
+    ultimo = 0
+    while True:
+        ops = list(OrdenProduccion.objects.using(db).filter(pk__gt=ultimo)
+                   .order_by("pk").only("pk", "receta_id")[:BATCH])
+        if not ops:
+            break
+        ultimo = ops[-1].pk
+        fotos.preparar({op.receta_id for op in ops})
+        cambiadas = []
+        for op in ops:
+            if fotos.fotos.get(op.receta_id):
+                op.receta_snapshot = fotos.fotos[op.receta_id]
+                cambiadas.append(op)
+        OrdenProduccion.objects.using(db).bulk_update(cambiadas, ["receta_snapshot"])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('inventario', '0015_recetalinea_producto'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='ordenproduccion',
+            name='receta_snapshot',
+            field=models.JSONField(blank=True, default=dict, editable=False),
+        ),
+        migrations.RunPython(completar_fotos, migrations.RunPython.noop),
+    ]
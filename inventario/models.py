@@ -4,13 +4,21 @@
 from decimal import Decimal, ROUND_HALF_UP
 from datetime import timedelta
 # <--- AQUI: Importamos 'Sum' para calcular stocks totales
-from django.db import models, transaction
-from django.db.models import Sum, Q, F
+from django.db import connections, models, router
+from django.db.models import Sum, Q, F, Case, When
+from django.db.models.functions import Now
 from django.core.exceptions import ValidationError
 from django.utils import timezone
 from django.conf import settings
 from django.contrib.auth.models import AbstractUser, Group, Permission
 
+# Formato de cantidades (fmt1 se sigue importando desde aquí)
+from .unidades import fmt1, formatear
+# Transacciones en la base del tenant (ver inventario/shards.py)
+from .shards import atomico
+# Versión de datos por empresa para la caché del panel (ver inventario/cache_empresa.py)
+from . import cache_empresa
+
 # -----------------------------------------------------------------
 # MODELO 1: LA EMPRESA (EL "DUEÑO" DE TODO)
 # -----------------------------------------------------------------
@@ -33,7 +41,11 @@ class SuscripcionCliente(models.Model):
     )
     subscription_status = models.CharField(max_length=20, default="trialing")
     ha_completado_onboarding = models.BooleanField(default=False)
-    
+    # Base donde viven sus datos (alias de DATABASES, ver inventario/shards.py)
+    base_datos = models.CharField(max_length=50, default="default")
+    # Mientras se mueve de base no acepta escrituras
+    en_mudanza = models.BooleanField(default=False)
+
     def __str__(self):
         return f"{self.nombre_empresa} - Plan {self.get_plan_actual_display()}"
 
@@ -78,15 +90,6 @@ class User(AbstractUser):
     )
 
 
-# ---------- Helper global (Sin cambios) ----------
-def fmt1(value) -> str:
-    try:
-        d = Decimal(value or 0)
-    except Exception:
-        return str(value)
-    q = d.quantize(Decimal("0.1"), rounding=ROUND_HALF_UP)
-    return f"{int(q)}" if q == q.to_integral() else f"{q.normalize():f}"
-
 # =========================
 #  Unidades (Sin cambios)
 # =========================
@@ -157,6 +160,9 @@ class MateriaPrima(models.Model):
 
     # (Campos 'stock' y 'stock_minimo' eliminados de aquí)
 
+    # Costo promedio ponderado por unidad (se actualiza con cada INGRESO con costo).
+    costo_promedio = models.DecimalField(max_digits=14, decimal_places=4, default=0)
+
     activo = models.BooleanField(default=True)
     created_at = models.DateTimeField(auto_now_add=True)
     
@@ -167,6 +173,22 @@ class MateriaPrima(models.Model):
     def __str__(self):
         return self.nombre
     
+    def registrar_costo_ingreso(self, cantidad, costo_unitario, stock_previo):
+        """
+        Promedio ponderado: (stock previo × promedio + cantidad × costo) / stock nuevo.
+        Si no había stock (o era negativo) el promedio pasa a ser el costo del ingreso.
+        """
+        cantidad = Decimal(cantidad); costo_unitario = Decimal(costo_unitario)
+        if stock_previo <= 0:
+            nuevo = costo_unitario
+        else:
+            nuevo = (stock_previo * self.costo_promedio + cantidad * costo_unitario) / (stock_previo + cantidad)
+        nuevo = nuevo.quantize(Decimal("0.0001"), rounding=ROUND_HALF_UP)
+        cambio = nuevo != self.costo_promedio
+        self.costo_promedio = nuevo
+        MateriaPrima.objects.filter(pk=self.pk).update(costo_promedio=nuevo)
+        return cambio
+
     @property
     def stock_total(self) -> Decimal:
         total = self.stock_por_ubicacion.aggregate(
@@ -187,19 +209,7 @@ class MateriaPrima(models.Model):
     @property
     def stock_minimo_total_fmt(self) -> str: return fmt1(self.stock_minimo_total)
 
-    # (Funciones de formato sin cambios)
-    def _fmt_decimal_short(self, x: Decimal, max_dec: int = 1) -> str:
-        d = Decimal(x or 0); q = d.quantize(Decimal(10) ** -max_dec, rounding=ROUND_HALF_UP); return f"{int(q)}" if q == q.to_integral() else f"{q.normalize():f}"
-    
-    def format_qty(self, qty: Decimal) -> str:
-        d = Decimal(qty or 0); u = (self.unidad.nombre or "").lower()
-        if u == "kg":
-            if d >= 1: return f"{self._fmt_decimal_short(d)} kg"
-            g = (d * Decimal("1000")).quantize(Decimal("1"), rounding=ROUND_HALF_UP); return f"{int(g)} g"
-        if u in ("l", "lt", "litro", "litros"):
-            if d >= 1: return f"{self._fmt_decimal_short(d)} l"
-            ml = (d * Decimal("1000")).quantize(Decimal("1"), rounding=ROUND_HALF_UP); return f"{int(ml)} ml"
-        return f"{self._fmt_decimal_short(d)} {self.unidad.nombre}"
+    def format_qty(self, qty: Decimal) -> str: return formatear(qty, self.unidad_id)
 
 
 class StockPorUbicacion(models.Model):
@@ -223,13 +233,68 @@ class StockPorUbicacion(models.Model):
     def __str__(self):
         return f"{self.ubicacion} | {self.mp.nombre}: {fmt1(self.stock)}"
 
+    @classmethod
+    def aplicar_delta(cls, ubicacion_id, mp_id, delta):
+        """
+        Modo 'atomico': suma 'delta' con un solo UPDATE stock = stock + delta,
+        sin leer ni bloquear la fila durante toda la transacción. Si el delta
+        resta, el UPDATE solo aplica si alcanza el stock (nunca queda
+        negativo). Si la fila no existe se inserta con ON CONFLICT DO NOTHING
+        (otro proceso pudo crearla entre medio) y se reintenta el UPDATE.
+        """
+        fila = cls.objects.filter(ubicacion_id=ubicacion_id, mp_id=mp_id)
+        destino = fila.filter(stock__gte=-delta) if delta < 0 else fila
+        if destino.update(stock=F("stock") + delta):
+            return
+        if not fila.exists():
+            cls.objects.bulk_create([cls(ubicacion_id=ubicacion_id, mp_id=mp_id, stock=Decimal("0"))],
+                                    ignore_conflicts=True)
+            if destino.update(stock=F("stock") + delta):
+                return
+        raise StockInsuficiente(ubicacion_id, mp_id, -delta)
+
+
+class StockInsuficiente(ValidationError):
+    """El UPDATE condicional de StockPorUbicacion.aplicar_delta no alcanzó."""
+    def __init__(self, ubicacion_id, mp_id, requerido):
+        self.ubicacion_id, self.mp_id, self.requerido = ubicacion_id, mp_id, requerido
+        super().__init__(f"Stock insuficiente: se requieren {fmt1(requerido)} (MP {mp_id}, ubicación {ubicacion_id}).")
+
+
+def actualizar_columna(modelo, campo, valores):
+    """
+    UPDATE <campo> = valor WHERE pk = ... para muchas filas ({pk: valor}),
+    con un executemany. bulk_update() arma un CASE WHEN por fila y con
+    miles de filas se va en construir la consulta, no en ejecutarla.
+    """
+    if not valores:
+        return
+    conn = connections[router.db_for_write(modelo)]
+    q = conn.ops.quote_name
+    col = modelo._meta.get_field(campo).column
+    sql = f"UPDATE {q(modelo._meta.db_table)} SET {q(col)} = %s WHERE {q(modelo._meta.pk.column)} = %s"
+    with conn.cursor() as cur:
+        cur.executemany(sql, [(v, pk) for pk, v in valores.items()])
+
+
+def modo_stock_atomico() -> bool:
+    """settings.STOCK_MODO_ACTUALIZACION: 'bloqueo' (por defecto) o 'atomico'."""
+    return getattr(settings, "STOCK_MODO_ACTUALIZACION", "bloqueo") == "atomico"
+
 
 # =========================
 #  Kardex (¡CORREGIDO!)
 # =========================
 class MovimientoMP(models.Model):
     INGRESO = "INGRESO"; CONSUMO = "CONSUMO"; AJUSTE_POS = "AJUSTE_POS"; AJUSTE_NEG = "AJUSTE_NEG"; MERMA = "MERMA"
-    TIPOS = [(INGRESO, "Ingreso"), (CONSUMO, "Consumo"), (AJUSTE_POS, "Ajuste (+)"), (AJUSTE_NEG, "Ajuste (-)"), (MERMA, "Merma")]
+    TRASLADO_SAL = "TRASLADO_SAL"; TRASLADO_ENT = "TRASLADO_ENT"; APERTURA = "APERTURA"
+    TIPOS = [(INGRESO, "Ingreso"), (CONSUMO, "Consumo"), (AJUSTE_POS, "Ajuste (+)"), (AJUSTE_NEG, "Ajuste (-)"), (MERMA, "Merma"),
+             (TRASLADO_SAL, "Traslado (salida)"), (TRASLADO_ENT, "Traslado (entrada)"), (APERTURA, "Saldo de apertura")]
+    # Tipos que SUMAN stock; el resto resta. APERTURA lleva el saldo con
+    # su signo (lo escribe el archivado: resume lo que pasó al archivo).
+    TIPOS_POSITIVOS = (INGRESO, AJUSTE_POS, TRASLADO_ENT, APERTURA)
+    # Solo los genera Traslado.confirmar() (siempre de a pares).
+    TIPOS_TRASLADO = (TRASLADO_SAL, TRASLADO_ENT)
     
     mp = models.ForeignKey(MateriaPrima, on_delete=models.PROTECT, related_name="movimientos")
     
@@ -247,49 +312,165 @@ class MovimientoMP(models.Model):
     fecha = models.DateTimeField(default=timezone.now)
     nota = models.CharField(max_length=250, blank=True)
     created_by = models.ForeignKey(settings.AUTH_USER_MODEL, null=True, blank=True, on_delete=models.SET_NULL)
+    # Costo por unidad de MP; solo en INGRESO (alimenta MateriaPrima.costo_promedio).
+    costo_unitario = models.DecimalField(max_digits=14, decimal_places=4, null=True, blank=True)
+    # OP que originó el CONSUMO (trazabilidad; antes solo quedaba en 'nota').
+    op = models.ForeignKey(
+        "OrdenProduccion", null=True, blank=True, on_delete=models.SET_NULL, related_name="consumos_mp"
+    )
+    # Traslado que generó el par TRASLADO_SAL / TRASLADO_ENT.
+    traslado = models.ForeignKey(
+        "Traslado", null=True, blank=True, on_delete=models.PROTECT, related_name="movimientos"
+    )
+    # Conteo físico que generó el AJUSTE_POS / AJUSTE_NEG.
+    conteo = models.ForeignKey(
+        "ConteoFisico", null=True, blank=True, on_delete=models.PROTECT, related_name="movimientos"
+    )
     
     class Meta: 
         ordering = ["-fecha"] 
+        indexes = [
+            # Saldos / conciliación / stock a una fecha (ver inventario/saldos.py)
+            models.Index(fields=["mp", "ubicacion", "fecha"], name="movmp_mp_ubic_fecha_idx"),
+        ]
     
     def __str__(self): return f"{self.ubicacion} · {self.mp} · {self.tipo} · {fmt1(self.cantidad)}"
     
     @property
     def cantidad_signed(self) -> Decimal: 
-        return self.cantidad if self.tipo in [self.INGRESO, self.AJUSTE_POS] else -self.cantidad
+        return self.cantidad if self.tipo in self.TIPOS_POSITIVOS else -self.cantidad
+
+    @classmethod
+    def expr_cantidad_signed(cls):
+        """Lo mismo que 'cantidad_signed', pero como expresión SQL (para Sum())."""
+        return Case(
+            When(tipo__in=cls.TIPOS_POSITIVOS, then=F("cantidad")),
+            default=-F("cantidad"),
+            output_field=models.DecimalField(max_digits=14, decimal_places=3),
+        )
     
     # (Lógica save() y delete() sin cambios)
     def save(self, *args, **kwargs):
-        with transaction.atomic():
+        with atomico():
             delta = Decimal("0")
             if self.pk: 
                 old_mov = MovimientoMP.objects.select_for_update().get(pk=self.pk)
                 delta = self.cantidad_signed - old_mov.cantidad_signed
             else: 
                 delta = self.cantidad_signed
+                if self.tipo == self.INGRESO and self.costo_unitario is not None:
+                    # Lock de la MP: dos ingresos simultáneos no pueden promediar sobre el mismo stock.
+                    mp = MateriaPrima.objects.select_for_update().get(pk=self.mp_id)
+                    self.costo_cambiado = mp.registrar_costo_ingreso(self.cantidad, self.costo_unitario, mp.stock_total)
+                    self.mp.costo_promedio = mp.costo_promedio
             
             super().save(*args, **kwargs) 
             
+            if modo_stock_atomico():
+                if delta:
+                    StockPorUbicacion.aplicar_delta(self.ubicacion_id, self.mp_id, delta)
+                return
+
             stock_item, created = StockPorUbicacion.objects.select_for_update().get_or_create(
-                ubicacion=self.ubicacion,
-                mp=self.mp,
+                ubicacion_id=self.ubicacion_id,
+                mp_id=self.mp_id,
                 defaults={'stock': Decimal("0")} 
             )
             
+            # Misma guarda que el modo 'atomico': lo que resta no puede dejar stock negativo.
+            if delta < 0 and (stock_item.stock or Decimal("0")) + delta < 0:
+                raise StockInsuficiente(self.ubicacion_id, self.mp_id, -delta)
             stock_item.stock = (stock_item.stock or Decimal("0")) + (delta or Decimal("0"))
             stock_item.save(update_fields=["stock"])
     
-    def delete(self, *args, **kwargs):
-        with transaction.atomic():
-            try:
-                stock_item = StockPorUbicacion.objects.select_for_update().get(
-                    ubicacion=self.ubicacion, 
-                    mp=self.mp
+    @classmethod
+    @atomico
+    def registrar_bulk(cls, movimientos):
+        """
+        Guarda muchos movimientos como una sola operación: un bulk_create del
+        kardex y los deltas sumados por (ubicación, MP) aplicados sobre
+        StockPorUbicacion con un lock de todas las filas (en orden fijo de
+        ubicacion_id, mp_id, así dos lotes de movimientos simultáneos no se
+        bloquean en cruz) y un bulk_update. Si algún saldo quedaría negativo
+        no se guarda nada (StockInsuficiente).
+
+        No pasa por save(): no aplica a INGRESOs con costo (el costo
+        promedio se calcula de a uno) ni dispara post_save (la versión de
+        datos de la empresa se sube acá, ver cache_empresa.py).
+        """
+        if any(m.tipo == cls.INGRESO and m.costo_unitario is not None for m in movimientos):
+            raise ValueError("registrar_bulk no recalcula costos: los ingresos con costo van con save().")
+        deltas = {}
+        for m in movimientos:
+            clave = (m.ubicacion_id, m.mp_id)
+            deltas[clave] = deltas.get(clave, Decimal("0")) + m.cantidad_signed
+        claves = sorted(deltas)
+        if claves:
+            def bloquear(pares):
+                # ubicación × MP cubre los pares (y para un traslado o un conteo,
+                # con una o dos ubicaciones, es exactamente eso).
+                return {(f.ubicacion_id, f.mp_id): f for f in StockPorUbicacion.objects.select_for_update().filter(
+                    ubicacion_id__in={u for u, _ in pares}, mp_id__in={mp for _, mp in pares},
+                ).order_by("ubicacion_id", "mp_id")}
+            filas = bloquear(claves)
+            faltan = [c for c in claves if c not in filas]
+            if faltan:
+                # Filas nuevas: ON CONFLICT DO NOTHING por si otro proceso las crea a la vez.
+                StockPorUbicacion.objects.bulk_create(
+                    [StockPorUbicacion(ubicacion_id=u, mp_id=mp, stock=Decimal("0")) for u, mp in faltan],
+                    ignore_conflicts=True,
                 )
-                stock_item.stock = (stock_item.stock or Decimal("0")) - (self.cantidad_signed or Decimal("0"))
-                stock_item.save(update_fields=["stock"])
-            except StockPorUbicacion.DoesNotExist:
-                pass
-            super().delete(*args, **kwargs)
+                filas.update(bloquear(faltan))
+            for clave in claves:
+                fila = filas[clave]
+                fila.stock = (fila.stock or Decimal("0")) + deltas[clave]
+                # Misma guarda que save(): solo lo que resta no puede dejar stock negativo.
+                if deltas[clave] < 0 and fila.stock < 0:
+                    raise StockInsuficiente(clave[0], clave[1], -deltas[clave])
+            actualizar_columna(StockPorUbicacion, "stock", {filas[c].pk: filas[c].stock for c in claves})
+            cache_empresa.invalidar_mps({mp for _, mp in claves})
+        return cls.objects.bulk_create(movimientos, batch_size=2000)
+
+    def delete(self, *args, **kwargs):
+        # Borrar es aplicar el delta contrario, con la misma guarda que save():
+        # borrar un INGRESO ya consumido levanta StockInsuficiente.
+        with atomico():
+            delta = -(self.cantidad_signed or Decimal("0"))
+            if modo_stock_atomico():
+                if delta:
+                    StockPorUbicacion.aplicar_delta(self.ubicacion_id, self.mp_id, delta)
+                return super().delete(*args, **kwargs)
+
+            stock_item, created = StockPorUbicacion.objects.select_for_update().get_or_create(
+                ubicacion_id=self.ubicacion_id,
+                mp_id=self.mp_id,
+                defaults={'stock': Decimal("0")}
+            )
+            if delta < 0 and (stock_item.stock or Decimal("0")) + delta < 0:
+                raise StockInsuficiente(self.ubicacion_id, self.mp_id, -delta)
+            stock_item.stock = (stock_item.stock or Decimal("0")) + delta
+            stock_item.save(update_fields=["stock"])
+            return super().delete(*args, **kwargs)
+
+# =========================
+#  Saldos diarios (snapshots del kardex)
+# =========================
+class SaldoDiarioMP(models.Model):
+    """
+    Saldo de una MP en una ubicación al CIERRE de 'fecha' (día local).
+    Solo se escribe para los días con movimientos: el saldo de cualquier
+    fecha es la última foto <= esa fecha (ver inventario/saldos.py).
+    """
+    mp = models.ForeignKey(MateriaPrima, on_delete=models.CASCADE, related_name="saldos_diarios")
+    ubicacion = models.ForeignKey(Ubicacion, on_delete=models.CASCADE, related_name="saldos_diarios")
+    fecha = models.DateField()
+    stock = models.DecimalField(max_digits=14, decimal_places=3)
+
+    class Meta:
+        unique_together = ("mp", "ubicacion", "fecha")
+        ordering = ["-fecha"]
+
+    def __str__(self): return f"{self.fecha} · {self.ubicacion} · {self.mp}: {fmt1(self.stock)}"
 
 # =========================
 #  Productos (Sin cambios)
@@ -304,18 +485,7 @@ class Producto(models.Model):
         ordering = ["nombre"]
         unique_together = ("suscripcion", "nombre")
     def __str__(self): return self.nombre
-    # (helpers de formato sin cambios)
-    def _fmt_decimal_short(self, x: Decimal, max_dec: int = 1) -> str:
-        d = Decimal(x or 0); q = d.quantize(Decimal(10) ** -max_dec, rounding=ROUND_HALF_UP); return f"{int(q)}" if q == q.to_integral() else f"{q.normalize():f}"
-    def format_qty(self, qty: Decimal) -> str:
-        u = (self.unidad.nombre or "").lower(); d = Decimal(qty or 0)
-        if u == "kg":
-            if d >= 1: return f"{self._fmt_decimal_short(d)} kg"
-            g = (d * Decimal("1000")).quantize(Decimal("1"), rounding=ROUND_HALF_UP); return f"{int(g)} g"
-        if u in ("l", "lt", "litro", "litros"):
-            if d >= 1: return f"{self._fmt_decimal_short(d)} l"
-            ml = (d * Decimal("1000")).quantize(Decimal("1"), rounding=ROUND_HALF_UP); return f"{int(ml)} ml"
-        return f"{self._fmt_decimal_short(d)} {self.unidad.nombre}"
+    def format_qty(self, qty: Decimal) -> str: return formatear(qty, self.unidad_id)
 
 # =========================
 #  Recetas (Sin cambios)
@@ -328,22 +498,37 @@ class Receta(models.Model):
     descripcion = models.TextField(blank=True)
     creada_en = models.DateTimeField(auto_now_add=True, null=True, blank=True)
     activo = models.BooleanField(default=True)
+    # Caché del costo por unidad producida (ver inventario/costos.py).
+    costo_unitario = models.DecimalField(max_digits=14, decimal_places=4, default=0)
+    costo_actualizado_en = models.DateTimeField(null=True, blank=True)
     class Meta:
         unique_together = ("producto", "nombre", "version")
         ordering = ["producto__nombre", "-version"] 
     def __str__(self): return f"{self.producto.nombre} - {self.nombre} v{self.version}"
 
 class RecetaLinea(models.Model):
+    """Una MP o un producto intermedio con receta propia (ver inventario/bom.py)."""
     receta = models.ForeignKey(Receta, on_delete=models.CASCADE, related_name="lineas")
-    mp = models.ForeignKey(MateriaPrima, on_delete=models.PROTECT) 
+    mp = models.ForeignKey(MateriaPrima, on_delete=models.PROTECT, null=True, blank=True) 
+    producto = models.ForeignKey(Producto, on_delete=models.PROTECT, null=True, blank=True,
+                                 related_name="usos_en_recetas")
     cantidad = models.DecimalField(max_digits=12, decimal_places=3) 
     class Meta:
         unique_together = ("receta", "mp")
-        ordering = ["mp__nombre"]
-    def __str__(self): return f"{self.receta} → {self.mp} x {fmt1(self.cantidad)}"
-    def por_lote_fmt(self) -> str: return self.mp.format_qty(self.cantidad)
+        ordering = ["mp__nombre", "producto__nombre"]
+        constraints = [
+            models.UniqueConstraint(fields=["receta", "producto"], name="recetalinea_receta_producto_uniq"),
+            models.CheckConstraint(
+                condition=(Q(mp__isnull=False, producto__isnull=True) | Q(mp__isnull=True, producto__isnull=False)),
+                name="recetalinea_mp_o_producto",
+            ),
+        ]
+    def __str__(self): return f"{self.receta} → {self.ingrediente} x {fmt1(self.cantidad)}"
+    @property
+    def ingrediente(self): return self.mp if self.mp_id else self.producto
+    def por_lote_fmt(self) -> str: return self.ingrediente.format_qty(self.cantidad)
     def total_para(self, lotes) -> Decimal: return Decimal(self.cantidad) * Decimal(lotes)
-    def total_para_fmt(self, lotes) -> str: return self.mp.format_qty(self.total_para(lotes))
+    def total_para_fmt(self, lotes) -> str: return self.ingrediente.format_qty(self.total_para(lotes))
 
 # =========================
 #  Producción / Lotes (Modificado)
@@ -364,86 +549,118 @@ class OrdenProduccion(models.Model):
         related_name="ordenes_produccion",
         null=True # Permitir null temporalmente
     )
+    # Receta explotada a MP al crear la OP (ver bom.snapshot): editar la
+    # receta después no cambia lo que la OP muestra, valida ni consume.
+    receta_snapshot = models.JSONField(default=dict, blank=True, editable=False)
 
     class Meta: ordering = ["-fecha"]
     def __str__(self): return f"OP #{self.id or '—'} · {self.producto} · {fmt1(self.lotes)} lote(s)"
+
+    def save(self, *args, **kwargs):
+        # Foto de la receta al crear la OP (o si a un borrador se le cambia la receta).
+        if self.receta_id and (self.receta_snapshot or {}).get("receta") != self.receta_id:
+            from . import bom
+            self.receta_snapshot = bom.snapshot(self.receta)
+            if kwargs.get("update_fields") is not None:
+                kwargs["update_fields"] = {*kwargs["update_fields"], "receta_snapshot"}
+        super().save(*args, **kwargs)
+
+    def _snapshot(self):
+        """receta_snapshot; si la OP no lo tiene todavía, la receta explotada en vivo (sin guardar)."""
+        if not self.receta_snapshot:
+            from . import bom
+            self.receta_snapshot = bom.snapshot(self.receta)
+        return self.receta_snapshot
     
-    # (Propiedades sin cambios)
+    # Todo sale de receta_snapshot: no consulta las tablas de recetas.
     @property
-    def unidades_totales(self): return (self.receta.rendimiento_por_lote or Decimal("0")) * (self.lotes or Decimal("0"))
+    def unidades_totales(self): return Decimal(self._snapshot()["rendimiento"]) * (self.lotes or Decimal("0"))
     @property
     def unidades_totales_fmt(self) -> str: return self.producto.format_qty(self.unidades_totales)
     @property
     def detalle_consumo(self):
-        rows = [];
-        for ln in self.receta.lineas.select_related("mp"):
-            total = Decimal(ln.cantidad) * Decimal(self.lotes or 0)
-            rows.append({"mp": ln.mp, "por_lote": ln.por_lote_fmt(), "total_fmt": ln.mp.format_qty(total)})
-        return rows
+        """MP por lote y total de la OP, según la receta al momento de crearla."""
+        lotes = self.lotes or Decimal("0")
+        return [
+            {"mp": nombre, "por_lote": formatear(Decimal(q), unidad_id), "total_fmt": formatear(Decimal(q) * lotes, unidad_id)}
+            for _, nombre, unidad_id, q in self._snapshot()["mp"]
+        ]
     
+    def requerimientos_mp(self):
+        """{mp_id: cantidad total} que consume la OP (receta explotada a MP × lotes)."""
+        from .bom import total
+        return {mp_id: total(q, self.lotes) for mp_id, _, _, q in self._snapshot()["mp"]}
+
     def validar_stock(self):
+        """Disponible = stock − reservas de otros borradores (ver inventario/reservas.py)."""
+        from .reservas import disponible_mp
         if not self.sucursal:
             raise ValidationError("La Orden de Producción no tiene una sucursal asignada.")
 
-        faltantes = []
-        for ln in self.receta.lineas.select_related("mp"):
-            requerido = Decimal(ln.cantidad) * Decimal(self.lotes)
-            
-            stock_disponible = StockPorUbicacion.objects.filter(
-                mp=ln.mp, 
-                ubicacion__sucursal=self.sucursal
-            ).aggregate(total=Sum('stock'))['total'] or Decimal("0")
-            
-            if stock_disponible < requerido:
-                faltantes.append(f"{ln.mp.nombre}: req {fmt1(requerido)} / disp {fmt1(stock_disponible)}")
+        requerido = self.requerimientos_mp()
+        disponible = disponible_mp(self.sucursal_id, requerido, excluir_op=self.pk)
+        nombres = {mp_id: nombre for mp_id, nombre, _, _ in self._snapshot()["mp"]}
+        faltantes = [f"{nombres[mp_id]}: req {fmt1(req)} / disp {fmt1(disponible[mp_id])}"
+                     for mp_id, req in requerido.items() if disponible[mp_id] < req]
         
         if faltantes: raise ValidationError("Stock insuficiente en esta sucursal → " + "; ".join(faltantes))
+
+    def reservar(self):
+        """Aparta la MP de este borrador por RESERVAS_TTL_MINUTOS. ValidationError si no alcanza."""
+        from .reservas import reservar_op
+        return reservar_op(self)
     
     def consumir_mp(self, user=None):
-        for ln in self.receta.lineas.select_related("mp"):
-            pendiente = Decimal(ln.cantidad) * Decimal(self.lotes)
-            
-            stock_items = StockPorUbicacion.objects.filter(
-                mp=ln.mp,
-                ubicacion__sucursal=self.sucursal,
-                stock__gt=0
-            ).order_by('ubicacion__nombre') 
-
-            for item in stock_items:
-                if pendiente <= 0: break
-                
-                tomar = min(pendiente, item.stock)
-                
-                if tomar > 0:
-                    MovimientoMP.objects.create(
-                        mp=ln.mp, 
-                        ubicacion=item.ubicacion, 
-                        tipo=MovimientoMP.CONSUMO, # <--- Usa el campo 'tipo'
-                        cantidad=tomar, 
-                        nota=f"OP {self.pk} · {self.producto}", 
-                        created_by=user
-                    )
-                    pendiente -= tomar
-            
-            if pendiente > 0:
-                raise ValidationError(f"Error de consistencia al consumir {ln.mp.nombre}")
+        """
+        Convierte las reservas de la OP en CONSUMOs (si no tiene reservas
+        vigentes, reserva en el momento). Devuelve los MovimientoMP creados.
+        """
+        from .reservas import para_consumir_op, reservar_op
+        reservas = para_consumir_op(self)
+        try:
+            with atomico():
+                movs = self._consumir_reservas(reservas, user)
+        except StockInsuficiente:
+            # Una merma/ajuste dejó alguna ubicación bajo lo reservado:
+            # se reasigna con lock y se consume lo nuevo.
+            movs = self._consumir_reservas(reservar_op(self), user)
+        StockReserva.objects.filter(op=self).delete()
+        return movs
+
+    def _consumir_reservas(self, reservas, user):
+        mps = MateriaPrima.objects.in_bulk({r.mp_id for r in reservas})
+        return [
+            MovimientoMP.objects.create(
+                mp=mps[r.mp_id],
+                ubicacion_id=r.ubicacion_id,
+                tipo=MovimientoMP.CONSUMO,
+                cantidad=r.cantidad,
+                op=self,
+                nota=f"OP {self.pk} · {self.producto}",
+                created_by=user,
+            )
+            for r in reservas
+        ]
     
     def ejecutar(self, user=None):
         if self.estado == self.CONSUMIDA: return 
-        self.validar_stock() 
+        if not self.sucursal:
+            raise ValidationError("La Orden de Producción no tiene una sucursal asignada.")
         
         ubicacion_destino = Ubicacion.objects.filter(sucursal=self.sucursal).first()
         if not ubicacion_destino:
             raise ValidationError(f"La sucursal {self.sucursal} no tiene ubicaciones para recibir el producto.")
 
-        with transaction.atomic():
-            self.consumir_mp(user=user); self.estado = self.CONSUMIDA; self.save(update_fields=["estado"])
+        with atomico():
+            movs = self.consumir_mp(user=user); self.estado = self.CONSUMIDA; self.save(update_fields=["estado"])
             
             unidades = self.unidades_totales; fecha_prod = self.fecha
+            costo_mp = sum((m.cantidad * m.mp.costo_promedio for m in movs), Decimal("0"))
+            costo_unitario = (costo_mp / unidades).quantize(Decimal("0.0001")) if unidades else None
             venc = (fecha_prod + timedelta(days=self.producto.vida_util_dias)).date()
             codigo = LoteProducto.generar_codigo(self.producto, fecha_prod)
             
-            LoteProducto.objects.create(
+            lote = LoteProducto.objects.create(
                 producto=self.producto, 
                 codigo=codigo, 
                 op=self, 
@@ -451,9 +668,11 @@ class OrdenProduccion(models.Model):
                 fecha_vencimiento=venc, 
                 cantidad_inicial=unidades, 
                 cantidad_disponible=unidades, 
+                costo_unitario=costo_unitario,
                 created_by=user,
                 ubicacion=ubicacion_destino
             )
+            TrazaEnlace.objects.bulk_create([TrazaEnlace.desde_consumo(m, lote) for m in movs])
 
 class LoteProducto(models.Model):
     OK = "OK"; POR_RALLAR = "RALLAR"; VENCIDO = "VENCIDO"
@@ -475,10 +694,18 @@ class LoteProducto(models.Model):
     cantidad_inicial = models.DecimalField(max_digits=12, decimal_places=3)
     cantidad_disponible = models.DecimalField(max_digits=12, decimal_places=3)
     estado = models.CharField(max_length=10, choices=ESTADOS, default=OK)
+    # Costo real por unidad: MP consumida por la OP (a costo promedio) / unidades producidas.
+    costo_unitario = models.DecimalField(max_digits=14, decimal_places=4, null=True, blank=True)
     created_by = models.ForeignKey(settings.AUTH_USER_MODEL, null=True, blank=True, on_delete=models.SET_NULL)
     created_at = models.DateTimeField(auto_now_add=True)
     
-    class Meta: ordering = ["fecha_vencimiento", "-cantidad_disponible"]
+    class Meta:
+        ordering = ["fecha_vencimiento", "-cantidad_disponible"]
+        indexes = [
+            # Orden del listado (keyset). Las búsquedas por código / nombre
+            # usan índices por expresión que crea la migración 0009 según el motor.
+            models.Index(fields=["fecha_vencimiento", "created_at", "id"], name="lote_venc_orden_idx"),
+        ]
     def __str__(self): return f"{self.codigo} · {self.producto} @ {self.ubicacion}"
     
     # (Propiedades sin cambios)
@@ -489,7 +716,9 @@ class LoteProducto(models.Model):
     @staticmethod
     def generar_codigo(producto, fecha_dt):
         base = f"{producto.id}-{fecha_dt.strftime('%Y%m%d')}"
-        n = LoteProducto.objects.filter(producto__suscripcion=producto.suscripcion, producto=producto, fecha_produccion__date=fecha_dt.date()).count() + 1
+        # Se cuenta por el mismo prefijo del código (no por fecha local): si no,
+        # cerca de medianoche la fecha del código y la del conteo no coinciden.
+        n = LoteProducto.objects.filter(producto=producto, codigo__startswith=f"{base}-").count() + 1
         return f"{base}-{n:03d}" 
     @property
     def dias_restantes(self): return (self.fecha_vencimiento - timezone.localdate()).days
@@ -498,6 +727,17 @@ class LoteProducto(models.Model):
         if d < 0: return self.VENCIDO
         elif d <= 1: return self.POR_RALLAR
         return self.OK
+    @property
+    def estado_actual(self):
+        """Estado a hoy ('estado' se guarda en save() y envejece con los días)."""
+        return self._calcular_estado()
+    @classmethod
+    def q_estado(cls, estado, hoy=None):
+        """Mismo criterio que _calcular_estado, como filtro por fecha_vencimiento."""
+        hoy = hoy or timezone.localdate()
+        if estado == cls.VENCIDO: return Q(fecha_vencimiento__lt=hoy)
+        if estado == cls.POR_RALLAR: return Q(fecha_vencimiento__gte=hoy, fecha_vencimiento__lte=hoy + timedelta(days=1))
+        return Q(fecha_vencimiento__gt=hoy + timedelta(days=1))
     def save(self, *args, **kwargs):
         self.estado = self._calcular_estado()
         super().save(*args, **kwargs)
@@ -520,57 +760,80 @@ class Venta(models.Model):
     estado = models.CharField(max_length=12, choices=ESTADOS, default=BORRADOR)
     nota = models.CharField(max_length=200, blank=True)
     created_by = models.ForeignKey(settings.AUTH_USER_MODEL, null=True, blank=True, on_delete=models.SET_NULL)
+    # Ticket del POS externo (cierre del día importado, ver inventario/cierre_pos.py):
+    # el mismo ticket no entra dos veces en la sucursal. NULL en las ventas cargadas acá.
+    ticket_pos = models.CharField(max_length=40, null=True, blank=True)
     
-    class Meta: ordering = ["-fecha"]
+    class Meta:
+        ordering = ["-fecha"]
+        constraints = [models.UniqueConstraint(fields=["sucursal", "ticket_pos"], name="venta_ticket_pos_uniq")]
     def __str__(self): return f"Venta #{self.id or '—'} ({self.sucursal.nombre})"
+
+    @property
+    def costo_total(self) -> Decimal:
+        """
+        Costo de lo vendido (COGS). Usa consumos.all() para aprovechar
+        prefetch_related('consumos__lote'); si la venta ya se archivó, suma
+        los consumos del archivo (ver archivo.consumos_de_venta).
+        """
+        from .archivo import consumos_de_venta
+        return sum((c.costo for c in consumos_de_venta(self)), Decimal("0"))
     
     def validar_stock(self):
+        """Disponible = lotes − reservas de otros borradores (ver inventario/reservas.py)."""
+        from .reservas import disponible_lotes
         if not self.sucursal:
             raise ValidationError("La Venta no tiene una sucursal asignada.")
-        if self.lineas.count() == 0: raise ValidationError("La venta no tiene líneas.")
+        lineas = list(self.lineas.select_related("producto"))
+        if not lineas: raise ValidationError("La venta no tiene líneas.")
         
+        disponible = disponible_lotes(self.sucursal_id, {ln.producto_id for ln in lineas}, excluir_venta=self.pk)
         faltantes = []
-        for ln in self.lineas.select_related("producto"):
-            qs = LoteProducto.objects.filter(
-                producto=ln.producto, 
-                ubicacion__sucursal=self.sucursal, 
-                estado__in=[LoteProducto.OK, LoteProducto.POR_RALLAR], 
-                cantidad_disponible__gt=0
-            ).order_by("fecha_vencimiento", "created_at")
-            
-            disp = sum((l.cantidad_disponible or Decimal("0")) for l in qs)
-            if disp < ln.cantidad:
-                faltantes.append(f"{ln.producto}: req {fmt1(ln.cantidad)} / disp {fmt1(disp)}")
+        for ln in lineas:
+            if disponible[ln.producto_id] < ln.cantidad:
+                faltantes.append(f"{ln.producto}: req {fmt1(ln.cantidad)} / disp {fmt1(disponible[ln.producto_id])}")
+            disponible[ln.producto_id] -= ln.cantidad
         
         if faltantes: raise ValidationError(f"Stock insuficiente en {self.sucursal.nombre} → " + "; ".join(faltantes))
+
+    def reservar(self):
+        """Aparta los lotes (FEFO) de este borrador por RESERVAS_TTL_MINUTOS. ValidationError si no alcanza."""
+        from .reservas import reservar_venta
+        return reservar_venta(self)
     
-    @transaction.atomic 
+    @atomico 
     def consumir_fifo(self, user=None):
+        """Convierte las reservas de lotes en VentaConsumo (reservando en el momento si no tiene)."""
+        from .reservas import para_consumir_venta, reservar_venta
         if self.estado == self.CONFIRMADA: return 
-        self.validar_stock() 
         
-        for ln in self.lineas.select_related("producto"):
-            pendiente = Decimal(ln.cantidad) 
-            
-            lotes = LoteProducto.objects.select_for_update().filter(
-                producto=ln.producto, 
-                ubicacion__sucursal=self.sucursal, 
-                estado__in=[LoteProducto.OK, LoteProducto.POR_RALLAR], 
-                cantidad_disponible__gt=0
-            ).order_by("fecha_vencimiento", "created_at")
-            
-            for lote in lotes:
-                if pendiente <= 0: break 
-                tomar = min(pendiente, lote.cantidad_disponible)
-                if tomar > 0:
-                    lote.cantidad_disponible = (lote.cantidad_disponible or Decimal("0")) - tomar; lote.save()
-                    VentaConsumo.objects.create(venta=self, linea=ln, lote=lote, cantidad=tomar, created_by=user)
-                    pendiente -= tomar
-            
-            if pendiente > 0: raise ValidationError(f"Stock insuficiente durante consumo: {ln.producto}")
+        reservas = para_consumir_venta(self)
+        consumos = self._consumir_reservas(reservas, user)
+        if consumos is None:
+            # Algún lote ya no tiene lo reservado (vencido, ajustado): se reasigna con lock.
+            consumos = self._consumir_reservas(reservar_venta(self), user)
         
+        VentaConsumo.objects.bulk_create(consumos)
+        StockReserva.objects.filter(venta=self).delete()
+        TrazaEnlace.objects.bulk_create(TrazaEnlace.desde_ventas(consumos, self))
         self.estado = self.CONFIRMADA; self.save(update_fields=["estado"])
 
+    def _consumir_reservas(self, reservas, user):
+        """Descuenta los lotes reservados (con lock, orden por pk). None si alguno ya no alcanza."""
+        lotes = LoteProducto.objects.select_for_update().order_by("pk").in_bulk({r.lote_id for r in reservas})
+        vendibles = (LoteProducto.OK, LoteProducto.POR_RALLAR)
+        if any(r.lote_id not in lotes or lotes[r.lote_id].estado not in vendibles for r in reservas):
+            return None
+        tomado = {}
+        for r in reservas:
+            tomado[r.lote_id] = tomado.get(r.lote_id, Decimal("0")) + r.cantidad
+        if any(lotes[pk].cantidad_disponible < cant for pk, cant in tomado.items()):
+            return None
+        for pk, cant in sorted(tomado.items()):
+            lote = lotes[pk]; lote.cantidad_disponible -= cant; lote.save()
+        return [VentaConsumo(venta=self, linea_id=r.linea_id, lote=lotes[r.lote_id], cantidad=r.cantidad, created_by=user)
+                for r in reservas]
+
 # (VentaLinea y VentaConsumo sin cambios estructurales)
 class VentaLinea(models.Model):
     venta = models.ForeignKey(Venta, on_delete=models.CASCADE, related_name="lineas")
@@ -591,6 +854,324 @@ class VentaConsumo(models.Model):
     def __str__(self): return f"{self.venta_id} · {self.lote.codigo} · {fmt1(self.cantidad)}"
     @property
     def cantidad_fmt(self) -> str: return self.lote.producto.format_qty(self.cantidad)
+    @property
+    def costo(self) -> Decimal: return self.cantidad * (self.lote.costo_unitario or Decimal("0"))
+
+# =========================
+#  Trazabilidad
+# =========================
+class TrazaEnlace(models.Model):
+    """
+    Aristas del grafo de trazabilidad (ver inventario/trazabilidad.py):
+
+      MP_LOTE:    CONSUMO de MP (movimiento) → LoteProducto que produjo la OP
+      LOTE_VENTA: LoteProducto → Venta que lo despachó (suma de sus VentaConsumo)
+
+    Se escriben al ejecutar la OP / confirmar la venta. 'mp', 'cantidad' y
+    'fecha' van copiados para no tener que recorrer el kardex al trazar.
+    """
+    MP_LOTE = "MP_LOTE"; LOTE_VENTA = "LOTE_VENTA"
+    TIPOS = [(MP_LOTE, "MP → Lote"), (LOTE_VENTA, "Lote → Venta")]
+
+    suscripcion = models.ForeignKey(SuscripcionCliente, on_delete=models.CASCADE, related_name="trazas")
+    tipo = models.CharField(max_length=10, choices=TIPOS)
+    mp = models.ForeignKey(MateriaPrima, null=True, blank=True, on_delete=models.PROTECT, related_name="trazas")
+    # Sin FK en la base: al archivar el kardex el id queda apuntando a la
+    # fila de MovimientoMPArchivo (mismo id). Un delete() normal lo pone en NULL.
+    movimiento = models.ForeignKey(MovimientoMP, null=True, blank=True, on_delete=models.SET_NULL, related_name="trazas",
+                                   db_constraint=False)
+    lote = models.ForeignKey(LoteProducto, on_delete=models.CASCADE, related_name="trazas")
+    venta = models.ForeignKey(Venta, null=True, blank=True, on_delete=models.CASCADE, related_name="trazas")
+    cantidad = models.DecimalField(max_digits=12, decimal_places=3)
+    fecha = models.DateTimeField()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["mp", "fecha"], name="traza_mp_fecha_idx"),
+            models.Index(fields=["lote", "tipo"], name="traza_lote_tipo_idx"),
+        ]
+
+    def __str__(self):
+        destino = f"Venta #{self.venta_id}" if self.venta_id else f"Lote {self.lote_id}"
+        return f"{self.get_tipo_display()} · {destino} · {fmt1(self.cantidad)}"
+
+    @classmethod
+    def desde_consumo(cls, mov, lote):
+        return cls(suscripcion_id=mov.mp.suscripcion_id, tipo=cls.MP_LOTE, mp_id=mov.mp_id,
+                   movimiento=mov, lote=lote, cantidad=mov.cantidad, fecha=mov.fecha)
+
+    @classmethod
+    def desde_ventas(cls, consumos, venta):
+        """Una arista por (lote, venta), sumando las líneas que tomaron del mismo lote."""
+        por_lote = {}
+        for c in consumos:
+            por_lote[c.lote_id] = por_lote.get(c.lote_id, Decimal("0")) + c.cantidad
+        return [cls(suscripcion_id=venta.suscripcion_id, tipo=cls.LOTE_VENTA, lote_id=lote_id,
+                    venta=venta, cantidad=cant, fecha=venta.fecha)
+                for lote_id, cant in por_lote.items()]
+
+# =========================
+#  Reservas de stock (borradores)
+# =========================
+class StockReserva(models.Model):
+    """
+    Cantidad apartada por un borrador (OP o Venta) hasta que se confirme o
+    venza 'expira'. Las OPs reservan MP por ubicación; las ventas reservan
+    lotes. Disponible = stock − reservas vigentes (ver inventario/reservas.py).
+    """
+    suscripcion = models.ForeignKey(SuscripcionCliente, on_delete=models.CASCADE, related_name="reservas")
+    mp = models.ForeignKey(MateriaPrima, null=True, blank=True, on_delete=models.CASCADE, related_name="reservas")
+    lote = models.ForeignKey(LoteProducto, null=True, blank=True, on_delete=models.CASCADE, related_name="reservas")
+    ubicacion = models.ForeignKey(Ubicacion, on_delete=models.CASCADE, related_name="reservas")
+    cantidad = models.DecimalField(max_digits=12, decimal_places=3)
+    op = models.ForeignKey(OrdenProduccion, null=True, blank=True, on_delete=models.CASCADE, related_name="reservas")
+    venta = models.ForeignKey(Venta, null=True, blank=True, on_delete=models.CASCADE, related_name="reservas")
+    linea = models.ForeignKey(VentaLinea, null=True, blank=True, on_delete=models.CASCADE, related_name="reservas")
+    expira = models.DateTimeField()
+    creado = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            # Disponible de una MP / un lote: Σ reservas vigentes (expira > ahora).
+            models.Index(fields=["mp", "ubicacion", "expira"], name="reserva_mp_ubic_exp_idx"),
+            models.Index(fields=["lote", "expira"], name="reserva_lote_exp_idx"),
+            models.Index(fields=["expira"], name="reserva_expira_idx"),
+        ]
+        constraints = [
+            models.CheckConstraint(
+                condition=(Q(mp__isnull=False, lote__isnull=True, op__isnull=False, venta__isnull=True)
+                       | Q(mp__isnull=True, lote__isnull=False, op__isnull=True, venta__isnull=False)),
+                name="reserva_mp_op_o_lote_venta",
+            ),
+        ]
+
+    def __str__(self):
+        origen = f"OP #{self.op_id}" if self.op_id else f"Venta #{self.venta_id}"
+        item = self.mp or self.lote
+        return f"{origen} · {item} @ {self.ubicacion}: {fmt1(self.cantidad)}"
+
+# =========================
+#  Traslados entre ubicaciones / sucursales
+# =========================
+class Traslado(models.Model):
+    """
+    Documento que mueve stock de una ubicación a otra (de la misma o de
+    otra sucursal). Sus líneas son MP (cantidad) o lotes de producto
+    (el lote completo cambia de ubicación). Mientras es BORRADOR no toca
+    nada; confirmar() lo aplica entero o no aplica nada.
+    """
+    BORRADOR = "BORRADOR"; CONFIRMADO = "CONFIRMADO"
+    ESTADOS = [(BORRADOR, "Borrador"), (CONFIRMADO, "Confirmado")]
+
+    suscripcion = models.ForeignKey(SuscripcionCliente, on_delete=models.CASCADE, related_name="traslados")
+    origen = models.ForeignKey(Ubicacion, on_delete=models.PROTECT, related_name="traslados_salida")
+    destino = models.ForeignKey(Ubicacion, on_delete=models.PROTECT, related_name="traslados_entrada")
+    estado = models.CharField(max_length=12, choices=ESTADOS, default=BORRADOR)
+    fecha = models.DateTimeField(default=timezone.now)
+    nota = models.CharField(max_length=200, blank=True)
+    created_by = models.ForeignKey(settings.AUTH_USER_MODEL, null=True, blank=True, on_delete=models.SET_NULL)
+
+    class Meta: ordering = ["-fecha"]
+    def __str__(self): return f"Traslado #{self.id or '—'} ({self.origen} → {self.destino})"
+
+    def clean(self):
+        if self.origen_id and self.origen_id == self.destino_id:
+            raise ValidationError("El origen y el destino deben ser distintos.")
+        if self.origen_id and self.destino_id and self.suscripcion_id and {
+            self.origen.sucursal.suscripcion_id, self.destino.sucursal.suscripcion_id
+        } != {self.suscripcion_id}:
+            raise ValidationError("El origen y el destino deben ser ubicaciones de la empresa.")
+
+    @atomico
+    def confirmar(self, user=None):
+        """
+        Aplica el traslado: un par TRASLADO_SAL / TRASLADO_ENT por línea de
+        MP (MovimientoMP.registrar_bulk, con lock ordenado de origen y
+        destino) y un UPDATE de ubicación para los lotes. Respeta las
+        reservas vigentes de OPs y ventas sobre lo que sale del origen.
+        """
+        from .reservas import filas_mp, vigentes
+        t = Traslado.objects.select_for_update().get(pk=self.pk)
+        if t.estado == self.CONFIRMADO: return
+        self.clean()
+        lineas = list(self.lineas.select_related("mp", "lote__producto"))
+        if not lineas: raise ValidationError("El traslado no tiene líneas.")
+        lineas_mp = [ln for ln in lineas if ln.mp_id]
+        lineas_lote = [ln for ln in lineas if ln.lote_id]
+        ahora = timezone.now()
+
+        if lineas_mp:
+            # Lo reservado por OPs en el origen no se puede llevar.
+            libre = {f.mp_id: f.stock - f.reservado
+                     for f in filas_mp(self.origen.sucursal_id, {ln.mp_id for ln in lineas_mp})
+                     if f.ubicacion_id == self.origen_id}
+            pedido = {}
+            for ln in lineas_mp:
+                pedido[ln.mp_id] = pedido.get(ln.mp_id, Decimal("0")) + ln.cantidad
+            faltantes = [f"{ln.mp.nombre}: req {fmt1(pedido[ln.mp_id])} / disp {fmt1(libre.get(ln.mp_id, 0))}"
+                         for ln in lineas_mp if pedido[ln.mp_id] > libre.get(ln.mp_id, Decimal("0"))]
+            if faltantes:
+                raise ValidationError(f"Stock insuficiente en {self.origen} → " + "; ".join(dict.fromkeys(faltantes)))
+            nota = f"Traslado #{self.pk}"
+            MovimientoMP.registrar_bulk([
+                MovimientoMP(mp_id=ln.mp_id, ubicacion_id=u, tipo=tipo, cantidad=ln.cantidad, fecha=ahora,
+                             nota=nota, traslado=self, created_by=user)
+                for ln in lineas_mp
+                for u, tipo in ((self.origen_id, MovimientoMP.TRASLADO_SAL), (self.destino_id, MovimientoMP.TRASLADO_ENT))
+            ])
+
+        if lineas_lote:
+            ids = [ln.lote_id for ln in lineas_lote]
+            lotes = LoteProducto.objects.select_for_update().order_by("pk").in_bulk(ids)
+            errores = [f"{lotes[pk].codigo} no está en {self.origen}" for pk in ids if lotes[pk].ubicacion_id != self.origen_id]
+            reservados = set(vigentes().filter(lote_id__in=ids).values_list("lote__codigo", flat=True))
+            errores += [f"{codigo} está reservado por una venta en borrador" for codigo in sorted(reservados)]
+            if errores: raise ValidationError("No se pueden trasladar los lotes → " + "; ".join(errores))
+            LoteProducto.objects.filter(pk__in=ids).update(ubicacion_id=self.destino_id)
+            # La línea guarda cuánto se movió (el lote va completo).
+            for ln in lineas_lote:
+                ln.cantidad = lotes[ln.lote_id].cantidad_disponible
+            TrasladoLinea.objects.bulk_update(lineas_lote, ["cantidad"])
+
+        self.estado = self.CONFIRMADO; self.fecha = ahora
+        self.save(update_fields=["estado", "fecha"])
+
+
+class TrasladoLinea(models.Model):
+    traslado = models.ForeignKey(Traslado, on_delete=models.CASCADE, related_name="lineas")
+    mp = models.ForeignKey(MateriaPrima, null=True, blank=True, on_delete=models.PROTECT, related_name="lineas_traslado")
+    lote = models.ForeignKey(LoteProducto, null=True, blank=True, on_delete=models.PROTECT, related_name="lineas_traslado")
+    # MP: cantidad a mover. Lote: la disponible al confirmar (se mueve entero).
+    cantidad = models.DecimalField(max_digits=12, decimal_places=3, default=Decimal("0"))
+
+    class Meta:
+        constraints = [
+            models.CheckConstraint(
+                condition=Q(mp__isnull=False, lote__isnull=True) | Q(mp__isnull=True, lote__isnull=False),
+                name="traslado_linea_mp_o_lote",
+            ),
+        ]
+
+    def __str__(self): return f"{self.mp or self.lote} x {fmt1(self.cantidad)}"
+
+# =========================
+#  Conteos físicos (inventario cíclico)
+# =========================
+class ConteoFisico(models.Model):
+    """
+    Sesión de conteo de una sucursal: cantidades contadas por (ubicación, MP)
+    cargadas desde un archivo o desde los escáneres (ver inventario/conteos.py).
+    Al contabilizar, las diferencias contra StockPorUbicacion se registran
+    como AJUSTE_POS / AJUSTE_NEG en una sola escritura del kardex.
+    """
+    ABIERTO = "ABIERTO"; CONTABILIZADO = "CONTABILIZADO"
+    ESTADOS = [(ABIERTO, "Abierto"), (CONTABILIZADO, "Contabilizado")]
+
+    suscripcion = models.ForeignKey(SuscripcionCliente, on_delete=models.CASCADE, related_name="conteos")
+    sucursal = models.ForeignKey(Sucursal, on_delete=models.PROTECT, related_name="conteos")
+    estado = models.CharField(max_length=14, choices=ESTADOS, default=ABIERTO)
+    nota = models.CharField(max_length=200, blank=True)
+    created_by = models.ForeignKey(settings.AUTH_USER_MODEL, null=True, blank=True, on_delete=models.SET_NULL)
+    created_at = models.DateTimeField(auto_now_add=True)
+    contabilizado_en = models.DateTimeField(null=True, blank=True)
+
+    class Meta: ordering = ["-created_at"]
+    def __str__(self): return f"Conteo #{self.id or '—'} ({self.sucursal.nombre})"
+
+    def contabilizar(self, user=None):
+        """Registra los ajustes de las diferencias (ver conteos.contabilizar)."""
+        from .conteos import contabilizar
+        return contabilizar(self, user=user)
+
+
+class ConteoLinea(models.Model):
+    conteo = models.ForeignKey(ConteoFisico, on_delete=models.CASCADE, related_name="lineas")
+    ubicacion = models.ForeignKey(Ubicacion, on_delete=models.PROTECT, related_name="+")
+    mp = models.ForeignKey(MateriaPrima, on_delete=models.PROTECT, related_name="+")
+    contado = models.DecimalField(max_digits=12, decimal_places=3)
+    # Stock del sistema al contabilizar (antes de ajustar); NULL mientras está abierto.
+    sistema = models.DecimalField(max_digits=12, decimal_places=3, null=True, blank=True)
+
+    class Meta:
+        unique_together = ("conteo", "ubicacion", "mp")
+
+    def __str__(self): return f"{self.ubicacion} · {self.mp}: {fmt1(self.contado)}"
+
+# =========================
+#  Archivo del kardex (movimientos viejos)
+# =========================
+# Copias de MovimientoMP / VentaConsumo más viejos que el horizonte de
+# archivado (ver inventario/archivo.py), con el mismo id que tenían. Las
+# FKs no tienen restricción en la base (db_constraint=False): la fila de
+# origen ya no existe y lo referenciado puede borrarse después; sirven
+# para select_related en los reportes históricos.
+def _ref(modelo, **kwargs):
+    return models.ForeignKey(modelo, on_delete=models.DO_NOTHING, db_constraint=False, related_name="+", **kwargs)
+
+
+class MovimientoMPArchivo(models.Model):
+    id = models.BigIntegerField(primary_key=True)
+    mp = _ref(MateriaPrima)
+    tipo = models.CharField(max_length=12, choices=MovimientoMP.TIPOS)
+    ubicacion = _ref(Ubicacion)
+    cantidad = models.DecimalField(max_digits=12, decimal_places=3)
+    fecha = models.DateTimeField()
+    nota = models.CharField(max_length=250, blank=True)
+    created_by = _ref(settings.AUTH_USER_MODEL, null=True, blank=True)
+    costo_unitario = models.DecimalField(max_digits=14, decimal_places=4, null=True, blank=True)
+    op = _ref("OrdenProduccion", null=True, blank=True)
+    traslado = _ref("Traslado", null=True, blank=True)
+    conteo = _ref("ConteoFisico", null=True, blank=True)
+    archivado_en = models.DateTimeField(db_default=Now())
+
+    class Meta:
+        ordering = ["-fecha"]
+        indexes = [models.Index(fields=["mp", "ubicacion", "fecha"], name="movarch_mp_ubic_fecha_idx")]
+
+    def __str__(self): return f"{self.ubicacion} · {self.mp} · {self.tipo} · {fmt1(self.cantidad)} (archivo)"
+
+    @property
+    def cantidad_signed(self) -> Decimal:
+        return self.cantidad if self.tipo in MovimientoMP.TIPOS_POSITIVOS else -self.cantidad
+
+
+class VentaConsumoArchivo(models.Model):
+    id = models.BigIntegerField(primary_key=True)
+    venta = _ref(Venta)
+    linea = _ref(VentaLinea)
+    lote = _ref(LoteProducto)
+    cantidad = models.DecimalField(max_digits=12, decimal_places=3)
+    created_by = _ref(settings.AUTH_USER_MODEL, null=True, blank=True)
+    created_at = models.DateTimeField(null=True, blank=True)
+    archivado_en = models.DateTimeField(db_default=Now())
+
+    class Meta:
+        ordering = ["created_at"]
+        indexes = [models.Index(fields=["venta"], name="ventacons_arch_venta_idx")]
+
+    def __str__(self): return f"{self.venta_id} · {self.lote_id} · {fmt1(self.cantidad)} (archivo)"
+    @property
+    def cantidad_fmt(self) -> str: return self.lote.producto.format_qty(self.cantidad)
+    @property
+    def costo(self) -> Decimal: return self.cantidad * (self.lote.costo_unitario or Decimal("0"))
+
+
+class CorteArchivo(models.Model):
+    """Una corrida de archivar_movimientos: todo lo anterior a 'hasta' está en el archivo."""
+    suscripcion = models.ForeignKey(SuscripcionCliente, on_delete=models.CASCADE, related_name="cortes_archivo")
+    hasta = models.DateTimeField()
+    movimientos = models.PositiveIntegerField(default=0)
+    aperturas = models.PositiveIntegerField(default=0)
+    consumos = models.PositiveIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta: ordering = ["-hasta"]
+    def __str__(self): return f"{self.suscripcion} · hasta {self.hasta:%Y-%m-%d}"
+
+    @classmethod
+    def horizonte(cls, suscripcion):
+        """Hasta dónde está archivado el kardex de la suscripción (None si nunca se archivó)."""
+        return cls.objects.filter(suscripcion=suscripcion).aggregate(m=models.Max("hasta"))["m"]
 
 # =========================
 #  Históricos (Sin cambios)
@@ -601,4 +1182,25 @@ class HistoricoVenta(models.Model):
     producto = models.ForeignKey(Producto, on_delete=models.PROTECT)
     cantidad = models.DecimalField(max_digits=12, decimal_places=3)
     class Meta: ordering = ["fecha"]
-    def __str__(self): return f"{self.fecha} · {self.producto} · {self.cantidad}"
\ No newline at end of file
+    def __str__(self): return f"{self.fecha} · {self.producto} · {self.cantidad}"
+# =========================
+#  Idempotencia (reintentos de clientes)
+# =========================
+class RespuestaIdempotente(models.Model):
+    """
+    Respuesta guardada de un POST que trajo 'Idempotency-Key'.
+    Un reintento con la misma llave devuelve esta respuesta sin volver
+    a tocar el kardex (ver inventario/idempotencia.py).
+    """
+    # sha256(usuario/credencial + método + ruta + llave del cliente)
+    llave = models.CharField(max_length=64, unique=True)
+    body_hash = models.CharField(max_length=64)
+    # status_code NULL = la primera petición todavía se está procesando
+    status_code = models.PositiveSmallIntegerField(null=True, blank=True)
+    content_type = models.CharField(max_length=100, blank=True)
+    location = models.CharField(max_length=500, blank=True)
+    contenido = models.BinaryField(blank=True, default=b"")
+    creado = models.DateTimeField(auto_now_add=True)
+    expira = models.DateTimeField(db_index=True)
+
+    def __str__(self): return f"{self.llave[:12]}… · {self.status_code or 'en proceso'}"
@@ -0,0 +1,109 @@
+# inventario/paginacion.py
+# ============================================================
+#  PAGINACIÓN KEYSET PARA LAS VISTAS HTML
+# ============================================================
+# El Paginator de Django hace COUNT(*) + OFFSET: con cientos de miles de
+# filas cada página cuesta más que la anterior. Acá la página se pide
+# "después de" (o "antes de") la última fila vista, por los mismos campos
+# del ORDER BY, y un índice con esos campos la resuelve leyendo solo las
+# filas de la página.
+#
+# El cursor es la tupla de valores de esos campos en base64 (opaco para
+# la URL). El último campo del orden debe ser único (normalmente "id").
+# La API usa la CursorPagination de DRF (ver api.py), que hace lo mismo.
+import base64
+import json
+from dataclasses import dataclass
+
+from django.core.exceptions import ValidationError
+from django.db.models import Q
+
+DESPUES = "despues"
+ANTES = "antes"
+
+
+@dataclass
+class PaginaKeyset:
+    objetos: list
+    siguiente: str = None     # cursor para ?despues=
+    anterior: str = None      # cursor para ?antes=
+
+    @property
+    def hay_otras(self):
+        return bool(self.siguiente or self.anterior)
+
+
+def _campos(orden):
+    return [(c.lstrip("-"), c.startswith("-")) for c in orden]
+
+
+def _json(valor):
+    # isoformat completo: DjangoJSONEncoder recorta los microsegundos y el
+    # cursor dejaría de ser exacto sobre created_at.
+    return valor.isoformat() if hasattr(valor, "isoformat") else str(valor)
+
+
+def codificar(obj, orden):
+    valores = [getattr(obj, nombre) for nombre, _ in _campos(orden)]
+    return base64.urlsafe_b64encode(json.dumps(valores, default=_json).encode()).decode()
+
+
+def decodificar(cursor, modelo, orden):
+    """Valores del cursor ya convertidos al tipo de cada campo; None si es inválido."""
+    try:
+        valores = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        campos = _campos(orden)
+        if len(valores) != len(campos):
+            return None
+        return [modelo._meta.get_field(nombre).to_python(v) for (nombre, _), v in zip(campos, valores)]
+    except (ValueError, TypeError, ValidationError):
+        return None
+
+
+def _despues_de(orden, valores, hacia_atras=False):
+    """
+    (a, b, c) > (x, y, z) respetando el sentido de cada campo:
+    a > x  OR  (a = x AND b > y)  OR  (a = x AND b = y AND c > z).
+    """
+    campos = _campos(orden)
+    cond = Q()
+    for i, (nombre, desc) in enumerate(campos):
+        op = "lt" if desc != hacia_atras else "gt"
+        igual = {n: v for (n, _), v in zip(campos[:i], valores[:i])}
+        cond |= Q(**igual, **{f"{nombre}__{op}": valores[i]})
+    # Cota sobre el primer campo: no cambia el resultado, pero deja al
+    # motor usar el índice como rango en lugar de evaluar el OR fila a fila.
+    primero, desc = campos[0]
+    return cond & Q(**{f"{primero}__{'lte' if desc != hacia_atras else 'gte'}": valores[0]})
+
+
+def paginar(qs, orden, cursor=None, direccion=DESPUES, tamano=50):
+    """
+    Una página de 'qs' ordenado por 'orden' (lista de campos, '-' = desc).
+    Con cursor inválido o sin cursor devuelve la primera página.
+    """
+    valores = decodificar(cursor, qs.model, orden) if cursor else None
+    if valores is None:
+        direccion = DESPUES
+    atras = direccion == ANTES
+    invertido = [c[1:] if c.startswith("-") else f"-{c}" for c in orden]
+
+    if valores is not None:
+        qs = qs.filter(_despues_de(orden, valores, hacia_atras=atras))
+    filas = list(qs.order_by(*(invertido if atras else orden))[:tamano + 1])
+    hay_mas = len(filas) > tamano
+    filas = filas[:tamano]
+    if atras:
+        filas.reverse()
+
+    if not filas:
+        return PaginaKeyset([])
+    # Se sabe que hay más hacia donde se avanzó (se pidió una fila de más);
+    # hacia el otro lado, hay si se llegó desde un cursor.
+    hay_siguiente = hay_mas if not atras else True
+    hay_anterior = valores is not None if not atras else hay_mas
+    return PaginaKeyset(
+        filas,
+        siguiente=codificar(filas[-1], orden) if hay_siguiente else None,
+        anterior=codificar(filas[0], orden) if hay_anterior else None,
+    )
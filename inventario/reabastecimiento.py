@@ -0,0 +1,181 @@
+# inventario/reabastecimiento.py
+# ============================================================
+#  PUNTOS DE REORDEN CALCULADOS DESDE EL CONSUMO
+# ============================================================
+# Reemplaza el stock_minimo cargado a mano por un punto de reorden por
+# (MP, sucursal) calculado con el historial de CONSUMO del kardex:
+#
+#   1. UNA consulta GROUP BY (mp, ubicación, día) con el consumo de los
+#      últimos REPOSICION_VENTANA_DIAS días (todas las MPs juntas).
+#   2. pandas arma la matriz pares × días (los días sin consumo van en 0)
+#      y NumPy calcula, para todos los pares a la vez, las sumas móviles
+#      de L días (L = lead time de la sucursal): cada suma es "lo que se
+#      consumió durante una reposición". Con su media y su desvío:
+#
+#         stock de seguridad = z × desvío(sumas de L días)
+#         punto de reorden   = media(sumas de L días) + stock de seguridad
+#
+#      z sale del nivel de servicio (0.95 → 1.645). Usar la ventana móvil
+#      en lugar de d̄·L + z·σ·√L respeta los patrones semanales (la
+#      panadería consume más el fin de semana) sin suponer días
+#      independientes.
+#   3. El punto de reorden se reparte entre las ubicaciones de la
+#      sucursal según cuánto consumió cada una, así la suma por MP (lo
+#      que compara el panel) sigue siendo la de la sucursal. Se escribe
+#      con un executemany (actualizar_columna), solo en las filas que
+#      cambian.
+#
+# Los pares con menos de REPOSICION_MIN_DIAS_CONSUMO días con consumo en
+# la ventana (MPs nuevas o que casi no se usan) no se tocan: conservan el
+# mínimo que se haya cargado a mano. Correr todas las noches por cron:
+#
+#   python manage.py calcular_reposicion
+import datetime
+from decimal import Decimal
+from statistics import NormalDist
+
+import numpy as np
+import pandas as pd
+from django.conf import settings
+from django.db.models import Sum
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+from .models import MovimientoMP, StockPorUbicacion, actualizar_columna
+from .shards import atomico
+from . import cache_empresa
+
+COLUMNAS = ["mp", "sucursal", "lead_time", "dias_consumo", "demanda_diaria", "stock_seguridad", "punto_reorden"]
+
+
+def _config(nombre, defecto):
+    return getattr(settings, f"REPOSICION_{nombre}", defecto)
+
+
+def _lead_time(sucursal_id):
+    por_sucursal = _config("LEAD_TIME_SUCURSAL", {})
+    return int(por_sucursal.get(sucursal_id, _config("LEAD_TIME_DIAS", 2)))
+
+
+# ============================================================
+#  CONSUMO DIARIO
+# ============================================================
+def consumo_diario(suscripcion=None, hoy=None, dias=None):
+    """
+    DataFrame (mp, ubicacion, sucursal, dia, cantidad) con el consumo por
+    día de la ventana que termina ayer (hoy todavía está incompleto).
+    """
+    hoy = hoy or timezone.localdate()
+    dias = dias or _config("VENTANA_DIAS", 56)
+    desde = hoy - datetime.timedelta(days=dias)
+    # Rango sobre 'fecha' tal cual (no fecha__date) para usar el índice.
+    inicio, fin = (timezone.make_aware(datetime.datetime.combine(d, datetime.time.min)) for d in (desde, hoy))
+    qs = MovimientoMP.objects.filter(tipo=MovimientoMP.CONSUMO, fecha__gte=inicio, fecha__lt=fin)
+    if suscripcion is not None:
+        qs = qs.filter(mp__suscripcion=suscripcion)
+    filas = (qs.annotate(dia=TruncDate("fecha"))
+               .values_list("mp_id", "ubicacion_id", "ubicacion__sucursal_id", "dia")
+               .annotate(total=Sum("cantidad"))
+               .order_by())
+    df = pd.DataFrame.from_records(list(filas), columns=["mp", "ubicacion", "sucursal", "dia", "cantidad"])
+    df["cantidad"] = df["cantidad"].astype(float)
+    return df, pd.date_range(desde, hoy - datetime.timedelta(days=1)).date
+
+
+# ============================================================
+#  CÁLCULO
+# ============================================================
+def _sumas_moviles(matriz, l):
+    """Sumas de 'l' días consecutivos por fila (pares × (días − l + 1))."""
+    acumulado = np.cumsum(np.pad(matriz, ((0, 0), (1, 0))), axis=1)
+    return acumulado[:, l:] - acumulado[:, :-l]
+
+
+def calcular(consumo, fechas, nivel_servicio=None):
+    """
+    Punto de reorden y stock de seguridad por (mp, sucursal) a partir de
+    consumo_diario(). Vectorizado: un cálculo por cada lead time distinto,
+    no por MP.
+    """
+    if consumo.empty:
+        return pd.DataFrame(columns=COLUMNAS)
+    z = NormalDist().inv_cdf(nivel_servicio or _config("NIVEL_SERVICIO", 0.95))
+    minimo = _config("MIN_DIAS_CONSUMO", 4)
+
+    diario = (consumo.groupby(["mp", "sucursal", "dia"])["cantidad"].sum()
+                     .unstack("dia", fill_value=0.0)
+                     .reindex(columns=fechas, fill_value=0.0))
+    matriz = diario.to_numpy()
+    res = diario.index.to_frame(index=False)
+    res["dias_consumo"] = (matriz > 0).sum(axis=1)
+    res["demanda_diaria"] = matriz.mean(axis=1)
+    res["lead_time"] = res["sucursal"].map(_lead_time).clip(1, len(fechas))
+    res["stock_seguridad"] = 0.0
+    res["punto_reorden"] = 0.0
+
+    for l in res["lead_time"].unique():
+        filas = (res["lead_time"] == l).to_numpy()
+        sumas = _sumas_moviles(matriz[filas], int(l))
+        desvio = sumas.std(axis=1, ddof=1) if sumas.shape[1] > 1 else np.zeros(len(sumas))
+        seguridad = z * desvio
+        res.loc[filas, "stock_seguridad"] = seguridad
+        res.loc[filas, "punto_reorden"] = sumas.mean(axis=1) + seguridad
+
+    res = res[res["dias_consumo"] >= minimo]
+    # Hacia arriba, a la precisión de la columna (3 decimales).
+    for col in ("stock_seguridad", "punto_reorden"):
+        res[col] = np.ceil(res[col].to_numpy() * 1000) / 1000
+    return res[COLUMNAS].reset_index(drop=True)
+
+
+def minimos_por_ubicacion(consumo, puntos):
+    """
+    Reparte el punto de reorden de cada (mp, sucursal) entre sus
+    ubicaciones según lo que consumió cada una → DataFrame
+    (mp, sucursal, ubicacion, stock_minimo).
+    """
+    por_ubicacion = consumo.groupby(["mp", "sucursal", "ubicacion"], as_index=False)["cantidad"].sum()
+    por_ubicacion["peso"] = (por_ubicacion["cantidad"]
+                             / por_ubicacion.groupby(["mp", "sucursal"])["cantidad"].transform("sum"))
+    df = por_ubicacion.merge(puntos[["mp", "sucursal", "punto_reorden"]], on=["mp", "sucursal"])
+    df["stock_minimo"] = np.ceil(df["punto_reorden"].to_numpy() * df["peso"].to_numpy() * 1000) / 1000
+    return df[["mp", "sucursal", "ubicacion", "stock_minimo"]]
+
+
+# ============================================================
+#  ESCRITURA
+# ============================================================
+def actualizar_minimos(suscripcion=None, hoy=None, dias=None, nivel_servicio=None, aplicar=True):
+    """
+    Recalcula y escribe StockPorUbicacion.stock_minimo. Devuelve
+    (puntos de reorden, filas que cambian). Con aplicar=False no escribe.
+    """
+    consumo, fechas = consumo_diario(suscripcion, hoy, dias)
+    puntos = calcular(consumo, fechas, nivel_servicio)
+    if puntos.empty:
+        return puntos, 0
+    nuevos = minimos_por_ubicacion(consumo, puntos)
+    clave = dict(zip(zip(nuevos["ubicacion"], nuevos["mp"]), nuevos["stock_minimo"]))
+    recalculados = set(zip(puntos["mp"], puntos["sucursal"]))
+
+    filas = StockPorUbicacion.objects.filter(mp_id__in=puntos["mp"].unique().tolist())
+    if suscripcion is not None:
+        filas = filas.filter(mp__suscripcion=suscripcion)
+    cambios, mps = {}, set()
+    for pk, ubicacion, sucursal, mp, actual in filas.values_list(
+            "pk", "ubicacion_id", "ubicacion__sucursal_id", "mp_id", "stock_minimo").order_by():
+        if (mp, sucursal) not in recalculados:
+            continue
+        # Las ubicaciones de la sucursal que no consumieron quedan en 0:
+        # el mínimo del par ya está repartido entre las que sí.
+        nuevo = Decimal(str(clave.get((ubicacion, mp), 0.0))).quantize(Decimal("0.001"))
+        if nuevo != actual:
+            cambios[pk] = nuevo
+            mps.add(mp)
+
+    if aplicar and cambios:
+        with atomico():
+            actualizar_columna(StockPorUbicacion, "stock_minimo", cambios)
+            cache_empresa.invalidar_mps(mps)  # alertas del panel
+    return puntos, len(cambios)
+
@@ -0,0 +1,114 @@
+# inventario/replicas.py
+# ============================================================
+#  RÉPLICA DE LECTURA PARA REPORTES
+# ============================================================
+# La primaria atiende las escrituras del kardex (select_for_update de
+# StockPorUbicacion, ventas del POS); los reportes pesados (panel,
+# exportaciones, listados) pueden leer de una réplica (alias 'replica',
+# ver DATABASE_REPLICA_URL en bigmomma/basedatos.py) y no competir con
+# ellas.
+#
+#   - @usar_replica marca una vista (o leer_de_replica() un bloque): sus
+#     lecturas van a la réplica. Nada más cambia de lugar: lo que no está
+#     marcado sigue en la primaria.
+#   - Lee lo que escribiste: si la sesión escribió (un POST, o cualquier
+#     escritura por el ORM) durante los últimos REPLICA_FIJAR_SEGUNDOS,
+#     sus lecturas vuelven a la primaria, así no ve la réplica atrasada
+#     justo después de cargar algo. Lo marca una cookie.
+#   - Dentro del mismo request, después de la primera escritura o dentro
+#     de una transacción de la primaria, todo se lee de la primaria.
+#   - Sesiones, usuarios, permisos e idempotencia siempre en la primaria:
+#     una sesión recién creada todavía puede no estar en la réplica.
+#
+# Sin alias 'replica' configurado el router no hace nada.
+import contextvars
+from contextlib import contextmanager
+from functools import wraps
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections
+
+REPLICA = "replica"
+COOKIE = "leer_primaria"
+
+APPS_PRIMARIA = {"auth", "contenttypes", "sessions", "admin", "account", "socialaccount", "sites"}
+MODELOS_PRIMARIA = {"inventario.respuestaidempotente"}
+
+_replica = contextvars.ContextVar("replica_activa", default=False)
+_escribio = contextvars.ContextVar("replica_escribio", default=False)
+
+
+def hay_replica():
+    return REPLICA in settings.DATABASES
+
+
+def leyendo_replica():
+    """¿Lo que se lea ahora (fuera de una transacción) va a la réplica?"""
+    return _replica.get() and not _escribio.get() and hay_replica()
+
+
+def _solo_primaria(model):
+    meta = model._meta
+    return (meta.app_label in APPS_PRIMARIA or meta.label_lower in MODELOS_PRIMARIA
+            or meta.label_lower == settings.AUTH_USER_MODEL.lower())
+
+
+class RouterReplica:
+    def db_for_read(self, model, **hints):
+        if (not _replica.get() or _escribio.get() or not hay_replica() or _solo_primaria(model)
+                or connections[DEFAULT_DB_ALIAS].in_atomic_block):
+            return None
+        return REPLICA
+
+    def db_for_write(self, model, **hints):
+        # Lo que se lea después en este request tiene que ver esta escritura.
+        _escribio.set(True)
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Es la misma base: un objeto leído de la réplica puede apuntar a uno de la primaria.
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return False if db == REPLICA else None
+
+
+@contextmanager
+def leer_de_replica():
+    token = _replica.set(True)
+    try:
+        yield
+    finally:
+        _replica.reset(token)
+
+
+def usar_replica(vista):
+    """Las lecturas de la vista van a la réplica (salvo que la sesión acabe de escribir)."""
+    @wraps(vista)
+    def envuelta(request, *args, **kwargs):
+        if getattr(request, "leer_primaria", False):
+            return vista(request, *args, **kwargs)
+        with leer_de_replica():
+            return vista(request, *args, **kwargs)
+    return envuelta
+
+
+class ReplicaMiddleware:
+    """Fija a la primaria las sesiones que acaban de escribir (cookie con vencimiento)."""
+    METODOS_SEGUROS = ("GET", "HEAD", "OPTIONS", "TRACE")
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        request.leer_primaria = COOKIE in request.COOKIES
+        token = _escribio.set(False)
+        try:
+            response = self.get_response(request)
+            escribio = _escribio.get() or request.method not in self.METODOS_SEGUROS
+        finally:
+            _escribio.reset(token)
+        if escribio and hay_replica() and response.status_code < 500:
+            response.set_cookie(COOKIE, "1", max_age=getattr(settings, "REPLICA_FIJAR_SEGUNDOS", 10),
+                                httponly=True, samesite="Lax")
+        return response
@@ -0,0 +1,210 @@
+# inventario/reservas.py
+# ============================================================
+#  RESERVAS DE STOCK PARA BORRADORES (OP / VENTA)
+# ============================================================
+# Un borrador aparta lo que va a consumir en StockReserva:
+#
+#   - OrdenProduccion → MP por ubicación (mismo orden que consumir_mp)
+#   - Venta           → lotes en orden FEFO (mismo orden que consumir_fifo)
+#
+# Disponible = stock − reservas vigentes de OTROS borradores. Se calcula
+# en una sola consulta con una subconsulta por fila que usa los índices
+# (mp, ubicacion, expira) / (lote, expira). Las reservas vencen solas
+# (settings.RESERVAS_TTL_MINUTOS): una reserva vencida simplemente deja
+# de contar, no hace falta un proceso que la borre para que el stock se
+# libere (purgar_vencidas() solo limpia la tabla).
+#
+# Reservar toma lock de las filas de stock / lotes involucradas, así dos
+# borradores simultáneos no pueden apartar lo mismo. Al confirmar, si las
+# reservas siguen vigentes y cubren el borrador, se convierten en
+# consumo tal cual, sin volver a recorrer ubicaciones ni lotes.
+from collections import defaultdict
+from datetime import timedelta
+from decimal import Decimal
+
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.db.models import DecimalField, OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from .models import StockReserva, StockPorUbicacion, LoteProducto, MateriaPrima, fmt1
+from .shards import atomico
+
+CERO = Decimal("0")
+
+
+def _ttl():
+    return timedelta(minutes=getattr(settings, "RESERVAS_TTL_MINUTOS", 60))
+
+
+def vigentes(ahora=None):
+    return StockReserva.objects.filter(expira__gt=ahora or timezone.now())
+
+
+def _suma(qs, campo):
+    """Σ cantidad de 'qs' agrupada por 'campo' como subconsulta escalar (0 si no hay)."""
+    return Coalesce(
+        Subquery(qs.values(campo).annotate(t=Sum("cantidad")).values("t")[:1]),
+        Value(CERO),
+        output_field=DecimalField(max_digits=14, decimal_places=3),
+    )
+
+
+# ============================================================
+#  DISPONIBLE
+# ============================================================
+def filas_mp(sucursal, mp_ids, excluir_op=None, bloquear=False):
+    """
+    StockPorUbicacion de esas MPs en la sucursal, con '.reservado' (reservas
+    vigentes de otras OPs), en el orden en que las consume una OP.
+    """
+    reservas = vigentes().filter(mp_id=OuterRef("mp_id"), ubicacion_id=OuterRef("ubicacion_id"))
+    if excluir_op is not None:
+        reservas = reservas.exclude(op_id=excluir_op)
+    qs = StockPorUbicacion.objects.filter(ubicacion__sucursal=sucursal, mp_id__in=mp_ids)
+    if bloquear:
+        qs = qs.select_for_update(of=("self",))
+    return list(qs.annotate(reservado=_suma(reservas, "mp_id")).order_by("ubicacion__nombre", "pk"))
+
+
+def disponible_mp(sucursal, mp_ids, excluir_op=None):
+    """{mp_id: stock − reservado} en la sucursal (1 consulta)."""
+    disp = defaultdict(lambda: CERO)
+    for f in filas_mp(sucursal, mp_ids, excluir_op=excluir_op):
+        disp[f.mp_id] += max(f.stock - f.reservado, CERO)
+    return disp
+
+
+def filas_lotes(sucursal, producto_ids, excluir_venta=None, bloquear=False):
+    """Lotes vendibles de esos productos con '.reservado', en orden FEFO."""
+    reservas = vigentes().filter(lote_id=OuterRef("pk"))
+    if excluir_venta is not None:
+        reservas = reservas.exclude(venta_id=excluir_venta)
+    qs = LoteProducto.objects.filter(
+        producto_id__in=producto_ids,
+        ubicacion__sucursal=sucursal,
+        estado__in=[LoteProducto.OK, LoteProducto.POR_RALLAR],
+        cantidad_disponible__gt=0,
+    )
+    if bloquear:
+        qs = qs.select_for_update(of=("self",))
+    return list(qs.annotate(reservado=_suma(reservas, "lote_id")).order_by("fecha_vencimiento", "created_at"))
+
+
+def disponible_lotes(sucursal, producto_ids, excluir_venta=None):
+    """{producto_id: Σ cantidad_disponible − reservado} en la sucursal (1 consulta)."""
+    disp = defaultdict(lambda: CERO)
+    for l in filas_lotes(sucursal, producto_ids, excluir_venta=excluir_venta):
+        disp[l.producto_id] += max(l.cantidad_disponible - l.reservado, CERO)
+    return disp
+
+
+# ============================================================
+#  RESERVAR
+# ============================================================
+@atomico
+def reservar_op(op):
+    """
+    (Re)hace las reservas de MP de la OP. Levanta ValidationError si no
+    alcanza; en ese caso la OP queda con las reservas que tenía.
+    """
+    if not op.sucursal_id:
+        raise ValidationError("La Orden de Producción no tiene una sucursal asignada.")
+    requerido = op.requerimientos_mp()
+    por_mp = defaultdict(list)
+    for f in filas_mp(op.sucursal_id, requerido, excluir_op=op.pk, bloquear=True):
+        por_mp[f.mp_id].append(f)
+
+    expira = timezone.now() + _ttl()
+    nuevas, faltantes = [], {}
+    for mp_id, cantidad in requerido.items():
+        pendiente = cantidad
+        for f in por_mp[mp_id]:
+            tomar = min(pendiente, f.stock - f.reservado)
+            if tomar > 0:
+                nuevas.append(StockReserva(suscripcion_id=op.producto.suscripcion_id, mp_id=mp_id,
+                                           ubicacion_id=f.ubicacion_id, cantidad=tomar, op=op, expira=expira))
+                pendiente -= tomar
+            if pendiente <= 0:
+                break
+        if pendiente > 0:
+            faltantes[mp_id] = (cantidad, cantidad - pendiente)
+    if faltantes:
+        nombres = dict(MateriaPrima.objects.filter(pk__in=faltantes).values_list("pk", "nombre"))
+        raise ValidationError("Stock insuficiente en esta sucursal → " + "; ".join(
+            f"{nombres[mp_id]}: req {fmt1(req)} / disp {fmt1(disp)}" for mp_id, (req, disp) in faltantes.items()
+        ))
+
+    StockReserva.objects.filter(op=op).delete()
+    return StockReserva.objects.bulk_create(nuevas)
+
+
+@atomico
+def reservar_venta(venta):
+    """(Re)hace las reservas de lotes (FEFO) de la venta; ValidationError si no alcanza."""
+    if not venta.sucursal_id:
+        raise ValidationError("La Venta no tiene una sucursal asignada.")
+    lineas = list(venta.lineas.select_related("producto"))
+    if not lineas:
+        raise ValidationError("La venta no tiene líneas.")
+    por_producto = defaultdict(list)
+    for l in filas_lotes(venta.sucursal_id, {ln.producto_id for ln in lineas}, excluir_venta=venta.pk, bloquear=True):
+        l.libre = l.cantidad_disponible - l.reservado
+        por_producto[l.producto_id].append(l)
+
+    expira = timezone.now() + _ttl()
+    nuevas, faltantes = [], []
+    for ln in lineas:
+        pendiente = Decimal(ln.cantidad)
+        for l in por_producto[ln.producto_id]:
+            tomar = min(pendiente, l.libre)
+            if tomar > 0:
+                nuevas.append(StockReserva(suscripcion_id=venta.suscripcion_id, lote=l, ubicacion_id=l.ubicacion_id,
+                                           cantidad=tomar, venta=venta, linea=ln, expira=expira))
+                l.libre -= tomar; pendiente -= tomar
+            if pendiente <= 0:
+                break
+        if pendiente > 0:
+            faltantes.append(f"{ln.producto}: req {fmt1(ln.cantidad)} / disp {fmt1(ln.cantidad - pendiente)}")
+    if faltantes:
+        raise ValidationError(f"Stock insuficiente en {venta.sucursal.nombre} → " + "; ".join(faltantes))
+
+    StockReserva.objects.filter(venta=venta).delete()
+    return StockReserva.objects.bulk_create(nuevas)
+
+
+# ============================================================
+#  CONFIRMAR
+# ============================================================
+def _cubre(reservas, requerido, clave):
+    total = defaultdict(lambda: CERO)
+    for r in reservas:
+        total[getattr(r, clave)] += r.cantidad
+    return all(total[k] == v for k, v in requerido.items())
+
+
+def para_consumir_op(op):
+    """Reservas vigentes de la OP si la cubren completa; si no, reserva de nuevo (con lock)."""
+    reservas = list(vigentes().filter(op=op).order_by("pk"))
+    if reservas and _cubre(reservas, op.requerimientos_mp(), "mp_id"):
+        return reservas
+    return reservar_op(op)
+
+
+def para_consumir_venta(venta):
+    """Reservas vigentes de la venta si cubren cada línea; si no, reserva de nuevo (con lock)."""
+    reservas = list(vigentes().filter(venta=venta).order_by("pk"))
+    if reservas and _cubre(reservas, {ln.pk: ln.cantidad for ln in venta.lineas.all()}, "linea_id"):
+        return reservas
+    return reservar_venta(venta)
+
+
+def purgar_vencidas(batch=5000):
+    """Borra las reservas vencidas en tandas (usa el índice de 'expira')."""
+    total = 0
+    while True:
+        ids = list(StockReserva.objects.filter(expira__lte=timezone.now()).values_list("pk", flat=True)[:batch])
+        if not ids:
+            return total
+        total += StockReserva.objects.filter(pk__in=ids).delete()[0]
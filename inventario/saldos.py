@@ -0,0 +1,290 @@
+# inventario/saldos.py
+# ============================================================
+#  SALDOS: CONCILIACIÓN Y SNAPSHOTS DEL KARDEX
+# ============================================================
+# StockPorUbicacion.stock es un total "corrido" que mantiene
+# MovimientoMP.save()/delete(). Si alguien lo toca a mano (admin) o
+# un proceso se cae a medias, se descuadra del kardex. Este módulo:
+#
+#   - saldos_kardex(): recalcula TODOS los saldos desde MovimientoMP
+#     con un solo GROUP BY (mp, ubicacion).
+#   - conciliar(): compara contra StockPorUbicacion en bloque y,
+#     si se pide, repara las diferencias (bulk_update).
+#   - generar_snapshots(): escribe SaldoDiarioMP (saldo al cierre de
+#     cada día con movimientos) para consultar stock a una fecha sin
+#     recorrer todo el kardex.
+#   - stock_at() / stocks_at(): stock a una fecha/hora = última foto
+#     diaria + los movimientos posteriores (acotados por el índice
+#     (mp, ubicacion, fecha)).
+#
+# Con el kardex archivado (ver inventario/archivo.py) todo esto sigue
+# valiendo: cada par arranca con un movimiento APERTURA que resume lo
+# archivado, fechado en el último movimiento que resume (día que ya tiene
+# su foto).
+import datetime
+from collections import namedtuple
+from decimal import Decimal
+
+from django.db.models import Sum, Max, OuterRef, Subquery
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+from .models import CorteArchivo, MateriaPrima, MovimientoMP, StockPorUbicacion, SaldoDiarioMP, Ubicacion
+from .shards import atomico
+from . import cache_empresa
+
+CERO = Decimal("0")
+TRES_DEC = Decimal("0.001")
+
+
+def _q(valor):
+    """
+    Normaliza una suma del kardex a 3 decimales (los de 'cantidad').
+    En SQLite Sum() de decimales vuelve con ruido de punto flotante (1e-15).
+    """
+    return Decimal(valor or 0).quantize(TRES_DEC)
+
+Diferencia = namedtuple("Diferencia", "mp_id ubicacion_id stock_registrado stock_kardex")
+
+
+def inicio_dia(fecha):
+    """Datetime aware del inicio de 'fecha' en la zona horaria local."""
+    return timezone.make_aware(datetime.datetime.combine(fecha, datetime.time.min))
+
+
+def _movimientos(suscripcion=None):
+    qs = MovimientoMP.objects.all()
+    if suscripcion is not None:
+        qs = qs.filter(mp__suscripcion=suscripcion)
+    return qs
+
+
+# ============================================================
+#  CONCILIACIÓN
+# ============================================================
+def saldos_kardex(suscripcion=None, mp_ids=None):
+    """{(mp_id, ubicacion_id): saldo} recalculado desde el kardex (1 query)."""
+    qs = _movimientos(suscripcion)
+    if mp_ids is not None:
+        qs = qs.filter(mp_id__in=mp_ids)
+    filas = (qs.order_by()
+             .values("mp_id", "ubicacion_id")
+             .annotate(saldo=Sum(MovimientoMP.expr_cantidad_signed())))
+    return {(f["mp_id"], f["ubicacion_id"]): _q(f["saldo"]) for f in filas}
+
+
+def _stock_registrado(suscripcion=None, mp_ids=None, lock=False):
+    qs = StockPorUbicacion.objects.all()
+    if suscripcion is not None:
+        qs = qs.filter(mp__suscripcion=suscripcion)
+    if mp_ids is not None:
+        qs = qs.filter(mp_id__in=mp_ids)
+    if lock:
+        qs = qs.select_for_update().order_by("pk")
+    return {(s.mp_id, s.ubicacion_id): s for s in qs.only("pk", "mp_id", "ubicacion_id", "stock")}
+
+
+def _diferencias(kardex, registrado):
+    difs = []
+    for par in kardex.keys() | registrado.keys():
+        esperado = kardex.get(par, CERO)
+        item = registrado.get(par)
+        actual = item.stock if item else CERO
+        if actual != esperado:
+            difs.append(Diferencia(par[0], par[1], actual, esperado))
+    return sorted(difs)
+
+
+def conciliar(suscripcion=None, reparar=False):
+    """
+    Devuelve la lista de Diferencia entre StockPorUbicacion y el kardex.
+    Con reparar=True deja StockPorUbicacion igual al kardex.
+    """
+    difs = _diferencias(saldos_kardex(suscripcion), _stock_registrado(suscripcion))
+    if difs and reparar:
+        reparar_pares({(d.mp_id, d.ubicacion_id) for d in difs})
+    return difs
+
+
+@atomico
+def reparar_pares(pares):
+    """
+    Recalcula y escribe el stock de los pares (mp_id, ubicacion_id).
+    Bloquea primero las filas de StockPorUbicacion y LUEGO lee el kardex:
+    un movimiento concurrente queda esperando el lock y suma su delta
+    después, sobre el valor ya corregido.
+    """
+    mp_ids = {mp_id for mp_id, _ in pares}
+    registrado = _stock_registrado(mp_ids=mp_ids, lock=True)
+    kardex = saldos_kardex(mp_ids=mp_ids)
+
+    actualizar, crear = [], []
+    for par in pares:
+        esperado = kardex.get(par, CERO)
+        item = registrado.get(par)
+        if item is None:
+            if esperado != CERO:
+                crear.append(StockPorUbicacion(mp_id=par[0], ubicacion_id=par[1], stock=esperado))
+        elif item.stock != esperado:
+            item.stock = esperado
+            actualizar.append(item)
+    StockPorUbicacion.objects.bulk_update(actualizar, ["stock"], batch_size=1000)
+    StockPorUbicacion.objects.bulk_create(crear, batch_size=1000)
+    if actualizar or crear:
+        cache_empresa.invalidar_mps({i.mp_id for i in actualizar + crear})
+    return len(actualizar) + len(crear)
+
+
+# ============================================================
+#  SNAPSHOTS DIARIOS
+# ============================================================
+def generar_snapshots(hasta=None, suscripcion=None, desde=None, batch_size=2000):
+    """
+    Escribe SaldoDiarioMP hasta el día 'hasta' (por defecto, ayer).
+
+    Parte del último día ya fotografiado de la empresa (o de 'desde',
+    borrando lo que haya desde ahí; sin 'suscripcion', empresa por
+    empresa) y solo lee los movimientos nuevos: un GROUP BY por
+    (mp, ubicacion, día) + el último saldo conocido de cada par.
+    Devuelve la cantidad de filas escritas.
+    """
+    hasta = hasta or (timezone.localdate() - datetime.timedelta(days=1))
+    if suscripcion is None:
+        # Cada empresa retoma desde su propia última foto: con un máximo
+        # global, una empresa atrasada se quedaría sin los días que le faltan.
+        empresas = list(MateriaPrima.objects.order_by().values_list("suscripcion_id", flat=True).distinct())
+        return sum(generar_snapshots(hasta, s, desde, batch_size) for s in empresas)
+    snaps = SaldoDiarioMP.objects.filter(mp__suscripcion=suscripcion)
+
+    if desde is not None:
+        # Antes del horizonte de archivado el kardex vivo ya no tiene el
+        # detalle (solo los saldos de apertura): esas fotos no se rehacen.
+        corte = CorteArchivo.objects.filter(suscripcion=suscripcion).aggregate(m=Max("hasta"))["m"]
+        if corte is not None:
+            desde = max(desde, timezone.localtime(corte).date())
+        snaps.filter(fecha__gte=desde).delete()
+        ultimo = desde - datetime.timedelta(days=1)
+    else:
+        ultimo = snaps.aggregate(m=Max("fecha"))["m"]
+    if ultimo is not None and ultimo >= hasta:
+        return 0
+
+    movs = _movimientos(suscripcion).filter(fecha__lt=inicio_dia(hasta + datetime.timedelta(days=1)))
+    if ultimo is not None:
+        movs = movs.filter(fecha__gte=inicio_dia(ultimo + datetime.timedelta(days=1)))
+    filas = list(movs.order_by()
+                 .annotate(dia=TruncDate("fecha"))
+                 .values("mp_id", "ubicacion_id", "dia")
+                 .annotate(delta=Sum(MovimientoMP.expr_cantidad_signed()))
+                 .order_by("mp_id", "ubicacion_id", "dia"))
+    if not filas:
+        return 0
+
+    base = {}
+    if ultimo is not None:
+        mp_ids = {f["mp_id"] for f in filas}
+        base = saldos_a_fecha_snapshot(ultimo, mp_ids=mp_ids)
+
+    # Saldo acumulado por par, día a día.
+    nuevos, saldo, par_actual = [], CERO, None
+    for f in filas:
+        par = (f["mp_id"], f["ubicacion_id"])
+        if par != par_actual:
+            par_actual, saldo = par, base.get(par, CERO)
+        saldo += _q(f["delta"])
+        nuevos.append(SaldoDiarioMP(mp_id=par[0], ubicacion_id=par[1], fecha=f["dia"], stock=saldo))
+
+    SaldoDiarioMP.objects.bulk_create(
+        nuevos, batch_size=batch_size,
+        update_conflicts=True, unique_fields=["mp", "ubicacion", "fecha"], update_fields=["stock"],
+    )
+    return len(nuevos)
+
+
+def saldos_a_fecha_snapshot(fecha, mp_ids=None, ubicacion_ids=None, suscripcion=None):
+    """
+    {(mp_id, ubicacion_id): saldo} según la última foto <= 'fecha'
+    de cada par (no suma movimientos posteriores a la foto).
+    """
+    qs = SaldoDiarioMP.objects.all()
+    if suscripcion is not None:
+        qs = qs.filter(mp__suscripcion=suscripcion)
+    if mp_ids is not None:
+        qs = qs.filter(mp_id__in=mp_ids)
+    if ubicacion_ids is not None:
+        qs = qs.filter(ubicacion_id__in=ubicacion_ids)
+    # Subconsulta correlacionada: usa el índice único (mp, ubicacion, fecha).
+    ultima = (SaldoDiarioMP.objects
+              .filter(mp=OuterRef("mp"), ubicacion=OuterRef("ubicacion"), fecha__lte=fecha)
+              .order_by("-fecha").values("fecha")[:1])
+    filas = qs.filter(fecha=Subquery(ultima)).values_list("mp_id", "ubicacion_id", "stock")
+    return {(m, u): s for m, u, s in filas}
+
+
+# ============================================================
+#  STOCK A UNA FECHA
+# ============================================================
+def _corte(momento):
+    """
+    (filtro de movimientos hasta 'momento', último día cuya foto se puede usar).
+    Una fecha sola significa "al cierre de ese día".
+    """
+    if isinstance(momento, datetime.datetime):
+        if timezone.is_naive(momento):
+            momento = timezone.make_aware(momento)
+        dia = timezone.localtime(momento).date() - datetime.timedelta(days=1)
+        return {"fecha__lte": momento}, dia
+    return {"fecha__lt": inicio_dia(momento + datetime.timedelta(days=1))}, momento
+
+
+def stocks_at(momento, suscripcion, mp_ids=None, ubicacion_ids=None):
+    """
+    {(mp_id, ubicacion_id): stock} de toda la empresa (o de las MPs /
+    ubicaciones indicadas) a 'momento' (datetime, o date = cierre del día).
+
+    Tres consultas sin importar el tamaño del kardex: hasta dónde llegan
+    las fotos, la última foto de cada par y el GROUP BY de los movimientos
+    posteriores a ella. Sin fotos recorre el kardex completo (mismo
+    resultado, más lento). Si se registran movimientos con fecha pasada,
+    hay que rehacer las fotos (conciliar_stock --rehacer-desde).
+    """
+    filtro, dia = _corte(momento)
+
+    fotos = SaldoDiarioMP.objects.filter(mp__suscripcion=suscripcion)
+    if mp_ids is not None:
+        fotos = fotos.filter(mp_id__in=mp_ids)
+    # Las fotos de la empresa llegan hasta el último día procesado; después
+    # de eso solo sirven los movimientos.
+    ultimo = fotos.aggregate(m=Max("fecha"))["m"]
+
+    saldos, movs = {}, _movimientos(suscripcion).filter(**filtro)
+    if ultimo is not None:
+        foto = min(dia, ultimo)
+        saldos = saldos_a_fecha_snapshot(foto, mp_ids=mp_ids, ubicacion_ids=ubicacion_ids, suscripcion=suscripcion)
+        movs = movs.filter(fecha__gte=inicio_dia(foto + datetime.timedelta(days=1)))
+    if mp_ids is not None:
+        movs = movs.filter(mp_id__in=mp_ids)
+    if ubicacion_ids is not None:
+        movs = movs.filter(ubicacion_id__in=ubicacion_ids)
+
+    filas = (movs.order_by()
+             .values("mp_id", "ubicacion_id")
+             .annotate(delta=Sum(MovimientoMP.expr_cantidad_signed())))
+    for f in filas:
+        par = (f["mp_id"], f["ubicacion_id"])
+        saldos[par] = saldos.get(par, CERO) + _q(f["delta"])
+    return saldos
+
+
+def stock_at(mp, lugar, momento):
+    """
+    Stock de 'mp' en 'lugar' (Ubicacion o Sucursal) a 'momento'.
+
+        stock_at(harina, sucursal_centro, datetime(2025, 3, 31, 23, 59))
+    """
+    if isinstance(lugar, Ubicacion):
+        ubicaciones = [lugar.pk]
+    else:
+        ubicaciones = lugar.ubicaciones.values("pk")
+    saldos = stocks_at(momento, mp.suscripcion_id, mp_ids=[mp.pk], ubicacion_ids=ubicaciones)
+    return sum(saldos.values(), CERO)
@@ -0,0 +1,313 @@
+# inventario/serializers.py
+# ============================================================
+#  SERIALIZERS DE LA API (POS / ESCÁNERES)
+# ============================================================
+# Todos los serializers reciben el 'request' en el contexto y
+# limitan los querysets de sus FKs a la suscripción del usuario.
+# Los campos "_nombre" / "_fmt" asumen que la vista ya hizo
+# select_related / prefetch_related (ver inventario/api.py).
+from decimal import Decimal
+
+from django.core.exceptions import ValidationError as DjangoValidationError
+from rest_framework import serializers
+
+from .models import (
+    MateriaPrima, MovimientoMP, StockPorUbicacion,
+    Producto, Receta, OrdenProduccion, LoteProducto,
+    Venta, VentaLinea, VentaConsumo,
+    Sucursal, Ubicacion, Traslado, TrasladoLinea, ConteoFisico,
+)
+from . import archivo, bom, conteos
+
+
+def _suscripcion(serializer):
+    request = serializer.context.get("request")
+    return getattr(getattr(request, "user", None), "suscripcion", None)
+
+
+class TenantPKField(serializers.PrimaryKeyRelatedField):
+    """
+    PrimaryKeyRelatedField cuyo queryset se construye a partir de la
+    suscripción del usuario (también funciona en serializers anidados,
+    porque 'self.context' siempre es el del serializer raíz).
+    """
+    def __init__(self, construir, **kwargs):
+        self.construir = construir
+        kwargs.setdefault("queryset", None)
+        super().__init__(**kwargs)
+
+    def get_queryset(self):
+        return self.construir(_suscripcion(self))
+
+
+# =========================
+#  Stock / Kardex
+# =========================
+class MovimientoMPSerializer(serializers.ModelSerializer):
+    mp = TenantPKField(lambda s: MateriaPrima.objects.filter(suscripcion=s, activo=True))
+    ubicacion = TenantPKField(lambda s: Ubicacion.objects.filter(sucursal__suscripcion=s, activo=True))
+    cantidad = serializers.DecimalField(max_digits=12, decimal_places=3, min_value=Decimal("0.001"))
+    mp_nombre = serializers.CharField(source="mp.nombre", read_only=True)
+    ubicacion_nombre = serializers.CharField(source="ubicacion.nombre", read_only=True)
+    sucursal = serializers.IntegerField(source="ubicacion.sucursal_id", read_only=True)
+    cantidad_signed = serializers.DecimalField(max_digits=12, decimal_places=3, read_only=True)
+    cantidad_fmt = serializers.SerializerMethodField()
+
+    class Meta:
+        model = MovimientoMP
+        fields = [
+            "id", "mp", "mp_nombre", "ubicacion", "ubicacion_nombre", "sucursal",
+            "tipo", "cantidad", "cantidad_signed", "cantidad_fmt", "costo_unitario",
+            "fecha", "nota", "created_by",
+        ]
+        read_only_fields = ["id", "fecha", "created_by"]
+
+    def get_cantidad_fmt(self, obj):
+        return obj.mp.format_qty(obj.cantidad_signed)
+
+    def validate(self, attrs):
+        if attrs.get("costo_unitario") is not None and attrs.get("tipo") != MovimientoMP.INGRESO:
+            raise serializers.ValidationError({"costo_unitario": "Solo los ingresos llevan costo."})
+        if attrs.get("tipo") in MovimientoMP.TIPOS_TRASLADO:
+            raise serializers.ValidationError({"tipo": "Los traslados se registran en /api/traslados/."})
+        if attrs.get("tipo") == MovimientoMP.APERTURA:
+            raise serializers.ValidationError({"tipo": "Los saldos de apertura los escribe el archivado del kardex."})
+        return attrs
+
+
+class StockPorUbicacionSerializer(serializers.ModelSerializer):
+    mp_nombre = serializers.CharField(source="mp.nombre", read_only=True)
+    unidad = serializers.CharField(source="mp.unidad.nombre", read_only=True)
+    ubicacion_nombre = serializers.CharField(source="ubicacion.nombre", read_only=True)
+    sucursal = serializers.IntegerField(source="ubicacion.sucursal_id", read_only=True)
+    sucursal_nombre = serializers.CharField(source="ubicacion.sucursal.nombre", read_only=True)
+
+    class Meta:
+        model = StockPorUbicacion
+        fields = [
+            "id", "mp", "mp_nombre", "unidad",
+            "ubicacion", "ubicacion_nombre", "sucursal", "sucursal_nombre",
+            "stock", "stock_minimo",
+        ]
+        read_only_fields = fields
+
+
+# =========================
+#  Lotes
+# =========================
+class LoteProductoSerializer(serializers.ModelSerializer):
+    producto_nombre = serializers.CharField(source="producto.nombre", read_only=True)
+    ubicacion_nombre = serializers.CharField(source="ubicacion.nombre", read_only=True, default=None)
+    sucursal = serializers.IntegerField(source="ubicacion.sucursal_id", read_only=True, default=None)
+    cantidad_disponible_fmt = serializers.CharField(read_only=True)
+
+    class Meta:
+        model = LoteProducto
+        fields = [
+            "id", "codigo", "producto", "producto_nombre", "op",
+            "ubicacion", "ubicacion_nombre", "sucursal",
+            "fecha_produccion", "fecha_vencimiento",
+            "cantidad_inicial", "cantidad_disponible", "cantidad_disponible_fmt",
+            "costo_unitario", "estado",
+        ]
+        read_only_fields = fields
+
+
+# =========================
+#  Producción (OP)
+# =========================
+class OrdenProduccionSerializer(serializers.ModelSerializer):
+    sucursal = TenantPKField(lambda s: Sucursal.objects.filter(suscripcion=s, activa=True))
+    producto = TenantPKField(lambda s: Producto.objects.filter(suscripcion=s, activo=True))
+    receta = TenantPKField(lambda s: Receta.objects.filter(producto__suscripcion=s, activo=True))
+    lotes = serializers.DecimalField(max_digits=12, decimal_places=3, min_value=Decimal("0.001"))
+    ejecutar = serializers.BooleanField(write_only=True, required=False, default=False)
+    producto_nombre = serializers.CharField(source="producto.nombre", read_only=True)
+    unidades_totales = serializers.DecimalField(max_digits=14, decimal_places=3, read_only=True)
+    lotes_creados = serializers.SlugRelatedField(many=True, read_only=True, slug_field="codigo")
+
+    class Meta:
+        model = OrdenProduccion
+        fields = [
+            "id", "sucursal", "producto", "producto_nombre", "receta",
+            "lotes", "unidades_totales", "fecha", "estado", "nota",
+            "lotes_creados", "ejecutar", "created_by",
+        ]
+        read_only_fields = ["id", "fecha", "estado", "created_by"]
+
+    def validate(self, attrs):
+        receta = attrs.get("receta"); producto = attrs.get("producto")
+        if receta and producto and receta.producto_id != producto.id:
+            raise serializers.ValidationError({"receta": "La receta seleccionada no corresponde a ese producto."})
+        if receta:
+            # Receta explotada a MP (ver bom.snapshot); un intermedio sin receta activa es error de validación.
+            try:
+                attrs["receta_snapshot"] = bom.snapshot(receta)
+            except DjangoValidationError as e:
+                raise serializers.ValidationError({"receta": e.messages})
+        return attrs
+
+    def create(self, validated_data):
+        validated_data.pop("ejecutar", None)
+        return super().create(validated_data)
+
+
+# =========================
+#  Ventas
+# =========================
+class VentaLineaSerializer(serializers.ModelSerializer):
+    producto = TenantPKField(lambda s: Producto.objects.filter(suscripcion=s, activo=True))
+    cantidad = serializers.DecimalField(max_digits=12, decimal_places=3, min_value=Decimal("0.001"))
+    producto_nombre = serializers.CharField(source="producto.nombre", read_only=True)
+    cantidad_fmt = serializers.CharField(read_only=True)
+
+    class Meta:
+        model = VentaLinea
+        fields = ["id", "producto", "producto_nombre", "cantidad", "cantidad_fmt"]
+        read_only_fields = ["id"]
+
+
+class VentaConsumoSerializer(serializers.ModelSerializer):
+    lote_codigo = serializers.CharField(source="lote.codigo", read_only=True)
+    producto = serializers.IntegerField(source="linea.producto_id", read_only=True)
+
+    class Meta:
+        model = VentaConsumo
+        fields = ["id", "linea", "producto", "lote", "lote_codigo", "cantidad"]
+        read_only_fields = fields
+
+
+class VentaSerializer(serializers.ModelSerializer):
+    sucursal = TenantPKField(lambda s: Sucursal.objects.filter(suscripcion=s, activa=True))
+    lineas = VentaLineaSerializer(many=True)
+    # Vivos o, si la venta ya se archivó, los del archivo (mismos atributos).
+    consumos = serializers.SerializerMethodField()
+    confirmar = serializers.BooleanField(write_only=True, required=False, default=False)
+    costo_total = serializers.DecimalField(max_digits=16, decimal_places=4, read_only=True)
+
+    class Meta:
+        model = Venta
+        fields = [
+            "id", "sucursal", "fecha", "estado", "nota",
+            "lineas", "consumos", "costo_total", "confirmar", "created_by",
+        ]
+        read_only_fields = ["id", "fecha", "estado", "created_by"]
+
+    def get_consumos(self, venta):
+        return VentaConsumoSerializer(archivo.consumos_de_venta(venta), many=True).data
+
+    def validate_lineas(self, lineas):
+        if not lineas:
+            raise serializers.ValidationError("La venta debe tener al menos una línea.")
+        productos = [ln["producto"].pk for ln in lineas]
+        if len(productos) != len(set(productos)):
+            raise serializers.ValidationError("Producto repetido en otra línea. Combínalas.")
+        return lineas
+
+    def create(self, validated_data):
+        lineas = validated_data.pop("lineas")
+        validated_data.pop("confirmar", None)
+        venta = Venta.objects.create(suscripcion=_suscripcion(self), **validated_data)
+        VentaLinea.objects.bulk_create([VentaLinea(venta=venta, **ln) for ln in lineas])
+        return venta
+
+
+# =========================
+#  Traslados
+# =========================
+class TrasladoLineaSerializer(serializers.ModelSerializer):
+    mp = TenantPKField(lambda s: MateriaPrima.objects.filter(suscripcion=s, activo=True),
+                       required=False, allow_null=True)
+    lote = TenantPKField(lambda s: LoteProducto.objects.filter(producto__suscripcion=s),
+                         required=False, allow_null=True)
+    cantidad = serializers.DecimalField(max_digits=12, decimal_places=3, required=False, min_value=Decimal("0"))
+    mp_nombre = serializers.CharField(source="mp.nombre", read_only=True, default=None)
+    lote_codigo = serializers.CharField(source="lote.codigo", read_only=True, default=None)
+
+    class Meta:
+        model = TrasladoLinea
+        fields = ["id", "mp", "mp_nombre", "lote", "lote_codigo", "cantidad"]
+        read_only_fields = ["id"]
+
+    def validate(self, attrs):
+        if bool(attrs.get("mp")) == bool(attrs.get("lote")):
+            raise serializers.ValidationError("Cada línea lleva una MP o un lote (no ambos).")
+        if attrs.get("mp") and not attrs.get("cantidad"):
+            raise serializers.ValidationError({"cantidad": "Indique la cantidad de MP a trasladar."})
+        if attrs.get("lote"):
+            attrs["cantidad"] = attrs["lote"].cantidad_disponible
+        return attrs
+
+
+class TrasladoSerializer(serializers.ModelSerializer):
+    origen = TenantPKField(lambda s: Ubicacion.objects.filter(sucursal__suscripcion=s, activo=True))
+    destino = TenantPKField(lambda s: Ubicacion.objects.filter(sucursal__suscripcion=s, activo=True))
+    lineas = TrasladoLineaSerializer(many=True)
+    confirmar = serializers.BooleanField(write_only=True, required=False, default=False)
+
+    class Meta:
+        model = Traslado
+        fields = ["id", "origen", "destino", "fecha", "estado", "nota", "lineas", "confirmar", "created_by"]
+        read_only_fields = ["id", "fecha", "estado", "created_by"]
+
+    def validate(self, attrs):
+        if attrs["origen"] == attrs["destino"]:
+            raise serializers.ValidationError({"destino": "El origen y el destino deben ser distintos."})
+        return attrs
+
+    def validate_lineas(self, lineas):
+        if not lineas:
+            raise serializers.ValidationError("El traslado debe tener al menos una línea.")
+        claves = [("mp", ln["mp"].pk) if ln.get("mp") else ("lote", ln["lote"].pk) for ln in lineas]
+        if len(claves) != len(set(claves)):
+            raise serializers.ValidationError("MP o lote repetido en otra línea. Combínalas.")
+        return lineas
+
+    def create(self, validated_data):
+        lineas = validated_data.pop("lineas")
+        validated_data.pop("confirmar", None)
+        traslado = Traslado.objects.create(suscripcion=_suscripcion(self), **validated_data)
+        TrasladoLinea.objects.bulk_create([TrasladoLinea(traslado=traslado, **ln) for ln in lineas])
+        return traslado
+
+
+class IdONombreField(serializers.Field):
+    """Un número JSON es un id; un string es un nombre ("12" es el nombre "12", no el id 12)."""
+    default_error_messages = {"invalido": "Se espera un id (número) o un nombre (texto)."}
+
+    def to_internal_value(self, data):
+        if isinstance(data, int) and not isinstance(data, bool):
+            return data
+        if isinstance(data, str) and data.strip():
+            return data.strip()
+        self.fail("invalido")
+
+    def to_representation(self, value):
+        return value
+
+
+class ConteoLecturaSerializer(serializers.Serializer):
+    """Una lectura del escáner: ubicación y MP por id (número) o por nombre (texto)."""
+    ubicacion = IdONombreField()
+    mp = IdONombreField()
+    contado = serializers.DecimalField(max_digits=12, decimal_places=3, min_value=Decimal("0"))
+
+
+class ConteoFisicoSerializer(serializers.ModelSerializer):
+    sucursal = TenantPKField(lambda s: Sucursal.objects.filter(suscripcion=s))
+    lineas = ConteoLecturaSerializer(many=True, write_only=True, required=False)
+    n_lineas = serializers.IntegerField(read_only=True, default=None)
+
+    class Meta:
+        model = ConteoFisico
+        fields = ["id", "sucursal", "estado", "nota", "created_at", "contabilizado_en", "created_by",
+                  "n_lineas", "lineas"]
+        read_only_fields = ["id", "estado", "created_at", "contabilizado_en", "created_by"]
+
+    def create(self, validated_data):
+        lineas = validated_data.pop("lineas", [])
+        conteo = ConteoFisico.objects.create(suscripcion=_suscripcion(self), **validated_data)
+        _, errores = conteos.cargar(conteo, [(ln["ubicacion"], ln["mp"], ln["contado"]) for ln in lineas])
+        if errores:
+            raise serializers.ValidationError({"lineas": errores})
+        return conteo
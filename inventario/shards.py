@@ -0,0 +1,455 @@
+# inventario/shards.py
+# ============================================================
+#  SHARDING POR TENANT (SuscripcionCliente → base de datos)
+# ============================================================
+# Todo el inventario cuelga de una SuscripcionCliente. Las empresas
+# grandes pueden vivir en otra base (alias de DATABASE_SHARDS, ver
+# bigmomma/basedatos.py) para no cargar la E/S de las demás:
+#
+#   - El mapa tenant → base es SuscripcionCliente.base_datos ('default'
+#     salvo que se la haya movido con 'manage.py mover_tenant').
+#   - El directorio queda siempre en 'default': SuscripcionCliente,
+#     usuarios, unidades, idempotencia, sesiones, auth. El resto de los
+#     modelos de inventario ("modelos del tenant") va a la base del
+#     tenant del request.
+#   - ShardMiddleware (o TenantViewSetMixin en la API, que autentica por
+#     token después del middleware) fija la base del usuario para el
+#     request; en comandos y tareas se fija con usar(suscripcion) o se
+#     recorren todas con en_bases().
+#   - Las transacciones del dominio usan atomico() en lugar de
+#     transaction.atomic(): la base se resuelve al entrar (no al importar)
+#     y el select_for_update del kardex corre en la base correcta.
+#   - Los FKs de los modelos del tenant a SuscripcionCliente, User y
+#     UnidadMedida necesitan esas filas en el shard: se mantiene una copia
+#     (sincronizar_referencias) al mover el tenant y al guardarlas.
+#   - Los ids no chocan entre bases: cada shard genera los suyos desde su
+#     bloque (posición en SHARDS × SHARD_BLOQUE_IDS, reservar_ids()); las
+#     filas movidas conservan el id que tenían. (En SQLite una tabla
+#     numera desde su mayor id: la que recibe filas de un bloque más alto
+#     sigue desde ahí. Si eso llegara a chocar, la mudanza falla entera.)
+#
+# Sin DATABASE_SHARDS todo está en 'default' y el router no decide nada.
+import contextvars
+from collections import deque
+from contextlib import contextmanager
+from functools import wraps
+
+from django.apps import apps
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.db import DEFAULT_DB_ALIAS, connections, transaction
+from django.http import JsonResponse
+
+APP = "inventario"
+# Directorio: siempre en 'default' (con copia de referencia en los shards).
+GLOBALES = {"inventario.suscripcioncliente", "inventario.user", "inventario.unidadmedida",
+            "inventario.respuestaidempotente"}
+
+_base = contextvars.ContextVar("shard_base", default=None)
+
+
+def bases():
+    """'default' y los shards configurados, en orden."""
+    return [DEFAULT_DB_ALIAS] + list(getattr(settings, "SHARDS", []))
+
+
+def base_de(suscripcion):
+    """Alias de la base del tenant (None → 'default')."""
+    alias = getattr(suscripcion, "base_datos", None) or DEFAULT_DB_ALIAS
+    if alias not in settings.DATABASES:
+        raise ImproperlyConfigured(f"La suscripción {suscripcion.pk} vive en '{alias}', que no está en DATABASES.")
+    return alias
+
+
+def base_actual():
+    return _base.get() or DEFAULT_DB_ALIAS
+
+
+def fijar(destino):
+    """Fija la base (alias o SuscripcionCliente). Devuelve el token para soltar()."""
+    return _base.set(destino if isinstance(destino, str) else base_de(destino))
+
+
+def soltar(token):
+    _base.reset(token)
+
+
+@contextmanager
+def usar(destino):
+    """Como fijar(), para lo que corra dentro del bloque."""
+    token = fijar(destino)
+    try:
+        yield
+    finally:
+        soltar(token)
+
+
+def en_bases(suscripcion=None):
+    """
+    Para comandos: recorre la base de 'suscripcion' (o todas si es None)
+    con esa base fijada en cada vuelta.
+        for alias in en_bases(suscripcion): conciliar(suscripcion)
+    """
+    for alias in [base_de(suscripcion)] if suscripcion is not None else bases():
+        with usar(alias):
+            yield alias
+
+
+def atomico(func=None, **kwargs):
+    """
+    transaction.atomic() en la base del tenant actual. Como decorador va
+    sin paréntesis (@atomico): la base se elige en cada llamada.
+    """
+    if func is None:
+        return transaction.atomic(using=base_actual(), **kwargs)
+
+    @wraps(func)
+    def envuelta(*args, **kw):
+        with transaction.atomic(using=base_actual(), **kwargs):
+            return func(*args, **kw)
+    return envuelta
+
+
+# ============================================================
+#  MODELOS DEL TENANT
+# ============================================================
+_tenant = None
+
+
+def modelos_tenant():
+    """
+    [(modelo, ruta a la suscripción)] de los modelos del tenant, padres
+    antes que hijos (orden para copiar; al revés, para borrar).
+    """
+    global _tenant
+    if _tenant is None:
+        modelos = [m for m in apps.get_app_config(APP).get_models() if m._meta.label_lower not in GLOBALES]
+        _tenant = [(m, _ruta_suscripcion(m)) for m in _ordenar(modelos)]
+    return _tenant
+
+
+def es_del_tenant(model):
+    return model._meta.app_label == APP and model._meta.label_lower not in GLOBALES and not model._meta.auto_created
+
+
+def _fks(modelo):
+    return [f for f in modelo._meta.concrete_fields if f.is_relation and f.many_to_one]
+
+
+def _ruta_suscripcion(modelo):
+    """Lookup más corto por FKs obligatorios hasta SuscripcionCliente ('mp__suscripcion', ...)."""
+    cola, vistos = deque([(modelo, [])]), {modelo}
+    while cola:
+        actual, camino = cola.popleft()
+        for f in _fks(actual):
+            if f.null:
+                continue
+            destino = f.related_model
+            if destino._meta.label_lower == "inventario.suscripcioncliente":
+                return "__".join(camino + [f.name])
+            if destino not in vistos and es_del_tenant(destino):
+                vistos.add(destino)
+                cola.append((destino, camino + [f.name]))
+    raise ImproperlyConfigured(f"{modelo._meta.label} no llega a SuscripcionCliente por FKs obligatorios.")
+
+
+def _ordenar(modelos):
+    """Orden topológico por FKs (a quien se apunta va primero)."""
+    pendientes = {m: {f.related_model for f in _fks(m) if f.related_model in modelos and f.related_model is not m}
+                  for m in modelos}
+    orden = []
+    while pendientes:
+        listos = [m for m, deps in pendientes.items() if not deps - set(orden)]
+        if not listos:
+            raise ImproperlyConfigured(f"Ciclo de FKs entre {', '.join(m._meta.label for m in pendientes)}.")
+        for m in sorted(listos, key=lambda m: m._meta.label):
+            orden.append(m)
+            del pendientes[m]
+    return orden
+
+
+# ============================================================
+#  ROUTER Y MIDDLEWARE
+# ============================================================
+def _base_de_instancia(hints):
+    instancia = hints.get("instance")
+    db = getattr(getattr(instancia, "_state", None), "db", None)
+    return db if db in getattr(settings, "SHARDS", ()) else None
+
+
+class RouterShards:
+    """
+    Modelos del tenant → base del tenant actual (o la del objeto desde el
+    que se navega). Devuelve None para lo que va a 'default', así decide
+    el router que sigue (la réplica de reportes).
+    """
+    def db_for_read(self, model, **hints):
+        if es_del_tenant(model):
+            alias = _base_de_instancia(hints) or base_actual()
+            return alias if alias != DEFAULT_DB_ALIAS else None
+        # Un usuario o una unidad navegados desde un objeto del shard se
+        # leen del directorio, no de la copia de referencia.
+        return DEFAULT_DB_ALIAS if _base_de_instancia(hints) else None
+
+    db_for_write = db_for_read
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Dos objetos del tenant de bases distintas no se pueden relacionar.
+        # _meta.model y no type(): request.user llega como SimpleLazyObject.
+        if (es_del_tenant(obj1._meta.model) and es_del_tenant(obj2._meta.model)
+                and obj1._state.db and obj2._state.db):
+            return obj1._state.db == obj2._state.db
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # Los shards tienen el esquema completo (los FKs apuntan a las copias de referencia).
+        return None
+
+
+class ShardMiddleware:
+    """Fija la base del tenant del usuario; con el tenant en mudanza rechaza las escrituras."""
+    METODOS_SEGUROS = ("GET", "HEAD", "OPTIONS", "TRACE")
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        suscripcion = getattr(request.user, "suscripcion", None) if request.user.is_authenticated else None
+        if suscripcion is None:
+            return self.get_response(request)
+        if suscripcion.en_mudanza and request.method not in self.METODOS_SEGUROS:
+            resp = JsonResponse({"detail": "La empresa se está moviendo de base de datos; reintente en unos minutos."},
+                                status=503)
+            resp["Retry-After"] = "60"
+            return resp
+        with usar(suscripcion):
+            return self.get_response(request)
+
+
+# ============================================================
+#  COPIAS DE REFERENCIA E IDS POR BLOQUE
+# ============================================================
+def _copiar_filas(modelo, qs, alias):
+    """Upsert por pk de las filas de 'qs' (leídas de 'default') en 'alias'."""
+    filas = list(qs.using(DEFAULT_DB_ALIAS))
+    if filas:
+        modelo._base_manager.using(alias).bulk_create(
+            filas, update_conflicts=True, unique_fields=[modelo._meta.pk.name],
+            update_fields=[f.name for f in modelo._meta.concrete_fields if not f.primary_key],
+        )
+    return len(filas)
+
+
+def sincronizar_referencias(alias, suscripcion=None, usuarios=()):
+    """
+    Copia al shard las filas del directorio a las que apuntan los modelos
+    del tenant: todas las unidades, la suscripción, sus miembros y los
+    usuarios extra de 'usuarios' (ids).
+    """
+    if alias == DEFAULT_DB_ALIAS:
+        return
+    from .models import SuscripcionCliente, UnidadMedida, User
+
+    _copiar_filas(UnidadMedida, UnidadMedida.objects.all(), alias)
+    if suscripcion is not None:
+        _copiar_filas(SuscripcionCliente, SuscripcionCliente.objects.filter(pk=suscripcion.pk), alias)
+        # Los usuarios de otra empresa que aparezcan (created_by) apuntan a la suya.
+        extra = User.objects.filter(pk__in=usuarios).exclude(suscripcion=suscripcion)
+        _copiar_filas(SuscripcionCliente, SuscripcionCliente.objects.filter(
+            pk__in=extra.exclude(suscripcion=None).values("suscripcion_id")), alias)
+        _copiar_filas(User, User.objects.filter(suscripcion=suscripcion) | extra, alias)
+
+
+def reservar_ids(alias):
+    """
+    Lleva las secuencias de los modelos del tenant en 'alias' al comienzo
+    de su bloque de ids (no las baja si ya pasaron). Idempotente.
+    """
+    if alias == DEFAULT_DB_ALIAS:
+        return
+    inicio = (settings.SHARDS.index(alias) + 1) * getattr(settings, "SHARD_BLOQUE_IDS", 10**12)
+    conn = connections[alias]
+    with transaction.atomic(using=alias), conn.cursor() as cur:
+        for modelo, _ in modelos_tenant():
+            tabla, columna = modelo._meta.db_table, modelo._meta.pk.column
+            if conn.vendor == "sqlite":
+                cur.execute("UPDATE sqlite_sequence SET seq = MAX(seq, %s) WHERE name = %s", [inicio - 1, tabla])
+                if not cur.rowcount:
+                    cur.execute("INSERT INTO sqlite_sequence (name, seq) VALUES (%s, %s)", [tabla, inicio - 1])
+            elif conn.vendor == "postgresql":
+                cur.execute("SELECT pg_get_serial_sequence(%s, %s)", [tabla, columna])
+                secuencia = cur.fetchone()[0]
+                cur.execute(f"SELECT last_value FROM {secuencia}")
+                if cur.fetchone()[0] < inicio:
+                    cur.execute("SELECT setval(%s, %s, false)", [secuencia, inicio])
+
+
+def copiar_referencia(instancia):
+    """
+    Actualiza la copia de una fila del directorio recién guardada: la
+    suscripción o el usuario en el shard de su empresa; una unidad, en
+    todos los shards.
+    """
+    from .models import SuscripcionCliente, UnidadMedida
+
+    if isinstance(instancia, UnidadMedida):
+        destinos = bases()[1:]
+    else:
+        suscripcion = instancia if isinstance(instancia, SuscripcionCliente) else instancia.suscripcion
+        destinos = [base_de(suscripcion)] if suscripcion is not None else []
+    for alias in destinos:
+        if alias != DEFAULT_DB_ALIAS:
+            _copiar_filas(type(instancia), type(instancia).objects.filter(pk=instancia.pk), alias)
+
+
+# ============================================================
+#  MOVER UN TENANT ENTRE BASES
+# ============================================================
+class MudanzaError(Exception):
+    pass
+
+
+def _del_tenant(modelo, ruta, suscripcion, alias):
+    return modelo._base_manager.using(alias).filter(**{ruta: suscripcion.pk})
+
+
+def contar(suscripcion, alias):
+    """{modelo: filas del tenant en 'alias'}."""
+    return {modelo: _del_tenant(modelo, ruta, suscripcion, alias).count() for modelo, ruta in modelos_tenant()}
+
+
+def _tandas_crudas(qs, columnas, alias, tanda):
+    """Filas de 'qs' tal como están en la base (sin pasar por modelos), por tandas de pk."""
+    conn, ultimo = connections[alias], None
+    while True:
+        sql, params = ((qs if ultimo is None else qs.filter(pk__gt=ultimo))
+                       .values_list(*columnas)[:tanda].query.sql_with_params())
+        with conn.cursor() as cur:
+            cur.execute(sql, params)
+            filas = cur.fetchall()
+        if not filas:
+            return
+        yield filas
+        ultimo = filas[-1][0]
+
+
+def _tandas_modelos(qs, tanda):
+    ultimo = None
+    while True:
+        lote = list((qs if ultimo is None else qs.filter(pk__gt=ultimo))[:tanda])
+        if not lote:
+            return
+        yield lote
+        ultimo = lote[-1].pk
+
+
+def _copiar_modelo(modelo, qs, origen, destino, tanda):
+    """
+    Copia las filas de 'qs' (en 'origen') a 'destino' con los mismos ids.
+    Devuelve (filas, ids de usuario referenciados). Entre bases del mismo
+    motor los valores pasan crudos (executemany); si no, por el ORM.
+    """
+    from .models import User
+
+    campos = [modelo._meta.pk] + [f for f in modelo._meta.concrete_fields if not f.primary_key]
+    de_usuario = [i for i, f in enumerate(campos) if f.is_relation and f.related_model is User]
+    conn = connections[destino]
+    n, usuarios = 0, set()
+    if connections[origen].vendor == conn.vendor:
+        q = conn.ops.quote_name
+        sql = (f"INSERT INTO {q(modelo._meta.db_table)} ({', '.join(q(f.column) for f in campos)}) "
+               f"VALUES ({', '.join(['%s'] * len(campos))})")
+        for filas in _tandas_crudas(qs.order_by("pk"), [f.attname for f in campos], origen, tanda):
+            with conn.cursor() as cur:
+                cur.executemany(sql, filas)
+            usuarios.update(fila[i] for fila in filas for i in de_usuario)
+            n += len(filas)
+    else:
+        for lote in _tandas_modelos(qs.order_by("pk"), tanda):
+            # raw=True: los valores van tal cual (auto_now_add no pisa las fechas).
+            paso = conn.ops.bulk_batch_size(campos, lote) or len(lote)
+            for i in range(0, len(lote), paso):
+                modelo._base_manager._insert(lote[i:i + paso], fields=campos, using=destino, raw=True)
+            usuarios.update(getattr(obj, campos[i].attname) for obj in lote for i in de_usuario)
+            n += len(lote)
+    return n, usuarios
+
+
+def _copiar_tenant(suscripcion, origen, destino, tanda):
+    """
+    Copia las filas del tenant de 'origen' a 'destino' conservando los ids,
+    en UNA transacción del destino: los FKs se verifican al confirmar
+    (son diferidos en PostgreSQL y SQLite), así que un error no deja nada
+    a medias. Devuelve {modelo: filas copiadas}.
+    """
+    copiados, usuarios = {}, set()
+    with transaction.atomic(using=destino):
+        for modelo, ruta in modelos_tenant():
+            copiados[modelo], de_usuario = _copiar_modelo(
+                modelo, _del_tenant(modelo, ruta, suscripcion, origen), origen, destino, tanda)
+            usuarios |= de_usuario
+
+        usuarios.discard(None)
+        sincronizar_referencias(destino, suscripcion, usuarios)
+        # Lo que haya entrado en el origen mientras tanto (no debería: el
+        # tenant está en mudanza) deja la cuenta distinta y se deshace todo.
+        for modelo, ruta in modelos_tenant():
+            en_origen = _del_tenant(modelo, ruta, suscripcion, origen).count()
+            if en_origen != copiados[modelo]:
+                raise MudanzaError(f"{modelo._meta.label}: {en_origen} filas en '{origen}', "
+                                   f"{copiados[modelo]} copiadas. No se movió nada.")
+    return copiados
+
+
+def borrar_tenant(suscripcion, alias):
+    """
+    Borra las filas del tenant de una base que ya no es la suya (hijos
+    antes que padres, una transacción por modelo). Devuelve las borradas.
+    """
+    if alias == base_de(suscripcion):
+        raise MudanzaError(f"'{alias}' es la base actual de la suscripción {suscripcion.pk}.")
+    total = 0
+    for modelo, ruta in reversed(modelos_tenant()):
+        with transaction.atomic(using=alias):
+            total += _del_tenant(modelo, ruta, suscripcion, alias)._raw_delete(alias)
+    return total
+
+
+def mover(suscripcion, destino, tanda=2000, borrar_origen=True):
+    """
+    Mueve el tenant a 'destino' (alias ya migrado):
+
+      1. marca la suscripción en mudanza (sus escrituras reciben 503),
+      2. copia sus filas al destino con los mismos ids (_copiar_tenant),
+      3. apunta base_datos al destino y levanta la marca,
+      4. borra las filas del origen (borrar_tenant).
+
+    Si falla en 1-3 el tenant sigue donde estaba, sin cambios. Devuelve
+    {modelo: filas movidas}.
+    """
+    from .models import SuscripcionCliente
+
+    origen = base_de(suscripcion)
+    if destino not in bases():
+        raise MudanzaError(f"'{destino}' no es una base de tenants ({', '.join(bases())}).")
+    if destino == origen:
+        raise MudanzaError(f"La suscripción {suscripcion.pk} ya está en '{destino}'.")
+    restos = [m._meta.label for m, n in contar(suscripcion, destino).items() if n]
+    if restos:
+        raise MudanzaError(f"'{destino}' ya tiene filas de la suscripción {suscripcion.pk} "
+                           f"({', '.join(restos)}); bórrelas primero (--borrar-de {destino}).")
+
+    directorio = SuscripcionCliente.objects.filter(pk=suscripcion.pk)
+    directorio.update(en_mudanza=True)
+    try:
+        reservar_ids(destino)
+        copiados = _copiar_tenant(suscripcion, origen, destino, tanda)
+    except BaseException:
+        directorio.update(en_mudanza=False)
+        raise
+    directorio.update(base_datos=destino, en_mudanza=False)
+    suscripcion.base_datos, suscripcion.en_mudanza = destino, False
+
+    if borrar_origen:
+        borrar_tenant(suscripcion, origen)
+    return copiados
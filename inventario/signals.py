@@ -1,5 +1,5 @@
 from django.dispatch import receiver
-from django.db.models.signals import post_save
+from django.db.models.signals import post_save, post_delete
 from allauth.account.signals import user_signed_up
 from django.contrib.auth.models import Group, User # Importa tu User
 
@@ -18,4 +18,141 @@ def handle_social_signup(request, user, **kwargs):
         # Manejar error si el grupo no existe (aunque no debería pasar)
         print("ADVERTENCIA: El grupo 'Gerente' no existe. El usuario no tendrá permisos.")
         pass
-    user.save()
\ No newline at end of file
+    user.save()
+
+
+# ============================================================
+#  CACHÉ DE COSTOS DE RECETAS (ver inventario/costos.py)
+# ============================================================
+from .models import MovimientoMP, Receta, RecetaLinea
+from .costos import recalcular_recetas
+
+@receiver(post_save, sender=MovimientoMP)
+def costo_mp_cambiado(sender, instance, created, **kwargs):
+    # MovimientoMP.save() marca 'costo_cambiado' si el INGRESO movió el promedio.
+    if created and getattr(instance, "costo_cambiado", False):
+        recalcular_recetas(mp_ids=[instance.mp_id])
+
+@receiver(post_save, sender=RecetaLinea)
+@receiver(post_delete, sender=RecetaLinea)
+def receta_linea_cambiada(sender, instance, **kwargs):
+    recalcular_recetas(receta_ids=[instance.receta_id])
+
+@receiver(post_save, sender=Receta)
+def receta_guardada(sender, instance, **kwargs):
+    # El rendimiento por lote también cambia el costo unitario; activar o
+    # desactivar una versión cambia el de las recetas que usan el producto.
+    recalcular_recetas(receta_ids=[instance.pk], producto_ids=[instance.producto_id])
+
+
+# ============================================================
+#  REGISTRO DE UNIDADES DE MEDIDA (ver inventario/unidades.py)
+# ============================================================
+from .models import UnidadMedida
+from . import unidades
+
+@receiver(post_save, sender=UnidadMedida)
+@receiver(post_delete, sender=UnidadMedida)
+def limpiar_registro_unidades(sender, **kwargs):
+    unidades.limpiar()
+
+
+# ============================================================
+#  MÉTRICAS DE CONEXIONES (ver inventario/conexiones.py)
+# ============================================================
+from django.db.backends.signals import connection_created
+from . import conexiones
+
+@receiver(connection_created)
+def conexion_abierta(sender, connection, **kwargs):
+    conexiones.registrar_apertura(connection)
+
+
+# ============================================================
+#  COPIAS DE REFERENCIA EN LOS SHARDS (ver inventario/shards.py)
+# ============================================================
+from django.db import DEFAULT_DB_ALIAS
+from .models import SuscripcionCliente
+from . import shards
+
+@receiver(post_save, sender=SuscripcionCliente)
+@receiver(post_save, sender="inventario.User")
+@receiver(post_save, sender=UnidadMedida)
+def copiar_referencia(sender, instance, raw=False, using=None, **kwargs):
+    # Solo lo que se guarda en el directorio; loaddata (raw) no.
+    if not raw and using == DEFAULT_DB_ALIAS and shards.bases()[1:]:
+        shards.copiar_referencia(instance)
+
+
+# ============================================================
+#  VERSIÓN DE DATOS PARA LA CACHÉ DEL PANEL (ver inventario/cache_empresa.py)
+# ============================================================
+from .models import LoteProducto, MateriaPrima, OrdenProduccion, Producto, Sucursal, Venta, VentaLinea
+from . import cache_empresa
+
+# modelo → FK por la que se llega a la empresa (None: la tiene directo).
+# MPs, productos y sucursales: sus nombres (y 'activo') salen en los widgets.
+_CAMINO_EMPRESA = {MovimientoMP: "mp", LoteProducto: "producto", OrdenProduccion: "producto",
+                   Venta: None, VentaLinea: "venta", MateriaPrima: None, Producto: None, Sucursal: None}
+
+def datos_cambiados(sender, instance, using=None, raw=False, **kwargs):
+    if raw:
+        return
+    campo = _CAMINO_EMPRESA[sender]
+    sid = instance.suscripcion_id if campo is None else cache_empresa.empresa_de(instance, campo)
+    cache_empresa.invalidar(sid, using)
+
+for _modelo in _CAMINO_EMPRESA:
+    post_save.connect(datos_cambiados, sender=_modelo, dispatch_uid=f"datos_cambiados_save_{_modelo.__name__}")
+    post_delete.connect(datos_cambiados, sender=_modelo, dispatch_uid=f"datos_cambiados_delete_{_modelo.__name__}")
+
+
+# ============================================================
+#  EVENTOS EN VIVO DEL PANEL (ver inventario/eventos.py)
+# ============================================================
+from django.utils import timezone
+from . import eventos
+
+def _dia(momento):
+    return timezone.localtime(momento).date().isoformat()
+
+def _cambio_a(instance, estado, update_fields):
+    # consumir_fifo() / ejecutar() guardan solo 'estado' al confirmar.
+    return instance.estado == estado and update_fields is not None and "estado" in update_fields
+
+@receiver(post_save, sender=Venta)
+def venta_confirmada(sender, instance, update_fields=None, raw=False, using=None, **kwargs):
+    if raw or not _cambio_a(instance, Venta.CONFIRMADA, update_fields):
+        return
+    lineas = [{"producto": nombre, "cantidad": float(cantidad)}
+              for nombre, cantidad in instance.lineas.values_list("producto__nombre", "cantidad")]
+    eventos.publicar(instance.suscripcion_id, "venta",
+                     {"id": instance.pk, "fecha": _dia(instance.fecha), "lineas": lineas}, using)
+
+@receiver(post_save, sender=OrdenProduccion)
+def op_ejecutada(sender, instance, update_fields=None, raw=False, using=None, **kwargs):
+    if raw or not _cambio_a(instance, OrdenProduccion.CONSUMIDA, update_fields):
+        return
+    eventos.publicar(instance.producto.suscripcion_id, "op", {
+        "id": instance.pk, "fecha": _dia(instance.fecha), "producto": instance.producto.nombre,
+        "unidades": float(instance.unidades_totales),
+    }, using)
+
+@receiver(post_save, sender=MovimientoMP)
+def merma_registrada(sender, instance, created, raw=False, using=None, **kwargs):
+    if raw or not created or instance.tipo != MovimientoMP.MERMA:
+        return
+    eventos.publicar(instance.mp.suscripcion_id, "merma", {
+        "id": instance.pk, "fecha": _dia(instance.fecha), "mp": instance.mp.nombre,
+        "cantidad": float(instance.cantidad),
+    }, using)
+
+@receiver(post_save, sender=LoteProducto)
+def lote_guardado(sender, instance, raw=False, using=None, **kwargs):
+    if raw:
+        return
+    eventos.publicar(instance.producto.suscripcion_id, "lote", {
+        "id": instance.pk, "codigo": instance.codigo, "producto": instance.producto.nombre,
+        "estado": instance.estado, "disponible": float(instance.cantidad_disponible),
+        "disponible_fmt": instance.cantidad_disponible_fmt, "vencimiento": instance.fecha_vencimiento.isoformat(),
+    }, using)
@@ -1,3 +1,1741 @@
-from django.test import TestCase
+# inventario/tests.py
+# ============================================================
+#  TESTS DEL INVENTARIO
+# ============================================================
+# Cada sección cubre un módulo (api, idempotencia, saldos, ...). Los
+# datos base salen de Empresa: una suscripción con su usuario (todos los
+# permisos de la app), una sucursal con dos ubicaciones, Harina y Agua
+# en kg y una receta de Pan (rinde 10 un por lote: 1 kg Harina + 0,5 kg
+# Agua).
+#
+# Los tests de la réplica y de los shards se saltean si sus alias no
+# están configurados. Para correrlos:
+#
+#   DATABASE_REPLICA_URL=sqlite:////tmp/replica.sqlite3 \
+#   DATABASE_SHARDS="s1=sqlite:////tmp/s1.sqlite3;s2=sqlite:////tmp/s2.sqlite3" \
+#   python manage.py test inventario
+import asyncio
+import importlib
+import json
+import os
+import tempfile
+from datetime import timedelta
+from decimal import Decimal
+from io import StringIO
+from unittest import mock, skipUnless
 
-# Create your tests here.
+from django.apps import apps as django_apps
+from django.conf import settings
+from django.contrib.auth.models import Permission
+from django.contrib.sessions.models import Session
+from django.core.cache import cache
+from django.core.exceptions import ValidationError
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import DatabaseError, connection, connections, transaction
+from django.db.models import Sum
+from django.db.utils import ConnectionHandler, load_backend
+from django.test import Client, SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+import pandas as pd
+from rest_framework.test import APIClient
+
+from bigmomma import basedatos
+
+from . import (
+    archivo, bom, cache_empresa, cierre_pos, conteos, costos, eventos, idempotencia, instrumentacion, reabastecimiento,
+    replicas, reservas, saldos, shards, trazabilidad, unidades, views,
+)
+from .forms import RecetaLineaFormSet
+from .models import (
+    ConteoFisico, LoteProducto, MateriaPrima, MovimientoMP, OrdenProduccion, Producto, Receta, RecetaLinea,
+    RespuestaIdempotente, SaldoDiarioMP, StockInsuficiente, StockPorUbicacion, StockReserva, Sucursal,
+    SuscripcionCliente, Traslado, TrasladoLinea, TrazaEnlace, Ubicacion, UnidadMedida, User, Venta, VentaConsumo,
+)
+
+D = Decimal
+
+
+# ============================================================
+#  DATOS BASE
+# ============================================================
+class Empresa(TestCase):
+    """Tenant completo en setUpTestData; self.api es un APIClient con sesión."""
+    # Con DATABASE_SHARDS las unidades y los usuarios se copian a los shards.
+    databases = set(shards.bases())
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.s, cls.u = cls.crear_empresa("Panadería")
+        cls.suc = Sucursal.objects.create(suscripcion=cls.s, nombre="Central", es_principal=True)
+        cls.ub1 = Ubicacion.objects.create(sucursal=cls.suc, nombre="Depósito")
+        cls.ub2 = Ubicacion.objects.create(sucursal=cls.suc, nombre="Cámara")
+        cls.kg = UnidadMedida.objects.get_or_create(nombre="kg")[0]
+        cls.un = UnidadMedida.objects.get_or_create(nombre="un")[0]
+        cls.harina = MateriaPrima.objects.create(suscripcion=cls.s, nombre="Harina", unidad=cls.kg)
+        cls.agua = MateriaPrima.objects.create(suscripcion=cls.s, nombre="Agua", unidad=cls.kg)
+        cls.pan = Producto.objects.create(suscripcion=cls.s, nombre="Pan", unidad=cls.un)
+        cls.receta = Receta.objects.create(producto=cls.pan, rendimiento_por_lote=D("10"))
+        RecetaLinea.objects.create(receta=cls.receta, mp=cls.harina, cantidad=D("1"))
+        RecetaLinea.objects.create(receta=cls.receta, mp=cls.agua, cantidad=D("0.5"))
+
+    @staticmethod
+    def crear_empresa(nombre):
+        s = SuscripcionCliente.objects.create(nombre_empresa=nombre, plan_actual="multi_sucursal",
+                                              ha_completado_onboarding=True)
+        u = User.objects.create_user(username=f"u_{nombre}", password="x", suscripcion=s)
+        u.user_permissions.set(Permission.objects.filter(content_type__app_label="inventario"))
+        return s, u
+
+    def setUp(self):
+        self.api = APIClient()
+        self.api.force_login(self.u)
+
+    # ---------------- atajos ----------------
+    def ingreso(self, mp, cantidad, ubicacion=None, costo=None, **kwargs):
+        return MovimientoMP.objects.create(mp=mp, ubicacion=ubicacion or self.ub1, tipo=MovimientoMP.INGRESO,
+                                           cantidad=D(cantidad), costo_unitario=costo, **kwargs)
+
+    def stock(self, mp, ubicacion=None):
+        fila = StockPorUbicacion.objects.filter(mp=mp, ubicacion=ubicacion or self.ub1).first()
+        return fila.stock if fila else D("0")
+
+    def producir(self, lotes="1"):
+        """OP del Pan ejecutada: devuelve su LoteProducto."""
+        op = OrdenProduccion.objects.create(producto=self.pan, receta=self.receta, lotes=D(lotes), sucursal=self.suc)
+        op.ejecutar(user=self.u)
+        return LoteProducto.objects.get(op=op)
+
+    def vender(self, cantidad, confirmar=True):
+        venta = Venta.objects.create(suscripcion=self.s, sucursal=self.suc)
+        venta.lineas.create(producto=self.pan, cantidad=D(cantidad))
+        if confirmar:
+            venta.consumir_fifo(user=self.u)
+        return venta
+
+
+# ============================================================
+#  API (POS / ESCÁNERES)
+# ============================================================
+class ApiTests(Empresa):
+    def test_movimiento_suma_stock(self):
+        r = self.api.post("/api/movimientos/", {"mp": self.harina.pk, "ubicacion": self.ub1.pk,
+                                                "tipo": "INGRESO", "cantidad": "5"}, format="json")
+        self.assertEqual(r.status_code, 201, r.content)
+        self.assertEqual(r.json()["cantidad_signed"], "5.000")
+        self.assertEqual(self.stock(self.harina), D("5"))
+
+    def test_no_ve_datos_de_otra_empresa(self):
+        otra, _ = self.crear_empresa("Otra")
+        ajena = MateriaPrima.objects.create(suscripcion=otra, nombre="Sal", unidad=self.kg)
+        r = self.api.post("/api/movimientos/", {"mp": ajena.pk, "ubicacion": self.ub1.pk,
+                                                "tipo": "INGRESO", "cantidad": "1"}, format="json")
+        self.assertEqual(r.status_code, 400)
+        self.assertIn("mp", r.json())
+
+    def test_batch_reporta_por_item(self):
+        self.ingreso(self.harina, "2")
+        r = self.api.post("/api/movimientos/batch/", [
+            {"mp": self.harina.pk, "ubicacion": self.ub1.pk, "tipo": "CONSUMO", "cantidad": "1"},
+            {"mp": self.harina.pk, "ubicacion": self.ub1.pk, "tipo": "CONSUMO", "cantidad": "5"},
+        ], format="json")
+        self.assertEqual(r.status_code, 207)
+        self.assertEqual([x["ok"] for x in r.json()["resultados"]], [True, False])
+        self.assertEqual(self.stock(self.harina), D("1"))
+
+    def test_venta_confirmada_consume_lotes(self):
+        self.ingreso(self.harina, "10"); self.ingreso(self.agua, "10")
+        lote = self.producir("1")
+        r = self.api.post("/api/ventas/", {"sucursal": self.suc.pk, "confirmar": True,
+                                           "lineas": [{"producto": self.pan.pk, "cantidad": "4"}]}, format="json")
+        self.assertEqual(r.status_code, 201, r.content)
+        self.assertEqual(r.json()["estado"], Venta.CONFIRMADA)
+        self.assertEqual([c["lote"] for c in r.json()["consumos"]], [lote.pk])
+        lote.refresh_from_db()
+        self.assertEqual(lote.cantidad_disponible, D("6"))
+
+    def test_listado_paginado_por_cursor(self):
+        for _ in range(3):
+            self.ingreso(self.harina, "1")
+        r = self.api.get("/api/movimientos/?page_size=2")
+        self.assertEqual(r.status_code, 200)
+        self.assertEqual(len(r.json()["results"]), 2)
+        siguiente = self.api.get(r.json()["next"])
+        self.assertEqual(len(siguiente.json()["results"]), 1)
+
+
+# ============================================================
+#  IDEMPOTENCIA
+# ============================================================
+class IdempotenciaTests(Empresa):
+    def _ingreso(self, llave, cantidad="5", cliente=None):
+        return (cliente or self.api).post(
+            "/api/movimientos/", {"mp": self.harina.pk, "ubicacion": self.ub1.pk, "tipo": "INGRESO", "cantidad": cantidad},
+            format="json", HTTP_IDEMPOTENCY_KEY=llave)
+
+    def test_reintento_devuelve_la_respuesta_guardada(self):
+        primera = self._ingreso("k1")
+        segunda = self._ingreso("k1")
+        self.assertEqual(primera.status_code, 201)
+        self.assertEqual(segunda.status_code, 201)
+        self.assertEqual(segunda.content, primera.content)
+        self.assertEqual(segunda["Idempotent-Replay"], "true")
+        self.assertEqual(MovimientoMP.objects.filter(mp=self.harina).count(), 1)
+        self.assertEqual(self.stock(self.harina), D("5"))
+
+    def test_misma_llave_con_otro_contenido(self):
+        self._ingreso("k1")
+        r = self._ingreso("k1", cantidad="7")
+        self.assertEqual(r.status_code, 422)
+        self.assertEqual(self.stock(self.harina), D("5"))
+
+    def test_la_llave_es_por_usuario(self):
+        _, otro = self.crear_empresa("Otra")
+        otro.suscripcion = self.s; otro.save()
+        cliente = APIClient(); cliente.force_login(otro)
+        self._ingreso("k1")
+        r = self._ingreso("k1", cliente=cliente)
+        self.assertNotIn("Idempotent-Replay", r)
+        self.assertEqual(self.stock(self.harina), D("10"))
+
+    def test_sin_llave_no_deduplica(self):
+        self._ingreso(""); self._ingreso("")
+        self.assertEqual(self.stock(self.harina), D("10"))
+        self.assertFalse(RespuestaIdempotente.objects.exists())
+
+    def test_purgar_expiradas(self):
+        self._ingreso("k1")
+        RespuestaIdempotente.objects.update(expira=timezone.now() - timedelta(seconds=1))
+        self.assertEqual(idempotencia.purgar_expiradas(), 1)
+        self.assertEqual(self._ingreso("k1").status_code, 201)
+        self.assertEqual(self.stock(self.harina), D("10"))
+
+
+# ============================================================
+#  SALDOS: CONCILIACIÓN Y SNAPSHOTS
+# ============================================================
+def hace(dias, hora=12):
+    """Datetime aware de hace 'dias' días a la 'hora' local."""
+    return saldos.inicio_dia(timezone.localdate() - timedelta(days=dias)) + timedelta(hours=hora)
+
+
+class SaldosTests(Empresa):
+    def test_conciliar_detecta_y_repara(self):
+        self.ingreso(self.harina, "5")
+        StockPorUbicacion.objects.filter(mp=self.harina).update(stock=D("7"))
+        difs = saldos.conciliar(self.s, reparar=True)
+        self.assertEqual([(d.stock_registrado, d.stock_kardex) for d in difs], [(D("7"), D("5"))])
+        self.assertEqual(self.stock(self.harina), D("5"))
+        self.assertEqual(saldos.conciliar(self.s), [])
+
+    def test_snapshots_diarios(self):
+        self.ingreso(self.harina, "5", fecha=hace(3))
+        self.ingreso(self.harina, "2", fecha=hace(3))
+        self.ingreso(self.harina, "1", fecha=hace(1))
+        self.assertEqual(saldos.generar_snapshots(suscripcion=self.s), 2)
+        fotos = dict(SaldoDiarioMP.objects.filter(mp=self.harina).values_list("fecha", "stock"))
+        self.assertEqual(fotos, {hace(3).date(): D("7"), hace(1).date(): D("8")})
+        # Sin movimientos nuevos no hay nada que escribir.
+        self.assertEqual(saldos.generar_snapshots(suscripcion=self.s), 0)
+
+    def test_corrida_global_retoma_por_empresa(self):
+        otra, _ = self.crear_empresa("Otra")
+        suc = Sucursal.objects.create(suscripcion=otra, nombre="Norte", es_principal=True)
+        ub = Ubicacion.objects.create(sucursal=suc, nombre="Depósito")
+        sal = MateriaPrima.objects.create(suscripcion=otra, nombre="Sal", unidad=self.kg)
+        self.ingreso(self.harina, "5", fecha=hace(1))
+        self.ingreso(sal, "3", ubicacion=ub, fecha=hace(2))
+        saldos.generar_snapshots(suscripcion=self.s)
+        # La otra empresa está atrasada: la corrida global igual le escribe su día.
+        saldos.generar_snapshots()
+        self.assertEqual(list(SaldoDiarioMP.objects.filter(mp=sal).values_list("fecha", "stock")),
+                         [(hace(2).date(), D("3"))])
+
+
+# ============================================================
+#  STOCK A UNA FECHA
+# ============================================================
+class StockAFechaTests(Empresa):
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        MovimientoMP.objects.create(mp=cls.harina, ubicacion=cls.ub1, tipo=MovimientoMP.INGRESO,
+                                    cantidad=D("10"), fecha=hace(5))
+        MovimientoMP.objects.create(mp=cls.harina, ubicacion=cls.ub2, tipo=MovimientoMP.INGRESO,
+                                    cantidad=D("4"), fecha=hace(4))
+        MovimientoMP.objects.create(mp=cls.harina, ubicacion=cls.ub1, tipo=MovimientoMP.CONSUMO,
+                                    cantidad=D("3"), fecha=hace(2, hora=9))
+        MovimientoMP.objects.create(mp=cls.harina, ubicacion=cls.ub1, tipo=MovimientoMP.CONSUMO,
+                                    cantidad=D("1"), fecha=hace(2, hora=18))
+
+    def _esperados(self):
+        return [
+            saldos.stock_at(self.harina, self.ub1, hace(6).date()),
+            saldos.stock_at(self.harina, self.ub1, hace(5).date()),
+            saldos.stock_at(self.harina, self.ub1, hace(2, hora=12)),
+            saldos.stock_at(self.harina, self.ub1, hace(2).date()),
+            saldos.stock_at(self.harina, self.suc, hace(4).date()),
+        ]
+
+    def test_stock_a_fecha_y_hora(self):
+        self.assertEqual(self._esperados(), [D("0"), D("10"), D("7"), D("6"), D("14")])
+
+    def test_mismo_resultado_con_fotos(self):
+        sin_fotos = self._esperados()
+        saldos.generar_snapshots(suscripcion=self.s, hasta=hace(3).date())
+        self.assertTrue(SaldoDiarioMP.objects.exists())
+        self.assertEqual(self._esperados(), sin_fotos)
+
+    def test_reporte_csv(self):
+        self.client.force_login(self.u)
+        r = self.client.get("/reporte/stock-a-fecha/", {"fecha": hace(3).date().isoformat(), "formato": "csv"})
+        self.assertEqual(r.status_code, 200)
+        self.assertIn("Harina,Central,14.000,kg", r.content.decode())
+
+
+# ============================================================
+#  TRAZABILIDAD
+# ============================================================
+class TrazabilidadTests(Empresa):
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        for mp in (cls.harina, cls.agua):
+            MovimientoMP.objects.create(mp=mp, ubicacion=cls.ub1, tipo=MovimientoMP.INGRESO, cantidad=D("10"))
+
+    def setUp(self):
+        super().setUp()
+        self.lote = self.producir("1")
+        self.venta1, self.venta2 = self.vender("4"), self.vender("3")
+
+    def test_adelante_desde_mp(self):
+        with self.assertNumQueries(3):
+            traza = trazabilidad.adelante(self.s, mp=self.harina)
+        self.assertEqual([l["codigo"] for l in traza["lotes"]], [self.lote.codigo])
+        self.assertEqual(traza["total_ventas"], 2)
+        self.assertEqual(sorted(v["cantidad"] for v in traza["lotes"][0]["ventas"]), [D("3"), D("4")])
+
+    def test_atras_desde_venta(self):
+        traza = trazabilidad.atras(self.s, venta=self.venta1)
+        insumos = {i["mp_nombre"]: i["cantidad"] for i in traza["lotes"][0]["insumos"]}
+        self.assertEqual(insumos, {"Harina": D("1"), "Agua": D("0.5")})
+        self.assertEqual([v["venta"] for v in traza["lotes"][0]["ventas"]], [self.venta1.pk])
+
+    def test_reconstruir_completa_lo_que_falta(self):
+        antes = TrazaEnlace.objects.count()
+        TrazaEnlace.objects.all().delete()
+        self.assertEqual(trazabilidad.reconstruir(), (0, 2, 2))
+        self.assertEqual(TrazaEnlace.objects.count(), antes)
+        self.assertEqual(trazabilidad.reconstruir(), (0, 0, 0))
+
+    def test_api_lote(self):
+        r = self.api.get(f"/api/lotes/{self.lote.pk}/traza/")
+        self.assertEqual(r.status_code, 200)
+        self.assertEqual(r.json()["total_ventas"], 2)
+
+
+# ============================================================
+#  COSTOS
+# ============================================================
+class CostosTests(Empresa):
+    def setUp(self):
+        super().setUp()
+        self.ingreso(self.harina, "10", costo=D("100"))
+        self.ingreso(self.harina, "10", costo=D("200"))
+        self.ingreso(self.agua, "10", costo=D("1"))
+
+    def test_costo_promedio_ponderado(self):
+        self.harina.refresh_from_db()
+        self.assertEqual(self.harina.costo_promedio, D("150"))
+
+    def test_cache_de_receta_se_actualiza_sola(self):
+        self.receta.refresh_from_db()
+        self.assertEqual(self.receta.costo_unitario, D("15.0500"))
+        self.ingreso(self.agua, "10", costo=D("21"))  # promedio 11
+        self.receta.refresh_from_db()
+        self.assertEqual(self.receta.costo_unitario, D("15.5500"))
+
+    def test_recalcular_todo_coincide(self):
+        Receta.objects.filter(pk=self.receta.pk).update(costo_unitario=0)
+        self.assertEqual(costos.recalcular_todo(self.s), 1)
+        self.receta.refresh_from_db()
+        self.assertEqual(self.receta.costo_unitario, D("15.0500"))
+        self.assertEqual(costos.recalcular_todo(self.s), 0)
+
+    def test_costo_de_lote_y_de_lo_vendido(self):
+        lote = self.producir("1")
+        self.assertEqual(lote.costo_unitario, D("15.0500"))
+        venta = self.vender("4")
+        self.assertEqual(venta.costo_total, D("60.2"))
+        self.assertEqual(costos.costo_ventas(Venta.objects.filter(pk=venta.pk)), {venta.pk: D("60.2000")})
+
+
+# ============================================================
+#  DATOS MASIVOS Y BENCHMARK
+# ============================================================
+class SembrarDatosTests(TestCase):
+    databases = set(shards.bases())
+
+    @classmethod
+    def setUpTestData(cls):
+        call_command("sembrar_datos", empresa="Bench", sucursales=2, ubicaciones=2, mps=30, productos=5, lineas=3,
+                     movimientos=400, lotes=20, ventas=40, dias=20, snapshots=True, stdout=StringIO())
+        cls.s = SuscripcionCliente.objects.get(nombre_empresa="Bench")
+
+    def test_stock_igual_al_kardex(self):
+        self.assertEqual(MovimientoMP.objects.filter(mp__suscripcion=self.s).count(), 400)
+        self.assertEqual(saldos.conciliar(self.s), [])
+
+    def test_lotes_descontados_por_ventas(self):
+        vendido = dict(VentaConsumo.objects.filter(venta__suscripcion=self.s).values("lote_id")
+                       .annotate(t=Sum("cantidad")).values_list("lote_id", "t"))
+        for lote in LoteProducto.objects.filter(producto__suscripcion=self.s):
+            self.assertEqual(lote.cantidad_disponible, lote.cantidad_inicial - vendido.get(lote.pk, D("0")))
+
+    def test_benchmark_escribe_json(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            salida = os.path.join(tmp, "bench.json")
+            call_command("benchmark", suscripcion=self.s.pk, repeticiones=1, solo=["movimiento_save"],
+                         salida=salida, stdout=StringIO())
+            with open(salida, encoding="utf-8") as f:
+                datos = json.load(f)
+        self.assertEqual(list(datos["resultados"]), ["movimiento_save"])
+        self.assertGreater(datos["resultados"]["movimiento_save"]["consultas"], 0)
+
+
+# ============================================================
+#  INSTRUMENTACIÓN
+# ============================================================
+@override_settings(INSTRUMENTACION_ACTIVA=True, INSTRUMENTACION_MUESTREO=1.0, INSTRUMENTACION_UMBRAL_N1=3)
+class InstrumentacionTests(Empresa):
+    def test_registro_detecta_n_mas_1_y_duplicadas(self):
+        registro = instrumentacion.Registro()
+        with connection.execute_wrapper(registro):
+            for mp in (self.harina, self.agua, self.harina):
+                list(StockPorUbicacion.objects.filter(mp_id=mp.pk))
+        resumen = registro.resumen(umbral_n1=3)
+        self.assertEqual(resumen["consultas"], 3)
+        self.assertEqual(resumen["duplicadas"], 1)
+        self.assertEqual(resumen["n_mas_1"][0]["veces"], 3)
+        self.assertIn("inventario/tests.py", resumen["n_mas_1"][0]["origen"])
+
+    def test_middleware_mide_y_expone_el_buffer(self):
+        self.ingreso(self.harina, "1")
+        with self.assertLogs("inventario.instrumentacion", "INFO") as logs:
+            r = self.api.get("/api/movimientos/")
+        self.assertIn("db;dur=", r["Server-Timing"])
+        self.assertEqual(json.loads(logs.records[0].getMessage())["ruta"], "/api/movimientos/")
+
+        admin = User.objects.create_superuser("admin", "admin@example.com", "x")
+        cliente = Client(); cliente.force_login(admin)
+        datos = cliente.get("/diagnostico/requests/", {"vista": "inventario:api-movimiento-list"}).json()
+        self.assertTrue(datos["activa"])
+        self.assertEqual(datos["requests"][0]["ruta"], "/api/movimientos/")
+        self.assertGreater(datos["requests"][0]["consultas"], 0)
+
+    @override_settings(LOGIN_URL="/accounts/login/")
+    def test_diagnostico_solo_superusuarios(self):
+        self.client.force_login(self.u)
+        self.assertEqual(self.client.get("/diagnostico/requests/").status_code, 302)
+
+
+# ============================================================
+#  ACTUALIZACIÓN DE STOCK (BLOQUEO / ATÓMICO)
+# ============================================================
+class ModoStockTests(Empresa):
+    def _en_cada_modo(self, prueba):
+        for modo in ("bloqueo", "atomico"):
+            with self.subTest(modo=modo), override_settings(STOCK_MODO_ACTUALIZACION=modo):
+                StockPorUbicacion.objects.all().delete()
+                MovimientoMP.objects.all().delete()
+                prueba()
+
+    def test_consumo_sin_stock_no_deja_nada(self):
+        def prueba():
+            self.ingreso(self.harina, "2")
+            with self.assertRaises(StockInsuficiente):
+                MovimientoMP.objects.create(mp=self.harina, ubicacion=self.ub1, tipo=MovimientoMP.CONSUMO,
+                                            cantidad=D("3"))
+            self.assertEqual(self.stock(self.harina), D("2"))
+            self.assertEqual(MovimientoMP.objects.count(), 1)
+        self._en_cada_modo(prueba)
+
+    def test_editar_y_borrar_ajustan_el_delta(self):
+        def prueba():
+            mov = self.ingreso(self.harina, "5")
+            mov.cantidad = D("8"); mov.save()
+            self.assertEqual(self.stock(self.harina), D("8"))
+            mov.delete()
+            self.assertEqual(self.stock(self.harina), D("0"))
+
+            # Borrar un INGRESO ya consumido dejaría el saldo negativo: no se borra nada.
+            ingreso = self.ingreso(self.harina, "5")
+            consumo = MovimientoMP.objects.create(mp=self.harina, ubicacion=self.ub1, tipo=MovimientoMP.CONSUMO,
+                                                  cantidad=D("3"))
+            with self.assertRaises(StockInsuficiente):
+                ingreso.delete()
+            self.assertTrue(MovimientoMP.objects.filter(pk=ingreso.pk).exists())
+            self.assertEqual(self.stock(self.harina), D("2"))
+            # En orden inverso sí: el CONSUMO devuelve y el INGRESO resta lo que hay.
+            consumo.delete()
+            ingreso.delete()
+            self.assertEqual(self.stock(self.harina), D("0"))
+        self._en_cada_modo(prueba)
+
+    def test_aplicar_delta_no_pierde_actualizaciones(self):
+        vieja = StockPorUbicacion.objects.create(ubicacion=self.ub1, mp=self.harina, stock=D("5"))
+        StockPorUbicacion.aplicar_delta(self.ub1.pk, self.harina.pk, D("3"))
+        StockPorUbicacion.aplicar_delta(self.ub1.pk, self.harina.pk, D("-8"))
+        with self.assertRaises(StockInsuficiente):
+            StockPorUbicacion.aplicar_delta(self.ub1.pk, self.harina.pk, D("-0.001"))
+        self.assertEqual(vieja.stock, D("5"))
+        self.assertEqual(self.stock(self.harina), D("0"))
+        # Sin fila: la crea en el momento.
+        StockPorUbicacion.aplicar_delta(self.ub2.pk, self.harina.pk, D("1"))
+        self.assertEqual(self.stock(self.harina, self.ub2), D("1"))
+
+
+# ============================================================
+#  RESERVAS
+# ============================================================
+class ReservasTests(Empresa):
+    def setUp(self):
+        super().setUp()
+        self.ingreso(self.harina, "3"); self.ingreso(self.agua, "3")
+
+    def op(self, lotes="2"):
+        return OrdenProduccion.objects.create(producto=self.pan, receta=self.receta, lotes=D(lotes), sucursal=self.suc)
+
+    def test_reservar_consumir_y_liberar(self):
+        primera, segunda = self.op(), self.op()
+        primera.reservar()
+        self.assertEqual(reservas.disponible_mp(self.suc.pk, [self.harina.pk])[self.harina.pk], D("1"))
+        # Lo apartado por la primera no está para la segunda.
+        with self.assertRaises(ValidationError):
+            segunda.reservar()
+        self.assertFalse(StockReserva.objects.filter(op=segunda).exists())
+
+        primera.ejecutar(user=self.u)
+        self.assertFalse(StockReserva.objects.filter(op=primera).exists())
+        self.assertEqual(self.stock(self.harina), D("1"))
+        self.assertEqual(reservas.disponible_mp(self.suc.pk, [self.harina.pk])[self.harina.pk], D("1"))
+
+        # Una reserva vencida deja de contar; purgar solo limpia la tabla.
+        tercera = self.op("1")
+        tercera.reservar()
+        StockReserva.objects.filter(op=tercera).update(expira=timezone.now() - timedelta(seconds=1))
+        self.assertEqual(reservas.disponible_mp(self.suc.pk, [self.harina.pk])[self.harina.pk], D("1"))
+        self.assertEqual(reservas.purgar_vencidas(), 2)
+
+    def test_borrar_el_borrador_libera(self):
+        op = self.op()
+        op.reservar()
+        op.delete()
+        self.assertEqual(reservas.disponible_mp(self.suc.pk, [self.harina.pk])[self.harina.pk], D("3"))
+
+    def test_venta_reserva_lotes_fefo(self):
+        self.producir("1")
+        venta = self.vender("6", confirmar=False)
+        venta.reservar()
+        otra = self.vender("5", confirmar=False)
+        with self.assertRaises(ValidationError):
+            otra.validar_stock()
+        venta.consumir_fifo(user=self.u)
+        self.assertEqual(venta.estado, Venta.CONFIRMADA)
+        self.assertFalse(StockReserva.objects.exists())
+        self.assertEqual(reservas.disponible_lotes(self.suc.pk, [self.pan.pk])[self.pan.pk], D("4"))
+
+
+# ============================================================
+#  DETALLE DE RECETA Y DE OP (CONSULTAS CONSTANTES)
+# ============================================================
+class DetallesTests(Empresa):
+    def _consultas(self, url):
+        self.client.get(url)  # el primer request carga el registro de unidades
+        with CaptureQueriesContext(connection) as ctx:
+            r = self.client.get(url)
+        self.assertEqual(r.status_code, 200)
+        return len(ctx)
+
+    def _agregar_lineas(self, n):
+        for i in range(n):
+            mp = MateriaPrima.objects.create(suscripcion=self.s, nombre=f"Semilla {i}", unidad=self.kg)
+            RecetaLinea.objects.create(receta=self.receta, mp=mp, cantidad=D("0.1"))
+
+    def test_no_crecen_con_las_lineas(self):
+        self.client.force_login(self.u)
+        op = OrdenProduccion.objects.create(producto=self.pan, receta=self.receta, lotes=D("2"), sucursal=self.suc)
+        receta_antes = self._consultas(f"/recetas/{self.receta.pk}/")
+        op_antes = self._consultas(f"/produccion/{op.pk}/")
+
+        self._agregar_lineas(8)
+        op = OrdenProduccion.objects.create(producto=self.pan, receta=self.receta, lotes=D("2"), sucursal=self.suc)
+        self.assertEqual(self._consultas(f"/recetas/{self.receta.pk}/"), receta_antes)
+        self.assertEqual(self._consultas(f"/produccion/{op.pk}/"), op_antes)
+
+
+# ============================================================
+#  UNIDADES Y FORMATO
+# ============================================================
+class UnidadesTests(TestCase):
+    databases = set(shards.bases())
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.kg = UnidadMedida.objects.get_or_create(nombre="kg")[0]
+        cls.litros = UnidadMedida.objects.get_or_create(nombre="litros")[0]
+        cls.un = UnidadMedida.objects.get_or_create(nombre="un")[0]
+
+    def setUp(self):
+        unidades.limpiar()
+
+    def test_formato(self):
+        self.assertEqual(unidades.formatear(D("1.5"), self.kg.pk), "1.5 kg")
+        self.assertEqual(unidades.formatear(D("0.25"), self.kg.pk), "250 g")
+        self.assertEqual(unidades.formatear(D("0.5"), self.litros.pk), "500 ml")
+        self.assertEqual(unidades.formatear(D("3.000"), self.un.pk), "3 un")
+        self.assertEqual(unidades.fmt1(D("-0.01")), "0")
+        self.assertEqual(unidades.a_base("250", "g", "kg"), D("0.25"))
+        self.assertEqual(unidades.a_base("2", "kg", "kg"), D("2"))
+
+    def test_registro_en_memoria(self):
+        unidades.nombre(self.kg.pk)
+        with self.assertNumQueries(0):
+            self.assertEqual(unidades.nombre(self.un.pk), "un")
+            self.assertEqual(unidades.formatear(D("2"), self.kg.pk), "2 kg")
+
+    def test_se_invalida_al_guardar(self):
+        unidades.nombre(self.kg.pk)
+        nueva = UnidadMedida.objects.create(nombre="caja")
+        self.assertEqual(unidades.nombre(nueva.pk), "caja")
+        nueva.nombre = "bandeja"; nueva.save()
+        self.assertEqual(unidades.nombre(nueva.pk), "bandeja")
+
+
+# ============================================================
+#  LISTADO DE LOTES (BÚSQUEDA, PESTAÑAS, KEYSET)
+# ============================================================
+class LotesListadoTests(Empresa):
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.medialuna = Producto.objects.create(suscripcion=cls.s, nombre="Medialuna", unidad=cls.un)
+        hoy = timezone.localdate()
+        # Pan: 1 vencido, 1 por rallar, 3 OK. Medialuna: 1 OK.
+        for i, dias in enumerate([-2, 1, 5, 6, 7]):
+            cls.lote(cls.pan, f"PAN-{i:03d}", hoy + timedelta(days=dias))
+        cls.lote(cls.medialuna, "ML-000", hoy + timedelta(days=5))
+        otra, _ = cls.crear_empresa("Otra")
+        ajeno = Producto.objects.create(suscripcion=otra, nombre="Pan", unidad=cls.un)
+        cls.lote(ajeno, "PAN-999", hoy)
+
+    @classmethod
+    def lote(cls, producto, codigo, vence):
+        return LoteProducto.objects.create(producto=producto, codigo=codigo, ubicacion=cls.ub1,
+                                           fecha_vencimiento=vence, cantidad_inicial=D("10"),
+                                           cantidad_disponible=D("10"))
+
+    def setUp(self):
+        super().setUp()
+        self.client.force_login(self.u)
+
+    def listar(self, **params):
+        r = self.client.get("/lotes/", params)
+        self.assertEqual(r.status_code, 200)
+        return r.context
+
+    def codigos(self, ctx):
+        return [l.codigo for l in ctx["pagina"].objetos]
+
+    def test_pestanas_cuentan_por_estado(self):
+        ctx = self.listar()
+        n = {p["valor"]: p["n"] for p in ctx["pestanas"]}
+        self.assertEqual(n, {"": 6, LoteProducto.OK: 4, LoteProducto.POR_RALLAR: 1, LoteProducto.VENCIDO: 1})
+        self.assertNotIn("PAN-999", self.codigos(ctx))
+
+    def test_filtro_por_estado(self):
+        self.assertEqual(self.codigos(self.listar(estado=LoteProducto.VENCIDO)), ["PAN-000"])
+        self.assertEqual(self.codigos(self.listar(estado=LoteProducto.POR_RALLAR)), ["PAN-001"])
+
+    def test_busqueda_por_codigo_y_por_producto(self):
+        self.assertEqual(self.codigos(self.listar(q="ml-")), ["ML-000"])
+        ctx = self.listar(q="medial")
+        self.assertEqual(self.codigos(ctx), ["ML-000"])
+        # Las pestañas cuentan sobre la búsqueda.
+        self.assertEqual(ctx["pestanas"][0]["n"], 1)
+
+    def test_paginacion_keyset(self):
+        with mock.patch.object(views.LoteListView, "por_pagina", 2):
+            vistos, ctx = [], self.listar()
+            vistos += self.codigos(ctx)
+            self.assertIsNone(ctx["url_anterior"])
+            while ctx["pagina"].siguiente:
+                ctx = self.listar(despues=ctx["pagina"].siguiente)
+                vistos += self.codigos(ctx)
+            self.assertEqual(len(vistos), 6)
+            self.assertEqual(len(set(vistos)), 6)
+            self.assertEqual(vistos[0], "PAN-000")  # el orden es por vencimiento
+
+            atras = self.listar(antes=ctx["pagina"].anterior)
+            self.assertEqual(self.codigos(atras), vistos[2:4])
+            # Un cursor inválido vuelve a la primera página.
+            self.assertEqual(self.codigos(self.listar(despues="basura")), vistos[:2])
+
+
+# ============================================================
+#  CONFIGURACIÓN DE LA BASE (bigmomma/basedatos.py)
+# ============================================================
+class BaseDatosTests(SimpleTestCase):
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.dir.cleanup)
+
+    def configurar(self, entorno, archivo="a.sqlite3", replica=False):
+        entorno = {"URL_PRUEBA": f"sqlite:///{self.dir.name}/{archivo}", "SQLITE_WAL": "0", **entorno}
+        with mock.patch.dict(os.environ, entorno):
+            return basedatos.configurar(None, "URL_PRUEBA", replica=replica)
+
+    def abrir(self, db):
+        """Conexión real con esa configuración (el init_command corre al abrirla)."""
+        db = ConnectionHandler({"default": db}).settings["default"]
+        conexion = load_backend(db["ENGINE"]).DatabaseWrapper(db, "prueba")
+        self.addCleanup(conexion.close)
+        return conexion
+
+    def pragma(self, conexion, nombre):
+        with conexion.cursor() as cursor:
+            cursor.execute(f"PRAGMA {nombre}")
+            return cursor.fetchone()[0]
+
+    def test_sin_url_no_hay_alias(self):
+        with mock.patch.dict(os.environ):
+            os.environ.pop("URL_PRUEBA", None)
+            self.assertIsNone(basedatos.configurar(None, "URL_PRUEBA"))
+
+    def test_sqlite_sin_wal_por_defecto(self):
+        db = self.configurar({"SQLITE_BUSY_TIMEOUT": "7"})
+        self.assertEqual(db["OPTIONS"]["timeout"], 7)
+        self.assertEqual(db["OPTIONS"]["transaction_mode"], "IMMEDIATE")
+        self.assertNotIn("init_command", db["OPTIONS"])
+        self.assertEqual(self.pragma(self.abrir(db), "journal_mode"), "delete")
+
+    def test_sqlite_wal_con_la_variable(self):
+        db = self.configurar({"SQLITE_WAL": "1"})
+        conexion = self.abrir(db)
+        self.assertEqual(self.pragma(conexion, "journal_mode"), "wal")
+        self.assertEqual(self.pragma(conexion, "synchronous"), 1)  # NORMAL
+
+    def test_replica_de_solo_lectura_y_espejo_en_tests(self):
+        db = self.configurar({"SQLITE_WAL": "1"}, replica=True)
+        self.assertEqual(db["TEST"], {"MIRROR": "default"})
+        self.assertEqual(db["OPTIONS"]["init_command"], "PRAGMA query_only=ON;")
+        self.assertNotIn("transaction_mode", db["OPTIONS"])
+        conexion = self.abrir(db)
+        with self.assertRaises(DatabaseError), conexion.cursor() as cursor:
+            cursor.execute("CREATE TABLE t (x int)")
+
+    def test_shards_desde_la_variable(self):
+        entorno = {"DATABASE_SHARDS": f" s1=sqlite:///{self.dir.name}/s1.sqlite3 ;;"
+                                      f"s2=sqlite:///{self.dir.name}/s2.sqlite3"}
+        with mock.patch.dict(os.environ, entorno):
+            shards = basedatos.configurar_shards()
+        self.assertEqual(list(shards), ["s1", "s2"])
+        self.assertTrue(shards["s2"]["NAME"].endswith("s2.sqlite3"))
+        self.assertEqual(shards["s1"]["OPTIONS"]["transaction_mode"], "IMMEDIATE")
+        self.assertNotIn("TEST", shards["s1"])
+        with mock.patch.dict(os.environ, {"DATABASE_SHARDS": ""}):
+            self.assertEqual(basedatos.configurar_shards(), {})
+
+
+# ============================================================
+#  TRASLADOS Y REGISTRO EN BLOQUE
+# ============================================================
+class TrasladosTests(Empresa):
+    def lote(self, ubicacion, codigo="PAN-T1"):
+        return LoteProducto.objects.create(producto=self.pan, codigo=codigo, ubicacion=ubicacion,
+                                           fecha_vencimiento=timezone.localdate() + timedelta(days=5),
+                                           cantidad_inicial=D("8"), cantidad_disponible=D("8"))
+
+    def traslado(self, *lineas):
+        t = Traslado.objects.create(suscripcion=self.s, origen=self.ub1, destino=self.ub2)
+        TrasladoLinea.objects.bulk_create([TrasladoLinea(traslado=t, **ln) for ln in lineas])
+        return t
+
+    def assertSinEfecto(self, t, stock):
+        t.refresh_from_db()
+        self.assertEqual(t.estado, Traslado.BORRADOR)
+        self.assertFalse(MovimientoMP.objects.filter(traslado=t).exists())
+        self.assertEqual({(mp, u): self.stock(mp, u) for mp, u in stock}, stock)
+
+    def test_confirmar_mueve_mp_y_lotes(self):
+        self.ingreso(self.harina, "10")
+        lote = self.lote(self.ub1)
+        t = self.traslado({"mp": self.harina, "cantidad": D("4")}, {"lote": lote})
+        t.confirmar(user=self.u)
+
+        self.assertEqual(self.stock(self.harina), D("6"))
+        self.assertEqual(self.stock(self.harina, self.ub2), D("4"))
+        tipos = sorted(MovimientoMP.objects.filter(traslado=t).values_list("tipo", flat=True))
+        self.assertEqual(tipos, [MovimientoMP.TRASLADO_ENT, MovimientoMP.TRASLADO_SAL])
+        lote.refresh_from_db()
+        self.assertEqual(lote.ubicacion, self.ub2)
+        self.assertEqual(t.lineas.get(lote=lote).cantidad, D("8"))
+        # El par suma cero: el kardex de la MP sigue cerrando.
+        self.assertEqual(saldos.conciliar(self.s), [])
+        t.confirmar()  # confirmar dos veces no duplica
+        self.assertEqual(MovimientoMP.objects.filter(traslado=t).count(), 2)
+
+    def test_sin_stock_no_aplica_nada(self):
+        self.ingreso(self.harina, "10")
+        self.ingreso(self.agua, "1")
+        t = self.traslado({"mp": self.harina, "cantidad": D("4")}, {"mp": self.agua, "cantidad": D("5")})
+        with self.assertRaisesMessage(ValidationError, "Stock insuficiente"):
+            t.confirmar()
+        self.assertSinEfecto(t, {(self.harina, self.ub1): D("10"), (self.agua, self.ub1): D("1"),
+                                 (self.harina, self.ub2): D("0")})
+
+    def test_error_en_un_lote_deshace_las_mp(self):
+        # Las MP se registran antes que los lotes: el error del lote las deshace.
+        self.ingreso(self.harina, "10")
+        t = self.traslado({"mp": self.harina, "cantidad": D("4")}, {"lote": self.lote(self.ub2)})
+        with self.assertRaisesMessage(ValidationError, "no está en"):
+            t.confirmar()
+        self.assertSinEfecto(t, {(self.harina, self.ub1): D("10"), (self.harina, self.ub2): D("0")})
+
+    def test_api_confirmar_sin_stock_es_409(self):
+        r = self.api.post("/api/traslados/", {"origen": self.ub1.pk, "destino": self.ub2.pk,
+                                              "lineas": [{"mp": self.harina.pk, "cantidad": "3"}]}, format="json")
+        self.assertEqual(r.status_code, 201, r.content)
+        r = self.api.post(f"/api/traslados/{r.json()['id']}/confirmar/")
+        self.assertEqual(r.status_code, 409)
+        self.assertFalse(MovimientoMP.objects.exists())
+
+    def test_registrar_bulk_todo_o_nada(self):
+        self.ingreso(self.harina, "2")
+        movimientos = [
+            MovimientoMP(mp=self.agua, ubicacion=self.ub1, tipo=MovimientoMP.AJUSTE_POS, cantidad=D("5")),
+            MovimientoMP(mp=self.harina, ubicacion=self.ub1, tipo=MovimientoMP.AJUSTE_NEG, cantidad=D("3")),
+        ]
+        with self.assertRaises(StockInsuficiente):
+            MovimientoMP.registrar_bulk(movimientos)
+        self.assertEqual(self.stock(self.agua), D("0"))
+        self.assertEqual(MovimientoMP.objects.count(), 1)
+
+    def test_registrar_bulk_suma_sobre_stock_negativo(self):
+        # Un saldo ya negativo (datos viejos) no impide entradas: la guarda es solo para lo que resta.
+        StockPorUbicacion.objects.create(ubicacion=self.ub1, mp=self.harina, stock=D("-2"))
+        MovimientoMP.registrar_bulk([
+            MovimientoMP(mp=self.harina, ubicacion=self.ub1, tipo=MovimientoMP.AJUSTE_POS, cantidad=D("1")),
+        ])
+        self.assertEqual(self.stock(self.harina), D("-1"))
+
+
+# ============================================================
+#  CONTEOS FÍSICOS
+# ============================================================
+class ConteosTests(Empresa):
+    def setUp(self):
+        super().setUp()
+        self.conteo = ConteoFisico.objects.create(suscripcion=self.s, sucursal=self.suc)
+
+    def lineas(self):
+        return {(ln.ubicacion_id, ln.mp_id): ln.contado for ln in self.conteo.lineas.all()}
+
+    def test_cargar_contabilizar_y_ajustes(self):
+        self.ingreso(self.harina, "10")
+        self.ingreso(self.agua, "2")
+        self.ingreso(self.agua, "4", ubicacion=self.ub2)  # no se cuenta: no se toca
+        n, errores = conteos.cargar(self.conteo, [
+            ("Depósito", "Harina", "8"), (self.ub1.pk, self.agua.pk, "3"), ("depósito", "harina", "0,5"),
+            ("Depósito", "Sal", "1"), ("Depósito", "Agua", "-1"),
+        ])
+        self.assertEqual(n, 2)
+        self.assertEqual(len(errores), 2)
+        self.assertIn("MP desconocida", errores[0])
+        self.assertEqual(self.lineas()[self.ub1.pk, self.harina.pk], D("8.5"))
+
+        r = conteos.resumen(self.conteo)
+        self.assertEqual((r["lineas"], r["sobrantes"], r["faltantes"]), (2, 1, 1))
+        self.assertEqual(r["total_faltante"], D("-1.5"))
+
+        creados = self.conteo.contabilizar(user=self.u)
+        self.assertEqual(sorted((m.mp.nombre, m.tipo, m.cantidad) for m in creados), [
+            ("Agua", MovimientoMP.AJUSTE_POS, D("1")), ("Harina", MovimientoMP.AJUSTE_NEG, D("1.5")),
+        ])
+        self.assertEqual(self.stock(self.harina), D("8.5"))
+        self.assertEqual(self.stock(self.agua), D("3"))
+        self.assertEqual(self.stock(self.agua, self.ub2), D("4"))
+        self.assertEqual(saldos.conciliar(self.s), [])
+
+        # Contabilizado: las diferencias se leen del stock fijado, no del actual.
+        self.conteo.refresh_from_db()
+        self.assertEqual(self.conteo.estado, ConteoFisico.CONTABILIZADO)
+        self.ingreso(self.harina, "5")
+        dif = {ln.mp_id: (ln.stock, ln.diferencia) for ln in conteos.diferencias(self.conteo)}
+        self.assertEqual(dif[self.harina.pk], (D("10"), D("-1.5")))
+        with self.assertRaisesMessage(ValidationError, "ya fue contabilizado"):
+            self.conteo.contabilizar()
+
+    def test_id_y_nombre_no_se_mezclan(self):
+        # Una MP que se llama como el id de otra.
+        numerica = MateriaPrima.objects.create(suscripcion=self.s, nombre=str(self.harina.pk), unidad=self.kg)
+        conteos.cargar(self.conteo, [(self.ub1.pk, self.harina.pk, "1"), ("Depósito", str(self.harina.pk), "2")])
+        self.assertEqual(self.lineas(), {(self.ub1.pk, self.harina.pk): D("1"), (self.ub1.pk, numerica.pk): D("2")})
+
+    def test_archivo_columnas_id_y_nombre(self):
+        csv = (f"ubicacion_id,mp,cantidad\n{self.ub1.pk},Agua,2\n{self.ub1.pk},{self.harina.pk},1\n"
+               f"Depósito,Harina,3\n").encode()
+        filas = conteos.leer_archivo(SimpleUploadedFile("conteo.csv", csv))
+        n, errores = conteos.cargar(self.conteo, filas)
+        # La columna mp trae nombres ("12" no es la MP 12) y ubicacion_id trae ids.
+        self.assertEqual(n, 1)
+        self.assertEqual(len(errores), 2)
+        self.assertEqual(self.lineas(), {(self.ub1.pk, self.agua.pk): D("2")})
+
+        with self.assertRaisesMessage(ValidationError, "Falta la columna 'cantidad'"):
+            conteos.leer_archivo(SimpleUploadedFile("conteo.csv", b"ubicacion,mp\nx,y\n"))
+
+    def test_api_lecturas_y_contabilizar(self):
+        self.ingreso(self.harina, "10")
+        url = f"/api/conteos/{self.conteo.pk}"
+        r = self.api.post(f"{url}/lineas/", [{"ubicacion": self.ub1.pk, "mp": self.harina.pk, "contado": "4"}],
+                          format="json")
+        self.assertEqual(r.status_code, 200, r.content)
+        r = self.api.post(f"{url}/lineas/", [{"ubicacion": "Depósito", "mp": "Harina", "contado": "3"},
+                                             {"ubicacion": "Depósito", "mp": str(self.harina.pk), "contado": "1"}],
+                          format="json")
+        self.assertEqual(r.status_code, 207)
+        self.assertEqual(r.json()["cargadas"], 1)
+        self.assertEqual(self.lineas(), {(self.ub1.pk, self.harina.pk): D("7")})  # las lecturas se suman
+
+        r = self.api.get(f"{url}/diferencias/")
+        self.assertEqual(D(str(r.json()["results"][0]["diferencia"])), D("-3"))
+        r = self.api.post(f"{url}/contabilizar/")
+        self.assertEqual(r.json()["ajustes"], 1)
+        self.assertEqual(self.stock(self.harina), D("7"))
+        self.assertEqual(self.api.post(f"{url}/contabilizar/").status_code, 409)
+
+
+# ============================================================
+#  PUNTOS DE REORDEN
+# ============================================================
+@override_settings(REPOSICION_VENTANA_DIAS=10, REPOSICION_LEAD_TIME_DIAS=2, REPOSICION_LEAD_TIME_SUCURSAL={},
+                   REPOSICION_MIN_DIAS_CONSUMO=4, REPOSICION_NIVEL_SERVICIO=0.95)
+class ReposicionTests(Empresa):
+    def consumir(self, mp, cantidades, ubicacion=None):
+        """Un CONSUMO por día: cantidades[0] es el de ayer."""
+        self.ingreso(mp, sum(cantidades), ubicacion=ubicacion, fecha=hace(30))
+        for dias, q in enumerate(cantidades, start=1):
+            if q:
+                MovimientoMP.objects.create(mp=mp, ubicacion=ubicacion or self.ub1, tipo=MovimientoMP.CONSUMO,
+                                            cantidad=q, fecha=hace(dias))
+
+    def minimo(self, mp, ubicacion=None):
+        return StockPorUbicacion.objects.get(mp=mp, ubicacion=ubicacion or self.ub1).stock_minimo
+
+    def test_consumo_parejo_reparte_entre_ubicaciones(self):
+        self.consumir(self.harina, [3] * 10)
+        self.consumir(self.harina, [1] * 10, ubicacion=self.ub2)
+        puntos, cambios = reabastecimiento.actualizar_minimos(self.s)
+        fila = puntos.iloc[0]
+        # 4 por día × 2 días de lead time, sin variación: sin stock de seguridad.
+        self.assertEqual((fila["punto_reorden"], fila["stock_seguridad"]), (8.0, 0.0))
+        self.assertEqual(cambios, 2)
+        self.assertEqual((self.minimo(self.harina), self.minimo(self.harina, self.ub2)), (D("6"), D("2")))
+        # Otra vuelta sin consumo nuevo no cambia nada.
+        self.assertEqual(reabastecimiento.actualizar_minimos(self.s)[1], 0)
+
+    def test_stock_de_seguridad_por_la_variacion(self):
+        fechas = [timezone.localdate() - timedelta(days=d) for d in (4, 3, 2, 1)]
+        consumo = pd.DataFrame({"mp": 1, "ubicacion": 1, "sucursal": 1, "dia": fechas,
+                                "cantidad": [1.0, 3.0, 1.0, 3.0]})
+        with override_settings(REPOSICION_LEAD_TIME_DIAS=1):
+            fila = reabastecimiento.calcular(consumo, fechas).iloc[0]
+        # Sumas de 1 día: media 2, desvío √(4/3); z(0,95) = 1,645 → 1,8993 → 1,9 (hacia arriba).
+        self.assertEqual((fila["stock_seguridad"], fila["punto_reorden"]), (1.9, 3.9))
+
+    def test_poco_historial_conserva_el_minimo_manual(self):
+        self.consumir(self.agua, [5, 0, 0, 5, 0, 0, 5])
+        StockPorUbicacion.objects.filter(mp=self.agua).update(stock_minimo=D("7"))
+        puntos, cambios = reabastecimiento.actualizar_minimos(self.s)
+        self.assertTrue(puntos.empty)
+        self.assertEqual(self.minimo(self.agua), D("7"))
+
+    def test_comando_simular_no_escribe(self):
+        self.consumir(self.harina, [2] * 10)
+        salida = StringIO()
+        call_command("calcular_reposicion", "--simular", "--mostrar", "5", stdout=salida)
+        self.assertIn("1 puntos de reorden calculados; 1 filas de stock cambiarían", salida.getvalue())
+        self.assertEqual(self.minimo(self.harina), D("0"))
+        call_command("calcular_reposicion", stdout=StringIO())
+        self.assertEqual(self.minimo(self.harina), D("4"))
+
+
+# ============================================================
+#  ARCHIVO DEL KARDEX
+# ============================================================
+class ArchivoTests(Empresa):
+    def setUp(self):
+        super().setUp()
+        # Hace 20 días: compras. Hace 15: producción y venta. Hace 2: otra compra.
+        self.ingreso(self.harina, "10", costo=D("100"))
+        self.ingreso(self.agua, "10", costo=D("1"))
+        MovimientoMP.objects.update(fecha=hace(20))
+        self.producir("2")
+        self.venta = self.vender("12")
+        MovimientoMP.objects.exclude(fecha=hace(20)).update(fecha=hace(15))
+        Venta.objects.update(fecha=hace(15))
+        self.ingreso(self.harina, "3", fecha=hace(2))
+        self.momentos = [hace(18), hace(12), hace(1), timezone.now()]
+        self.horizonte = hace(10, hora=0)
+
+    def stocks(self):
+        return [saldos.stock_at(self.harina, self.ub1, m) for m in self.momentos]
+
+    def test_archivar_concilia_y_conserva_el_stock_a_fecha(self):
+        antes = self.stocks()
+        self.assertEqual(antes, [D("10"), D("8"), D("11"), D("11")])
+        vivos = MovimientoMP.objects.count()
+
+        corte = archivo.archivar(self.s, self.horizonte)
+        self.assertEqual(corte.movimientos, vivos - 1)
+        self.assertEqual(corte.aperturas, 2)  # harina y agua en el depósito
+        self.assertEqual(saldos.conciliar(self.s), [])
+        self.assertEqual(self.stocks(), antes)
+        self.assertEqual(sorted(MovimientoMP.objects.filter(mp=self.harina).values_list("tipo", "cantidad")),
+                         [(MovimientoMP.APERTURA, D("8")), (MovimientoMP.INGRESO, D("3"))])
+
+        # Una segunda corrida con el mismo horizonte no tiene nada que archivar.
+        otra = archivo.archivar(self.s, self.horizonte)
+        self.assertEqual((otra.movimientos, otra.aperturas), (0, 0))
+        self.assertEqual(self.stocks(), antes)
+
+    def test_archivar_dos_veces_reemplaza_la_apertura(self):
+        archivo.archivar(self.s, hace(16, hora=0))
+        archivo.archivar(self.s, self.horizonte)
+        aperturas = MovimientoMP.objects.filter(mp=self.harina, tipo=MovimientoMP.APERTURA)
+        self.assertEqual(list(aperturas.values_list("cantidad", flat=True)), [D("8")])
+        self.assertEqual(saldos.conciliar(self.s), [])
+        self.assertEqual(self.stocks(), [D("10"), D("8"), D("11"), D("11")])
+
+    def test_reportes_leen_el_archivo(self):
+        costo = self.venta.costo_total
+        historia = [(m.tipo, m.cantidad) for m in archivo.movimientos(self.s, historico=True)]
+        archivo.archivar(self.s, self.horizonte)
+
+        venta = Venta.objects.get(pk=self.venta.pk)
+        self.assertFalse(venta.consumos.exists())
+        self.assertEqual(venta.costo_total, costo)
+        self.assertEqual(costos.costo_ventas(Venta.objects.filter(pk=venta.pk)),
+                         {venta.pk: costo.quantize(D("0.0001"))})
+        r = self.api.get(f"/api/ventas/{venta.pk}/")
+        self.assertEqual(len(r.json()["consumos"]), 1)
+        # historico=True: lo archivado sin los saldos de apertura, en el mismo orden.
+        self.assertEqual([(m.tipo, m.cantidad) for m in archivo.movimientos(self.s, historico=True)], historia)
+        self.assertEqual(len(archivo.movimientos(self.s)), 3)  # 2 aperturas + la compra nueva
+        self.assertTrue(archivo.incluye_archivo(self.s, hace(12)))
+        self.assertFalse(archivo.incluye_archivo(self.s, hace(5)))
+        consumo = archivo.sumar(self.s, ["tipo"], historico=True, mp=self.harina)
+        self.assertEqual(consumo[(MovimientoMP.CONSUMO,)], D("2"))
+
+
+# ============================================================
+#  RÉPLICA DE LECTURA
+# ============================================================
+@mock.patch.object(replicas, "hay_replica", return_value=True)
+class RouterReplicaTests(SimpleTestCase):
+    """Decisiones del router, sin tocar ninguna base."""
+
+    def setUp(self):
+        token = replicas._escribio.set(False)
+        self.addCleanup(replicas._escribio.reset, token)
+        self.router = replicas.RouterReplica()
+
+    def test_solo_lo_marcado_va_a_la_replica(self, _):
+        self.assertIsNone(self.router.db_for_read(Producto))
+        with replicas.leer_de_replica():
+            self.assertEqual(self.router.db_for_read(Producto), replicas.REPLICA)
+            # Sesiones, usuarios e idempotencia, siempre de la primaria.
+            self.assertIsNone(self.router.db_for_read(User))
+            self.assertIsNone(self.router.db_for_read(RespuestaIdempotente))
+            self.assertIsNone(self.router.db_for_read(Session))
+
+    def test_despues_de_escribir_lee_la_primaria(self, _):
+        with replicas.leer_de_replica():
+            self.assertEqual(self.router.db_for_write(Producto), "default")
+            self.assertIsNone(self.router.db_for_read(Producto))
+
+    def test_nunca_migra_ni_escribe_en_la_replica(self, _):
+        with replicas.leer_de_replica():
+            self.assertEqual(self.router.db_for_write(Producto), "default")
+        self.assertFalse(self.router.allow_migrate(replicas.REPLICA, "inventario"))
+        self.assertIsNone(self.router.allow_migrate("default", "inventario"))
+
+
+@skipUnless(replicas.hay_replica(), "sin DATABASE_REPLICA_URL (ver el encabezado)")
+class ReplicaTests(TransactionTestCase):
+    """
+    Con la réplica configurada: en los tests es espejo de 'default' (otra
+    conexión a la misma base), así que se ve a dónde va cada consulta.
+    TransactionTestCase porque dentro de una transacción todo se lee de la
+    primaria.
+    """
+    # Sin réplica la clase se saltea, pero el runner igual junta sus bases.
+    databases = {*shards.bases(), replicas.REPLICA} if replicas.hay_replica() else set(shards.bases())
+
+    def setUp(self):
+        self.s, self.u = Empresa.crear_empresa("Réplica")
+        self.un = UnidadMedida.objects.get_or_create(nombre="un")[0]
+        self.pan = Producto.objects.create(suscripcion=self.s, nombre="Pan", unidad=self.un)
+        LoteProducto.objects.create(producto=self.pan, codigo="R-001", fecha_vencimiento=timezone.localdate(),
+                                    cantidad_inicial=D("1"), cantidad_disponible=D("1"))
+        suc = Sucursal.objects.create(suscripcion=self.s, nombre="Central", es_principal=True)
+        self.ub = Ubicacion.objects.create(sucursal=suc, nombre="Depósito")
+        self.harina = MateriaPrima.objects.create(suscripcion=self.s, nombre="Harina", unidad=self.un)
+        # Las escrituras de arriba fijarían este hilo a la primaria.
+        token = replicas._escribio.set(False)
+        self.addCleanup(replicas._escribio.reset, token)
+        self.client.force_login(self.u)
+        self.api = APIClient()
+        self.api.force_login(self.u)
+
+    def consultas(self, hacer):
+        """(SQL en la réplica, SQL en la primaria) de hacer()."""
+        with CaptureQueriesContext(connections[replicas.REPLICA]) as replica, \
+                CaptureQueriesContext(connections["default"]) as primaria:
+            hacer()
+        return [q["sql"] for q in replica], [q["sql"] for q in primaria]
+
+    def ingresar(self):
+        r = self.api.post("/api/movimientos/", {"mp": self.harina.pk, "ubicacion": self.ub.pk,
+                                                "tipo": "INGRESO", "cantidad": "5"}, format="json")
+        self.assertEqual(r.status_code, 201, r.content)
+        return r
+
+    def test_vista_marcada_lee_de_la_replica(self):
+        replica, primaria = self.consultas(lambda: self.assertEqual(self.client.get("/lotes/").status_code, 200))
+        self.assertTrue(any("inventario_loteproducto" in sql for sql in replica))
+        self.assertFalse(any("inventario_loteproducto" in sql for sql in primaria))
+        # La sesión y el usuario no salen de la réplica.
+        self.assertFalse(any("django_session" in sql for sql in replica))
+
+    def test_despues_de_escribir_lee_la_primaria(self):
+        self.assertIn(replicas.COOKIE, self.ingresar().cookies)
+        self.client.cookies[replicas.COOKIE] = "1"
+        replica, primaria = self.consultas(lambda: self.client.get("/lotes/"))
+        self.assertEqual(replica, [])
+        self.assertTrue(any("inventario_loteproducto" in sql for sql in primaria))
+
+        # En el mismo bloque: después de la primera escritura todo vuelve a la primaria.
+        def leer_escribir_leer():
+            replicas._escribio.set(False)  # como al empezar un request (ReplicaMiddleware)
+            with replicas.leer_de_replica():
+                Producto.objects.count()
+                Producto.objects.create(suscripcion=self.s, nombre="Factura", unidad=self.un)
+                Producto.objects.count()
+        replica, primaria = self.consultas(leer_escribir_leer)
+        self.assertEqual(len(replica), 1)
+        self.assertTrue(any(sql.startswith("INSERT") for sql in primaria))
+
+    def test_nunca_escribe_en_la_replica(self):
+        def escribir():
+            self.ingresar()
+            replicas._escribio.set(False)
+            with replicas.leer_de_replica():
+                p = Producto.objects.get(nombre="Pan")
+                p.nombre = "Pan francés"; p.save()
+        replica, _ = self.consultas(escribir)
+        self.assertTrue(replica)  # el get() de adentro sí leyó de la réplica
+        self.assertTrue(all(sql.startswith("SELECT") for sql in replica), replica)
+        self.assertTrue(Producto.objects.filter(nombre="Pan francés").exists())
+
+
+# ============================================================
+#  SHARDS: MUDANZA DE UN TENANT
+# ============================================================
+@skipUnless(len(getattr(settings, "SHARDS", [])) >= 2, "sin dos DATABASE_SHARDS (ver el encabezado)")
+class ShardsTests(TransactionTestCase):
+    """mover() con commits reales: los FKs del destino se verifican al confirmar."""
+    databases = set(shards.bases())
+
+    def setUp(self):
+        self.s1, self.s2 = settings.SHARDS[:2]
+        self.s, self.u = Empresa.crear_empresa("Grande")
+        self.otra, _ = Empresa.crear_empresa("Chica")
+        self.kg = UnidadMedida.objects.get_or_create(nombre="kg")[0]
+        self.un = UnidadMedida.objects.get_or_create(nombre="un")[0]
+        self.harina, self.ub = self.poblar(self.s)
+        self.harina_otra, self.ub_otra = self.poblar(self.otra)
+
+    def poblar(self, s):
+        """Sucursal, MP, receta, OP ejecutada y venta confirmada: filas en casi todas las tablas del tenant."""
+        suc = Sucursal.objects.create(suscripcion=s, nombre="Central", es_principal=True)
+        ub = Ubicacion.objects.create(sucursal=suc, nombre="Depósito")
+        harina = MateriaPrima.objects.create(suscripcion=s, nombre="Harina", unidad=self.kg)
+        pan = Producto.objects.create(suscripcion=s, nombre="Pan", unidad=self.un)
+        receta = Receta.objects.create(producto=pan, rendimiento_por_lote=D("10"))
+        RecetaLinea.objects.create(receta=receta, mp=harina, cantidad=D("1"))
+        MovimientoMP.objects.create(mp=harina, ubicacion=ub, tipo=MovimientoMP.INGRESO, cantidad=D("10"),
+                                    costo_unitario=D("100"), created_by=self.u)
+        op = OrdenProduccion.objects.create(producto=pan, receta=receta, lotes=D("2"), sucursal=suc)
+        op.ejecutar(user=self.u)
+        venta = Venta.objects.create(suscripcion=s, sucursal=suc)
+        venta.lineas.create(producto=pan, cantidad=D("5"))
+        venta.consumir_fifo(user=self.u)
+        return harina, ub
+
+    def stock(self, s, mp):
+        with shards.usar(s):
+            return StockPorUbicacion.objects.filter(mp_id=mp.pk).aggregate(t=Sum("stock"))["t"]
+
+    def test_mover_conserva_filas_e_integridad(self):
+        antes = shards.contar(self.s, "default")
+        stock = self.stock(self.s, self.harina)
+        otra = shards.contar(self.otra, "default")
+
+        copiados = shards.mover(self.s, self.s1)
+        self.assertEqual(copiados, antes)
+        self.assertEqual(shards.contar(self.s, self.s1), antes)
+        self.assertFalse(any(shards.contar(self.s, "default").values()))
+        self.assertEqual(shards.contar(self.otra, "default"), otra)
+        for alias in shards.bases():
+            connections[alias].check_constraints()
+
+        self.s.refresh_from_db()
+        self.assertEqual((self.s.base_datos, self.s.en_mudanza), (self.s1, False))
+        self.assertEqual(self.stock(self.s, self.harina), stock)
+        with shards.usar(self.s):
+            self.assertEqual(saldos.conciliar(self.s), [])
+            self.assertEqual(Venta.objects.get().costo_total, D("50"))
+
+        # Y de vuelta, pasando por el otro shard.
+        shards.mover(self.s, self.s2)
+        shards.mover(self.s, "default")
+        self.assertEqual(shards.contar(self.s, "default"), antes)
+        connections["default"].check_constraints()
+
+    def test_ids_por_bloque_sin_choques(self):
+        bloque = settings.SHARD_BLOQUE_IDS
+        shards.mover(self.s, self.s1)
+        shards.reservar_ids(self.s1)  # idempotente
+        self.s.refresh_from_db()
+        with shards.usar(self.s):
+            # Por id: las instancias de setUp son de 'default' y el router no las cruza de base.
+            nuevo = MovimientoMP.objects.create(mp_id=self.harina.pk, ubicacion_id=self.ub.pk,
+                                                tipo=MovimientoMP.INGRESO, cantidad=D("1"))
+        viejo = MovimientoMP.objects.create(mp=self.harina_otra, ubicacion=self.ub_otra, tipo=MovimientoMP.INGRESO,
+                                            cantidad=D("1"))
+        self.assertGreaterEqual(nuevo.pk, bloque)
+        self.assertLess(viejo.pk, bloque)
+
+        # Las filas movidas conservan su id y no chocan con las que el destino ya generó.
+        shards.mover(self.s, self.s2)
+        with shards.usar(self.s2):
+            ids = set(MovimientoMP.objects.values_list("pk", flat=True))
+            otro = MovimientoMP.objects.create(mp_id=self.harina.pk, ubicacion_id=self.ub.pk,
+                                               tipo=MovimientoMP.INGRESO, cantidad=D("1"))
+        self.assertIn(nuevo.pk, ids)
+        self.assertNotIn(otro.pk, ids)
+        self.assertGreaterEqual(otro.pk, 2 * bloque)
+        for alias in shards.bases():
+            connections[alias].check_constraints()
+
+    def test_destino_con_restos_no_se_toca(self):
+        shards.mover(self.s, self.s1, borrar_origen=False)
+        self.s.refresh_from_db()
+        with self.assertRaisesMessage(shards.MudanzaError, "ya tiene filas"):
+            shards.mover(self.s, "default")
+        self.assertEqual(shards.base_de(self.s), self.s1)
+        self.assertGreater(shards.borrar_tenant(self.s, "default"), 0)
+        with self.assertRaises(shards.MudanzaError):
+            shards.borrar_tenant(self.s, self.s1)  # es su base actual
+        shards.mover(self.s, "default")
+        self.assertFalse(any(shards.contar(self.s, self.s1).values()))
+
+
+# ============================================================
+#  CACHÉ DEL PANEL POR EMPRESA
+# ============================================================
+@override_settings(CACHE_FRAGMENTOS_SEGUNDOS=600)
+class CacheEmpresaTests(Empresa):
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+        self.client.force_login(self.u)
+        self.otra, _ = self.crear_empresa("Otra")
+
+    def ingreso_confirmado(self, mp, cantidad):
+        with self.captureOnCommitCallbacks(execute=True):
+            return self.ingreso(mp, cantidad)
+
+    def panel(self):
+        with CaptureQueriesContext(connection) as ctx:
+            r = self.client.get("/panel/")
+        self.assertEqual(r.status_code, 200)
+        return r.content.decode(), len(ctx)
+
+    def test_escrituras_suben_la_version_de_su_empresa(self):
+        v, v_otra = cache_empresa.version(self.s.pk), cache_empresa.version(self.otra.pk)
+        self.ingreso_confirmado(self.harina, "1")
+        self.assertGreater(cache_empresa.version(self.s.pk), v)
+        self.assertEqual(cache_empresa.version(self.otra.pk), v_otra)
+
+        # Los caminos en bloque (sin señales) también.
+        v = cache_empresa.version(self.s.pk)
+        with self.captureOnCommitCallbacks(execute=True):
+            MovimientoMP.registrar_bulk([MovimientoMP(mp=self.agua, ubicacion=self.ub1,
+                                                      tipo=MovimientoMP.AJUSTE_POS, cantidad=D("1"))])
+        self.assertGreater(cache_empresa.version(self.s.pk), v)
+
+    def test_rollback_no_invalida(self):
+        v = cache_empresa.version(self.s.pk)
+        with self.captureOnCommitCallbacks(execute=True) as callbacks:
+            with self.assertRaises(StockInsuficiente), transaction.atomic():
+                self.ingreso(self.harina, "1")
+                MovimientoMP.objects.create(mp=self.harina, ubicacion=self.ub1, tipo=MovimientoMP.CONSUMO,
+                                            cantidad=D("5"))
+        self.assertEqual(callbacks, [])
+        self.assertEqual(cache_empresa.version(self.s.pk), v)
+
+    def test_version_perdida_no_vuelve_atras(self):
+        v = cache_empresa.version(self.s.pk)
+        cache.delete(f"datos_version:{self.s.pk}")
+        self.assertGreaterEqual(cache_empresa.version(self.s.pk), v)
+
+    def test_panel_cacheado_hasta_que_cambian_los_datos(self):
+        self.ingreso_confirmado(self.harina, "2")
+        StockPorUbicacion.objects.filter(mp=self.harina).update(stock_minimo=D("5"))
+        self.client.get("/panel/")  # el primer request carga el registro de unidades
+        cache.clear()
+
+        html, consultas = self.panel()
+        self.assertIn("Mín: 5", html)
+        # Un cambio que no pasa por el ORM (sin invalidar) no se ve: los fragmentos salen del caché.
+        StockPorUbicacion.objects.filter(mp=self.harina).update(stock=D("50"))
+        html, cacheado = self.panel()
+        self.assertIn("Mín: 5", html)
+        self.assertLess(cacheado, consultas)
+
+        # Un movimiento sube la versión: el panel se recalcula.
+        self.ingreso_confirmado(self.harina, "1")
+        html, recalculado = self.panel()
+        self.assertNotIn("Mín: 5", html)
+        self.assertGreater(recalculado, cacheado)
+
+    @override_settings(CACHE_FRAGMENTOS_SEGUNDOS=0)
+    def test_sin_cache_configurado_siempre_consulta(self):
+        self.client.get("/panel/")
+        self.assertEqual(self.panel()[1], self.panel()[1])
+
+
+# ============================================================
+#  EVENTOS EN VIVO DEL PANEL (SSE)
+# ============================================================
+class EventosTests(Empresa):
+    def setUp(self):
+        super().setUp()
+        self.publicados = []
+        fake = mock.Mock(publicar=lambda sid, evento: self.publicados.append((sid, evento)))
+        parche = mock.patch.object(eventos, "broker", return_value=fake)
+        parche.start()
+        self.addCleanup(parche.stop)
+
+    def tipos(self):
+        return [(sid, e["tipo"]) for sid, e in self.publicados]
+
+    def test_senales_publican_al_confirmar(self):
+        self.ingreso(self.harina, "10")
+        self.ingreso(self.agua, "10")
+        with self.captureOnCommitCallbacks(execute=True):
+            self.producir("1")
+            self.assertEqual(self.publicados, [])  # nada antes del commit
+        self.assertIn((self.s.pk, "op"), self.tipos())
+        self.assertIn((self.s.pk, "lote"), self.tipos())
+
+        self.publicados.clear()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.vender("4")
+            MovimientoMP.objects.create(mp=self.harina, ubicacion=self.ub1, tipo=MovimientoMP.MERMA, cantidad=D("1"))
+        venta = next(e for _, e in self.publicados if e["tipo"] == "venta")
+        self.assertEqual(venta["lineas"], [{"producto": "Pan", "cantidad": 4.0}])
+        merma = next(e for _, e in self.publicados if e["tipo"] == "merma")
+        self.assertEqual((merma["mp"], merma["cantidad"], merma["fecha"]),
+                         ("Harina", 1.0, timezone.localdate().isoformat()))
+        # Un borrador (sin confirmar) no avisa.
+        self.publicados.clear()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.vender("1", confirmar=False)
+        self.assertEqual(self.publicados, [])
+
+    def test_rollback_no_publica(self):
+        self.ingreso(self.harina, "10")
+        with self.captureOnCommitCallbacks(execute=True):
+            with self.assertRaises(StockInsuficiente), transaction.atomic():
+                MovimientoMP.objects.create(mp=self.harina, ubicacion=self.ub1, tipo=MovimientoMP.MERMA,
+                                            cantidad=D("1"))
+                MovimientoMP.objects.create(mp=self.harina, ubicacion=self.ub1, tipo=MovimientoMP.MERMA,
+                                            cantidad=D("50"))
+        self.assertEqual(self.publicados, [])
+
+    def test_bajo_wsgi_no_hay_stream(self):
+        self.client.force_login(self.u)
+        self.assertEqual(self.client.get("/panel/eventos/").status_code, 204)
+
+
+class PanelEventosAsgiTests(Empresa):
+    async def test_stream_recibe_los_eventos_de_su_empresa(self):
+        await self.async_client.aforce_login(self.u)
+        r = await self.async_client.get("/panel/eventos/")
+        self.assertEqual(r["Content-Type"], "text/event-stream")
+        stream = aiter(r.streaming_content)
+        self.assertEqual(await anext(stream), b"retry: 5000\n\n")
+
+        siguiente = asyncio.ensure_future(anext(stream))
+        await asyncio.sleep(0.05)  # el stream ya está suscripto
+        eventos.broker().publicar(self.s.pk + 1, {"tipo": "venta", "id": 2})
+        eventos.broker().publicar(self.s.pk, {"tipo": "venta", "id": 1})
+        chunk = await asyncio.wait_for(siguiente, 1)
+        self.assertEqual(chunk, b'event: venta\ndata: {"tipo": "venta", "id": 1}\n\n')
+        # El cliente se desconecta (ASGI cancela la tarea): el panel se desuscribe.
+        esperando = asyncio.ensure_future(anext(stream))
+        await asyncio.sleep(0.05)
+        esperando.cancel()
+        with self.assertRaises(asyncio.CancelledError):
+            await esperando
+        self.assertNotIn(self.s.pk, eventos._local._subs)
+
+
+class BrokerLocalTests(SimpleTestCase):
+    def recibir(self, broker, sid, publicar, n=1):
+        """Suscribe un panel, corre publicar() desde otro thread y devuelve los n eventos que le llegan."""
+        async def panel():
+            stream = broker.suscribir(sid)
+            primero = asyncio.ensure_future(anext(stream))
+            await asyncio.sleep(0)  # ya suscripto
+            await asyncio.to_thread(publicar)
+            recibidos = [await asyncio.wait_for(primero, 1)]
+            while len(recibidos) < n:
+                recibidos.append(await asyncio.wait_for(anext(stream), 1))
+            await stream.aclose()
+            return recibidos
+        return asyncio.run(panel())
+
+    def test_cada_empresa_recibe_lo_suyo(self):
+        broker = eventos.BrokerLocal()
+        def publicar():
+            broker.publicar(2, {"tipo": "venta", "id": 99})
+            broker.publicar(1, {"tipo": "venta", "id": 1})
+        self.assertEqual(self.recibir(broker, 1, publicar), [{"tipo": "venta", "id": 1}])
+        self.assertEqual(broker._subs, {})  # al cerrar el stream se desuscribe
+
+    def test_panel_atrasado_recarga(self):
+        async def llenar():
+            cola = asyncio.Queue(maxsize=2)
+            for i in range(3):
+                eventos._poner(cola, {"tipo": "lote", "id": i})
+            return [cola.get_nowait() for _ in range(cola.qsize())]
+        self.assertEqual(asyncio.run(llenar()), [{"tipo": "recargar"}])
+
+    @mock.patch.object(eventos, "PING_SEGUNDOS", 0.01)
+    def test_ping_y_formato(self):
+        self.assertEqual(self.recibir(eventos.BrokerLocal(), 1, lambda: None), [None])
+        self.assertEqual(eventos.formatear(None), ": ping\n\n")
+        self.assertEqual(eventos.formatear({"tipo": "op", "unidades": D("10")}),
+                         'event: op\ndata: {"tipo": "op", "unidades": "10"}\n\n')
+
+
+# ============================================================
+#  CIERRE DEL DÍA DE UN POS EXTERNO
+# ============================================================
+class CierrePosTests(Empresa):
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.medialuna = Producto.objects.create(suscripcion=cls.s, nombre="Medialuna", unidad=cls.un)
+        hoy = timezone.localdate()
+        cls.l1 = cls.lote(cls.pan, "PAN-1", hoy + timedelta(days=2), "5", "10")
+        cls.l2 = cls.lote(cls.pan, "PAN-2", hoy + timedelta(days=5), "10", "12")
+        cls.l3 = cls.lote(cls.medialuna, "ML-1", hoy + timedelta(days=2), "3", "20")
+
+    @classmethod
+    def lote(cls, producto, codigo, vence, cantidad, costo):
+        return LoteProducto.objects.create(producto=producto, codigo=codigo, ubicacion=cls.ub1, fecha_vencimiento=vence,
+                                           cantidad_inicial=D(cantidad), cantidad_disponible=D(cantidad),
+                                           costo_unitario=D(costo))
+
+    # T2 no alcanza (Medialuna): queda en borrador y su Pan vuelve para T3.
+    FILAS = [
+        ("T1", "2026-10-19 08:00", "Pan", "4"),
+        ("T2", "2026-10-19 09:00", "Pan", "3"), ("T2", "2026-10-19 09:00", "medialuna", "5"),
+        ("T3", "2026-10-19 10:00", "Pan", "2"), ("T3", "2026-10-19 10:00", "Pan", "1"),
+    ]
+
+    def disponible(self):
+        return dict(LoteProducto.objects.filter(pk__in=[self.l1.pk, self.l2.pk, self.l3.pk])
+                    .values_list("codigo", "cantidad_disponible"))
+
+    def consumos(self, ticket):
+        return sorted(VentaConsumo.objects.filter(venta__ticket_pos=ticket).values_list("lote__codigo", "cantidad"))
+
+    def test_fefo_en_una_pasada_y_faltantes_como_borrador(self):
+        res = cierre_pos.importar(self.s, self.suc, self.FILAS, user=self.u)
+        self.assertEqual((res.confirmadas, res.borradores, res.lineas, res.unidades), (2, 1, 4, D("15")))
+        self.assertEqual((res.lotes, res.costo), (2, D("74")))
+        self.assertEqual([(f.ticket, f.producto, f.requerido, f.asignado, f.falta) for f in res.faltantes],
+                         [("T2", "Medialuna", D("5"), D("3"), D("2"))])
+
+        estados = dict(Venta.objects.filter(sucursal=self.suc).values_list("ticket_pos", "estado"))
+        self.assertEqual(estados, {"T1": Venta.CONFIRMADA, "T2": Venta.BORRADOR, "T3": Venta.CONFIRMADA})
+        self.assertEqual(self.consumos("T1"), [("PAN-1", D("4"))])
+        self.assertEqual(self.consumos("T2"), [])
+        self.assertEqual(self.consumos("T3"), [("PAN-1", D("1")), ("PAN-2", D("2"))])
+        self.assertEqual(self.disponible(), {"PAN-1": D("0"), "PAN-2": D("8"), "ML-1": D("3")})
+        # El producto repetido en un ticket es una sola línea; las trazas van por (lote, venta).
+        t3 = Venta.objects.get(ticket_pos="T3")
+        self.assertEqual(list(t3.lineas.values_list("cantidad", flat=True)), [D("3")])
+        self.assertEqual(TrazaEnlace.objects.filter(venta=t3, tipo=TrazaEnlace.LOTE_VENTA).count(), 2)
+
+    def test_tickets_ya_importados_se_saltan(self):
+        cierre_pos.importar(self.s, self.suc, self.FILAS[:1])
+        res = cierre_pos.importar(self.s, self.suc, self.FILAS)
+        self.assertEqual(res.duplicados, ["T1"])
+        self.assertEqual((res.confirmadas, res.borradores), (1, 1))
+        self.assertEqual(Venta.objects.filter(ticket_pos="T1").count(), 1)
+        self.assertEqual(self.disponible()["PAN-1"], D("0"))
+
+        res = cierre_pos.importar(self.s, self.suc, self.FILAS)
+        self.assertEqual(res.duplicados, ["T1", "T2", "T3"])
+        self.assertEqual(Venta.objects.filter(sucursal=self.suc).count(), 3)
+
+    def test_simular_no_escribe(self):
+        res = cierre_pos.importar(self.s, self.suc, self.FILAS, aplicar=False)
+        self.assertEqual((res.confirmadas, res.borradores, res.costo), (2, 1, D("74")))
+        self.assertFalse(Venta.objects.exists())
+        self.assertEqual(self.disponible()["PAN-1"], D("5"))
+
+    def test_respeta_lo_reservado_por_borradores(self):
+        borrador = self.vender("4", confirmar=False)
+        reservas.reservar_venta(borrador)
+        res = cierre_pos.importar(self.s, self.suc, [("T1", "", "Pan", "4")])
+        self.assertEqual(self.consumos("T1"), [("PAN-1", D("1")), ("PAN-2", D("3"))])
+        self.assertEqual(res.faltantes, [])
+
+    def test_archivo_id_y_nombre_no_se_mezclan(self):
+        # Un producto que se llama como el id de otro.
+        numerico = Producto.objects.create(suscripcion=self.s, nombre=str(self.pan.pk), unidad=self.un)
+        self.lote(numerico, "NUM-1", timezone.localdate(), "5", "1")
+        csv = f"ticket,producto_id,cantidad\nA,{self.pan.pk},1\nB,Pan,1\nC,{numerico.pk},1\n".encode()
+        filas = cierre_pos.leer_archivo(SimpleUploadedFile("cierre.csv", csv))
+        res = cierre_pos.importar(self.s, self.suc, filas)
+        self.assertEqual(len(res.errores), 1)
+        self.assertIn("Fila 2: producto desconocido", res.errores[0])
+        self.assertEqual(self.consumos("A"), [("PAN-1", D("1"))])
+        self.assertEqual(self.consumos("C"), [("NUM-1", D("1"))])
+
+        res = cierre_pos.importar(self.s, self.suc, [("D", "", str(self.pan.pk), "1")])
+        self.assertEqual(self.consumos("D"), [("NUM-1", D("1"))])  # texto: es el nombre
+
+        with self.assertRaisesMessage(ValidationError, "Falta la columna 'producto'"):
+            cierre_pos.leer_archivo(SimpleUploadedFile("cierre.csv", b"ticket,cantidad\nA,1\n"))
+
+    def test_comando_simular(self):
+        with tempfile.NamedTemporaryFile("w", suffix=".csv", delete=False) as f:
+            f.write("boleta,fecha,sku,unidades\n" + "".join(f"{t},{fe},{p},{c}\n" for t, fe, p, c in self.FILAS))
+        self.addCleanup(os.remove, f.name)
+        out = StringIO()
+        call_command("importar_cierre_pos", suscripcion=self.s.pk, sucursal=self.suc.pk, archivo=f.name,
+                     simular=True, stdout=out)
+        self.assertIn("[simulación] 2 ventas confirmadas, 1 en borrador", out.getvalue())
+        self.assertFalse(Venta.objects.exists())
+
+
+# ============================================================
+#  RECETAS MULTINIVEL (SUB-RECETAS)
+# ============================================================
+class BomTests(Empresa):
+    """
+    Factura (rinde 10): 2 kg Masa + 1 kg Relleno + 0,1 kg Sal
+    Relleno (rinde 2):  1 kg Masa + 1 kg Agua
+    Masa (rinde 5):     4 kg Harina + 2,5 kg Agua
+    → Factura por lote: 2 Harina + 1,75 Agua + 0,1 Sal
+    """
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.sal = MateriaPrima.objects.create(suscripcion=cls.s, nombre="Sal", unidad=cls.kg)
+        cls.masa, cls.r_masa = cls.con_receta("Masa", "5", [(cls.harina, "4"), (cls.agua, "2.5")])
+        cls.relleno, cls.r_relleno = cls.con_receta("Relleno", "2", [(cls.masa, "1"), (cls.agua, "1")])
+        cls.factura, cls.r_factura = cls.con_receta("Factura", "10",
+                                                    [(cls.masa, "2"), (cls.relleno, "1"), (cls.sal, "0.1")])
+
+    @classmethod
+    def con_receta(cls, nombre, rinde, lineas):
+        producto = Producto.objects.create(suscripcion=cls.s, nombre=nombre, unidad=cls.kg)
+        receta = Receta.objects.create(producto=producto, rendimiento_por_lote=D(rinde))
+        for ingrediente, cantidad in lineas:
+            campo = "mp" if isinstance(ingrediente, MateriaPrima) else "producto"
+            RecetaLinea.objects.create(receta=receta, cantidad=D(cantidad), **{campo: ingrediente})
+        return producto, receta
+
+    def test_explosion_multinivel(self):
+        explosion = bom.Explosion()
+        # Líneas de Factura + activas de Masa/Relleno + líneas de Masa/Relleno.
+        with self.assertNumQueries(3):
+            por_lote = explosion.por_lote(self.r_factura.pk)
+        self.assertEqual(por_lote, {self.harina.pk: D("2"), self.agua.pk: D("1.75"), self.sal.pk: D("0.1")})
+        # Masa aparece en dos ramas y se expande una vez.
+        self.assertEqual(set(explosion._memo), {(self.r_factura.pk, None), (self.r_masa.pk, 1), (self.r_relleno.pk, 1)})
+        self.assertEqual(explosion.productos(self.r_factura.pk), {self.masa.pk, self.relleno.pk})
+        self.assertEqual(bom.requerimientos(self.r_factura, D("3")),
+                         {self.harina.pk: D("6.000"), self.agua.pk: D("5.250"), self.sal.pk: D("0.300")})
+
+    def test_usa_la_version_activa_mas_alta(self):
+        v2 = Receta.objects.create(producto=self.masa, nombre="Integral", version=2, rendimiento_por_lote=D("5"))
+        RecetaLinea.objects.create(receta=v2, mp=self.harina, cantidad=D("5"))
+        self.assertEqual(bom.requerimientos(self.r_relleno, 1), {self.harina.pk: D("1.000"), self.agua.pk: D("1.000")})
+        v2.activo = False
+        v2.save()
+        self.assertEqual(bom.requerimientos(self.r_relleno, 1), {self.harina.pk: D("0.800"), self.agua.pk: D("1.500")})
+
+    def test_ciclo_se_detecta(self):
+        RecetaLinea.objects.create(receta=self.r_masa, producto=self.factura, cantidad=D("1"))
+        with self.assertRaisesMessage(ValidationError, "Receta circular: Factura → Masa → Factura."):
+            bom.Explosion().por_lote(self.r_factura.pk)
+
+    def test_intermedio_sin_receta_activa(self):
+        Receta.objects.filter(pk=self.r_masa.pk).update(activo=False)
+        with self.assertRaisesMessage(ValidationError, "El intermedio 'Masa' no tiene una receta activa."):
+            bom.requerimientos(self.r_factura, 1)
+
+    def test_validar_intermedios(self):
+        bom.validar_intermedios(self.pan.pk, {self.masa.pk, self.relleno.pk})
+        with self.assertRaisesMessage(ValidationError, "Receta circular"):
+            bom.validar_intermedios(self.masa.pk, {self.relleno.pk})  # Relleno ya usa Masa
+        with self.assertRaisesMessage(ValidationError, "su propia receta"):
+            bom.validar_intermedios(self.masa.pk, {self.masa.pk})
+        crema = Producto.objects.create(suscripcion=self.s, nombre="Crema", unidad=self.kg)
+        with self.assertRaisesMessage(ValidationError, "'Crema' no tiene una receta activa"):
+            bom.validar_intermedios(self.pan.pk, {crema.pk})
+
+    def test_formulario_rechaza_el_ciclo(self):
+        def formset(producto, sub_receta):
+            """Formset de una receta nueva de 'producto' con 'sub_receta' como única línea."""
+            return RecetaLineaFormSet({
+                "lineas-TOTAL_FORMS": "1", "lineas-INITIAL_FORMS": "0",
+                "lineas-0-producto": str(sub_receta.pk), "lineas-0-cantidad_valor": "1",
+                "lineas-0-cantidad_unidad": "auto",
+            }, instance=Receta(producto=producto), form_kwargs={"user": self.u})
+        fs = formset(self.masa, self.factura)  # Factura usa Masa
+        self.assertFalse(fs.is_valid())
+        self.assertIn("Receta circular", " ".join(fs.non_form_errors()))
+        fs = formset(self.pan, self.masa)
+        self.assertTrue(fs.is_valid(), fs.non_form_errors())
+
+    def test_op_valida_y_consume_materia_prima(self):
+        self.ingreso(self.harina, "2")
+        self.ingreso(self.agua, "2")
+        op = OrdenProduccion.objects.create(producto=self.factura, receta=self.r_factura, lotes=D("1"),
+                                            sucursal=self.suc)
+        with self.assertRaisesMessage(ValidationError, "Sal: req 0.1"):
+            op.validar_stock()
+        self.ingreso(self.sal, "1")
+        op.validar_stock()
+        op.ejecutar(user=self.u)
+        consumos = dict(MovimientoMP.objects.filter(op=op).values_list("mp__nombre", "cantidad"))
+        self.assertEqual(consumos, {"Harina": D("2"), "Agua": D("1.75"), "Sal": D("0.1")})
+        self.assertEqual(self.stock(self.agua), D("0.25"))
+
+    def test_costo_se_propaga_a_las_recetas_que_usan_el_intermedio(self):
+        self.ingreso(self.harina, "10", costo=D("100"))
+        self.ingreso(self.agua, "10", costo=D("10"))
+        costo = lambda r: Receta.objects.values_list("costo_unitario", flat=True).get(pk=r.pk)
+        # Masa (400 + 25) / 5 = 85; Relleno (85 + 10) / 2 = 47,5; Factura (170 + 47,5) / 10.
+        self.assertEqual([costo(r) for r in (self.r_masa, self.r_relleno, self.r_factura)],
+                         [D("85"), D("47.5"), D("21.75")])
+        self.ingreso(self.harina, "10", costo=D("300"))  # promedio 200
+        self.assertEqual([costo(r) for r in (self.r_masa, self.r_relleno, self.r_factura)],
+                         [D("165"), D("87.5"), D("41.75")])
+
+        Receta.objects.filter(producto__suscripcion=self.s).update(costo_unitario=0)
+        costos.recalcular_todo(self.s)
+        self.assertEqual(costo(self.r_factura), D("41.75"))
+
+
+# ============================================================
+#  FOTO DE LA RECETA EN LA OP
+# ============================================================
+class RecetaSnapshotTests(Empresa):
+    def op(self, lotes="2"):
+        return OrdenProduccion.objects.create(producto=self.pan, receta=self.receta, lotes=D(lotes), sucursal=self.suc)
+
+    def editar_receta(self):
+        """Lo que haría RecetaUpdateView: otra cantidad, otra MP y otro rendimiento."""
+        sal = MateriaPrima.objects.create(suscripcion=self.s, nombre="Sal", unidad=self.kg)
+        self.receta.lineas.filter(mp=self.harina).update(cantidad=D("3"))
+        RecetaLinea.objects.create(receta=self.receta, mp=sal, cantidad=D("0.1"))
+        Receta.objects.filter(pk=self.receta.pk).update(rendimiento_por_lote=D("20"))
+
+    def test_formato(self):
+        foto = self.op().receta_snapshot
+        self.assertEqual(foto["receta"], self.receta.pk)
+        self.assertEqual(foto["nombre"], str(self.receta))
+        self.assertEqual(D(foto["rendimiento"]), D("10"))
+        self.assertEqual(foto["mp"], [[self.agua.pk, "Agua", self.kg.pk, "0.5"],
+                                      [self.harina.pk, "Harina", self.kg.pk, "1"]])
+
+    def test_editar_la_receta_no_cambia_la_op(self):
+        op = self.op()
+        self.editar_receta()
+        op = OrdenProduccion.objects.select_related("producto").get(pk=op.pk)
+        unidades.nombre(self.kg.pk)  # registro de unidades cargado
+        with self.assertNumQueries(0):
+            self.assertEqual(op.unidades_totales, D("20"))
+            self.assertEqual(op.requerimientos_mp(), {self.harina.pk: D("2.000"), self.agua.pk: D("1.000")})
+            self.assertEqual([(d["mp"], d["total_fmt"]) for d in op.detalle_consumo],
+                             [("Agua", unidades.formatear(D("1"), self.kg.pk)),
+                              ("Harina", unidades.formatear(D("2"), self.kg.pk))])
+
+        self.ingreso(self.harina, "10")
+        self.ingreso(self.agua, "10")
+        op.ejecutar(user=self.u)
+        consumos = dict(MovimientoMP.objects.filter(op=op).values_list("mp__nombre", "cantidad"))
+        self.assertEqual(consumos, {"Harina": D("2"), "Agua": D("1")})
+        self.assertEqual(LoteProducto.objects.get(op=op).cantidad_inicial, D("20"))
+
+        # Una OP nueva toma la receta como está ahora.
+        self.assertEqual(self.op("1").requerimientos_mp()[self.harina.pk], D("3.000"))
+
+    def test_cambiar_la_receta_de_un_borrador_rehace_la_foto(self):
+        op = self.op()
+        otra = Receta.objects.create(producto=self.pan, nombre="Grande", version=2, rendimiento_por_lote=D("20"))
+        RecetaLinea.objects.create(receta=otra, mp=self.harina, cantidad=D("2"))
+        op.receta = otra
+        op.save(update_fields=["receta"])
+        op.refresh_from_db()
+        self.assertEqual(op.receta_snapshot["receta"], otra.pk)
+        self.assertEqual(op.requerimientos_mp(), {self.harina.pk: D("4.000")})
+
+    def test_op_sin_foto_la_arma_en_vivo(self):
+        op = self.op()
+        OrdenProduccion.objects.filter(pk=op.pk).update(receta_snapshot={})
+        op.refresh_from_db()
+        self.assertEqual(op.requerimientos_mp(), {self.harina.pk: D("2.000"), self.agua.pk: D("1.000")})
+
+    def test_migracion_completa_las_ops_existentes(self):
+        migracion = importlib.import_module("inventario.migrations.0016_op_receta_snapshot")
+        ops = [self.op() for _ in range(3)]
+        circular = Producto.objects.create(suscripcion=self.s, nombre="Circular", unidad=self.un)
+        r_circular = Receta.objects.create(producto=circular, rendimiento_por_lote=D("1"))
+        RecetaLinea.objects.create(receta=r_circular, producto=circular, cantidad=D("1"))
+        con_ciclo = OrdenProduccion(producto=circular, receta=r_circular, lotes=D("1"), sucursal=self.suc)
+        OrdenProduccion.objects.bulk_create([con_ciclo])  # sin save(): la foto levantaría el ciclo
+        OrdenProduccion.objects.update(receta_snapshot={})
+
+        with mock.patch.object(migracion, "BATCH", 2):
+            migracion.completar_fotos(django_apps, mock.Mock(connection=connection))
+        esperada = bom.snapshot(Receta.objects.get(pk=self.receta.pk))
+        for op in ops:
+            op.refresh_from_db()
+            self.assertEqual(op.receta_snapshot, esperada)
+        self.assertEqual(OrdenProduccion.objects.get(receta=r_circular).receta_snapshot, {})
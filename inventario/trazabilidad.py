@@ -0,0 +1,206 @@
+# inventario/trazabilidad.py
+# ============================================================
+#  TRAZABILIDAD (RECALLS)
+# ============================================================
+# Responde las dos preguntas de un recall usando solo TrazaEnlace:
+#
+#   - adelante(): ¿a qué ventas llegó el producto hecho con esta MP
+#     (en este rango de fechas) o con este lote?
+#   - atras():    ¿qué consumos de MP alimentaron este lote / esta venta?
+#
+# Cada dirección son 3 consultas fijas (aristas de origen, lotes,
+# aristas de destino) sin importar si un lote terminó en 5 o en 5.000
+# ventas: los ids intermedios viajan como subconsulta, no como lista.
+import re
+
+from django.db.models import Sum
+
+from .models import TrazaEnlace, LoteProducto, MovimientoMP, MovimientoMPArchivo, OrdenProduccion, Venta, VentaConsumo
+
+
+def _aristas(suscripcion, tipo):
+    return TrazaEnlace.objects.filter(suscripcion=suscripcion, tipo=tipo).order_by("fecha", "pk")
+
+
+def _insumo(e, archivadas):
+    return {
+        "mp": e.mp_id,
+        "mp_nombre": e.mp.nombre,
+        "unidad": e.mp.unidad.nombre,
+        "movimiento": e.movimiento_id,
+        "ubicacion": e.movimiento.ubicacion.nombre if e.movimiento else archivadas.get(e.movimiento_id),
+        "cantidad": e.cantidad,
+        "fecha": e.fecha,
+    }
+
+
+def _venta(e):
+    return {
+        "venta": e.venta_id,
+        "sucursal": e.venta.sucursal.nombre if e.venta.sucursal_id else None,
+        "estado": e.venta.estado,
+        "cantidad": e.cantidad,
+        "fecha": e.fecha,
+    }
+
+
+def _arbol(lotes_qs, insumos, ventas):
+    """Arma [{lote..., insumos: [...], ventas: [...]}] agrupando en memoria."""
+    por_lote = {}
+    for lote in lotes_qs.select_related("producto", "producto__unidad", "op").order_by("fecha_produccion", "pk"):
+        por_lote[lote.pk] = {
+            "id": lote.pk,
+            "codigo": lote.codigo,
+            "producto": lote.producto.nombre,
+            "op": lote.op_id,
+            "fecha_produccion": lote.fecha_produccion,
+            "fecha_vencimiento": lote.fecha_vencimiento,
+            "cantidad_inicial": lote.cantidad_inicial,
+            "insumos": [],
+            "ventas": [],
+        }
+    insumos = list(insumos)
+    # Movimientos ya archivados: la arista conserva el id (ver archivo.py).
+    sin_fila = {e.movimiento_id for e in insumos if e.movimiento_id and e.movimiento is None}
+    archivadas = dict(MovimientoMPArchivo.objects.filter(pk__in=sin_fila)
+                      .values_list("pk", "ubicacion__nombre")) if sin_fila else {}
+    for e in insumos:
+        if e.lote_id in por_lote:
+            por_lote[e.lote_id]["insumos"].append(_insumo(e, archivadas))
+    for e in ventas:
+        if e.lote_id in por_lote:
+            por_lote[e.lote_id]["ventas"].append(_venta(e))
+
+    lotes = list(por_lote.values())
+    return {
+        "lotes": lotes,
+        "total_lotes": len(lotes),
+        "total_ventas": len({v["venta"] for l in lotes for v in l["ventas"]}),
+    }
+
+
+def _select_insumos(qs):
+    return qs.select_related("mp", "mp__unidad", "movimiento__ubicacion")
+
+
+def _select_ventas(qs):
+    return qs.select_related("venta", "venta__sucursal")
+
+
+def adelante(suscripcion, *, mp=None, desde=None, hasta=None, lote=None):
+    """
+    Trazabilidad hacia adelante desde una MP (consumida entre 'desde' y
+    'hasta', ambos datetime opcionales) o desde un LoteProducto.
+    """
+    if (mp is None) == (lote is None):
+        raise ValueError("Indique 'mp' o 'lote'.")
+
+    if lote is not None:
+        lotes_ids = LoteProducto.objects.filter(pk=getattr(lote, "pk", lote), producto__suscripcion=suscripcion).values("pk")
+        insumos = _aristas(suscripcion, TrazaEnlace.MP_LOTE).filter(lote_id__in=lotes_ids)
+    else:
+        insumos = _aristas(suscripcion, TrazaEnlace.MP_LOTE).filter(mp=mp)
+        if desde: insumos = insumos.filter(fecha__gte=desde)
+        if hasta: insumos = insumos.filter(fecha__lte=hasta)
+        lotes_ids = insumos.values("lote_id")
+
+    ventas = _aristas(suscripcion, TrazaEnlace.LOTE_VENTA).filter(lote_id__in=lotes_ids)
+    return _arbol(
+        LoteProducto.objects.filter(pk__in=lotes_ids),
+        _select_insumos(insumos),
+        _select_ventas(ventas),
+    )
+
+
+def atras(suscripcion, *, lote=None, venta=None):
+    """Trazabilidad hacia atrás desde un LoteProducto o desde una Venta."""
+    if (venta is None) == (lote is None):
+        raise ValueError("Indique 'lote' o 'venta'.")
+
+    ventas = _aristas(suscripcion, TrazaEnlace.LOTE_VENTA)
+    if venta is not None:
+        ventas = ventas.filter(venta_id=getattr(venta, "pk", venta))
+        lotes_ids = ventas.values("lote_id")
+    else:
+        lotes_ids = LoteProducto.objects.filter(pk=getattr(lote, "pk", lote), producto__suscripcion=suscripcion).values("pk")
+        ventas = ventas.none()
+
+    insumos = _aristas(suscripcion, TrazaEnlace.MP_LOTE).filter(lote_id__in=lotes_ids)
+    return _arbol(
+        LoteProducto.objects.filter(pk__in=lotes_ids),
+        _select_insumos(insumos),
+        _select_ventas(ventas),
+    )
+
+
+# ============================================================
+#  RECONSTRUCCIÓN (datos anteriores a TrazaEnlace)
+# ============================================================
+NOTA_OP = re.compile(r"^OP (\d+)\b")
+
+
+def _tandas(qs, batch):
+    """Recorre 'qs' por rangos de pk (sin OFFSET) en listas de hasta 'batch' filas."""
+    ultimo = 0
+    while True:
+        filas = list(qs.filter(pk__gt=ultimo).order_by("pk")[:batch])
+        if not filas:
+            return
+        yield filas
+        ultimo = filas[-1].pk
+
+
+def reconstruir(batch=2000):
+    """
+    Completa la trazabilidad de lo registrado antes de que existiera:
+      1) MovimientoMP.op a partir de la nota "OP {pk} · ...",
+      2) aristas MP_LOTE de los consumos con OP,
+      3) aristas LOTE_VENTA de las ventas confirmadas.
+    Se puede correr varias veces: solo completa lo que falta.
+    Devuelve (movimientos enlazados, aristas MP_LOTE, aristas LOTE_VENTA).
+    """
+    enlazados = 0
+    sin_op = MovimientoMP.objects.filter(tipo=MovimientoMP.CONSUMO, op__isnull=True, nota__startswith="OP ")
+    for movs in _tandas(sin_op.select_related("mp"), batch):
+        candidatos = {m.pk: int(x.group(1)) for m in movs if (x := NOTA_OP.match(m.nota))}
+        # Solo OPs de la misma empresa que la MP.
+        ops = dict(OrdenProduccion.objects
+                   .filter(pk__in=set(candidatos.values()))
+                   .values_list("pk", "producto__suscripcion_id"))
+        cambios = []
+        for m in movs:
+            op_id = candidatos.get(m.pk)
+            if op_id and ops.get(op_id) == m.mp.suscripcion_id:
+                m.op_id = op_id
+                cambios.append(m)
+        MovimientoMP.objects.bulk_update(cambios, ["op"])
+        enlazados += len(cambios)
+
+    aristas_mp = 0
+    pendientes = (MovimientoMP.objects
+                  .filter(tipo=MovimientoMP.CONSUMO, op__isnull=False, trazas__isnull=True)
+                  .select_related("mp"))
+    for movs in _tandas(pendientes, batch):
+        lotes = {}
+        for lote in LoteProducto.objects.filter(op_id__in={m.op_id for m in movs}).order_by("pk"):
+            lotes.setdefault(lote.op_id, lote)
+        nuevas = [TrazaEnlace.desde_consumo(m, lotes[m.op_id]) for m in movs if m.op_id in lotes]
+        TrazaEnlace.objects.bulk_create(nuevas)
+        aristas_mp += len(nuevas)
+
+    aristas_venta = 0
+    ventas = Venta.objects.filter(estado=Venta.CONFIRMADA).exclude(trazas__tipo=TrazaEnlace.LOTE_VENTA)
+    for tanda in _tandas(ventas, batch):
+        por_venta = {v.pk: v for v in tanda}
+        filas = (VentaConsumo.objects.filter(venta_id__in=por_venta)
+                 .values("venta_id", "lote_id").annotate(total=Sum("cantidad")).order_by())
+        nuevas = [
+            TrazaEnlace(suscripcion_id=por_venta[f["venta_id"]].suscripcion_id, tipo=TrazaEnlace.LOTE_VENTA,
+                        lote_id=f["lote_id"], venta_id=f["venta_id"], cantidad=f["total"],
+                        fecha=por_venta[f["venta_id"]].fecha)
+            for f in filas
+        ]
+        TrazaEnlace.objects.bulk_create(nuevas)
+        aristas_venta += len(nuevas)
+
+    return enlazados, aristas_mp, aristas_venta
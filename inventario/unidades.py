@@ -0,0 +1,119 @@
+# inventario/unidades.py
+# ============================================================
+#  UNIDADES DE MEDIDA Y FORMATO DE CANTIDADES
+# ============================================================
+# Registro en proceso de UnidadMedida ({pk: nombre}): la tabla tiene un
+# puñado de filas (las carga la migración 0003) y casi nunca cambia, así
+# que se lee una vez por proceso y signals.py la invalida al guardar o
+# borrar una unidad. Un pk que el registro no conoce (creado desde otro
+# proceso) fuerza la recarga.
+#
+# Formato: un solo formateador para MateriaPrima y Producto. Los
+# cuantizadores están precalculados y el resultado se memoiza por
+# (valor, unidad): las pantallas repiten mucho las mismas cantidades.
+import threading
+from decimal import Decimal, ROUND_HALF_UP
+from functools import lru_cache
+
+from django.apps import apps
+
+_nombres = None
+_lock = threading.Lock()
+
+KG = "kg"
+LITRO = "l"
+_LITROS = ("l", "lt", "litro", "litros")
+# Subunidad para cantidades < 1 y su factor respecto de la base.
+SUBUNIDADES = {KG: ("g", Decimal("1000")), LITRO: ("ml", Decimal("1000"))}
+
+_CUANTIZADORES = {n: Decimal(10) ** -n for n in range(4)}
+_ENTERO = Decimal("1")
+_UNO = Decimal("1")
+
+
+# ============================================================
+#  REGISTRO
+# ============================================================
+def _cargar():
+    global _nombres
+    UnidadMedida = apps.get_model("inventario", "UnidadMedida")
+    with _lock:
+        _nombres = dict(UnidadMedida.objects.values_list("pk", "nombre"))
+    return _nombres
+
+
+def nombre(pk) -> str:
+    """Nombre de la unidad (sin consulta salvo la primera vez o si el pk es nuevo)."""
+    nombres = _nombres
+    if nombres is None or pk not in nombres:
+        nombres = _cargar()
+    return nombres.get(pk, "")
+
+
+def opciones():
+    """(valor, etiqueta) de todas las unidades ingresables: las del registro más g y ml."""
+    nombres = _nombres if _nombres is not None else _cargar()
+    extra = [sub for sub, _ in SUBUNIDADES.values()]
+    return [(n, n) for n in sorted(set(nombres.values()) | set(extra), key=str.lower)]
+
+
+def limpiar():
+    global _nombres
+    _nombres = None
+
+
+def familia(nombre_unidad) -> str:
+    """'kg', 'l' o el nombre tal cual (en minúsculas) para unidades sin subunidad."""
+    u = (nombre_unidad or "").lower()
+    return LITRO if u in _LITROS else u
+
+
+def a_base(valor, unidad_ingresada, unidad_base) -> Decimal:
+    """Convierte lo ingresado en g/ml a kg/l; cualquier otra cosa queda igual."""
+    sub = SUBUNIDADES.get(familia(unidad_base))
+    valor = Decimal(valor)
+    if sub and unidad_ingresada and unidad_ingresada.lower() == sub[0]:
+        return valor / sub[1]
+    return valor
+
+
+# ============================================================
+#  FORMATO
+# ============================================================
+def _dec(valor) -> Decimal:
+    return valor if type(valor) is Decimal else Decimal(valor or 0)
+
+
+@lru_cache(maxsize=8192)
+def decimal_corto(d: Decimal, max_dec: int = 1) -> str:
+    """'2', '2.5' (máx. 'max_dec' decimales, sin ceros de más)."""
+    # Texto en notación fija y sin ceros a la derecha (equivale a normalize()
+    # + to_integral(), pero sin crear Decimals intermedios).
+    txt = f"{d.quantize(_CUANTIZADORES[max_dec], rounding=ROUND_HALF_UP):f}"
+    if "." in txt:
+        txt = txt.rstrip("0").rstrip(".")
+    return "0" if txt == "-0" else txt
+
+
+def fmt1(value) -> str:
+    try:
+        d = _dec(value)
+    except Exception:
+        return str(value)
+    return decimal_corto(d, 1)
+
+
+@lru_cache(maxsize=16384)
+def _formatear(d: Decimal, nombre_unidad: str) -> str:
+    fam = familia(nombre_unidad)
+    sub = SUBUNIDADES.get(fam)
+    if sub is None:
+        return f"{decimal_corto(d)} {nombre_unidad}"
+    if d >= _UNO:
+        return f"{decimal_corto(d)} {fam}"
+    return f"{int((d * sub[1]).quantize(_ENTERO, rounding=ROUND_HALF_UP))} {sub[0]}"
+
+
+def formatear(cantidad, unidad_pk) -> str:
+    """'1.5 kg', '250 g', '3 un' según la unidad (pk de UnidadMedida)."""
+    return _formatear(_dec(cantidad), nombre(unidad_pk))
@@ -1,6 +1,7 @@
 # inventario/urls.py
-from django.urls import path
-from . import views
+from django.urls import path, include
+from rest_framework.authtoken.views import obtain_auth_token
+from . import views, api, instrumentacion, conexiones
 
 app_name = 'inventario'
 
@@ -51,6 +52,7 @@ urlpatterns = [
     # --- Dashboard ---
     path('panel/', views.panel, name='panel'),
     path('panel/csv/', views.panel_csv, name='panel_csv'),
+    path('panel/eventos/', views.panel_eventos, name='panel_eventos'),  # SSE (servidor ASGI)
 
     # --- Materias Primas / Kardex ---
     path('mp/', views.MPListView.as_view(), name='mp_list'),
@@ -60,6 +62,13 @@ urlpatterns = [
     path('mp/merma/', views.MPMermaView.as_view(), name='mp_merma'),
     path('kardex/', views.kardex, name='kardex'),
 
+    # --- Conteos físicos ---
+    path('conteos/', views.ConteoListView.as_view(), name='conteo_list'),
+    path('conteos/nuevo/', views.conteo_crear, name='conteo_create'),
+    path('conteos/<int:pk>/', views.ConteoDetailView.as_view(), name='conteo_detail'),
+    path('conteos/<int:pk>/cargar/', views.conteo_cargar, name='conteo_cargar'),
+    path('conteos/<int:pk>/contabilizar/', views.conteo_contabilizar, name='conteo_contabilizar'),
+
     # --- Recetas / Productos ---
     path('recetas/', views.RecetaListView.as_view(), name='receta_list'),
     path('recetas/nueva/', views.RecetaCreateView.as_view(), name='receta_create'),
@@ -78,6 +87,7 @@ urlpatterns = [
     # --- Ventas ---
     path('ventas/', views.VentaListView.as_view(), name='venta_list'),
     path('ventas/nueva/', views.VentaCreateView.as_view(), name='venta_create'),
+    path('ventas/importar/', views.venta_importar, name='venta_importar'),
     path('ventas/<int:pk>/', views.VentaDetailView.as_view(), name='venta_detail'),
 
     # ============================================================
@@ -88,4 +98,15 @@ urlpatterns = [
     path('ia/procesar-factura/', views.procesar_factura, name='procesar_factura'),
     path('ia/guardar-factura/', views.guardar_ingreso_factura, name='guardar_ingreso_factura'),
     path('reporte/stock-global/', views.reporte_stock_global, name='reporte_stock_global'),
+    path('reporte/stock-a-fecha/', views.reporte_stock_fecha, name='reporte_stock_fecha'),
+
+    # --- Diagnóstico (superusuarios) ---
+    path('diagnostico/requests/', instrumentacion.diagnostico_requests, name='diagnostico_requests'),
+    path('diagnostico/conexiones/', conexiones.diagnostico_conexiones, name='diagnostico_conexiones'),
+
+    # ============================================================
+    # API REST (POS / ESCÁNERES)
+    # ============================================================
+    path('api/token/', obtain_auth_token, name='api_token'),
+    path('api/', include(api.router.urls)),
 ]
\ No newline at end of file
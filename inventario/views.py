@@ -7,6 +7,7 @@ from django.contrib.auth.models import Group
 from decimal import Decimal
 import datetime
 import csv
+import json
 import base64
 from io import BytesIO
 
@@ -20,13 +21,18 @@ from django.contrib.messages.views import SuccessMessageMixin # <-- Ubicación c
 # --- FIN CORRECCIÓN ---
 
 from django.contrib.auth import login
+from django.core.exceptions import ValidationError
 from django.db import transaction
-from django.db.models import Sum, Case, When, F, Value, DecimalField, Q
+from django.db.models import Sum, Count, Case, When, F, Value, DecimalField, Q
 from django.db.models.functions import Coalesce, TruncDate
-from django.http import HttpResponse, HttpResponseRedirect
+from django.core.handlers.asgi import ASGIRequest
+from django.http import HttpResponse, HttpResponseRedirect, StreamingHttpResponse
+from django.utils.http import urlencode
 from django.shortcuts import render, redirect, get_object_or_404
 from django.urls import reverse, reverse_lazy
 from django.utils import timezone
+from django.utils.decorators import method_decorator
+from django.utils.functional import SimpleLazyObject
 from django.views.generic import ListView, CreateView, DetailView, View, UpdateView
 from django.conf import settings
 from django.core.files.storage import FileSystemStorage
@@ -49,9 +55,30 @@ from .models import (
     Producto, Receta, RecetaLinea, OrdenProduccion,
     LoteProducto, Venta, VentaLinea, VentaConsumo,
     HistoricoVenta, SuscripcionCliente, User,
-    Sucursal, Ubicacion, StockPorUbicacion
+    Sucursal, Ubicacion, StockPorUbicacion, ConteoFisico
 )
 
+# Reintentos seguros de los POST que mueven stock
+from .idempotencia import idempotente
+# Reportes y listados leen de la réplica (si hay)
+from .replicas import usar_replica
+# Base del tenant (sharding) para las transacciones
+from .shards import atomico
+# Stock a una fecha (fotos diarias + kardex)
+from .saldos import stocks_at
+from . import unidades
+# Paginación keyset de listados grandes
+from . import paginacion
+from . import archivo
+# Cambios en vivo del panel (Server-Sent Events)
+from . import eventos
+# Conteos físicos (carga, diferencias, ajustes en bloque)
+from . import conteos
+# Cierre del día de POS externos (importación en bloque)
+from . import cierre_pos
+# Explosión de recetas con sub-recetas
+from . import bom
+
 # Importaciones de esta app (formularios)
 from .forms import (
     CustomUserCreationForm, 
@@ -62,6 +89,7 @@ from .forms import (
     VentaForm, VentaLineaFormSet,
     UploadFileForm, 
     UploadInvoiceForm,
+    ConteoFisicoForm, CierrePOSForm,
     
     # --- Formularios del Nuevo Wizard ---
     SuscripcionConfigForm, SucursalForm, UbicacionForm
@@ -329,6 +357,7 @@ def wizard_finalizar(request):
 # VISTAS CRUD DE BODEGAS (¡NUEVAS!)
 # ============================================================
 
+@method_decorator(usar_replica, name="dispatch")
 class SucursalListView(LoginRequiredMixin, PermissionRequiredMixin, ListView):
     model = Sucursal
     template_name = "sucursal_list.html"
@@ -356,6 +385,7 @@ class SucursalCreateView(LoginRequiredMixin, PermissionRequiredMixin, SuccessMes
         form.instance.suscripcion = self.request.user.suscripcion
         return super().form_valid(form)
 
+@method_decorator(usar_replica, name="dispatch")
 class UbicacionListView(LoginRequiredMixin, PermissionRequiredMixin, ListView):
     model = Ubicacion
     template_name = "ubicacion_list.html"
@@ -385,6 +415,7 @@ class UbicacionCreateView(LoginRequiredMixin, PermissionRequiredMixin, SuccessMe
 # VISTAS CORE DEL ERP
 # ============================================================
 
+@method_decorator(usar_replica, name="dispatch")
 class MPListView(LoginRequiredMixin, PermissionRequiredMixin, ListView):
     permission_required = "inventario.view_materiaprima" 
     model = MateriaPrima; template_name = "mp_list.html"
@@ -421,6 +452,7 @@ class ProductoCreateView(LoginRequiredMixin, CreateView):
         return super().form_valid(form)
 # --- FIN DE LA VISTA QUE FALTABA ---
 
+@method_decorator(idempotente, name="post")
 class MPIngresoView(LoginRequiredMixin, PermissionRequiredMixin, CreateView):
     permission_required = "inventario.add_movimientomp"
     model = MovimientoMP; form_class = MovimientoIngresoForm
@@ -437,6 +469,7 @@ class MPIngresoView(LoginRequiredMixin, PermissionRequiredMixin, CreateView):
         form.save(user=self.request.user); messages.success(self.request, "Ingreso registrado.")
         return redirect(self.get_success_url())
 
+@method_decorator(idempotente, name="post")
 class MPAjusteView(LoginRequiredMixin, PermissionRequiredMixin, CreateView):
     permission_required = "inventario.add_movimientomp"
     model = MovimientoMP; form_class = MovimientoAjusteForm
@@ -444,9 +477,14 @@ class MPAjusteView(LoginRequiredMixin, PermissionRequiredMixin, CreateView):
     def get_form_kwargs(self):
         kwargs = super().get_form_kwargs(); kwargs['user'] = self.request.user; return kwargs
     def form_valid(self, form):
-        form.save(user=self.request.user); messages.success(self.request, "Ajuste registrado.")
+        try:
+            form.save(user=self.request.user)
+        except ValidationError as e:
+            form.add_error(None, e); return self.form_invalid(form)
+        messages.success(self.request, "Ajuste registrado.")
         return redirect(self.success_url)
 
+@method_decorator(idempotente, name="post")
 class MPMermaView(LoginRequiredMixin, PermissionRequiredMixin, CreateView):
     permission_required = "inventario.add_movimientomp"
     model = MovimientoMP; form_class = MovimientoMermaForm
@@ -454,23 +492,27 @@ class MPMermaView(LoginRequiredMixin, PermissionRequiredMixin, CreateView):
     def get_form_kwargs(self):
         kwargs = super().get_form_kwargs(); kwargs['user'] = self.request.user; return kwargs
     def form_valid(self, form):
-        form.save(user=self.request.user); messages.success(self.request, "Merma registrada.")
+        try:
+            form.save(user=self.request.user)
+        except ValidationError as e:
+            form.add_error(None, e); return self.form_invalid(form)
+        messages.success(self.request, "Merma registrada.")
         return redirect(self.success_url)
 
+@usar_replica
 @login_required
 @permission_required("inventario.view_movimientomp", raise_exception=True)
 def kardex(request):
-    qs = MovimientoMP.objects.filter(
-        mp__suscripcion=request.user.suscripcion
-    ).select_related(
-        "mp", "ubicacion", "ubicacion__sucursal"
-    ).order_by("-fecha")[:300]
-    return render(request, "kardex.html", {"movs": qs})
+    # ?historico=1 incluye los movimientos archivados (ver archivo.py).
+    historico = request.GET.get("historico") == "1"
+    movs = archivo.movimientos(request.user.suscripcion, limite=300, historico=historico)
+    return render(request, "kardex.html", {"movs": movs, "historico": historico})
 
 # ============================================================
 # VISTAS CORE DEL ERP (Recetas)
 # ============================================================
 
+@method_decorator(usar_replica, name="dispatch")
 class RecetaListView(LoginRequiredMixin, PermissionRequiredMixin, ListView):
     permission_required = "inventario.view_receta" 
     model = Receta; template_name = "receta_list.html"
@@ -479,24 +521,37 @@ class RecetaListView(LoginRequiredMixin, PermissionRequiredMixin, ListView):
         suscripcion = self.request.user.suscripcion
         qs = (Receta.objects
             .filter(producto__suscripcion=suscripcion)
-            .select_related("producto").prefetch_related("lineas__mp")
+            .select_related("producto")
             .order_by("producto__nombre", "nombre", "-version"))
         q = self.request.GET.get("q")
         if q: qs = qs.filter(Q(producto__nombre__icontains=q) | Q(nombre__icontains=q))
         return qs
 
+def _unidades_mp_json(user):
+    """
+    {"mp": {mp_id: unidad}, "producto": {producto_id: unidad}} para el selector
+    kg/g, l/ml de receta_form.html (unidades desde el registro, sin JOIN).
+    """
+    mps = MateriaPrima.objects.filter(suscripcion=user.suscripcion, activo=True).values_list("pk", "unidad_id")
+    productos = Producto.objects.filter(suscripcion=user.suscripcion, activo=True).values_list("pk", "unidad_id")
+    return json.dumps({
+        "mp": {pk: unidades.nombre(unidad_id) for pk, unidad_id in mps},
+        "producto": {pk: unidades.nombre(unidad_id) for pk, unidad_id in productos},
+    })
+
 class RecetaCreateView(LoginRequiredMixin, PermissionRequiredMixin, View):
     permission_required = "inventario.add_receta"; template_name = "receta_form.html"
     def get(self, request):
         form = RecetaForm(user=request.user)
         formset = RecetaLineaFormSet(form_kwargs={'user': request.user})
-        return render(request, self.template_name, {"form": form, "formset": formset})
+        return render(request, self.template_name, {"form": form, "formset": formset, "mp_units_json": _unidades_mp_json(request.user)})
     def post(self, request):
         form = RecetaForm(request.POST, user=request.user)
-        formset = RecetaLineaFormSet(request.POST, form_kwargs={'user': request.user})
+        # Con la instancia del form el formset conoce el producto (chequeo de ciclos en sub-recetas).
+        formset = RecetaLineaFormSet(request.POST, instance=form.instance, form_kwargs={'user': request.user})
         if not (form.is_valid() and formset.is_valid()):
-            return render(request, self.template_name, {"form": form, "formset": formset})
-        with transaction.atomic():
+            return render(request, self.template_name, {"form": form, "formset": formset, "mp_units_json": _unidades_mp_json(request.user)})
+        with atomico():
             receta = form.save(); formset.instance = receta; formset.save() 
         messages.success(request, "Receta creada correctamente.")
         return redirect("inventario:receta_detail", pk=receta.pk)
@@ -507,14 +562,14 @@ class RecetaUpdateView(LoginRequiredMixin, PermissionRequiredMixin, View):
         receta = get_object_or_404(Receta, pk=pk, producto__suscripcion=request.user.suscripcion)
         form = RecetaForm(instance=receta, user=request.user)
         formset = RecetaLineaFormSet(instance=receta, form_kwargs={'user': request.user})
-        return render(request, self.template_name, {"form": form, "formset": formset, "obj": receta})
+        return render(request, self.template_name, {"form": form, "formset": formset, "obj": receta, "mp_units_json": _unidades_mp_json(request.user)})
     def post(self, request, pk):
         receta = get_object_or_404(Receta, pk=pk, producto__suscripcion=request.user.suscripcion)
         form = RecetaForm(request.POST, instance=receta, user=request.user)
         formset = RecetaLineaFormSet(request.POST, instance=receta, form_kwargs={'user': request.user})
         if not (form.is_valid() and formset.is_valid()):
-            return render(request, self.template_name, {"form": form, "formset": formset, "obj": receta})
-        with transaction.atomic():
+            return render(request, self.template_name, {"form": form, "formset": formset, "obj": receta, "mp_units_json": _unidades_mp_json(request.user)})
+        with atomico():
             receta = form.save(); formset.save()
         messages.success(request, "Receta actualizada.")
         return redirect("inventario:receta_detail", pk=receta.pk)
@@ -524,12 +579,32 @@ class RecetaDetailView(LoginRequiredMixin, PermissionRequiredMixin, DetailView):
     model = Receta; template_name = "receta_detail.html"
     context_object_name = "receta"
     def get_queryset(self):
-        return super().get_queryset().filter(producto__suscripcion=self.request.user.suscripcion)
+        return (super().get_queryset()
+            .filter(producto__suscripcion=self.request.user.suscripcion)
+            .select_related("producto").prefetch_related("lineas__mp", "lineas__producto"))
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        try: lotes = Decimal(self.request.GET.get("lotes") or "1")
+        except ArithmeticError: lotes = Decimal("1")
+        context["lotes"] = lotes
+        lineas = self.object.lineas.all()
+        if any(ln.producto_id for ln in lineas):
+            # Con sub-recetas la calculadora muestra la MP de todos los niveles.
+            try: context["preview"] = bom.detalle(self.object, lotes)
+            except ValidationError as e: context["preview"] = []; messages.error(self.request, "; ".join(e.messages))
+        else:
+            context["preview"] = [
+                {"mp": ln.mp, "por_lote": ln.por_lote_fmt(), "total_fmt": ln.total_para_fmt(lotes)}
+                for ln in lineas
+            ]
+        return context
 
 # ============================================================
 # VISTAS CORE DEL ERP (Producción)
 # ============================================================
 
+@method_decorator(usar_replica, name="dispatch")
 class OPListView(LoginRequiredMixin, PermissionRequiredMixin, ListView):
     permission_required = "inventario.view_ordenproduccion" 
     model = OrdenProduccion; template_name = "op_list.html"
@@ -539,6 +614,7 @@ class OPListView(LoginRequiredMixin, PermissionRequiredMixin, ListView):
             producto__suscripcion=self.request.user.suscripcion
         ).select_related("producto", "receta", "sucursal")
 
+@method_decorator(idempotente, name="post")
 class OPCreateView(LoginRequiredMixin, PermissionRequiredMixin, View):
     permission_required = "inventario.add_ordenproduccion"
     template_name = "op_form.html"; success_url = reverse_lazy("inventario:op_list")
@@ -554,13 +630,17 @@ class OPCreateView(LoginRequiredMixin, PermissionRequiredMixin, View):
         
         if form.cleaned_data.get("confirmar_y_ejecutar"):
             try:
-                with transaction.atomic():
+                with atomico():
                     op.validar_stock(); op.ejecutar(user=request.user)
                 messages.success(request, "OP creada y ejecutada; lote generado.")
             except Exception as e:
                 messages.error(request, f"No se pudo ejecutar la OP: {e}")
         else:
-            messages.success(request, "OP creada en estado BORRADOR.")
+            try:
+                op.reservar()
+                messages.success(request, "OP creada en estado BORRADOR; materias primas reservadas.")
+            except ValidationError as e:
+                messages.warning(request, f"OP creada en estado BORRADOR, sin reserva: {' '.join(e.messages)}")
         return redirect(self.success_url)
 
 class OPDetailView(LoginRequiredMixin, PermissionRequiredMixin, DetailView):
@@ -570,29 +650,73 @@ class OPDetailView(LoginRequiredMixin, PermissionRequiredMixin, DetailView):
     def get_queryset(self):
         return super().get_queryset().filter(
             producto__suscripcion=self.request.user.suscripcion
-        ).select_related("producto", "receta", "sucursal")
+        ).select_related("producto", "sucursal")
 
 # ============================================================
 # VISTAS CORE DEL ERP (Lotes)
 # ============================================================
 
+@method_decorator(usar_replica, name="dispatch")
 class LoteListView(LoginRequiredMixin, PermissionRequiredMixin, ListView):
+    """
+    Lotes con búsqueda indexada, paginación keyset y conteo por estado.
+    'q' busca por prefijo de código (sin distinguir mayúsculas) o por
+    parte del nombre del producto; las pestañas de estado se calculan por
+    fecha_vencimiento (el 'estado' guardado puede estar desactualizado).
+    """
     permission_required = "inventario.view_loteproducto" 
     model = LoteProducto; template_name = "lote_list.html"
-    context_object_name = "lotes"; paginate_by = 50
-    def get_queryset(self):
+    context_object_name = "lotes"; paginate_by = None
+    por_pagina = 50
+    orden = ["fecha_vencimiento", "created_at", "id"]
+    ESTADOS = [LoteProducto.OK, LoteProducto.POR_RALLAR, LoteProducto.VENCIDO]
+
+    def _buscados(self):
         suscripcion = self.request.user.suscripcion
-        qs = super().get_queryset().filter(
-            producto__suscripcion=suscripcion
-        ).select_related("producto", "op", "ubicacion", "ubicacion__sucursal")
-        
+        qs = LoteProducto.objects.filter(producto__suscripcion=suscripcion)
+        q = self.request.GET.get("q", "").strip()
+        if q:
+            # Código: prefijo sobre UPPER(codigo) (índice por expresión).
+            # Nombre: los productos de la empresa son pocos, se resuelven
+            # aparte (trigram en PostgreSQL) y el lote filtra por producto_id.
+            productos = Producto.objects.filter(suscripcion=suscripcion, nombre__icontains=q).values("pk")
+            qs = qs.filter(Q(codigo__istartswith=q) | Q(producto__in=productos))
+        return qs
+
+    def get_queryset(self):
+        self.hoy = timezone.localdate()
+        self.buscados = self._buscados()
+        qs = self.buscados
         estado = self.request.GET.get("estado")
-        if estado in [LoteProducto.OK, LoteProducto.POR_RALLAR, LoteProducto.VENCIDO]:
-            qs = qs.filter(estado=estado)
-        q = self.request.GET.get("q")
-        if q: qs = qs.filter(Q(producto__nombre__icontains=q) | Q(codigo__icontains=q))
-        
-        return qs.order_by("fecha_vencimiento", "created_at")
+        if estado in self.ESTADOS:
+            qs = qs.filter(LoteProducto.q_estado(estado, self.hoy))
+        return qs.select_related("producto")
+
+    def get_context_data(self, **kwargs):
+        get = self.request.GET
+        direccion, cursor = ((paginacion.ANTES, get["antes"]) if get.get("antes")
+                             else (paginacion.DESPUES, get.get("despues")))
+        pagina = paginacion.paginar(self.object_list, self.orden, cursor, direccion, self.por_pagina)
+        ctx = super().get_context_data(object_list=pagina.objetos, **kwargs)
+
+        # Conteo de las pestañas: una sola consulta sobre la búsqueda actual.
+        conteos = self.buscados.aggregate(
+            total=Count("pk"),
+            **{e: Count("pk", filter=LoteProducto.q_estado(e, self.hoy)) for e in self.ESTADOS},
+        )
+        filtros = {k: get[k] for k in ("q", "estado") if get.get(k)}
+        ctx.update({
+            "pagina": pagina,
+            "pestanas": [{"valor": "", "etiqueta": "Todos", "n": conteos["total"]}] + [
+                {"valor": e, "etiqueta": etiqueta, "n": conteos[e]}
+                for e, etiqueta in LoteProducto.ESTADOS
+            ],
+            "estado_sel": get.get("estado", ""),
+            "q_pestana": urlencode({"q": filtros["q"]}) if "q" in filtros else "",
+            "url_siguiente": urlencode({**filtros, "despues": pagina.siguiente}) if pagina.siguiente else None,
+            "url_anterior": urlencode({**filtros, "antes": pagina.anterior}) if pagina.anterior else None,
+        })
+        return ctx
 
 class LoteDetailView(LoginRequiredMixin, PermissionRequiredMixin, DetailView):
     permission_required = "inventario.view_loteproducto" 
@@ -607,6 +731,7 @@ class LoteDetailView(LoginRequiredMixin, PermissionRequiredMixin, DetailView):
 # VISTAS CORE DEL ERP (Ventas)
 # ============================================================
 
+@method_decorator(usar_replica, name="dispatch")
 class VentaListView(LoginRequiredMixin, PermissionRequiredMixin, ListView):
     permission_required = "inventario.view_venta" 
     model = Venta; template_name = "venta_list.html"
@@ -633,7 +758,7 @@ class VentaDetailView(LoginRequiredMixin, PermissionRequiredMixin, DetailView):
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
         lotes_consumidos = []
-        for c in self.object.consumos.all():
+        for c in archivo.consumos_de_venta(self.object):
             codigo = c.lote.codigo; qr_img = qrcode.make(codigo)
             buffer_qr = BytesIO(); qr_img.save(buffer_qr, format="PNG")
             qr_base64 = base64.b64encode(buffer_qr.getvalue()).decode("utf-8")
@@ -650,6 +775,7 @@ class VentaDetailView(LoginRequiredMixin, PermissionRequiredMixin, DetailView):
         context["lotes_consumidos"] = lotes_consumidos
         return context
 
+@method_decorator(idempotente, name="post")
 class VentaCreateView(LoginRequiredMixin, PermissionRequiredMixin, View):
     permission_required = "inventario.add_venta"; template_name = "venta_form.html"
     def get(self, request):
@@ -674,7 +800,7 @@ class VentaCreateView(LoginRequiredMixin, PermissionRequiredMixin, View):
         
         if form.cleaned_data.get("confirmar_y_consumir"):
             try:
-                with transaction.atomic():
+                with atomico():
                     venta.validar_stock(); venta.consumir_fifo(user=request.user)
                 messages.success(request, "Venta confirmada y stock descontado (FEFO).")
             except Exception as e:
@@ -683,9 +809,145 @@ class VentaCreateView(LoginRequiredMixin, PermissionRequiredMixin, View):
                 formset = VentaLineaFormSet(instance=venta, form_kwargs={'user': request.user})
                 return render(request, self.template_name, {"form": form, "formset": formset})
         else:
-            messages.success(request, "Venta guardada como borrador.")
+            try:
+                venta.reservar()
+                messages.success(request, "Venta guardada como borrador; lotes reservados.")
+            except ValidationError as e:
+                messages.warning(request, f"Venta guardada como borrador, sin reserva: {' '.join(e.messages)}")
         return redirect("inventario:venta_detail", pk=venta.pk)
 
+# ============================================================
+# VISTAS CORE DEL ERP (Conteos físicos)
+# ============================================================
+@method_decorator(usar_replica, name="dispatch")
+class ConteoListView(LoginRequiredMixin, PermissionRequiredMixin, ListView):
+    permission_required = "inventario.view_conteofisico"
+    model = ConteoFisico; template_name = "conteo_list.html"
+    context_object_name = "conteos"; paginate_by = 50
+    def get_queryset(self):
+        return (super().get_queryset()
+                .filter(suscripcion=self.request.user.suscripcion)
+                .select_related("sucursal", "created_by")
+                .annotate(n_lineas=Count("lineas"))
+                .order_by("-created_at"))
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        context["form"] = ConteoFisicoForm(user=self.request.user)
+        return context
+
+def _avisar_errores_carga(request, n, errores):
+    messages.success(request, f"{n} líneas cargadas.")
+    if errores:
+        messages.warning(request, f"{len(errores)} filas con errores (no se cargaron): " + "; ".join(errores[:10]))
+
+@login_required
+@permission_required("inventario.add_conteofisico", raise_exception=True)
+def conteo_crear(request):
+    if request.method != "POST":
+        return redirect("inventario:conteo_list")
+    form = ConteoFisicoForm(request.POST, request.FILES, user=request.user)
+    if not form.is_valid():
+        messages.error(request, "Revisa la sucursal y el archivo: " + "; ".join(
+            f"{campo}: {' '.join(errs)}" for campo, errs in form.errors.items()))
+        return redirect("inventario:conteo_list")
+    try:
+        filas = conteos.leer_archivo(form.cleaned_data["archivo"])
+        with atomico():
+            conteo = ConteoFisico.objects.create(
+                suscripcion=request.user.suscripcion, sucursal=form.cleaned_data["sucursal"],
+                nota=form.cleaned_data["nota"], created_by=request.user,
+            )
+            n, errores = conteos.cargar(conteo, filas)
+    except ValidationError as e:
+        messages.error(request, "; ".join(e.messages))
+        return redirect("inventario:conteo_list")
+    _avisar_errores_carga(request, n, errores)
+    return redirect("inventario:conteo_detail", pk=conteo.pk)
+
+class ConteoDetailView(LoginRequiredMixin, PermissionRequiredMixin, DetailView):
+    """
+    Revisión de un conteo: totales y las líneas con diferencia (o todas
+    con ?todas=1), paginadas por keyset. La diferencia se calcula en la
+    misma consulta (ver conteos.diferencias).
+    """
+    permission_required = "inventario.view_conteofisico"
+    model = ConteoFisico; template_name = "conteo_detail.html"
+    context_object_name = "conteo"
+    def get_queryset(self):
+        return super().get_queryset().filter(
+            suscripcion=self.request.user.suscripcion
+        ).select_related("sucursal", "created_by")
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        get = self.request.GET
+        todas = get.get("todas") == "1"
+        qs = conteos.diferencias(self.object)
+        if not todas:
+            qs = qs.exclude(diferencia=0)
+        direccion, cursor = ((paginacion.ANTES, get["antes"]) if get.get("antes")
+                             else (paginacion.DESPUES, get.get("despues")))
+        pagina = paginacion.paginar(qs, ["id"], cursor, direccion, 100)
+        filtros = {"todas": "1"} if todas else {}
+        context.update({
+            "resumen": conteos.resumen(self.object),
+            "lineas": pagina.objetos, "pagina": pagina, "todas": todas,
+            "url_siguiente": urlencode({**filtros, "despues": pagina.siguiente}) if pagina.siguiente else None,
+            "url_anterior": urlencode({**filtros, "antes": pagina.anterior}) if pagina.anterior else None,
+            "form": UploadFileForm(),
+        })
+        return context
+
+@login_required
+@permission_required("inventario.change_conteofisico", raise_exception=True)
+def conteo_cargar(request, pk):
+    """Agrega o reemplaza líneas de un conteo abierto con otro archivo."""
+    conteo = get_object_or_404(ConteoFisico, pk=pk, suscripcion=request.user.suscripcion)
+    if request.method == "POST" and request.FILES.get("file"):
+        try:
+            n, errores = conteos.cargar(conteo, conteos.leer_archivo(request.FILES["file"]))
+        except ValidationError as e:
+            messages.error(request, "; ".join(e.messages))
+        else:
+            _avisar_errores_carga(request, n, errores)
+    return redirect("inventario:conteo_detail", pk=conteo.pk)
+
+@login_required
+@permission_required(["inventario.change_conteofisico", "inventario.add_movimientomp"], raise_exception=True)
+def conteo_contabilizar(request, pk):
+    conteo = get_object_or_404(ConteoFisico, pk=pk, suscripcion=request.user.suscripcion)
+    if request.method == "POST":
+        try:
+            movimientos = conteo.contabilizar(user=request.user)
+        except ValidationError as e:
+            messages.error(request, f"No se pudo contabilizar: {'; '.join(e.messages)}")
+        else:
+            messages.success(request, f"Conteo contabilizado: {len(movimientos)} ajustes registrados.")
+    return redirect("inventario:conteo_detail", pk=conteo.pk)
+
+
+@login_required
+@permission_required("inventario.add_venta", raise_exception=True)
+def venta_importar(request):
+    """Importa el cierre del día de un POS externo (ver cierre_pos.py) y muestra el reporte."""
+    resultado = None
+    form = CierrePOSForm(request.POST or None, request.FILES or None, user=request.user)
+    if request.method == "POST" and form.is_valid():
+        d = form.cleaned_data
+        try:
+            resultado = cierre_pos.importar(request.user.suscripcion, d["sucursal"],
+                                            cierre_pos.leer_archivo(d["archivo"]),
+                                            user=request.user, aplicar=not d["simular"])
+        except ValidationError as e:
+            messages.error(request, "; ".join(e.messages))
+        else:
+            if d["simular"]:
+                messages.info(request, "Revisión: no se guardó nada.")
+            else:
+                messages.success(request, f"{resultado.confirmadas} ventas confirmadas, "
+                                           f"{resultado.borradores} quedaron en borrador por falta de stock.")
+    return render(request, "venta_importar.html", {"form": form, "resultado": resultado})
+
+
 # ============================================================
 # VISTAS DE DASHBOARD Y REPORTES
 # ============================================================
@@ -697,6 +959,7 @@ def _parse_date(s):
         except ValueError: pass
     return None
 
+@usar_replica
 @login_required
 def panel(request):
     suscripcion = request.user.suscripcion
@@ -707,80 +970,82 @@ def panel(request):
     start = timezone.make_aware(datetime.datetime.combine(desde, datetime.time.min))
     end   = timezone.make_aware(datetime.datetime.combine(hasta, datetime.time.max))
 
+    # Todo lo que sigue es perezoso (querysets / SimpleLazyObject): los
+    # widgets van en {% cache %} con la versión de datos de la empresa y,
+    # si el fragmento está guardado, su consulta no se hace.
     ventas_rng = Venta.objects.filter(suscripcion=suscripcion, fecha__range=(start, end))
-    ventas_por_producto_qs = (
+    ventas_por_producto = SimpleLazyObject(lambda: list(
         VentaLinea.objects.filter(venta__in=ventas_rng)
         .values("producto__nombre")
         .annotate(total=Coalesce(Sum("cantidad"), Value(0), output_field=DecimalField(max_digits=12, decimal_places=3)))
         .order_by("producto__nombre")
-    )
-    total_unidades_vendidas = (
+    ))
+    total_unidades_vendidas = SimpleLazyObject(lambda: (
         VentaLinea.objects.filter(venta__in=ventas_rng)
         .aggregate(total=Coalesce(Sum("cantidad"), Value(0), output_field=DecimalField(max_digits=12, decimal_places=3)))["total"]
-    )
-    total_ventas = ventas_rng.count()
+    ))
+    total_ventas = SimpleLazyObject(ventas_rng.count)
+    # Las unidades salen de receta_snapshot: sin JOIN a recetas.
     ops_rng = OrdenProduccion.objects.filter(producto__suscripcion=suscripcion, fecha__range=(start, end))
-    unidades_producidas = sum([op.unidades_totales for op in ops_rng])
+    unidades_producidas = SimpleLazyObject(lambda: sum([op.unidades_totales for op in ops_rng]))
     
     mm = MovimientoMP
-    mermas_mp_qs = (
-        MovimientoMP.objects.filter(mp__suscripcion=suscripcion, tipo=mm.MERMA, fecha__range=(start, end))
-        .values("mp__nombre")
-        .annotate(total=Coalesce(Sum("cantidad"), Value(0), output_field=DecimalField(max_digits=12, decimal_places=3)))
-        .order_by("mp__nombre")
-    )
-    total_mermas_mp = (
-        MovimientoMP.objects.filter(mp__suscripcion=suscripcion, tipo=mm.MERMA, fecha__range=(start, end))
-        .aggregate(total=Coalesce(Sum("cantidad"), Value(0), output_field=DecimalField(max_digits=12, decimal_places=3)))["total"]
-    )
+    def _mermas():
+        # Un rango que empieza antes del horizonte de archivado suma también el archivo.
+        return archivo.sumar(suscripcion, ["mp__nombre"], historico=archivo.incluye_archivo(suscripcion, start),
+                             tipo=mm.MERMA, fecha__range=(start, end))
+    mermas = SimpleLazyObject(_mermas)
+    mermas_mp_qs = SimpleLazyObject(
+        lambda: [{"mp__nombre": nombre, "total": total} for (nombre,), total in sorted(mermas.items())])
+    total_mermas_mp = SimpleLazyObject(lambda: sum(mermas.values(), Decimal("0")))
     
-    mp_con_stock = MateriaPrima.objects.filter(
-        suscripcion=suscripcion, activo=True
-    ).annotate(
-        stock_total=Coalesce(Sum('stock_por_ubicacion__stock'), Decimal('0.0')),
-        stock_minimo_total=Coalesce(Sum('stock_por_ubicacion__stock_minimo'), Decimal('0.0'))
-    )
-    
-    mp_alertas = mp_con_stock.filter(
-        stock_total__lte=F('stock_minimo_total'),
-        stock_minimo_total__gt=0 
-    ).order_by("nombre")
+    # Alerta por (MP, sucursal): los mínimos salen del consumo de cada
+    # sucursal (ver reabastecimiento.py) y sumarlos entre sucursales
+    # escondería a la que se queda sin stock mientras otra tiene de sobra.
+    mp_alertas = SimpleLazyObject(lambda: [
+        {**r, "stock_fmt": unidades.formatear(r["stock"], r["mp__unidad_id"]),
+         "minimo_fmt": unidades.formatear(r["minimo"], r["mp__unidad_id"])}
+        for r in StockPorUbicacion.objects.filter(mp__suscripcion=suscripcion, mp__activo=True)
+        .values("mp__nombre", "mp__unidad_id", "ubicacion__sucursal__nombre")
+        .annotate(stock=Sum("stock"), minimo=Sum("stock_minimo"))
+        .filter(minimo__gt=0, stock__lte=F("minimo"))
+        .order_by("mp__nombre", "ubicacion__sucursal__nombre")
+    ])
 
     hoy_date = hoy
     lotes_por_vencer = LoteProducto.objects.filter(
         producto__suscripcion=suscripcion, fecha_vencimiento__gte=hoy_date,
         fecha_vencimiento__lte=hoy_date + datetime.timedelta(days=1),
         cantidad_disponible__gt=0,
-    ).order_by("fecha_vencimiento", "created_at")
+    ).select_related("producto").order_by("fecha_vencimiento", "created_at")
     
     lotes_vencidos = LoteProducto.objects.filter(
         producto__suscripcion=suscripcion, fecha_vencimiento__lt=hoy_date,
         cantidad_disponible__gt=0,
-    ).order_by("fecha_vencimiento", "created_at")
+    ).select_related("producto").order_by("fecha_vencimiento", "created_at")
 
-    chart_prod_labels = [r["producto__nombre"] for r in ventas_por_producto_qs]
-    chart_prod_values = [float(r["total"]) for r in ventas_por_producto_qs]
+    chart_prod_labels = SimpleLazyObject(lambda: [r["producto__nombre"] for r in ventas_por_producto])
+    chart_prod_values = SimpleLazyObject(lambda: [float(r["total"]) for r in ventas_por_producto])
     inicio_7 = hoy - datetime.timedelta(days=6)
-    ventas_7 = (
-        Venta.objects.filter(
-            suscripcion=suscripcion, fecha__date__gte=inicio_7, fecha__date__lte=hoy
-        ).annotate(d=TruncDate("fecha")).values("d")
-        .annotate(unidades=Coalesce(Sum("lineas__cantidad"), Value(0), output_field=DecimalField(max_digits=12, decimal_places=3)))
-        .order_by("d")
-    )
-    serie_7 = {v["d"]: float(v["unidades"]) for v in ventas_7}
-    chart_7_labels, chart_7_values = [], [],
-    for i in range(7):
-        d = inicio_7 + datetime.timedelta(days=i)
-        chart_7_labels.append(d.strftime("%d-%m"))
-        chart_7_values.append(serie_7.get(d, 0.0))
+    def _serie_7():
+        ventas_7 = (
+            Venta.objects.filter(
+                suscripcion=suscripcion, fecha__date__gte=inicio_7, fecha__date__lte=hoy
+            ).annotate(d=TruncDate("fecha")).values("d")
+            .annotate(unidades=Coalesce(Sum("lineas__cantidad"), Value(0), output_field=DecimalField(max_digits=12, decimal_places=3)))
+            .order_by("d")
+        )
+        serie_7 = {v["d"]: float(v["unidades"]) for v in ventas_7}
+        return [serie_7.get(inicio_7 + datetime.timedelta(days=i), 0.0) for i in range(7)]
+    chart_7_labels = [(inicio_7 + datetime.timedelta(days=i)).strftime("%d-%m") for i in range(7)]
+    chart_7_values = SimpleLazyObject(_serie_7)
     
     context = {
-        "desde": desde, "hasta": hasta, "total_ventas": total_ventas,
+        "hoy": hoy, "desde": desde, "hasta": hasta, "total_ventas": total_ventas,
         "total_unidades_vendidas": total_unidades_vendidas,
-        "ventas_por_producto": list(ventas_por_producto_qs),
+        "ventas_por_producto": ventas_por_producto,
         "ops_hoy": ops_rng, "unidades_producidas_hoy": unidades_producidas,
-        "mermas_mp_hoy": list(mermas_mp_qs), "total_mermas_mp_hoy": total_mermas_mp,
+        "mermas_mp_hoy": mermas_mp_qs, "total_mermas_mp_hoy": total_mermas_mp,
         "mp_alertas": mp_alertas, "lotes_por_vencer": lotes_por_vencer,
         "lotes_vencidos": lotes_vencidos, "chart_prod_labels": chart_prod_labels,
         "chart_prod_values": chart_prod_values, "chart_7_labels": chart_7_labels,
@@ -788,6 +1053,25 @@ def panel(request):
     }
     return render(request, "panel.html", context)
 
+@login_required
+async def panel_eventos(request):
+    """Stream SSE con los cambios de la empresa para el panel abierto (ver eventos.py)."""
+    user = await request.auser()
+    if not isinstance(request, ASGIRequest) or user.suscripcion_id is None:
+        # Bajo WSGI el stream ocuparía un worker: 204 hace que EventSource no reintente.
+        return HttpResponse(status=204)
+
+    async def stream():
+        yield "retry: 5000\n\n"
+        async for evento in eventos.broker().suscribir(user.suscripcion_id):
+            yield eventos.formatear(evento)
+
+    response = StreamingHttpResponse(stream(), content_type="text/event-stream")
+    response["Cache-Control"] = "no-cache"
+    response["X-Accel-Buffering"] = "no"  # nginx: no juntar los eventos en buffer
+    return response
+
+@usar_replica
 @login_required
 @permission_required("inventario.view_venta", raise_exception=True)
 def panel_csv(request):
@@ -823,6 +1107,7 @@ def panel_csv(request):
 # VISTA PROTOTIPO "PLAN PRO"
 # ============================================================
 
+@usar_replica
 @login_required
 @permission_required("inventario.view_materiaprima", raise_exception=True)
 def reporte_stock_global(request):
@@ -857,6 +1142,70 @@ def reporte_stock_global(request):
     return render(request, "reporte_stock_global_PRO.html", context)
 
 
+@usar_replica
+@login_required
+@permission_required("inventario.view_movimientomp", raise_exception=True)
+def reporte_stock_fecha(request):
+    """
+    Stock de todo el catálogo a una fecha (y hora) pasada, por bodega.
+    Sirve para auditorías y para el cierre de mes (?formato=csv).
+    """
+    suscripcion = request.user.suscripcion
+    hoy = timezone.localdate()
+    fecha = _parse_date(request.GET.get("fecha")) or hoy
+    hora = request.GET.get("hora") or ""
+    momento = fecha
+    if hora:
+        try:
+            momento = datetime.datetime.combine(fecha, datetime.time.fromisoformat(hora))
+        except ValueError:
+            hora = ""
+
+    sucursales = Sucursal.objects.filter(suscripcion=suscripcion).order_by("nombre")
+    sucursal = sucursales.filter(pk=request.GET.get("sucursal") or None).first()
+    ubicaciones = {u.pk: u for u in Ubicacion.objects.filter(sucursal__suscripcion=suscripcion).select_related("sucursal")}
+    if sucursal:
+        ubicaciones = {pk: u for pk, u in ubicaciones.items() if u.sucursal_id == sucursal.pk}
+
+    saldos = stocks_at(momento, suscripcion, ubicacion_ids=list(ubicaciones))
+
+    # Agrupa por (MP, bodega): el auditor cuenta por bodega, no por estante.
+    por_sucursal = {}
+    for (mp_id, ubic_id), stock in saldos.items():
+        clave = (mp_id, ubicaciones[ubic_id].sucursal_id)
+        por_sucursal[clave] = por_sucursal.get(clave, Decimal("0")) + stock
+    mps = {m.pk: m for m in MateriaPrima.objects.filter(
+        pk__in={mp_id for mp_id, _ in por_sucursal}).select_related("unidad")}
+    nombres_suc = {u.sucursal_id: u.sucursal.nombre for u in ubicaciones.values()}
+
+    filas = sorted(
+        ({"mp": mps[mp_id], "sucursal": nombres_suc[suc_id], "stock": stock}
+         for (mp_id, suc_id), stock in por_sucursal.items() if stock),
+        key=lambda r: (r["mp"].nombre, r["sucursal"]),
+    )
+
+    if request.GET.get("formato") == "csv":
+        filename = f"stock_{fecha.strftime('%Y%m%d')}.csv"
+        resp = HttpResponse(content_type="text/csv")
+        resp["Content-Disposition"] = f'attachment; filename="{filename}"'
+        w = csv.writer(resp)
+        w.writerow(["Fecha", fecha.isoformat(), "Hora", hora or "cierre"])
+        w.writerow([]); w.writerow(["Materia prima", "Bodega", "Stock", "Unidad"])
+        for r in filas:
+            w.writerow([r["mp"].nombre, r["sucursal"], r["stock"], r["mp"].unidad.nombre])
+        return resp
+
+    for r in filas:
+        r["stock_fmt"] = r["mp"].format_qty(r["stock"])
+    cierre_mes_anterior = hoy.replace(day=1) - datetime.timedelta(days=1)
+    context = {
+        "fecha": fecha, "hora": hora, "filas": filas,
+        "sucursales": sucursales, "sucursal": sucursal,
+        "cierre_mes_anterior": cierre_mes_anterior,
+    }
+    return render(request, "reporte_stock_fecha.html", context)
+
+
 # ============================================================
 # VISTAS DE IA E INTEGRACIONES
 # ============================================================
@@ -947,7 +1296,7 @@ def procesar_factura(request):
 
 @login_required
 @permission_required("inventario.add_movimientomp", raise_exception=True)
-@transaction.atomic
+@atomico
 def guardar_ingreso_factura(request):
     suscripcion = request.user.suscripcion
     if not suscripcion: